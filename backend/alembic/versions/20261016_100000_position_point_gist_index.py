@@ -0,0 +1,29 @@
+"""position_point: GiST-индекс по point(x_position, y_position) для выборки слоёв карты по bbox
+
+Встроенные геометрические типы PostgreSQL (без PostGIS). Запросы map_tiles.py
+используют то же выражение: point(x_position, y_position) <@ box(...).
+
+Revision ID: 20261016_100000
+Revises: 20260519_110000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261016_100000"
+down_revision: Union[str, None] = "20260519_110000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_position_point_xy_gist "
+        "ON position_point USING gist (point(x_position, y_position))"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_position_point_location_id ON position_point (location_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_position_point_location_id")
+    op.execute("DROP INDEX IF EXISTS ix_position_point_xy_gist")
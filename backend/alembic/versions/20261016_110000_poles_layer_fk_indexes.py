@@ -0,0 +1,28 @@
+"""Индексы внешних ключей для слоя опор (свёртки по опоре в map_tiles._get_poles_geojson_impl)
+
+equipment.pole_id, connectivity_node.pole_id и pole.tap_pole_id участвуют в коррелированных
+подзапросах по каждой опоре; без индексов запрос слоя сводится к seq scan на каждую строку.
+
+Revision ID: 20261016_110000
+Revises: 20261016_100000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261016_110000"
+down_revision: Union[str, None] = "20261016_100000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE INDEX IF NOT EXISTS ix_equipment_pole_id ON equipment (pole_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_connectivity_node_pole_id ON connectivity_node (pole_id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_pole_tap_pole_id ON pole (tap_pole_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_pole_tap_pole_id")
+    op.execute("DROP INDEX IF EXISTS ix_connectivity_node_pole_id")
+    op.execute("DROP INDEX IF EXISTS ix_equipment_pole_id")
@@ -0,0 +1,98 @@
+"""Ревизии синхронизации: sync_revision_seq, колонки sync_revision, надгробия удалений, триггеры
+
+Курсорный sync/download (app.core.sync_revision): каждая запись в line / pole / equipment /
+equipment_catalog получает монотонный номер, удаление — строку sync_tombstone.
+
+Revision ID: 20261017_100000
+Revises: 20261016_110000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261017_100000"
+down_revision: Union[str, None] = "20261016_110000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_LOCK_KEY = 0x53594E43
+_TABLES = {
+    "power_line": "line",
+    "pole": "pole",
+    "equipment": "equipment",
+    "equipment_catalog": "equipment_catalog",
+}
+
+
+def upgrade() -> None:
+    op.execute("CREATE SEQUENCE IF NOT EXISTS sync_revision_seq")
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_tombstone (
+            sync_revision BIGINT PRIMARY KEY,
+            entity_type VARCHAR(32) NOT NULL,
+            entity_id INTEGER NOT NULL,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_bump() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});
+            NEW.sync_revision := nextval('sync_revision_seq');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_tombstone() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id)
+            VALUES (nextval('sync_revision_seq'), TG_ARGV[0], OLD.id);
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    for entity_type, table in _TABLES.items():
+        op.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS sync_revision BIGINT')
+        # Существующие строки — в порядке последнего изменения
+        op.execute(
+            f"""
+            UPDATE "{table}" t SET sync_revision = o.rev
+            FROM (
+                SELECT id, nextval('sync_revision_seq') AS rev
+                FROM (SELECT id FROM "{table}" WHERE sync_revision IS NULL
+                      ORDER BY coalesce(updated_at, created_at), id) ordered
+            ) o
+            WHERE t.id = o.id
+            """
+        )
+        op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_sync_revision ON "{table}" (sync_revision)')
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_revision ON "{table}"')
+        op.execute(
+            f'CREATE TRIGGER trg_{table}_sync_revision BEFORE INSERT OR UPDATE ON "{table}" '
+            f"FOR EACH ROW EXECUTE FUNCTION sync_revision_bump()"
+        )
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_tombstone ON "{table}"')
+        op.execute(
+            f'CREATE TRIGGER trg_{table}_sync_tombstone AFTER DELETE ON "{table}" '
+            f"FOR EACH ROW EXECUTE FUNCTION sync_revision_tombstone('{entity_type}')"
+        )
+
+
+def downgrade() -> None:
+    for table in _TABLES.values():
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_tombstone ON "{table}"')
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_revision ON "{table}"')
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_sync_revision")
+        op.execute(f'ALTER TABLE "{table}" DROP COLUMN IF EXISTS sync_revision')
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_tombstone()")
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_bump()")
+    op.execute("DROP TABLE IF EXISTS sync_tombstone")
+    op.execute("DROP SEQUENCE IF EXISTS sync_revision_seq")
@@ -0,0 +1,65 @@
+"""Подписка sync/download на область: line_id в надгробиях, индексы фильтра по ЛЭП
+
+sync_tombstone.line_id заполняет триггер удаления (app.core.sync_revision); индексы —
+выборка ЛЭП по филиалу / региону и опор по ЛЭП (app.core.sync_scope).
+
+Revision ID: 20261017_110000
+Revises: 20261017_100000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261017_110000"
+down_revision: Union[str, None] = "20261017_100000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_LOCK_KEY = 0x53594E43
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS line_id INTEGER")
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_tombstone() RETURNS trigger AS $$
+        DECLARE
+            v_line_id INTEGER;
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});
+            IF TG_ARGV[0] = 'power_line' THEN
+                v_line_id := OLD.id;
+            ELSIF TG_ARGV[0] = 'pole' THEN
+                v_line_id := OLD.line_id;
+            ELSIF TG_ARGV[0] = 'equipment' THEN
+                SELECT line_id INTO v_line_id FROM pole WHERE id = OLD.pole_id;
+            END IF;
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id)
+            VALUES (nextval('sync_revision_seq'), TG_ARGV[0], OLD.id, v_line_id);
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_pole_line_id ON pole (line_id)")
+    op.execute('CREATE INDEX IF NOT EXISTS ix_line_branch_id ON "line" (branch_id)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_line_region_id ON "line" (region_id)')
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_line_region_id")
+    op.execute("DROP INDEX IF EXISTS ix_line_branch_id")
+    op.execute("DROP INDEX IF EXISTS ix_pole_line_id")
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_tombstone() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id)
+            VALUES (nextval('sync_revision_seq'), TG_ARGV[0], OLD.id);
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute("ALTER TABLE sync_tombstone DROP COLUMN IF EXISTS line_id")
@@ -0,0 +1,49 @@
+"""Журнал идемпотентности sync/upload: sync_upload_batch (ответы на пакеты), sync_upload_record (применённые записи)
+
+Revision ID: 20261017_120000
+Revises: 20261017_110000
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "20261017_120000"
+down_revision: Union[str, None] = "20261017_110000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_upload_batch",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("batch_id", sa.String(length=64), nullable=False),
+        sa.Column("response", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.UniqueConstraint("user_id", "batch_id", name="uq_sync_upload_batch_user_batch"),
+    )
+    op.create_index("ix_sync_upload_batch_created_at", "sync_upload_batch", ["created_at"])
+    op.create_table(
+        "sync_upload_record",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("record_id", sa.String(length=64), nullable=False),
+        sa.Column("batch_id", sa.String(length=64), nullable=False),
+        sa.Column("entity_type", sa.String(length=32), nullable=False),
+        sa.Column("action", sa.String(length=16), nullable=False),
+        sa.Column("client_id", sa.Integer(), nullable=True),
+        sa.Column("server_id", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.UniqueConstraint("user_id", "record_id", name="uq_sync_upload_record_user_record"),
+    )
+    op.create_index("ix_sync_upload_record_created_at", "sync_upload_record", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sync_upload_record_created_at", table_name="sync_upload_record")
+    op.drop_table("sync_upload_record")
+    op.drop_index("ix_sync_upload_batch_created_at", table_name="sync_upload_batch")
+    op.drop_table("sync_upload_batch")
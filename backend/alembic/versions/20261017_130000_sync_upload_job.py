@@ -0,0 +1,40 @@
+"""Фоновые задания sync/upload: sync_upload_job (пакет, прогресс, итоговый ответ)
+
+Revision ID: 20261017_130000
+Revises: 20261017_120000
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision: str = "20261017_130000"
+down_revision: Union[str, None] = "20261017_120000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sync_upload_job",
+        sa.Column("id", sa.String(length=32), primary_key=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("batch_id", sa.String(length=64), nullable=False),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("done", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("payload", postgresql.JSONB(), nullable=True),
+        sa.Column("response", postgresql.JSONB(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint("user_id", "batch_id", name="uq_sync_upload_job_user_batch"),
+    )
+    op.create_index("ix_sync_upload_job_created_at", "sync_upload_job", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_sync_upload_job_created_at", table_name="sync_upload_job")
+    op.drop_table("sync_upload_job")
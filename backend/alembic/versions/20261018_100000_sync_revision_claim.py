@@ -0,0 +1,82 @@
+"""Неблокирующая граница sync/download: объявление нижней границы ревизий транзакции
+
+Триггеры ревизий вместо общей разделяемой advisory-блокировки вызывают sync_revision_claim():
+транзакция один раз берёт разделяемую блокировку с ключом (0x53594E43 << 32) | граница своих
+номеров. sync_high_water (app.core.sync_revision) читает границы из pg_locks и больше не берёт
+исключительную сессионную блокировку, за которой выстраивались в очередь все записи.
+
+Revision ID: 20261018_100000
+Revises: 20261017_130000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261018_100000"
+down_revision: Union[str, None] = "20261017_130000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_LOCK_KEY = 0x53594E43
+
+
+def _tombstone_function(lock_statement: str) -> str:
+    return f"""
+        CREATE OR REPLACE FUNCTION sync_revision_tombstone() RETURNS trigger AS $$
+        DECLARE
+            v_line_id INTEGER;
+        BEGIN
+            {lock_statement}
+            IF TG_ARGV[0] = 'power_line' THEN
+                v_line_id := OLD.id;
+            ELSIF TG_ARGV[0] = 'pole' THEN
+                v_line_id := OLD.line_id;
+            ELSIF TG_ARGV[0] = 'equipment' THEN
+                SELECT line_id INTO v_line_id FROM pole WHERE id = OLD.pole_id;
+            END IF;
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id)
+            VALUES (nextval('sync_revision_seq'), TG_ARGV[0], OLD.id, v_line_id);
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+
+
+def _bump_function(lock_statement: str) -> str:
+    return f"""
+        CREATE OR REPLACE FUNCTION sync_revision_bump() RETURNS trigger AS $$
+        BEGIN
+            {lock_statement}
+            NEW.sync_revision := nextval('sync_revision_seq');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+
+
+def upgrade() -> None:
+    op.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_claim() RETURNS void AS $$
+        DECLARE
+            v_floor BIGINT;
+        BEGIN
+            IF coalesce(current_setting('sync_revision.floor', true), '') <> '' THEN
+                RETURN;
+            END IF;
+            SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END INTO v_floor
+            FROM sync_revision_seq;
+            PERFORM pg_advisory_xact_lock_shared(({_LOCK_KEY}::bigint << 32) | v_floor);
+            PERFORM set_config('sync_revision.floor', v_floor::text, true);
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(_bump_function("PERFORM sync_revision_claim();"))
+    op.execute(_tombstone_function("PERFORM sync_revision_claim();"))
+
+
+def downgrade() -> None:
+    op.execute(_bump_function(f"PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});"))
+    op.execute(_tombstone_function(f"PERFORM pg_advisory_xact_lock_shared({_LOCK_KEY});"))
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_claim()")
@@ -0,0 +1,90 @@
+"""Надгробия переноса: опора на другую ЛЭП, оборудование на опору другой ЛЭП
+
+Область подписки sync/download фильтрует строки по текущей ЛЭП, поэтому перенесённая за пределы
+области строка у устройства не удалялась. Триггер BEFORE UPDATE OF line_id (pole_id) пишет
+надгробие с moved = true для старой ЛЭП; выгрузка отдаёт его только областям, где новой ЛЭП нет.
+Оборудование перенесённой опоры получает такие же надгробия и новую ревизию после опоры.
+
+Revision ID: 20261018_110000
+Revises: 20261018_100000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261018_110000"
+down_revision: Union[str, None] = "20261018_100000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_SEQUENCE = "sync_revision_seq"
+_MOVE_COLUMNS = (
+    ("pole", "line_id", "pole"),
+    ("equipment", "pole_id", "equipment"),
+)
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved BOOLEAN NOT NULL DEFAULT false")
+    op.execute("ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_to_line_id INTEGER")
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION sync_revision_move() RETURNS trigger AS $$
+        DECLARE
+            v_old_line_id INTEGER;
+            v_new_line_id INTEGER;
+        BEGIN
+            IF TG_ARGV[0] = 'pole' THEN
+                v_old_line_id := OLD.line_id;
+                v_new_line_id := NEW.line_id;
+            ELSE
+                SELECT line_id INTO v_old_line_id FROM pole WHERE id = OLD.pole_id;
+                SELECT line_id INTO v_new_line_id FROM pole WHERE id = NEW.pole_id;
+            END IF;
+            IF v_old_line_id IS NULL OR v_old_line_id IS NOT DISTINCT FROM v_new_line_id THEN
+                RETURN NEW;
+            END IF;
+            PERFORM sync_revision_claim();
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved, moved_to_line_id)
+            VALUES (nextval('{_SEQUENCE}'), TG_ARGV[0], OLD.id, v_old_line_id, true, v_new_line_id);
+            IF TG_ARGV[0] = 'pole' THEN
+                INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved, moved_to_line_id)
+                SELECT nextval('{_SEQUENCE}'), 'equipment', e.id, v_old_line_id, true, v_new_line_id
+                FROM equipment e WHERE e.pole_id = OLD.id ORDER BY e.id;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION sync_revision_move_children() RETURNS trigger AS $$
+        BEGIN
+            UPDATE equipment SET sync_revision = NULL WHERE pole_id = NEW.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table, column, entity_type in _MOVE_COLUMNS:
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_move ON "{table}"')
+        op.execute(
+            f'CREATE TRIGGER trg_{table}_sync_move BEFORE UPDATE OF {column} ON "{table}" '
+            f"FOR EACH ROW WHEN (OLD.{column} IS DISTINCT FROM NEW.{column}) "
+            f"EXECUTE FUNCTION sync_revision_move('{entity_type}')"
+        )
+    op.execute('DROP TRIGGER IF EXISTS trg_pole_sync_move_children ON "pole"')
+    op.execute(
+        'CREATE TRIGGER trg_pole_sync_move_children AFTER UPDATE OF line_id ON "pole" '
+        "FOR EACH ROW WHEN (OLD.line_id IS DISTINCT FROM NEW.line_id) "
+        "EXECUTE FUNCTION sync_revision_move_children()"
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS trg_pole_sync_move_children ON "pole"')
+    for table, _column, _entity_type in _MOVE_COLUMNS:
+        op.execute(f'DROP TRIGGER IF EXISTS trg_{table}_sync_move ON "{table}"')
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_move_children()")
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_move()")
+    # Надгробия переноса без флага стали бы удалениями для всех областей
+    op.execute("DELETE FROM sync_tombstone WHERE moved")
+    op.execute("ALTER TABLE sync_tombstone DROP COLUMN IF EXISTS moved_to_line_id")
+    op.execute("ALTER TABLE sync_tombstone DROP COLUMN IF EXISTS moved")
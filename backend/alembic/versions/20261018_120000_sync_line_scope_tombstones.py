@@ -0,0 +1,83 @@
+"""Надгробия смены филиала/региона ЛЭП
+
+Область подписки sync/download по branch_ids / region_ids выбирает ЛЭП по текущим
+line.branch_id / line.region_id. ЛЭП, переведённая в другой филиал или регион, уходила из области
+вместе с опорами и оборудованием без надгробий. Триггер BEFORE UPDATE OF branch_id, region_id
+пишет надгробия (moved, moved_to_line_id = line_id) с прежними значениями; после — новые ревизии
+опор и оборудования для устройств новой области.
+
+Revision ID: 20261018_120000
+Revises: 20261018_110000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261018_120000"
+down_revision: Union[str, None] = "20261018_110000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_SEQUENCE = "sync_revision_seq"
+_CHANGED = "OLD.branch_id IS DISTINCT FROM NEW.branch_id OR OLD.region_id IS DISTINCT FROM NEW.region_id"
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_from_branch_id INTEGER")
+    op.execute("ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_from_region_id INTEGER")
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION sync_revision_line_scope() RETURNS trigger AS $$
+        BEGIN
+            IF OLD.branch_id IS NULL AND OLD.region_id IS NULL THEN
+                RETURN NEW;
+            END IF;
+            PERFORM sync_revision_claim();
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            VALUES (nextval('{_SEQUENCE}'), 'power_line', OLD.id, OLD.id, true,
+                    OLD.id, OLD.branch_id, OLD.region_id);
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            SELECT nextval('{_SEQUENCE}'), 'pole', p.id, OLD.id, true,
+                   OLD.id, OLD.branch_id, OLD.region_id
+            FROM pole p WHERE p.line_id = OLD.id ORDER BY p.id;
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            SELECT nextval('{_SEQUENCE}'), 'equipment', e.id, OLD.id, true,
+                   OLD.id, OLD.branch_id, OLD.region_id
+            FROM equipment e JOIN pole p ON p.id = e.pole_id WHERE p.line_id = OLD.id ORDER BY e.id;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION sync_revision_line_scope_children() RETURNS trigger AS $$
+        BEGIN
+            UPDATE pole SET sync_revision = NULL WHERE line_id = NEW.id;
+            UPDATE equipment SET sync_revision = NULL
+            WHERE pole_id IN (SELECT id FROM pole WHERE line_id = NEW.id);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute('DROP TRIGGER IF EXISTS trg_line_sync_move ON "line"')
+    op.execute(
+        'CREATE TRIGGER trg_line_sync_move BEFORE UPDATE OF branch_id, region_id ON "line" '
+        f"FOR EACH ROW WHEN ({_CHANGED}) EXECUTE FUNCTION sync_revision_line_scope()"
+    )
+    op.execute('DROP TRIGGER IF EXISTS trg_line_sync_move_children ON "line"')
+    op.execute(
+        'CREATE TRIGGER trg_line_sync_move_children AFTER UPDATE OF branch_id, region_id ON "line" '
+        f"FOR EACH ROW WHEN ({_CHANGED}) EXECUTE FUNCTION sync_revision_line_scope_children()"
+    )
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS trg_line_sync_move_children ON "line"')
+    op.execute('DROP TRIGGER IF EXISTS trg_line_sync_move ON "line"')
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_line_scope_children()")
+    op.execute("DROP FUNCTION IF EXISTS sync_revision_line_scope()")
+    # Без колонок такие надгробия стали бы переносом на ту же ЛЭП и пропали бы из выгрузки
+    op.execute("DELETE FROM sync_tombstone WHERE moved_from_branch_id IS NOT NULL OR moved_from_region_id IS NOT NULL")
+    op.execute("ALTER TABLE sync_tombstone DROP COLUMN IF EXISTS moved_from_region_id")
+    op.execute("ALTER TABLE sync_tombstone DROP COLUMN IF EXISTS moved_from_branch_id")
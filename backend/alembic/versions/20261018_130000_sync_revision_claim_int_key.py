@@ -0,0 +1,60 @@
+"""Граница ревизий транзакции — в ключе advisory-блокировки из двух int
+
+Ключ (0x53594E43 << 32) | граница переставал работать с ростом последовательности: граница с
+2^31 затирала биты метки, а у 2^31 OR выходил за bigint, и sync_high_water не находил
+объявленные границы в pg_locks. Теперь sync_revision_claim() берёт
+pg_advisory_xact_lock_shared(0x53594E43, граница::int): в pg_locks это classid = метка,
+objid = граница (без знака, до 2^32 - 1), objsubid = 2. Граница выше — явная ошибка.
+
+Revision ID: 20261018_130000
+Revises: 20261018_120000
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "20261018_130000"
+down_revision: Union[str, None] = "20261018_120000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_LOCK_KEY = 0x53594E43
+_FLOOR_MAX = 2 ** 32 - 1
+
+
+def _claim_function(lock_statement: str, bound_check: str = "") -> str:
+    return f"""
+        CREATE OR REPLACE FUNCTION sync_revision_claim() RETURNS void AS $$
+        DECLARE
+            v_floor BIGINT;
+        BEGIN
+            IF coalesce(current_setting('sync_revision.floor', true), '') <> '' THEN
+                RETURN;
+            END IF;
+            SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END INTO v_floor
+            FROM sync_revision_seq;
+            {bound_check}
+            {lock_statement}
+            PERFORM set_config('sync_revision.floor', v_floor::text, true);
+        END
+        $$ LANGUAGE plpgsql
+        """
+
+
+def upgrade() -> None:
+    op.execute(_claim_function(
+        f"""PERFORM pg_advisory_xact_lock_shared(
+                {_LOCK_KEY},
+                (v_floor - CASE WHEN v_floor > 2147483647 THEN 4294967296 ELSE 0 END)::int
+            );""",
+        f"""IF v_floor > {_FLOOR_MAX} THEN
+                RAISE EXCEPTION 'sync_revision_claim: граница % вне ключа advisory-блокировки (до %)',
+                    v_floor, {_FLOOR_MAX};
+            END IF;""",
+    ))
+
+
+def downgrade() -> None:
+    op.execute(_claim_function(
+        f"PERFORM pg_advisory_xact_lock_shared(({_LOCK_KEY}::bigint << 32) | v_floor);"
+    ))
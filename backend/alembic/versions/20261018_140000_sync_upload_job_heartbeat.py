@@ -0,0 +1,26 @@
+"""Пульс задания sync/upload: sync_upload_job.updated_at
+
+Потерянное задание определялось по started_at / created_at, поэтому здоровая загрузка дольше
+SYNC_JOB_STALE_MINUTES переставлялась в очередь при каждом опросе. updated_at обновляется на
+старте, при перестановке и с каждой пачкой прогресса (app.core.sync_jobs).
+
+Revision ID: 20261018_140000
+Revises: 20261018_130000
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "20261018_140000"
+down_revision: Union[str, None] = "20261018_130000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("sync_upload_job", sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("sync_upload_job", "updated_at")
@@ -1,21 +1,51 @@
 """
-Прокси растровых тайлов (OSM) с кэшем PNG в Redis.
+Прокси растровых тайлов (OSM) с кэшем PNG в Redis и на диске (MBTiles в TILE_CACHE_DIR, app.core.tile_store).
+Тайлы в пределах офлайн-подложки (TILE_BASEMAP_MBTILES_PATH) отдаются из её файла раньше Redis и апстрима.
 Отдельное Redis-сoединение с decode_responses=False — см. main.lifespan.
-При недоступном апстриме пробуются запасные CDN; при полном сбое — HTTP 502 (клиент переключается на прямой источник).
+Промах Redis по одному тайлу в процессе обслуживает одна задача: остальные запросы того же z/x/y ждут её
+результат, а не идут к апстриму повторно (задача не отменяется, если клиент оборвал запрос).
+При недоступном апстриме пробуются запасные CDN, затем устаревший тайл с диска;
+при полном сбое — HTTP 502 (клиент переключается на прямой источник).
+Прогрев кэша по области или коридору вдоль ЛЭП (админ) — POST /tiles/prefetch, app.core.tile_prefetch.
+Здесь же векторные тайлы слоёв сети (MVT): тот же бинарный Redis, инвалидация через поколение
+(map_geojson_cache.invalidate_map_geojson_cache).
 """
+import asyncio
 import logging
-from typing import List, Optional
+import time
+from typing import Any, Dict, List, Optional
 
 import httpx
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
+from app.core.json_payload import loads_json_bytes
+from app.core.map_bbox import parse_bbox
+from app.core.map_geojson_cache import feature_line_id, get_map_geojson_payload, get_map_vector_tile_generation
 from app.core.redis_client import get_redis_binary_client
+from app.core.roles import require_admin_user
+from app.core.security import get_current_active_user
+from app.core.tile_prefetch import (
+    TileLimitExceeded,
+    bbox_tile_count,
+    bbox_tiles,
+    cancel_prefetch_job,
+    corridor_tiles,
+    get_prefetch_job,
+    start_prefetch_job,
+)
+from app.core.tile_store import get_basemap_tile_reader, get_osm_tile_store
+from app.core.vector_tiles import MVT_MEDIA_TYPE
+from app.database import get_db
+from app.models.user import User
+from app.schemas.tile_prefetch import TilePrefetchJobResponse, TilePrefetchRequest
 
 logger = logging.getLogger(__name__)
 
 TILE_KEY_PREFIX = "maptile:osm:"
+VECTOR_TILE_KEY_PREFIX = "maptile:vt:"
 OSM_MAX_ZOOM = 19
 
 _DEFAULT_UPSTREAM_FALLBACKS = (
@@ -25,6 +55,9 @@ _DEFAULT_UPSTREAM_FALLBACKS = (
     "https://basemaps.cartocdn.com/rastertiles/voyager/{z}/{x}/{y}.png",
 )
 
+# Загрузки тайлов, идущие в этом процессе: ключ Redis тайла → задача (байты, content-type) или None
+_inflight_tiles: Dict[str, "asyncio.Task[Optional[tuple[bytes, str]]]"] = {}
+
 router = APIRouter()
 
 
@@ -100,12 +133,97 @@ async def _fetch_tile_from_upstreams(
     return None
 
 
+async def _redis_set_tile(key: str, body: bytes) -> None:
+    r = get_redis_binary_client()
+    if not r:
+        return
+    try:
+        await r.set(key, body, ex=settings.TILE_CACHE_REDIS_TTL_SECONDS)
+    except Exception:
+        pass
+
+
+async def _basemap_get_tile(z: int, x: int, y: int) -> Optional[bytes]:
+    reader = get_basemap_tile_reader()
+    if reader is None or not reader.covers(z, x, y):
+        return None
+    try:
+        return await asyncio.to_thread(reader.get, z, x, y)
+    except Exception as e:
+        logger.warning("Offline basemap read failed z=%s x=%s y=%s: %s", z, x, y, e)
+        return None
+
+
+async def _disk_get_tile(z: int, x: int, y: int) -> Optional[tuple[bytes, int]]:
+    store = get_osm_tile_store()
+    if store is None:
+        return None
+    try:
+        return await asyncio.to_thread(store.get, z, x, y)
+    except Exception as e:
+        logger.warning("Tile disk cache read failed z=%s x=%s y=%s: %s", z, x, y, e)
+        return None
+
+
+async def _disk_put_tile(z: int, x: int, y: int, body: bytes) -> None:
+    store = get_osm_tile_store()
+    if store is None:
+        return
+    try:
+        await asyncio.to_thread(store.put, z, x, y, body)
+    except Exception as e:
+        logger.warning("Tile disk cache write failed z=%s x=%s y=%s: %s", z, x, y, e)
+
+
+async def _load_tile(request: Request, key: str, z: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+    """Промах Redis: диск → апстримы → устаревший тайл с диска; найденное кладётся в кэши."""
+    on_disk = await _disk_get_tile(z, x, y)
+    if on_disk is not None:
+        body, fetched_at = on_disk
+        if time.time() - fetched_at < settings.TILE_CACHE_DISK_MAX_AGE_SECONDS:
+            await _redis_set_tile(key, body)
+            return body, "image/png"
+
+    fetched = await _fetch_tile_from_upstreams(request, z, x, y)
+    if fetched is None:
+        if on_disk is not None:
+            # Апстримы недоступны (лимиты, сбой) — лучше устаревший тайл, чем 502
+            return on_disk[0], "image/png"
+        return None
+
+    body, _ = fetched
+    await _redis_set_tile(key, body)
+    await _disk_put_tile(z, x, y, body)
+    return fetched
+
+
+async def get_tile_coalesced(request: Request, z: int, x: int, y: int) -> Optional[tuple[bytes, str]]:
+    """Тайл мимо Redis: одна загрузка на z/x/y в процессе, остальные запросы ждут её."""
+    key = f"{TILE_KEY_PREFIX}{z}:{x}:{y}"
+    task = _inflight_tiles.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_tile(request, key, z, x, y))
+        _inflight_tiles[key] = task
+
+        def _forget(done: "asyncio.Task[Optional[tuple[bytes, str]]]", key: str = key) -> None:
+            if _inflight_tiles.get(key) is done:
+                del _inflight_tiles[key]
+
+        task.add_done_callback(_forget)
+    # shield: обрыв одного клиента не отменяет загрузку для остальных
+    return await asyncio.shield(task)
+
+
 @router.get("/tiles/{z}/{x}/{y}.png")
 async def proxy_osm_tile(request: Request, z: int, x: int, y: int):
     if not _valid_tile(z, x, y):
         raise HTTPException(status_code=400, detail="Invalid tile coordinates")
 
     cache_control = "public, max-age=86400"
+    basemap = await _basemap_get_tile(z, x, y)
+    if basemap:
+        return Response(content=basemap, media_type="image/png", headers={"Cache-Control": cache_control})
+
     r = get_redis_binary_client()
     key = f"{TILE_KEY_PREFIX}{z}:{x}:{y}"
 
@@ -121,20 +239,177 @@ async def proxy_osm_tile(request: Request, z: int, x: int, y: int):
         except Exception:
             pass
 
-    fetched = await _fetch_tile_from_upstreams(request, z, x, y)
+    if settings.TILE_CACHE_ENABLED:
+        fetched = await get_tile_coalesced(request, z, x, y)
+    else:
+        fetched = await _fetch_tile_from_upstreams(request, z, x, y)
     if fetched is None:
         raise HTTPException(status_code=502, detail="Tile upstream unavailable")
 
     body, ct = fetched
-
-    if settings.TILE_CACHE_ENABLED and r:
-        try:
-            await r.set(key, body, ex=settings.TILE_CACHE_REDIS_TTL_SECONDS)
-        except Exception:
-            pass
-
     return Response(
         content=body,
         media_type=ct,
         headers={"Cache-Control": cache_control},
     )
+
+
+async def _prefetch_line_geometries(db: AsyncSession, line_ids: Optional[List[int]]) -> List[List[Any]]:
+    """Координаты ЛЭП и пролётов (LineString) для коридора: из кэша слоёв или, для line_ids, из БД."""
+    from app.api.v1.map_tiles import _get_power_lines_geojson_impl, _get_spans_geojson_impl
+
+    lines: List[List[Any]] = []
+    for layer, loader in (("power-lines", _get_power_lines_geojson_impl), ("spans", _get_spans_geojson_impl)):
+        if line_ids:
+            data = await loader(db, line_ids=line_ids)
+        else:
+            data = loads_json_bytes((await get_map_geojson_payload(layer, loader, db)).identity)
+        for feature in data.get("features") or []:
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") != "LineString":
+                continue
+            if line_ids and feature_line_id(layer, feature) not in line_ids:
+                continue
+            lines.append(geometry.get("coordinates") or [])
+    return lines
+
+
+@router.post("/tiles/prefetch", response_model=TilePrefetchJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_tile_prefetch(
+    request: Request,
+    body: TilePrefetchRequest,
+    _: User = Depends(require_admin_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Прогреть кэш тайлов области: bbox, коридор corridor_m вдоль ЛЭП (line_ids — только эти линии)
+    или, без обоих, границы данных. Задание идёт в фоне; прогресс — GET /tiles/prefetch/{id}.
+    """
+    if not settings.TILE_CACHE_ENABLED:
+        raise HTTPException(status_code=409, detail="Tile cache disabled (TILE_CACHE_ENABLED)")
+    try:
+        bbox = parse_bbox(body.bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    try:
+        if body.corridor_m is not None:
+            mode = "corridor"
+            lines = await _prefetch_line_geometries(db, body.line_ids)
+            tiles = await asyncio.to_thread(
+                corridor_tiles, lines, body.corridor_m, body.min_zoom, body.max_zoom,
+                bbox, settings.TILE_PREFETCH_MAX_TILES,
+            )
+            total = len(tiles)
+        else:
+            mode = "bbox"
+            if bbox is None:
+                from app.api.v1.map_tiles import get_data_bbox
+
+                mode = "bounds"
+                bbox = await get_data_bbox(db)
+                if bbox is None:
+                    raise HTTPException(status_code=400, detail="Нет данных для границ: укажите bbox")
+            total = bbox_tile_count(bbox, body.min_zoom, body.max_zoom)
+            tiles = bbox_tiles(bbox, body.min_zoom, body.max_zoom)
+    except HTTPException:
+        raise
+    except TileLimitExceeded as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{e}; уменьшите коридор, область или max_zoom",
+        ) from e
+    except Exception as e:
+        logger.exception("map/tiles/prefetch: %s", e)
+        raise HTTPException(status_code=500, detail=f"map/tiles/prefetch: {type(e).__name__}: {e}") from e
+
+    if total > settings.TILE_PREFETCH_MAX_TILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Слишком много тайлов: {total} > {settings.TILE_PREFETCH_MAX_TILES}; уменьшите область или max_zoom",
+        )
+
+    async def is_cached(z: int, x: int, y: int) -> bool:
+        if await _basemap_get_tile(z, x, y):
+            return True
+        r = get_redis_binary_client()
+        if not r:
+            return False
+        try:
+            return bool(await r.exists(f"{TILE_KEY_PREFIX}{z}:{x}:{y}"))
+        except Exception:
+            return False
+
+    async def load(z: int, x: int, y: int) -> bool:
+        return await get_tile_coalesced(request, z, x, y) is not None
+
+    job = await start_prefetch_job(
+        mode,
+        tiles,
+        total,
+        body.min_zoom,
+        body.max_zoom,
+        min(body.concurrency, settings.TILE_PREFETCH_MAX_CONCURRENCY),
+        is_cached,
+        load,
+    )
+    return job.as_dict()
+
+
+@router.get("/tiles/prefetch/{job_id}", response_model=TilePrefetchJobResponse)
+async def get_tile_prefetch(job_id: str, _: User = Depends(require_admin_user)):
+    """Прогресс задания прогрева."""
+    state = await get_prefetch_job(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Prefetch job not found")
+    return state
+
+
+@router.delete("/tiles/prefetch/{job_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_tile_prefetch(job_id: str, _: User = Depends(require_admin_user)):
+    """Остановить задание прогрева (уже загруженные тайлы остаются в кэше)."""
+    if not await cancel_prefetch_job(job_id):
+        raise HTTPException(status_code=404, detail="Prefetch job not found")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/vt/{z}/{x}/{y}.mvt")
+async def get_map_vector_tile(
+    z: int,
+    x: int,
+    y: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Векторный тайл (MVT): ЛЭП, пролёты, подстанции, отпайки, опоры — по zoom тайла."""
+    if not _valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    from app.api.v1.map_tiles import build_map_vector_tile
+
+    # Данные сети меняются при синхронизации — клиенту держать недолго, основной кэш в Redis
+    cache_control = "private, max-age=60"
+    r = get_redis_binary_client() if settings.MAP_VECTOR_TILE_CACHE_ENABLED else None
+    key = None
+    if r:
+        generation = await get_map_vector_tile_generation()
+        key = f"{VECTOR_TILE_KEY_PREFIX}{generation}:{z}:{x}:{y}"
+        try:
+            cached = await r.get(key)
+            if cached is not None:
+                return Response(content=cached, media_type=MVT_MEDIA_TYPE, headers={"Cache-Control": cache_control})
+        except Exception:
+            pass
+
+    try:
+        body = await build_map_vector_tile(db, z, x, y)
+    except Exception as e:
+        logger.exception("map/vt/%s/%s/%s: %s", z, x, y, e)
+        raise HTTPException(status_code=500, detail=f"map/vt: {type(e).__name__}: {e}") from e
+
+    if r and key:
+        try:
+            await r.set(key, body, ex=settings.MAP_VECTOR_TILE_CACHE_TTL_SECONDS)
+        except Exception:
+            pass
+
+    return Response(content=body, media_type=MVT_MEDIA_TYPE, headers={"Cache-Control": cache_control})
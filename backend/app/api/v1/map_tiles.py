@@ -1,10 +1,10 @@
 from typing import List, Dict, Any, Optional
 import math
 import re
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func, or_, and_, case, true, union_all
+from sqlalchemy.orm import aliased, selectinload
 
 from app.database import get_db
 from app.core.security import get_current_active_user
@@ -15,7 +15,27 @@ from app.models.location import Location, PositionPoint
 from app.models.map_overlay_route import MapOverlayRoute, MapOverlayRoutePoint
 from app.models.cim_line_structure import ConnectivityNode, LineSection
 from app.core.map_uid_search import find_map_entity_by_uid
-from app.core.map_geojson_cache import get_map_geojson_cached
+from app.core.map_geojson_cache import (
+    NO_LINE_FRAGMENT_ID,
+    apply_map_geojson_variant,
+    get_map_geojson_cluster_payload,
+    get_map_geojson_payload,
+    map_geojson_variant,
+)
+from app.core.json_payload import (
+    IDENTITY,
+    JSON_MEDIA_TYPE,
+    JSONPayload,
+    build_json_payload,
+    choose_content_encoding,
+    dumps_json_bytes,
+    etag_matches,
+    loads_json_bytes,
+)
+from app.core.map_clusters import MAP_CLUSTER_LAYERS, cluster_zoom
+from app.core.config import settings
+from app.core.map_bbox import MapBBox, parse_bbox, layer_visible_at_zoom
+from app.core.vector_tiles import DEFAULT_BUFFER as VECTOR_TILE_BUFFER, encode_vector_tile, tile_bounds_lonlat
 import logging
 
 logger = logging.getLogger(__name__)
@@ -65,18 +85,24 @@ def _equipment_icon_key(equipment_type: str, name: Optional[str] = None) -> Opti
     return None
 
 
+# Критичность дефекта: варианты написания → нормализованное значение и ранг (чем больше, тем хуже)
+_CRITICALITY_ALIASES: Dict[str, tuple] = {
+    "high": ("high", "critical", "высокая", "высокий"),
+    "medium": ("medium", "med", "средняя", "средний"),
+    "low": ("low", "низкая", "низкий"),
+}
+_CRITICALITY_RANKS: Dict[str, int] = {"high": 3, "medium": 2, "low": 1}
+
+
 def _normalize_criticality(value: Optional[str]) -> Optional[str]:
     if value is None:
         return None
     v = str(value).strip().lower()
     if not v:
         return None
-    if v in {"high", "critical", "высокая", "высокий"}:
-        return "high"
-    if v in {"medium", "med", "средняя", "средний"}:
-        return "medium"
-    if v in {"low", "низкая", "низкий"}:
-        return "low"
+    for normalized, aliases in _CRITICALITY_ALIASES.items():
+        if v in aliases:
+            return normalized
     return None
 
 
@@ -86,25 +112,254 @@ def _has_equipment_defect(eq: Equipment) -> bool:
 
 
 def _criticality_rank(value: Optional[str]) -> int:
-    c = _normalize_criticality(value)
-    if c == "high":
-        return 3
-    if c == "medium":
-        return 2
-    if c == "low":
-        return 1
-    return 0
+    return _CRITICALITY_RANKS.get(_normalize_criticality(value), 0)
+
+
+def _criticality_from_rank(rank: int) -> Optional[str]:
+    for normalized, r in _CRITICALITY_RANKS.items():
+        if r == rank:
+            return normalized
+    return None
+
+
+def _sql_criticality_rank(col):
+    """_criticality_rank в SQL (для свёрток по оборудованию без загрузки строк)."""
+    v = func.lower(func.btrim(col))
+    return case(
+        *[
+            (v.in_(aliases), _CRITICALITY_RANKS[normalized])
+            for normalized, aliases in _CRITICALITY_ALIASES.items()
+        ],
+        else_=0,
+    )
+
+
+# --- Окно просмотра (bbox/zoom) ---
+# GiST-индекс ix_position_point_xy_gist построен по выражению point(x_position, y_position):
+# условие ниже должно совпадать с ним дословно, иначе планировщик уйдёт в seq scan.
+
+BBOX_QUERY_DESCRIPTION = "Окно карты minLon,minLat,maxLon,maxLat — только объекты в видимой области"
+CLUSTER_QUERY_DESCRIPTION = "Кластеры вместо точек на zoom ≤ 13 (число точек и худшая критичность дефекта)"
+ZOOM_QUERY_DESCRIPTION = "Текущий zoom карты; на малых zoom тяжёлые точечные слои не отдаются, геометрия ЛЭП упрощается"
+
+
+def _parse_bbox_param(bbox: Optional[str]) -> Optional[MapBBox]:
+    try:
+        return parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+
+def _view_box(view: MapBBox):
+    return func.box(
+        func.point(view.min_lon, view.min_lat),
+        func.point(view.max_lon, view.max_lat),
+    )
+
+
+def _xy_in_bbox(x_col, y_col, view: MapBBox):
+    return func.point(x_col, y_col).op("<@", is_comparison=True)(_view_box(view))
+
+
+def _box_overlaps_bbox(x1, y1, x2, y2, view: MapBBox):
+    """Прямоугольник с углами (x1, y1), (x2, y2) пересекает окно (box && box)."""
+    return func.box(func.point(x1, y1), func.point(x2, y2)).op("&&", is_comparison=True)(_view_box(view))
+
+
+def _pole_in_bbox(pole_id_col, view: MapBBox):
+    """Опора в окне: точка PositionPoint напрямую (pole_id) или через Location."""
+    direct = select(PositionPoint.pole_id).where(
+        PositionPoint.pole_id.isnot(None),
+        _xy_in_bbox(PositionPoint.x_position, PositionPoint.y_position, view),
+    )
+    via_location = (
+        select(Pole.id)
+        .join(PositionPoint, PositionPoint.location_id == Pole.location_id)
+        .where(_xy_in_bbox(PositionPoint.x_position, PositionPoint.y_position, view))
+    )
+    return or_(pole_id_col.in_(direct), pole_id_col.in_(via_location))
+
+
+def _pole_points(name: str, pole_filter):
+    """
+    (pole_id, line_id, x, y): точки опор — PositionPoint напрямую (pole_id) и через Location;
+    pole_filter — условие на Pole (только опоры-кандидаты, не вся сеть).
+    """
+    direct = select(
+        Pole.id.label("pole_id"), Pole.line_id.label("line_id"),
+        PositionPoint.x_position.label("x"), PositionPoint.y_position.label("y"),
+    ).join(PositionPoint, PositionPoint.pole_id == Pole.id).where(pole_filter)
+    via_location = select(
+        Pole.id, Pole.line_id, PositionPoint.x_position, PositionPoint.y_position,
+    ).join(PositionPoint, PositionPoint.location_id == Pole.location_id).where(pole_filter)
+    return union_all(direct, via_location).subquery(name)
+
+
+def _node_points(name: str, node_ids):
+    """(node_id, x, y) узлов node_ids: узел опоры — по точке опоры, узел ПС без опоры — по своим x/y."""
+    points = _pole_points(
+        f"{name}_poles",
+        Pole.id.in_(select(ConnectivityNode.pole_id).where(ConnectivityNode.id.in_(node_ids))),
+    )
+    with_pole = select(
+        ConnectivityNode.id.label("node_id"), points.c.x.label("x"), points.c.y.label("y"),
+    ).join(points, points.c.pole_id == ConnectivityNode.pole_id).where(ConnectivityNode.id.in_(node_ids))
+    own = select(
+        ConnectivityNode.id, ConnectivityNode.x_position, ConnectivityNode.y_position,
+    ).where(ConnectivityNode.pole_id.is_(None), ConnectivityNode.id.in_(node_ids))
+    return union_all(with_pole, own).subquery(name)
+
+
+def _near_view(view: MapBBox) -> MapBBox:
+    """Окно с запасом на длину пролёта: концы пролёта, пересекающего окно, лежат в нём."""
+    return view.expanded(settings.MAP_BBOX_SPAN_MARGIN_M)
+
+
+def _line_in_bbox(line_id_col, view: MapBBox):
+    """
+    ЛЭП в окне, если охват её опор пересекает окно: линия, проходящая окно насквозь
+    без опор внутри (длинные пролёты на крупном zoom), тоже попадает. Кандидаты — ЛЭП с опорой
+    в окне с запасом (_near_view, GiST-индекс точек); охват считается только по их опорам.
+    """
+    candidates = select(Pole.line_id).where(Pole.line_id.isnot(None), _pole_in_bbox(Pole.id, _near_view(view)))
+    points = _pole_points("pole_points", Pole.line_id.in_(candidates))
+    extents = (
+        select(points.c.line_id)
+        .group_by(points.c.line_id)
+        .having(_box_overlaps_bbox(
+            func.min(points.c.x), func.min(points.c.y), func.max(points.c.x), func.max(points.c.y), view,
+        ))
+    )
+    return line_id_col.in_(extents)
+
+
+def _span_in_bbox(view: MapBBox):
+    """
+    Пролёт в окне, если охват отрезка между его концами пересекает окно (концы могут быть вне окна).
+    Кандидаты — пролёты с концом в окне с запасом (_near_view): опора по GiST-индексу точек,
+    узел ПС без опоры — по своим x/y; точная проверка — только для них.
+    """
+    near = _near_view(view)
+    near_nodes = select(ConnectivityNode.id).where(or_(
+        and_(ConnectivityNode.pole_id.isnot(None), _pole_in_bbox(ConnectivityNode.pole_id, near)),
+        and_(
+            ConnectivityNode.pole_id.is_(None),
+            _xy_in_bbox(ConnectivityNode.x_position, ConnectivityNode.y_position, near),
+        ),
+    ))
+    candidates = (
+        select(Span.id, Span.from_connectivity_node_id, Span.to_connectivity_node_id)
+        .where(or_(
+            Span.from_connectivity_node_id.in_(near_nodes),
+            Span.to_connectivity_node_id.in_(near_nodes),
+        ))
+        .cte("span_candidates")
+    )
+    endpoint_ids = union_all(
+        select(candidates.c.from_connectivity_node_id),
+        select(candidates.c.to_connectivity_node_id),
+    )
+    from_points = _node_points("span_from_points", endpoint_ids)
+    to_points = _node_points("span_to_points", endpoint_ids)
+    return Span.id.in_(
+        select(candidates.c.id)
+        .join(from_points, from_points.c.node_id == candidates.c.from_connectivity_node_id)
+        .join(to_points, to_points.c.node_id == candidates.c.to_connectivity_node_id)
+        .join(to_points, to_points.c.node_id == Span.to_connectivity_node_id)
+        .where(_box_overlaps_bbox(from_points.c.x, from_points.c.y, to_points.c.x, to_points.c.y, view))
+    )
+
+
+def _in_line_fragments(line_id_col, line_ids: List[int]):
+    """Выборка только для перечисленных ЛЭП (фрагменты кэша слоя); 0 — объекты без ЛЭП."""
+    cond = line_id_col.in_([i for i in line_ids if i != NO_LINE_FRAGMENT_ID])
+    if NO_LINE_FRAGMENT_ID in line_ids:
+        cond = or_(cond, line_id_col.is_(None))
+    return cond
+
+
+def _empty_feature_collection() -> Dict[str, Any]:
+    return {"type": "FeatureCollection", "features": []}
+
+
+def _payload_response(request: Request, payload: JSONPayload) -> Response:
+    """Готовые байты слоя: 304 при совпадении ETag, иначе лучший доступный вариант сжатия."""
+    headers = {
+        "ETag": payload.etag,
+        "Vary": "Accept-Encoding",
+        # Клиент хранит ответ, но каждый раз сверяет ETag (данные правят бригады в течение смены)
+        "Cache-Control": "private, no-cache",
+    }
+    if etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    encoding = choose_content_encoding(
+        request.headers.get("accept-encoding"),
+        [e for e in payload.bodies if e != IDENTITY],
+    )
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.bodies[encoding], media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+def _request_payload(request: Request, data: Dict[str, Any]) -> JSONPayload:
+    """Ответ, собранный под запрос: сжимаем только в тот вариант, который примет клиент."""
+    encoding = choose_content_encoding(request.headers.get("accept-encoding"))
+    return build_json_payload(dumps_json_bytes(data), encodings=() if encoding == IDENTITY else (encoding,))
+
+
+def _features_in_view(data: Dict[str, Any], view: MapBBox) -> Dict[str, Any]:
+    features = []
+    for f in data.get("features") or []:
+        coords = (f.get("geometry") or {}).get("coordinates") or []
+        if len(coords) >= 2 and view.contains(coords[0], coords[1]):
+            features.append(f)
+    return {"type": "FeatureCollection", "features": features}
+
+
+async def _get_layer_geojson(
+    request: Request,
+    layer: str,
+    loader,
+    db: AsyncSession,
+    view: Optional[MapBBox],
+    zoom: Optional[int],
+    cluster: bool = False,
+) -> Response:
+    """
+    Слой целиком — готовые байты из кэша Redis; окно карты — запрос к БД по индексу, без кэша.
+    zoom также выбирает вариант слоя (упрощённая геометрия ЛЭП на обзорных масштабах).
+    cluster — на малых zoom вместо точек кластеры (строятся по закэшированному слою, bbox — фильтр по ним).
+    """
+    level = cluster_zoom(zoom) if cluster and layer in MAP_CLUSTER_LAYERS else None
+    if level is not None:
+        payload = await get_map_geojson_cluster_payload(layer, loader, db, level)
+        if view is not None:
+            payload = _request_payload(request, _features_in_view(loads_json_bytes(payload.identity), view))
+        return _payload_response(request, payload)
+
+    variant = map_geojson_variant(layer, zoom)
+    if not layer_visible_at_zoom(layer, zoom):
+        payload = build_json_payload(dumps_json_bytes(_empty_feature_collection()))
+    elif view is None:
+        payload = await get_map_geojson_payload(layer, loader, db, variant)
+    else:
+        payload = _request_payload(request, apply_map_geojson_variant(layer, variant, await loader(db, view)))
+    return _payload_response(request, payload)
 
 # Растровые тайлы подложки: GET /api/v1/map/tiles/{z}/{x}/{y}.png — см. map_tile_cache.py
 
 @router.get("/power-lines/geojson")
 async def get_power_lines_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
 ):
     """Получение ЛЭП в формате GeoJSON"""
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("power-lines", _get_power_lines_geojson_impl, db)
+        return await _get_layer_geojson(request, "power-lines", _get_power_lines_geojson_impl, db, view, zoom)
     except Exception as e:
         logger.exception("map/power-lines/geojson: %s", e)
         raise HTTPException(
@@ -125,13 +380,21 @@ def _pole_coords_from_position_point(pole):
     return None, None
 
 
-async def _get_power_lines_geojson_impl(db: AsyncSession):
-    result = await db.execute(
-        select(PowerLine).options(
-            selectinload(PowerLine.poles).selectinload(Pole.position_points),
-            selectinload(PowerLine.poles).selectinload(Pole.location).selectinload(Location.position_points),
-        )
+async def _get_power_lines_geojson_impl(
+    db: AsyncSession,
+    view: Optional[MapBBox] = None,
+    line_ids: Optional[List[int]] = None,
+):
+    stmt = select(PowerLine).options(
+        selectinload(PowerLine.poles).selectinload(Pole.position_points),
+        selectinload(PowerLine.poles).selectinload(Pole.location).selectinload(Location.position_points),
     )
+    if view is not None:
+        # Линия в окне целиком (а не обрезок): геометрия нужна клиенту для подписи и выделения
+        stmt = stmt.where(_line_in_bbox(PowerLine.id, view))
+    if line_ids is not None:
+        stmt = stmt.where(_in_line_fragments(PowerLine.id, line_ids))
+    result = await db.execute(stmt)
     power_lines = result.scalars().all()
 
     features = []
@@ -290,12 +553,17 @@ async def _get_power_lines_geojson_impl(db: AsyncSession):
 
 @router.get("/poles/geojson")
 async def get_poles_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
+    cluster: bool = Query(False, description=CLUSTER_QUERY_DESCRIPTION),
 ):
     """Получение опор в формате GeoJSON"""
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("poles", _get_poles_geojson_impl, db)
+        return await _get_layer_geojson(request, "poles", _get_poles_geojson_impl, db, view, zoom, cluster)
     except Exception as e:
         logger.exception("map/poles/geojson: %s", e)
         raise HTTPException(
@@ -304,170 +572,225 @@ async def get_poles_geojson(
         ) from e
 
 
-async def _get_poles_geojson_impl(db: AsyncSession):
-    result = await db.execute(
-        select(Pole).options(
-            selectinload(Pole.line),
-            selectinload(Pole.equipment),
-            selectinload(Pole.connectivity_nodes).selectinload(ConnectivityNode.from_segments),
-            selectinload(Pole.connectivity_nodes).selectinload(ConnectivityNode.to_segments),
-            selectinload(Pole.position_points),
-            selectinload(Pole.location).selectinload(Location.position_points)
+async def _get_poles_geojson_impl(
+    db: AsyncSession,
+    view: Optional[MapBBox] = None,
+    line_ids: Optional[List[int]] = None,
+):
+    """
+    Опоры в GeoJSON одним запросом по столбцам: координаты (LATERAL по PositionPoint),
+    имя ЛЭП, первый участок AClineSegment, свёртка дефектов оборудования и признак
+    начатой отпайки считаются в SQL — граф ORM (оборудование, узлы, участки) не загружается.
+    """
+    from app.models.acline_segment import AClineSegment
+
+    pole_pp = (
+        select(PositionPoint.x_position.label("x"), PositionPoint.y_position.label("y"))
+        .where(PositionPoint.pole_id == Pole.id)
+        .order_by(PositionPoint.id)
+        .limit(1)
+        .lateral("pole_pp")
+    )
+    location_pp = (
+        select(PositionPoint.x_position.label("x"), PositionPoint.y_position.label("y"))
+        .where(PositionPoint.location_id == Pole.location_id)
+        .order_by(PositionPoint.id)
+        .limit(1)
+        .lateral("location_pp")
+    )
+
+    defect_rows = (
+        select(
+            Equipment.pole_id.label("pole_id"),
+            func.count().label("defect_count"),
+            func.max(_sql_criticality_rank(Equipment.criticality)).label("defect_max_rank"),
         )
+        .where(func.btrim(Equipment.defect, " \t\r\n") != "")
+        .group_by(Equipment.pole_id)
+        .subquery("pole_defects")
     )
-    poles = result.scalars().all()
-    
-    # Для отпаечных опор: у каких уже есть хотя бы одна опора по отпайке (tap_pole_id = id отпаечной)
-    tap_pole_ids_with_branch = {
-        p.tap_pole_id for p in poles
-        if getattr(p, "tap_pole_id", None) is not None
-    }
-    
+
+    def _first_segment_id(node_col):
+        return (
+            select(func.min(AClineSegment.id))
+            .join(ConnectivityNode, node_col == ConnectivityNode.id)
+            .where(ConnectivityNode.pole_id == Pole.id)
+            .scalar_subquery()
+        )
+
+    branch_pole = aliased(Pole)
+    stmt = (
+        select(
+            Pole.id,
+            Pole.mrid,
+            Pole.pole_number,
+            Pole.pole_type,
+            Pole.condition,
+            Pole.notes,
+            Pole.height,
+            Pole.line_id,
+            PowerLine.name.label("line_name"),
+            Pole.connectivity_node_id,
+            Pole.sequence_number,
+            Pole.material,
+            Pole.year_installed,
+            Pole.branch_type,
+            Pole.tap_pole_id,
+            Pole.tap_branch_index,
+            Pole.is_tap_pole,
+            Pole.card_comment,
+            Pole.card_comment_attachment,
+            Pole.structural_defect,
+            Pole.structural_defect_criticality,
+            func.coalesce(pole_pp.c.x, location_pp.c.x).label("lon"),
+            func.coalesce(pole_pp.c.y, location_pp.c.y).label("lat"),
+            func.coalesce(
+                _first_segment_id(AClineSegment.from_connectivity_node_id),
+                _first_segment_id(AClineSegment.to_connectivity_node_id),
+            ).label("segment_id"),
+            func.coalesce(defect_rows.c.defect_count, 0).label("defect_count"),
+            func.coalesce(defect_rows.c.defect_max_rank, 0).label("defect_max_rank"),
+            # Оранжевый = отпайка не начата, зелёный = от отпаечной уже есть опоры
+            select(branch_pole.id).where(branch_pole.tap_pole_id == Pole.id).exists().label("tap_branch_has_poles"),
+        )
+        .outerjoin(PowerLine, PowerLine.id == Pole.line_id)
+        .outerjoin(pole_pp, true())
+        .outerjoin(location_pp, true())
+        .outerjoin(defect_rows, defect_rows.c.pole_id == Pole.id)
+        .order_by(Pole.id)
+    )
+    if view is not None:
+        stmt = stmt.where(_pole_in_bbox(Pole.id, view))
+    if line_ids is not None:
+        stmt = stmt.where(_in_line_fragments(Pole.line_id, line_ids))
+    rows = (await db.execute(stmt)).all()
+
+    segment_ids = {r.segment_id for r in rows if r.segment_id is not None}
+    segment_names: Dict[int, Optional[str]] = {}
+    if segment_ids:
+        seg_rows = await db.execute(
+            select(AClineSegment.id, AClineSegment.name).where(AClineSegment.id.in_(segment_ids))
+        )
+        segment_names = {int(sid): name for sid, name in seg_rows.all()}
+
     features = []
-    for pole in poles:
+    for row in rows:
         # CIM: координаты только из Location/PositionPoint
-        longitude, latitude = _pole_coords_from_position_point(pole)
-        if longitude is not None and latitude is not None:
-            # Убеждаемся, что координаты - это числа, а не None
-            try:
-                longitude = float(longitude)
-                latitude = float(latitude)
-                # Проверяем, что координаты валидны (не NaN, не Infinity)
-                if not (isinstance(longitude, (int, float)) and isinstance(latitude, (int, float))):
-                    continue
-                if longitude == float('inf') or latitude == float('inf') or longitude == float('-inf') or latitude == float('-inf'):
-                    continue
-                # Проверяем, что координаты не NaN
-                import math
-                if math.isnan(longitude) or math.isnan(latitude):
-                    continue
-            except (TypeError, ValueError):
-                continue  # Пропускаем объекты с невалидными координатами
-            
-            # Создаем properties, исключая None значения (mrid может отсутствовать в старых БД)
-            properties = {
-                "id": int(pole.id),
-                "mrid": str(getattr(pole, "mrid", None) or ""),
-                "pole_number": str(pole.pole_number) if pole.pole_number else "",
-                "pole_type": str(pole.pole_type) if pole.pole_type else "",
-                "condition": str(pole.condition) if pole.condition else "good",
-                "notes": str(pole.notes) if pole.notes else None,
-            }
-            # Добавляем опциональные поля только если они не None
-            if pole.height is not None:
-                properties["height"] = float(pole.height)
-            line_id_val = getattr(pole, 'line_id', None)
-            if line_id_val is None and pole.line is not None:
-                line_id_val = getattr(pole.line, 'id', None)
-            if line_id_val is not None:
-                properties["line_id"] = int(line_id_val)
-            if pole.line and pole.line.name:
-                properties["power_line_name"] = str(pole.line.name)
-            if pole.connectivity_node_id is not None:
-                properties["connectivity_node_id"] = int(pole.connectivity_node_id)
-            if pole.sequence_number is not None:
-                properties["sequence_number"] = int(pole.sequence_number)
-            # segment_id и segment_name для дерева: из ConnectivityNode -> AClineSegment (from/to)
-            segment_id = None
-            segment_name = None
-            for cn in (pole.connectivity_nodes or []):
-                for seg in (getattr(cn, "from_segments", None) or []) + (getattr(cn, "to_segments", None) or []):
-                    if seg and getattr(seg, "id", None) is not None:
-                        segment_id = int(seg.id)
-                        segment_name = getattr(seg, "name", None)
-                        break
-                if segment_id is not None:
-                    break
-            if segment_id is not None:
-                properties["segment_id"] = segment_id
-                properties["acline_segment_id"] = segment_id
+        try:
+            longitude = float(row.lon)
+            latitude = float(row.lat)
+        except (TypeError, ValueError):
+            continue  # Пропускаем объекты без координат или с невалидными координатами
+        if not (math.isfinite(longitude) and math.isfinite(latitude)):
+            continue
+        if view is not None and not view.contains(longitude, latitude):
+            continue
+
+        # Создаем properties, исключая None значения (mrid может отсутствовать в старых БД)
+        properties = {
+            "id": int(row.id),
+            "mrid": str(row.mrid or ""),
+            "pole_number": str(row.pole_number) if row.pole_number else "",
+            "pole_type": str(row.pole_type) if row.pole_type else "",
+            "condition": str(row.condition) if row.condition else "good",
+            "notes": str(row.notes) if row.notes else None,
+        }
+        # Добавляем опциональные поля только если они не None
+        if row.height is not None:
+            properties["height"] = float(row.height)
+        if row.line_id is not None:
+            properties["line_id"] = int(row.line_id)
+        if row.line_name:
+            properties["power_line_name"] = str(row.line_name)
+        if row.connectivity_node_id is not None:
+            properties["connectivity_node_id"] = int(row.connectivity_node_id)
+        if row.sequence_number is not None:
+            properties["sequence_number"] = int(row.sequence_number)
+        # segment_id и segment_name для дерева: из ConnectivityNode -> AClineSegment (from/to)
+        if row.segment_id is not None:
+            segment_id = int(row.segment_id)
+            properties["segment_id"] = segment_id
+            properties["acline_segment_id"] = segment_id
+            segment_name = segment_names.get(segment_id)
             if segment_name:
                 properties["segment_name"] = _segment_name_to_short(str(segment_name)) or str(segment_name)
-            if pole.material:
-                properties["material"] = str(pole.material)
-            if pole.year_installed is not None:
-                properties["year_installed"] = int(pole.year_installed)
-            if getattr(pole, "branch_type", None):
-                properties["branch_type"] = str(pole.branch_type)
-            if getattr(pole, "tap_pole_id", None) is not None:
-                properties["tap_pole_id"] = int(pole.tap_pole_id)
-            if getattr(pole, "tap_branch_index", None) is not None:
-                properties["tap_branch_index"] = int(pole.tap_branch_index)
-            if getattr(pole, "is_tap_pole", None) is True:
-                properties["is_tap_pole"] = True
-                # Оранжевый = отпайка не начата, зелёный = от отпаечной уже есть опоры
-                properties["tap_branch_has_poles"] = pole.id in tap_pole_ids_with_branch
-
-            # Карточка опоры (комментарий и вложения) — для панели свойств на карте
-            cc = getattr(pole, "card_comment", None)
-            if cc:
-                properties["card_comment"] = str(cc)
-            ca = getattr(pole, "card_comment_attachment", None)
-            if ca:
-                properties["card_comment_attachment"] = str(ca)
-
-            # Агрегация дефектов оборудования по опоре (вариант A для фронта)
-            defect_count = 0
-            defect_max_rank = 0
-            defect_max_criticality = None
-            for eq in (getattr(pole, "equipment", None) or []):
-                if not _has_equipment_defect(eq):
-                    continue
-                defect_count += 1
-                crit = _normalize_criticality(getattr(eq, "criticality", None))
-                rank = _criticality_rank(crit)
-                if rank > defect_max_rank:
-                    defect_max_rank = rank
-                    defect_max_criticality = crit
-            if defect_count > 0:
-                properties["has_equipment_defect"] = True
-                properties["equipment_defect_count"] = defect_count
-                if defect_max_criticality is not None:
-                    properties["equipment_defect_max_criticality"] = defect_max_criticality
-            else:
-                properties["has_equipment_defect"] = False
-
-            sd = getattr(pole, "structural_defect", None)
-            sd_crit = _normalize_criticality(getattr(pole, "structural_defect_criticality", None))
-            if sd and str(sd).strip():
-                properties["structural_defect"] = str(sd).strip()
-                if sd_crit:
-                    properties["structural_defect_criticality"] = sd_crit
-            # Итоговая критичность для подсветки маркера опоры (оборудование ∪ дефект опоры)
-            merged_crit = defect_max_criticality
-            merged_rank = _criticality_rank(merged_crit)
+        if row.material:
+            properties["material"] = str(row.material)
+        if row.year_installed is not None:
+            properties["year_installed"] = int(row.year_installed)
+        if row.branch_type:
+            properties["branch_type"] = str(row.branch_type)
+        if row.tap_pole_id is not None:
+            properties["tap_pole_id"] = int(row.tap_pole_id)
+        if row.tap_branch_index is not None:
+            properties["tap_branch_index"] = int(row.tap_branch_index)
+        if row.is_tap_pole is True:
+            properties["is_tap_pole"] = True
+            properties["tap_branch_has_poles"] = bool(row.tap_branch_has_poles)
+
+        # Карточка опоры (комментарий и вложения) — для панели свойств на карте
+        if row.card_comment:
+            properties["card_comment"] = str(row.card_comment)
+        if row.card_comment_attachment:
+            properties["card_comment_attachment"] = str(row.card_comment_attachment)
+
+        # Агрегация дефектов оборудования по опоре (вариант A для фронта)
+        defect_count = int(row.defect_count)
+        defect_max_criticality = _criticality_from_rank(int(row.defect_max_rank))
+        if defect_count > 0:
+            properties["has_equipment_defect"] = True
+            properties["equipment_defect_count"] = defect_count
+            if defect_max_criticality is not None:
+                properties["equipment_defect_max_criticality"] = defect_max_criticality
+        else:
+            properties["has_equipment_defect"] = False
+
+        sd = row.structural_defect
+        sd_crit = _normalize_criticality(row.structural_defect_criticality)
+        if sd and str(sd).strip():
+            properties["structural_defect"] = str(sd).strip()
             if sd_crit:
-                r = _criticality_rank(sd_crit)
-                if r > merged_rank:
-                    merged_rank = r
-                    merged_crit = sd_crit
-            if merged_crit:
-                properties["criticality"] = merged_crit
-
-            # Убеждаемся, что координаты - это числа, а не None
-            feature = {
-                "type": "Feature",
-                "properties": properties,
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [float(longitude), float(latitude)]  # Явное приведение к float
-                }
-            }
-            features.append(feature)
-    
+                properties["structural_defect_criticality"] = sd_crit
+        # Итоговая критичность для подсветки маркера опоры (оборудование ∪ дефект опоры)
+        merged_crit = defect_max_criticality
+        if sd_crit and _criticality_rank(sd_crit) > _criticality_rank(merged_crit):
+            merged_crit = sd_crit
+        if merged_crit:
+            properties["criticality"] = merged_crit
+
+        features.append({
+            "type": "Feature",
+            "properties": properties,
+            "geometry": {
+                "type": "Point",
+                "coordinates": [longitude, latitude],
+            },
+        })
+
     return {
         "type": "FeatureCollection",
         "features": features
     }
 
-async def _get_taps_geojson_impl(db: AsyncSession):
+async def _get_taps_geojson_impl(
+    db: AsyncSession,
+    view: Optional[MapBBox] = None,
+    line_ids: Optional[List[int]] = None,
+):
     """Получение отпаек в формате GeoJSON."""
-    result = await db.execute(
-        select(Tap).options(
-            selectinload(Tap.position_points),
-            selectinload(Tap.location).selectinload(Location.position_points)
-        )
+    stmt = select(Tap).options(
+        selectinload(Tap.position_points),
+        selectinload(Tap.location).selectinload(Location.position_points)
     )
+    if view is not None:
+        in_view = _xy_in_bbox(PositionPoint.x_position, PositionPoint.y_position, view)
+        stmt = stmt.where(or_(
+            Tap.id.in_(select(PositionPoint.tap_id).where(PositionPoint.tap_id.isnot(None), in_view)),
+            Tap.location_id.in_(select(PositionPoint.location_id).where(PositionPoint.location_id.isnot(None), in_view)),
+        ))
+    if line_ids is not None:
+        stmt = stmt.where(_in_line_fragments(Tap.line_id, line_ids))
+    result = await db.execute(stmt)
     taps = result.scalars().all()
     
     features = []
@@ -515,6 +838,8 @@ async def _get_taps_geojson_impl(db: AsyncSession):
                     continue
             except (TypeError, ValueError):
                 continue  # Пропускаем объекты с невалидными координатами
+            if view is not None and not view.contains(longitude, latitude):
+                continue
             
             # Создаем properties, исключая None значения
             properties = {
@@ -550,11 +875,15 @@ async def _get_taps_geojson_impl(db: AsyncSession):
 
 @router.get("/taps/geojson")
 async def get_taps_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
 ):
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("taps", _get_taps_geojson_impl, db)
+        return await _get_layer_geojson(request, "taps", _get_taps_geojson_impl, db, view, zoom)
     except Exception as e:
         logger.exception("map/taps/geojson: %s", e)
         raise HTTPException(
@@ -563,9 +892,9 @@ async def get_taps_geojson(
         ) from e
 
 
-async def _get_substations_geojson_impl(db: AsyncSession):
+async def _get_substations_geojson_impl(db: AsyncSession, view: Optional[MapBBox] = None):
     """Получение подстанций в формате GeoJSON."""
-    result = await db.execute(
+    stmt = (
         select(Substation)
         .where(Substation.is_active == True)
         .options(
@@ -574,6 +903,18 @@ async def _get_substations_geojson_impl(db: AsyncSession):
             selectinload(Substation.position_points),
         )
     )
+    if view is not None:
+        in_view = _xy_in_bbox(PositionPoint.x_position, PositionPoint.y_position, view)
+        stmt = stmt.where(or_(
+            and_(
+                Substation.x_position.isnot(None),
+                Substation.y_position.isnot(None),
+                _xy_in_bbox(Substation.x_position, Substation.y_position, view),
+            ),
+            Substation.id.in_(select(PositionPoint.substation_id).where(PositionPoint.substation_id.isnot(None), in_view)),
+            Substation.location_id.in_(select(PositionPoint.location_id).where(PositionPoint.location_id.isnot(None), in_view)),
+        ))
+    result = await db.execute(stmt)
     substations = result.scalars().all()
 
     features = []
@@ -634,6 +975,8 @@ async def _get_substations_geojson_impl(db: AsyncSession):
                     continue
             except (TypeError, ValueError):
                 continue  # Пропускаем объекты с невалидными координатами
+            if view is not None and not view.contains(longitude, latitude):
+                continue
             
             # Создаем properties, исключая None значения
             properties = {
@@ -668,11 +1011,15 @@ async def _get_substations_geojson_impl(db: AsyncSession):
 
 @router.get("/substations/geojson")
 async def get_substations_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
 ):
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("substations", _get_substations_geojson_impl, db)
+        return await _get_layer_geojson(request, "substations", _get_substations_geojson_impl, db, view, zoom)
     except Exception as e:
         logger.exception("map/substations/geojson: %s", e)
         raise HTTPException(
@@ -681,12 +1028,8 @@ async def get_substations_geojson(
         ) from e
 
 
-@router.get("/bounds")
-async def get_data_bounds(
-    current_user: User = Depends(get_current_active_user),
-    db: AsyncSession = Depends(get_db)
-):
-    """Получение границ всех данных для настройки карты (по CIM: из position_point)."""
+async def get_data_bbox(db: AsyncSession) -> Optional[MapBBox]:
+    """Границы всех точек position_point; None — данных нет."""
     result = await db.execute(
         select(
             func.min(PositionPoint.y_position).label('min_lat'),
@@ -696,14 +1039,30 @@ async def get_data_bounds(
         ).select_from(PositionPoint)
     )
     bounds = result.first()
-    
-    if bounds and bounds.min_lat:
+    if not bounds or not bounds.min_lat:
+        return None
+    return MapBBox(
+        min_lon=float(bounds.min_lng),
+        min_lat=float(bounds.min_lat),
+        max_lon=float(bounds.max_lng),
+        max_lat=float(bounds.max_lat),
+    )
+
+
+@router.get("/bounds")
+async def get_data_bounds(
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Получение границ всех данных для настройки карты (по CIM: из position_point)."""
+    bounds = await get_data_bbox(db)
+    if bounds is not None:
         return {
             "bounds": {
-                "min_lat": float(bounds.min_lat),
-                "max_lat": float(bounds.max_lat),
-                "min_lng": float(bounds.min_lng),
-                "max_lng": float(bounds.max_lng)
+                "min_lat": bounds.min_lat,
+                "max_lat": bounds.max_lat,
+                "min_lng": bounds.min_lon,
+                "max_lng": bounds.max_lon,
             }
         }
     else:
@@ -719,16 +1078,21 @@ async def get_data_bounds(
 
 @router.get("/equipment/geojson")
 async def get_equipment_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
+    cluster: bool = Query(False, description=CLUSTER_QUERY_DESCRIPTION),
 ):
     """
     Оборудование на карте: точки между соседними опорами (как во Flutter).
     Каждая фича — Point с properties: icon (ключ: recloser|breaker|zn|disconnector|arrester),
     angle_rad, equipment_type, name, from_pole_id, to_pole_id, line_id.
     """
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("equipment", _get_equipment_geojson_impl, db)
+        return await _get_layer_geojson(request, "equipment", _get_equipment_geojson_impl, db, view, zoom, cluster)
     except Exception as e:
         logger.exception("map/equipment/geojson: %s", e)
         raise HTTPException(
@@ -758,15 +1122,22 @@ def _pole_order_from_number(pole_number: str) -> int:
     return int(suffix) if suffix.isdigit() else (1 << 30)
 
 
-async def _get_equipment_geojson_impl(db: AsyncSession):
-    result = await db.execute(
-        select(PowerLine)
-        .options(
-            selectinload(PowerLine.poles).selectinload(Pole.position_points),
-            selectinload(PowerLine.poles).selectinload(Pole.location).selectinload(Location.position_points),
-            selectinload(PowerLine.poles).selectinload(Pole.equipment),
-        )
+async def _get_equipment_geojson_impl(
+    db: AsyncSession,
+    view: Optional[MapBBox] = None,
+    line_ids: Optional[List[int]] = None,
+):
+    stmt = select(PowerLine).options(
+        selectinload(PowerLine.poles).selectinload(Pole.position_points),
+        selectinload(PowerLine.poles).selectinload(Pole.location).selectinload(Location.position_points),
+        selectinload(PowerLine.poles).selectinload(Pole.equipment),
     )
+    if view is not None:
+        # Положение значка зависит от соседней опоры, поэтому грузим линии целиком, а фичи фильтруем по окну
+        stmt = stmt.where(_line_in_bbox(PowerLine.id, view))
+    if line_ids is not None:
+        stmt = stmt.where(_in_line_fragments(PowerLine.id, line_ids))
+    result = await db.execute(stmt)
     power_lines = result.scalars().all()
     features: List[Dict[str, Any]] = []
 
@@ -799,6 +1170,8 @@ async def _get_equipment_geojson_impl(db: AsyncSession):
                 return
             lng = x1 + (x2 - x1) * t
             lat = y1 + (y2 - y1) * t
+            if view is not None and not view.contains(lng, lat):
+                return
             if from_pole.id <= to_pole.id:
                 x_lo, y_lo, x_hi, y_hi = x1, y1, x2, y2
                 from_id, to_id = from_pole.id, to_pole.id
@@ -933,12 +1306,16 @@ async def _get_equipment_geojson_impl(db: AsyncSession):
     return {"type": "FeatureCollection", "features": features}
 
 
-async def _get_spans_geojson_impl(db: AsyncSession):
+async def _get_spans_geojson_impl(
+    db: AsyncSession,
+    view: Optional[MapBBox] = None,
+    line_ids: Optional[List[int]] = None,
+):
     """Получение пролётов в формате GeoJSON."""
     from app.models.power_line import Span
     from app.models.cim_line_structure import ConnectivityNode
 
-    result = await db.execute(
+    stmt = (
         select(Span)
         .options(
             selectinload(Span.from_connectivity_node).selectinload(ConnectivityNode.pole).selectinload(Pole.position_points),
@@ -949,6 +1326,12 @@ async def _get_spans_geojson_impl(db: AsyncSession):
             selectinload(Span.line_section).selectinload(LineSection.acline_segment)
         )
     )
+    if view is not None:
+        # Пролёт в окне, если его отрезок (опора или узел ПС со своими координатами) пересекает окно
+        stmt = stmt.where(_span_in_bbox(view))
+    if line_ids is not None:
+        stmt = stmt.where(_in_line_fragments(Span.line_id, line_ids))
+    result = await db.execute(stmt)
     spans = result.scalars().all()
     
     features = []
@@ -1003,6 +1386,8 @@ async def _get_spans_geojson_impl(db: AsyncSession):
                         continue
                 except (TypeError, ValueError):
                     continue
+                if view is not None and not view.overlaps_segment(from_longitude, from_latitude, to_longitude, to_latitude):
+                    continue
                 
                 # Явное приведение к float для всех координат
                 coordinates = [
@@ -1072,11 +1457,15 @@ async def _get_spans_geojson_impl(db: AsyncSession):
 
 @router.get("/spans/geojson")
 async def get_spans_geojson(
+    request: Request,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db),
+    bbox: Optional[str] = Query(None, description=BBOX_QUERY_DESCRIPTION),
+    zoom: Optional[int] = Query(None, ge=0, le=22, description=ZOOM_QUERY_DESCRIPTION),
 ):
+    view = _parse_bbox_param(bbox)
     try:
-        return await get_map_geojson_cached("spans", _get_spans_geojson_impl, db)
+        return await _get_layer_geojson(request, "spans", _get_spans_geojson_impl, db, view, zoom)
     except Exception as e:
         logger.exception("map/spans/geojson: %s", e)
         raise HTTPException(
@@ -1085,6 +1474,33 @@ async def get_spans_geojson(
         ) from e
 
 
+# Векторные тайлы: слой MVT → загрузчик GeoJSON с окном. Порядок — порядок отрисовки (снизу вверх).
+_VECTOR_TILE_LOADERS = (
+    ("power-lines", _get_power_lines_geojson_impl),
+    ("spans", _get_spans_geojson_impl),
+    ("substations", _get_substations_geojson_impl),
+    ("taps", _get_taps_geojson_impl),
+    ("poles", _get_poles_geojson_impl),
+)
+
+
+async def build_map_vector_tile(db: AsyncSession, z: int, x: int, y: int) -> bytes:
+    """
+    MVT-тайл z/x/y из слоёв карты: отсев слоёв по zoom, выборка по пересечению с окном тайла
+    (с запасом) — пролёт через тайл без опор в нём тоже попадает; линии обрезаются по тайлу
+    в encode_vector_tile.
+    """
+    min_lon, min_lat, max_lon, max_lat = tile_bounds_lonlat(z, x, y, buffer=VECTOR_TILE_BUFFER)
+    view = MapBBox(min_lon=min_lon, min_lat=min_lat, max_lon=max_lon, max_lat=max_lat)
+    layers = []
+    for layer, loader in _VECTOR_TILE_LOADERS:
+        if not layer_visible_at_zoom(layer, z):
+            continue
+        collection = await loader(db, view)
+        layers.append((layer, collection.get("features") or []))
+    return encode_vector_tile(layers, z, x, y, buffer=VECTOR_TILE_BUFFER)
+
+
 @router.get("/find-uid")
 async def find_uid_on_map(
     q: str = Query(..., min_length=8, description="mRID / UID объекта (из журнала или карточки)"),
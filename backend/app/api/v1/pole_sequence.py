@@ -8,11 +8,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 from sqlalchemy.orm import selectinload
 from pydantic import ValidationError
-import math
 
 logger = logging.getLogger(__name__)
 
 from app.database import get_db
+from app.core.geodesy import as_coordinate_array, nearest_neighbour_order
 from app.core.security import get_current_active_user
 from app.models.user import User
 from app.models.power_line import Pole, PowerLine
@@ -22,43 +22,6 @@ from app.schemas.cim_line_structure import ConnectivityNodeResponse
 router = APIRouter()
 
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Расчёт расстояния между двумя точками (в метрах) по формуле Гаверсинуса"""
-    R = 6371000  # Радиус Земли в метрах
-    
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    a = math.sin(delta_phi / 2) ** 2 + \
-        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    return R * c
-
-
-def find_nearest_pole(poles: List[Pole], current_pole: Pole, visited: set) -> Optional[Pole]:
-    """Находит ближайшую непосещённую опору"""
-    min_distance = float('inf')
-    nearest = None
-    
-    for pole in poles:
-        if pole.id in visited or pole.id == current_pole.id:
-            continue
-        
-        distance = calculate_distance(
-            current_pole.get_latitude(), current_pole.get_longitude(),
-            pole.get_latitude(), pole.get_longitude(),
-        )
-        
-        if distance < min_distance:
-            min_distance = distance
-            nearest = pole
-    
-    return nearest
-
-
 @router.post("/power-lines/{power_line_id}/poles/auto-sequence")
 async def auto_sequence_poles(
     power_line_id: int,
@@ -98,19 +61,13 @@ async def auto_sequence_poles(
         # Берём первую опору по номеру
         start_pole = poles[0]
     
-    # Строим последовательность
-    sequence = [start_pole]
-    visited = {start_pole.id}
-    current_pole = start_pole
-    
-    while len(visited) < len(poles):
-        nearest = find_nearest_pole(poles, current_pole, visited)
-        if not nearest:
-            break
-        
-        sequence.append(nearest)
-        visited.add(nearest.id)
-        current_pole = nearest
+    # Строим последовательность: от начальной опоры каждый раз к ближайшей непосещённой
+    order = nearest_neighbour_order(
+        as_coordinate_array(p.get_latitude() for p in poles),
+        as_coordinate_array(p.get_longitude() for p in poles),
+        start=poles.index(start_pole),
+    )
+    sequence = [poles[i] for i in order]
     
     # Обновляем sequence_number для всех опор
     for index, pole in enumerate(sequence, start=1):
@@ -254,7 +254,7 @@ async def create_equipment(
         await sync_equipment_terminals_for_line(db, pole.line_id)
         await db.commit()
         from app.core.map_geojson_cache import invalidate_map_geojson_cache
-        await invalidate_map_geojson_cache(["equipment", "poles"])
+        await invalidate_map_geojson_cache(["equipment", "poles"], line_ids=[pole.line_id])
         await db.refresh(db_equipment)
 
         # Полная запись журнала создания оборудования
@@ -329,10 +329,11 @@ async def delete_pole_equipment(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Equipment not found",
         )
+    line_id = (await db.execute(select(Pole.line_id).where(Pole.id == pole_id))).scalar_one_or_none()
     await db.delete(equipment)
     await db.commit()
     from app.core.map_geojson_cache import invalidate_map_geojson_cache
-    await invalidate_map_geojson_cache(["equipment", "poles"])
+    await invalidate_map_geojson_cache(["equipment", "poles"], line_ids=[line_id])
     print("DEBUG delete_pole_equipment: deleted successfully")
 
 
@@ -362,6 +363,11 @@ async def delete_pole(
             )
         
         print(f"DEBUG: Опора {pole_id} найдена: {pole.pole_number}")
+        # ЛЭП, чьи фрагменты кэша карты затронет удаление (своя линия и линии отпаек от этой опоры)
+        affected_line_ids = {pole.line_id}
+        affected_line_ids.update(
+            (await db.execute(select(Pole.line_id).where(Pole.tap_pole_id == pole_id))).scalars().all()
+        )
         
         # Удаляем связанные объекты перед удалением опоры
         from app.models.cim_line_structure import ConnectivityNode, Terminal
@@ -495,7 +501,7 @@ async def delete_pole(
         await db.execute(stmt)
         await db.commit()
         from app.core.map_geojson_cache import invalidate_map_geojson_cache
-        await invalidate_map_geojson_cache()
+        await invalidate_map_geojson_cache(line_ids=affected_line_ids)
         
         print(f"DEBUG: Опора {pole_id} успешно удалена")
         return {
@@ -1,5 +1,4 @@
-from typing import List, Optional, Tuple
-import math
+from typing import Iterable, List, Optional, Tuple
 import re
 import uuid
 from pydantic import BaseModel
@@ -24,6 +23,7 @@ from app.models.acline_segment import AClineSegment
 from app.models.cim_line_structure import ConnectivityNode, LineSection, Terminal
 from app.models.change_log import ChangeLog
 from app.core.card_attachment_audit import build_pole_card_change_payload
+from app.core.geodesy import chain_length_m
 from app.models.patrol_session import PatrolSession
 from app.schemas.power_line import (
     PowerLineCreate,
@@ -203,28 +203,6 @@ def _equipment_pole_count(equipment: Equipment) -> int:
     return 2 if equipment_is_two_terminal_device(equipment) else 1
 
 
-def _is_main_switching_equipment(equipment_type: str) -> bool:
-    """
-    Главное коммутационное оборудование (разъединитель, выключатель, реклозер) — граница участка (AClineSegment).
-    ЗН и разрядник — вторичное, не создают границу участка.
-    """
-    if not equipment_type:
-        return False
-    etype = (equipment_type or "").lower()
-    return bool(
-        any(k in etype for k in ("разъедин", "disconnector", "выключат", "breaker", "реклозер", "recloser"))
-    )
-
-
-async def _pair_needs_switch_split(db: AsyncSession, from_pole_id: int) -> bool:
-    """Нужно ли делить пролёт от этой опоры по секционирующему оборудованию (только начало пары)."""
-    result = await db.execute(
-        select(Equipment.equipment_type).where(Equipment.pole_id == from_pole_id)
-    )
-    eq_types = [row[0] for row in result.all()]
-    return any(_is_main_switching_equipment(t or "") for t in eq_types)
-
-
 async def _sync_equipment_terminals_for_line(db: AsyncSession, power_line_id: int) -> None:
     """Delegate to app.core.cim_connectivity."""
     from app.core.cim_connectivity import sync_equipment_terminals_for_line
@@ -406,9 +384,13 @@ async def _recompute_power_line_length(db: AsyncSession, power_line_id: int) ->
         .where(Pole.line_id == power_line_id)
     )
     poles = poles_result.scalars().all()
+    return _length_by_pole_coordinates_km(poles)
+
+
+def _length_by_pole_coordinates_km(poles) -> float:
+    """Длина ломаной по опорам в порядке sequence_number (опоры без номера — в конце), км."""
     if len(poles) < 2:
         return 0.0
-
     poles_sorted = sorted(
         poles,
         key=lambda p: (
@@ -417,29 +399,33 @@ async def _recompute_power_line_length(db: AsyncSession, power_line_id: int) ->
             getattr(p, "id", 0) or 0,
         ),
     )
+    total_by_coords_m = chain_length_m((pole.get_latitude(), pole.get_longitude()) for pole in poles_sorted)
+    return round(total_by_coords_m / 1000.0, 6)
 
-    def _haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        r_earth_m = 6371000.0
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        d_phi = math.radians(lat2 - lat1)
-        d_lambda = math.radians(lon2 - lon1)
-        a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return r_earth_m * c
-
-    total_by_coords_m = 0.0
-    prev = None
-    for pole in poles_sorted:
-        lat = pole.get_latitude()
-        lon = pole.get_longitude()
-        if lat is None or lon is None:
-            continue
-        if prev is not None:
-            total_by_coords_m += _haversine_m(prev[0], prev[1], float(lat), float(lon))
-        prev = (float(lat), float(lon))
 
-    return round(total_by_coords_m / 1000.0, 6)
+async def _recompute_power_line_lengths(db: AsyncSession, power_lines) -> dict:
+    """
+    Длины (км) для списка ЛЭП: суммы пролётов — одним GROUP BY по линиям; линии без пролётов —
+    по координатам уже загруженных опор (power_line.poles с position_points / location).
+    """
+    from sqlalchemy import func as sql_func
+    line_ids = [pl.id for pl in power_lines]
+    if not line_ids:
+        return {}
+    rows = await db.execute(
+        select(Span.line_id, sql_func.coalesce(sql_func.sum(Span.length), 0))
+        .where(Span.line_id.in_(line_ids))
+        .group_by(Span.line_id)
+    )
+    totals_m = {line_id: float(total or 0.0) for line_id, total in rows.all()}
+    lengths = {}
+    for pl in power_lines:
+        total_m = totals_m.get(pl.id, 0.0)
+        if total_m > 0:
+            lengths[pl.id] = round(total_m / 1000.0, 6)
+        else:
+            lengths[pl.id] = _length_by_pole_coordinates_km(pl.poles)
+    return lengths
 
 
 def _fill_pole_coordinates(pole: Pole) -> None:
@@ -625,6 +611,9 @@ async def get_power_lines(
     )
     power_lines = result.scalars().all()
     
+    # Длина линии — всегда по сумме пролётов (авторасчёт по Span.length), для всех линий одним запросом
+    computed_lengths = await _recompute_power_line_lengths(db, power_lines)
+
     # Заполняем x_position, y_position у каждой опоры для PoleResponse (иначе валидация падает на None)
     for power_line in power_lines:
         for pole in power_line.poles:
@@ -632,9 +621,7 @@ async def get_power_lines(
             if hasattr(pole, '_get_connectivity_node_safe'):
                 _ = pole._get_connectivity_node_safe()
             _fill_pole_coordinates(pole)
-        # Длина линии — всегда по сумме пролётов (авторасчёт по Span.length)
-        computed_length = await _recompute_power_line_length(db, power_line.id)
-        object.__setattr__(power_line, "length", computed_length)
+        object.__setattr__(power_line, "length", computed_lengths[power_line.id])
 
     # Сериализуем через dict (чтение только из __dict__), чтобы не вызывать MissingGreenlet при доступе к ORM
     return [PowerLineResponse.model_validate(_power_line_orm_to_dict(pl)) for pl in power_lines]
@@ -966,29 +953,12 @@ async def create_pole(
             await db.flush()
             db_pole.connectivity_node_id = connectivity_node.id
 
-        # Автоматическое создание пролёта от предыдущей опоры к новой
-        try:
-            from app.core.line_auto_assembly import auto_create_span
-
-            await auto_create_span(
-                db=db,
-                power_line_id=power_line_id,
-                new_pole=db_pole,
-                new_connectivity_node=connectivity_node,
-                conductor_type=pole_data.conductor_type,
-                conductor_material=pole_data.conductor_material,
-                conductor_section=pole_data.conductor_section,
-                is_tap=pole_data.is_tap,
-                current_user_id=current_user.id
-            )
-        except Exception as e:
-            import traceback
-            print(f"Ошибка автоматического создания пролёта: {e}")
-            print(traceback.format_exc())
+        # Пролёты к новой опоре: вставка в середину заменяет пролёт между соседями
+        await _update_pole_topology(db, power_line, db_pole.id, current_user.id)
 
         await db.commit()
         from app.core.map_geojson_cache import invalidate_map_geojson_cache
-        await invalidate_map_geojson_cache()
+        await invalidate_map_geojson_cache(line_ids=[power_line_id])
     except ProgrammingError as e:
         await db.rollback()
         if _is_schema_mismatch(e):
@@ -1004,6 +974,32 @@ async def create_pole(
     # Загружаем опору с relationships для корректной сериализации ответа
     return await _fetch_pole_for_response(db, db_pole.id)
 
+async def _update_pole_topology(
+    db: AsyncSession,
+    power_line: PowerLine,
+    pole_id: int,
+    user_id: int,
+    changed_fields: Optional[Iterable[str]] = None,
+) -> bool:
+    """
+    Пролёты, секции и участки вокруг добавленной (changed_fields=None) или изменённой опоры —
+    update_line_topology_for_poles в savepoint; ошибка не отменяет сохранение опоры.
+    True — топология пересчитывалась.
+    """
+    from app.core.line_topology import TOPOLOGY_POLE_FIELDS, update_line_topology_for_poles
+
+    if changed_fields is not None and not set(changed_fields) & TOPOLOGY_POLE_FIELDS:
+        return False
+    try:
+        async with db.begin_nested():
+            await update_line_topology_for_poles(db, power_line, [pole_id], user_id)
+    except Exception as e:
+        import traceback
+        print(f"WARNING: Failed to update spans for pole {pole_id}: {e}")
+        traceback.print_exc()
+    return True
+
+
 @router.get("/{power_line_id}/edit-hint")
 async def power_line_edit_hint(
     power_line_id: int,
@@ -1430,6 +1426,7 @@ async def update_pole(
         "structural_defect_criticality": pole.structural_defect_criticality,
         "is_tap_pole": pole.is_tap_pole,
         "branch_type": pole.branch_type,
+        "sequence_number": pole.sequence_number,
         "tap_pole_id": pole.tap_pole_id,
         "tap_branch_index": pole.tap_branch_index,
         "conductor_type": pole.conductor_type,
@@ -1523,6 +1520,7 @@ async def update_pole(
         "structural_defect_criticality": pole.structural_defect_criticality,
         "is_tap_pole": pole.is_tap_pole,
         "branch_type": pole.branch_type,
+        "sequence_number": pole.sequence_number,
         "tap_pole_id": pole.tap_pole_id,
         "tap_branch_index": pole.tap_branch_index,
         "conductor_type": pole.conductor_type,
@@ -1552,9 +1550,13 @@ async def update_pole(
             )
         )
 
+    # Опора сдвинута, перенумерована, перенесена в другую ветку или сменила провод — пересобрать
+    # только соседние пролёты, их секции и участок (полная пересборка линии не нужна)
+    await _update_pole_topology(db, power_line, pole_id, current_user.id, changed_fields)
+
     await db.commit()
     from app.core.map_geojson_cache import invalidate_map_geojson_cache
-    await invalidate_map_geojson_cache()
+    await invalidate_map_geojson_cache(line_ids=[power_line_id])
     await db.refresh(pole)
     
     # Загружаем опору с relationships для корректной сериализации ответа
@@ -2044,10 +2046,12 @@ async def auto_create_spans_service(
     power_line_id: int,
     current_user: User,
     mode: str = "full",
+    pole_ids: Optional[List[int]] = None,
 ) -> dict:
     """
     Создание пролётов и участков (ACLineSegment) по последовательности опор.
     Общая реализация для POST .../spans/auto-create и для экспорта CIM.
+    mode=incremental — только соседи опор pole_ids (см. update_line_topology_for_poles).
     """
     from app.models.base import generate_mrid
 
@@ -2058,7 +2062,28 @@ async def auto_create_spans_service(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Power line not found"
         )
-    
+
+    if mode == "incremental":
+        if not pole_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Для mode=incremental нужны pole_ids изменённых опор",
+            )
+        from app.core.line_topology import update_line_topology_for_poles
+        from app.core.map_geojson_cache import invalidate_map_geojson_cache
+
+        created_spans = await update_line_topology_for_poles(db, power_line, pole_ids, current_user.id)
+        power_line.length = await _recompute_power_line_length(db, power_line_id)
+        await db.commit()
+        await invalidate_map_geojson_cache(line_ids=[power_line_id])
+        for span in created_spans:
+            await db.refresh(span)
+        return {
+            "message": f"Создано пролётов: {len(created_spans)}",
+            "created_count": len(created_spans),
+            "spans": created_spans,
+        }
+
     if mode == "full":
         # Сохраняем ТП только у отпаек (is_tap). Магистраль до конечной ПС (substation_end_id)
         # пересобирается ниже через extend_tap_segment_to_substation — иначе в список попадал
@@ -2093,44 +2118,11 @@ async def auto_create_spans_service(
     )
     all_poles = result.scalars().all()
 
-    # Строим пролёты по ветвям: магистраль (tap_pole_id is None) + каждая отпайка (tap_pole_id = id отпаечной опоры)
-    # Магистраль: сортировка по sequence_number
-    main_poles = sorted(
-        [p for p in all_poles if getattr(p, "tap_pole_id", None) is None],
-        key=lambda p: (p.sequence_number or 0),
-    )
-    # Пары (from_pole, to_pole) для магистрали
-    span_pairs: List[Tuple[Pole, Pole]] = []
-    for i in range(1, len(main_poles)):
-        span_pairs.append((main_poles[i - 1], main_poles[i]))
-
-    # Отпайки: для каждой отпаечной опоры и каждой ветки (tap_branch_index) — своя цепочка.
-    # Раньше все ветки от одной опоры (3/1, 3/2, 3/3, 3/4) шли одной цепочкой по tap_pole_id,
-    # что давало неправильные пролёты и участки. Теперь учитываем tap_branch_index.
-    branches: dict[tuple[int, int], list[Pole]] = {}
-    poles_by_id = {p.id: p for p in all_poles}
-    for p in all_poles:
-        tpid = getattr(p, "tap_pole_id", None)
-        if tpid is None:
-            continue
-        tbi = getattr(p, "tap_branch_index", None) or 1
-        key_branch = (int(tpid), int(tbi))
-        branches.setdefault(key_branch, []).append(p)
+    # Пролёты по ветвям: магистраль (tap_pole_id is None) по sequence_number + каждая ветка отпайки
+    # (tap_pole_id, tap_branch_index) — своя цепочка от отпаечной опоры
+    from app.core.line_topology import line_span_pairs
 
-    for (tpid, tbi), branch_poles in branches.items():
-        tap_pole = poles_by_id.get(tpid)
-        if not tap_pole:
-            continue
-        branch_poles_sorted = sorted(
-            branch_poles,
-            key=lambda p: (p.sequence_number or 0),
-        )
-        if not branch_poles_sorted:
-            continue
-        # Пролёт от отпаечной опоры к первой опоре данной ветки отпайки
-        span_pairs.append((tap_pole, branch_poles_sorted[0]))
-        for i in range(1, len(branch_poles_sorted)):
-            span_pairs.append((branch_poles_sorted[i - 1], branch_poles_sorted[i]))
+    main_poles, span_pairs = line_span_pairs(all_poles)
 
     poles = all_poles  # для создания узлов ниже
     
@@ -2141,40 +2133,40 @@ async def auto_create_spans_service(
             detail="Для создания пролётов необходимо минимум 2 опоры с заданной последовательностью (магистраль или отпайка)"
         )
     
-    # Проверяем, что у всех опор есть ConnectivityNode для этой линии
+    # Проверяем, что у всех опор есть ConnectivityNode для этой линии (один запрос, недостающие — одним flush)
     from app.models.cim_line_structure import ConnectivityNode
-    
-    for pole in poles:
-        # Ищем ConnectivityNode для этой опоры и этой линии
-        result_node = await db.execute(
-            select(ConnectivityNode).where(
-                ConnectivityNode.pole_id == pole.id,
-                ConnectivityNode.line_id == power_line_id
-            )
+
+    result_nodes = await db.execute(
+        select(ConnectivityNode.pole_id, ConnectivityNode.id)
+        .where(
+            ConnectivityNode.line_id == power_line_id,
+            ConnectivityNode.pole_id.in_([p.id for p in poles]),
         )
-        connectivity_node = result_node.scalar_one_or_none()
-        
-        if not connectivity_node:
-            # Если ConnectivityNode нет, создаём его
-            connectivity_node = ConnectivityNode(
-                mrid=generate_mrid(),
-                name=f"Узел {pole.pole_number}",
-                pole_id=pole.id,
-                line_id=power_line_id,
-                y_position=pole.get_latitude(),
-                x_position=pole.get_longitude(),
-                description=f"Автоматически созданный узел для опоры {pole.pole_number} линии {power_line_id}",
-                is_virtual=True,
-            )
-            db.add(connectivity_node)
-            await db.flush()
-            
-            # Обновляем connectivity_node_id в опоре (для обратной совместимости)
+        .order_by(ConnectivityNode.id.asc())
+    )
+    poles_with_node = {pole_id for pole_id, _ in result_nodes.all()}
+    new_nodes = []
+    for pole in poles:
+        if pole.id in poles_with_node:
+            continue
+        connectivity_node = ConnectivityNode(
+            mrid=generate_mrid(),
+            name=f"Узел {pole.pole_number}",
+            pole_id=pole.id,
+            line_id=power_line_id,
+            y_position=pole.get_latitude(),
+            x_position=pole.get_longitude(),
+            description=f"Автоматически созданный узел для опоры {pole.pole_number} линии {power_line_id}",
+            is_virtual=True,
+        )
+        db.add(connectivity_node)
+        new_nodes.append((pole, connectivity_node))
+    if new_nodes:
+        await db.flush()
+        # Обновляем connectivity_node_id в опоре (для обратной совместимости)
+        for pole, connectivity_node in new_nodes:
             pole.connectivity_node_id = connectivity_node.id
-        
-        # Сохраняем ConnectivityNode в опоре для использования ниже
-        pole._connectivity_node = connectivity_node
-    
+
     # Перечитываем ЛЭП из БД, чтобы гарантированно иметь актуальные substation_start_id/substation_end_id
     await db.refresh(power_line)
     # Пролёты от/до подстанций (если заданы начало и/или конец линии)
@@ -2199,50 +2191,14 @@ async def auto_create_spans_service(
         # Пролёт до конечной ПС создаём после цепочки опора–опора (см. ниже), иначе путается порядок сегментов/имена
     await db.flush()
     
-    # Используем ту же логику, что и при пошаговом добавлении опор: создаются
-    # участки линии (AClineSegment) по ветвлениям/подстанциям и секции линии
-    # (LineSection) по марке провода — через auto_create_span из line_auto_assembly
-    from app.core.line_auto_assembly import auto_create_span
-
-    created_spans = []
-    for from_pole, to_pole in span_pairs:
-        existing_span = await db.execute(
-            select(Span).where(
-                Span.from_pole_id == from_pole.id,
-                Span.to_pole_id == to_pole.id,
-                Span.line_id == power_line_id
-            )
-        )
-        existing_pair_spans = list(existing_span.scalars().all())
-        needs_split = await _pair_needs_switch_split(db, from_pole.id)
-        if existing_pair_spans:
-            if not needs_split:
-                continue
-            # Для секционирующего оборудования ожидаем 2 пролёта пары.
-            # Если уже есть 2+ — ничего не делаем.
-            if len(existing_pair_spans) >= 2:
-                continue
-            # Если есть только 1 старый пролёт пары — удаляем и пересоздаём как два.
-            await db.execute(delete(Span).where(Span.id.in_([s.id for s in existing_pair_spans])))
-            await db.flush()
-        new_cn = getattr(to_pole, "_connectivity_node", None)
-        # is_tap: первый пролёт отпайки (от отпаечной опоры к первой опоре ветки 3/1),
-        # как при пошаговом создании (pole_data.is_tap=True только для первой опоры отпайки).
-        # Признак: у новой опоры задан tap_pole_id (она на отпайке) и sequence_number == 1 в этой ветке.
-        is_tap = bool(getattr(to_pole, "tap_pole_id", None) is not None and (to_pole.sequence_number or 0) == 1)
-        span = await auto_create_span(
-            db,
-            power_line_id,
-            to_pole,
-            new_connectivity_node=new_cn,
-            conductor_type=getattr(from_pole, "conductor_type", None),
-            conductor_material=getattr(from_pole, "conductor_material", None),
-            conductor_section=getattr(from_pole, "conductor_section", None),
-            is_tap=is_tap,
-            current_user_id=current_user.id,
-        )
-        if span:
-            created_spans.append(span)
+    # Та же логика, что и при пошаговом добавлении опор (auto_create_span): участки линии
+    # (AClineSegment) по ветвлениям/подстанциям и секции линии (LineSection) по марке провода.
+    # Топология считается в памяти и записывается пачками — без запросов на каждую пару опор.
+    from app.core.line_topology import apply_line_topology, load_line_topology
+
+    topology = await load_line_topology(db, power_line, current_user.id)
+    topology.plan_span_pairs([(from_pole.id, to_pole.id) for from_pole, to_pole in span_pairs])
+    created_spans = await apply_line_topology(db, topology)
 
     # После построения пролётов и участков создаём/обновляем терминалы оборудования на опорах этой линии.
     # Терминалы T1/T2 автоматически привязываются к ConnectivityNode соответствующих опор.
@@ -2357,7 +2313,7 @@ async def auto_create_spans_service(
     await db.commit()
     from app.core.map_geojson_cache import invalidate_map_geojson_cache
 
-    await invalidate_map_geojson_cache()
+    await invalidate_map_geojson_cache(line_ids=[power_line_id])
 
     # Запись в журнал изменений об автосборке топологии (созданные пролёты/участки)
     if created_spans:
@@ -2408,7 +2364,8 @@ async def auto_create_spans_service(
 @router.post("/{power_line_id}/spans/auto-create")
 async def auto_create_spans(
     power_line_id: int,
-    mode: str = Query("full", description="full — пересобрать с нуля (удалить существующие); preserve — добавить только недостающие"),
+    mode: str = Query("full", description="full — пересобрать с нуля (удалить существующие); preserve — добавить только недостающие; incremental — только соседи опор pole_ids"),
+    pole_ids: Optional[List[int]] = Query(None, description="Изменённые опоры (для mode=incremental)"),
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -2418,7 +2375,7 @@ async def auto_create_spans(
     - mode=preserve: существующие пролёты сохраняются, добавляются только недостающие.
     Создаёт пролёты между соседними опорами, участки линии (AClineSegment) и секции линии (LineSection).
     """
-    return await auto_create_spans_service(db, power_line_id, current_user, mode)
+    return await auto_create_spans_service(db, power_line_id, current_user, mode, pole_ids)
 
 
 @router.post("/{power_line_id}/taps", response_model=TapResponse)
@@ -1,13 +1,18 @@
-from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from collections import Counter
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Sequence, Set, Tuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status, Query
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func, delete, update
+from sqlalchemy import select, and_, or_, func, delete, update, true
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.orm import selectinload
 from datetime import datetime, timezone, timedelta
 import uuid
 
-from app.database import get_db
-from app.core.roles import can_manage_equipment_catalog
+from app.database import AsyncSessionLocal, get_db
+from app.core.roles import can_manage_equipment_catalog, is_admin
 from app.core.security import get_current_active_user
 from app.models.user import User
 from app.models.branch import Branch
@@ -20,11 +25,12 @@ from app.models.cim_line_structure import ConnectivityNode, LineSection
 from app.models.patrol_session import PatrolSession
 from app.models.sync_client_mapping import SyncClientMapping
 from app.models.change_log import ChangeLog
+from app.models.sync_tombstone import SyncTombstone
 from app.core.card_attachment_audit import build_pole_card_change_payload
 from app.schemas.sync import SyncBatch, SyncResponse, SyncRecord, SyncStatus, SyncAction, ENTITY_SCHEMAS
+from app.models.base import generate_mrid
 from app.schemas.power_line import PowerLineCreate, PoleCreate, EquipmentCreate
 from app.core.pole_sequence_slots import assign_client_sequence_or_auto
-import jsonschema
 import logging
 from app.core.map_geojson_cache import invalidate_map_geojson_cache
 from app.core.voltage_consistency import (
@@ -33,10 +39,52 @@ from app.core.voltage_consistency import (
 )
 from app.core.equipment_nominal_voltage import nominal_kv_from_line_voltage
 from app.core.cim_connectivity import sync_equipment_terminals_for_line
+from app.core.json_payload import dumps_json_bytes
+from app.core.sync_revision import merge_revision_pages, sync_high_water
+from app.core.sync_scope import ResolvedScope, SyncScope, resolve_scope, tombstone_in_scope
+from app.core.sync_conflicts import CONFLICT_RESOLUTION_SERVER_WINS, is_stale, merge_update
+from app.core.sync_idempotency import (
+    AppliedRecord,
+    compact_upload_ledger,
+    get_applied_records,
+    get_stored_response,
+    lock_upload_batch,
+    lock_upload_records,
+    store_upload_result,
+)
+from app.core.sync_jobs import (
+    create_upload_job,
+    enqueue_upload_job,
+    get_job_progress,
+    get_upload_job,
+    job_as_dict,
+    job_stale,
+    requeue_stale_jobs,
+)
+from app.core.sync_wire import (
+    WireFormatError,
+    decode_envelope,
+    decompress_body,
+    encode_sync_response,
+    negotiated,
+    unpack_body,
+)
+from app.core.json_payload import IDENTITY
+from app.core.sync_upload import (
+    UploadPrefetch,
+    prefetch_upload,
+    run_chunked_with_bisect,
+    validate_entity_data,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Страница курсорного sync/download
+SYNC_DOWNLOAD_PAGE_SIZE = 1000
+SYNC_DOWNLOAD_MAX_PAGE_SIZE = 5000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 def _order_for_sync(records: List[SyncRecord]) -> List[SyncRecord]:
     """Порядок: ЛЭП → опоры → оборудование (опоры ссылаются на ЛЭП, оборудование на опоры)."""
     order = {"power_line": 0, "pole": 1, "equipment_catalog": 2, "equipment": 3}
@@ -233,8 +281,20 @@ def _log_pole_card_from_sync(
     )
 
 
-async def _upsert_pole_mapping(user_id: int, client_id: int, server_id: int, db: AsyncSession) -> None:
+async def _upsert_pole_mapping(
+    user_id: int,
+    client_id: int,
+    server_id: int,
+    db: AsyncSession,
+    prefetch: Optional[UploadPrefetch] = None,
+) -> None:
     """Сохраняет маппинг локальный id опоры → серверный id для последующих пакетов синхронизации."""
+    if prefetch is not None:
+        absent = prefetch.pole_mapping_absent(client_id)
+        prefetch.touch_pole_mapping(client_id)
+        if absent:
+            db.add(SyncClientMapping(user_id=user_id, entity_type="pole", client_id=client_id, server_id=server_id))
+            return
     existing = (
         await db.execute(
             select(SyncClientMapping).where(
@@ -250,107 +310,378 @@ async def _upsert_pole_mapping(user_id: int, client_id: int, server_id: int, db:
         db.add(SyncClientMapping(user_id=user_id, entity_type="pole", client_id=client_id, server_id=server_id))
 
 
+def _resolve_upload_refs(
+    record: SyncRecord,
+    data: Dict[str, Any],
+    id_mapping: Dict[str, Dict[int, int]],
+    prior_pole_mapping: Dict[int, int],
+) -> Dict[str, Any]:
+    """Подстановка серверных id вместо локальных (отрицательных) в ссылках опор и оборудования."""
+    if record.entity_type == "pole" and record.action == SyncAction.CREATE:
+        pl_id = _to_int(data.get("line_id"))
+        if pl_id is not None and pl_id < 0 and pl_id in id_mapping["power_line"]:
+            data = {**data, "line_id": id_mapping["power_line"][pl_id]}
+    elif record.entity_type == "equipment" and record.action == SyncAction.CREATE:
+        pole_id = _to_int(data.get("pole_id"))
+        pole_server_id = _to_int(data.get("pole_server_id"))
+        if pole_server_id is not None and pole_server_id > 0:
+            # Клиент передал уже известный серверный id опоры — используем его
+            data = {**data, "pole_id": pole_server_id}
+        elif pole_id is not None and pole_id < 0:
+            if pole_id in id_mapping["pole"]:
+                data = {**data, "pole_id": id_mapping["pole"][pole_id]}
+            elif pole_id in prior_pole_mapping:
+                # Опора не в текущем пакете — из сохранённого маппинга (предыдущие синхронизации)
+                data = {**data, "pole_id": prior_pole_mapping[pole_id]}
+            else:
+                raise ValueError(
+                    f"pole_id={pole_id} (локальный) не найден в маппинге: опора должна быть в том же пакете синхронизации или уже синхронизирована ранее"
+                )
+    return data
+
+
+def _applied_record(record: SyncRecord, data: Dict[str, Any], id_mapping: Dict[str, Dict[int, int]]) -> AppliedRecord:
+    """Результат записи для журнала: для созданной сущности с локальным id — её серверный id."""
+    client_id = _to_int(data.get("id")) if record.action == SyncAction.CREATE else None
+    server_id = None
+    if client_id is not None and client_id < 0:
+        server_id = id_mapping.get(record.entity_type, {}).get(client_id)
+    else:
+        client_id = None
+    return AppliedRecord(
+        record_id=record.id,
+        entity_type=record.entity_type,
+        action=SyncAction(record.action).value,
+        client_id=client_id,
+        server_id=server_id,
+    )
+
+
+_REVISION_MODELS = {"power_line": PowerLine, "pole": Pole, "equipment": Equipment}
+# Координаты опоры в sync — из PositionPoint (как пишет обновление опоры)
+_POLE_COORD_FIELDS = {"x_position": "x_position", "longitude": "x_position", "y_position": "y_position", "latitude": "y_position"}
+
+
+async def _applied_revisions(
+    db: AsyncSession,
+    applied: Sequence[Tuple[SyncRecord, Dict[str, Any]]],
+    id_mapping: Dict[str, Dict[int, int]],
+) -> Dict[str, Dict[str, int]]:
+    """Ревизии созданных / изменённых пакетом строк (по запросу на тип)."""
+    ids: Dict[str, Set[int]] = {entity_type: set() for entity_type in _REVISION_MODELS}
+    for record, data in applied:
+        if record.action == SyncAction.DELETE or record.entity_type not in ids:
+            continue
+        server_id = _applied_record(record, data, id_mapping).server_id
+        if server_id is None:
+            row_id = _to_int(data.get("id"))
+            server_id = row_id if row_id is not None and row_id > 0 else None
+        if server_id is not None:
+            ids[record.entity_type].add(server_id)
+    revisions: Dict[str, Dict[str, int]] = {}
+    for entity_type, row_ids in ids.items():
+        if not row_ids:
+            continue
+        model = _REVISION_MODELS[entity_type]
+        rows = await db.execute(select(model.id, model.sync_revision).where(model.id.in_(row_ids)))
+        revisions[entity_type] = {str(row_id): int(rev) for row_id, rev in rows.all() if rev is not None}
+    return revisions
+
+
+async def _pole_sync_coordinates(db: AsyncSession, pole: Pole) -> Dict[str, Optional[float]]:
+    """
+    Координаты опоры в том же порядке, что Pole.get_latitude / get_longitude: PositionPoint опоры,
+    затем точка её Location, затем колонки. Запросами, без ленивой загрузки связей.
+    """
+    conditions = [PositionPoint.pole_id == pole.id]
+    if pole.location_id is not None:
+        conditions.append(PositionPoint.location_id == pole.location_id)
+    for condition in conditions:
+        point = (await db.execute(select(PositionPoint).where(condition).limit(1))).scalar_one_or_none()
+        if point is not None:
+            return {"x_position": point.x_position, "y_position": point.y_position}
+    return {
+        field: float(value) if value is not None else None
+        for field, value in (("x_position", pole.x_position), ("y_position", pole.y_position))
+    }
+
+
+async def _current_sync_values(db: AsyncSession, entity_type: str, row: Any, keys: Sequence[str]) -> Dict[str, Any]:
+    """Серверные значения полей патча в представлении sync (для сравнения при слиянии)."""
+    columns = sa_inspect(type(row)).column_attrs.keys()
+    current: Dict[str, Any] = {}
+    coordinates: Optional[Dict[str, Optional[float]]] = None
+    for key in keys:
+        if entity_type == "pole" and key in _POLE_COORD_FIELDS:
+            if coordinates is None:
+                coordinates = await _pole_sync_coordinates(db, row)
+            current[key] = coordinates[_POLE_COORD_FIELDS[key]]
+        elif key in columns:
+            current[key] = getattr(row, key)
+    return current
+
+
+async def _merge_stale_update(
+    db: AsyncSession,
+    record: SyncRecord,
+    row: Any,
+    data: Dict[str, Any],
+    conflicts: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Патч с base_revision поверх строки row: что из data применять. Если строка новее base_revision —
+    слияние по полям (app.core.sync_conflicts), конфликтующие поля остаются серверными и
+    добавляются в conflicts.
+    """
+    if record.base_revision is None:
+        return data
+    model = type(row)
+    server_revision = (await db.execute(select(model.sync_revision).where(model.id == row.id))).scalar()
+    if not is_stale(record.base_revision, server_revision):
+        return data
+    current = await _current_sync_values(db, record.entity_type, row, list(data))
+    result = merge_update(data, current, record.base_revision, server_revision, record.base)
+    if result.conflicts:
+        conflicts.append({
+            "record_id": record.id,
+            "entity_type": record.entity_type,
+            "entity_id": row.id,
+            "base_revision": record.base_revision,
+            "server_revision": int(server_revision),
+            "resolution": CONFLICT_RESOLUTION_SERVER_WINS,
+            "fields": [c.as_dict() for c in result.conflicts],
+        })
+    return result.data
+
+
+async def read_sync_batch(request: Request) -> SyncBatch:
+    """
+    Тело sync/upload: JSON или MessagePack (Content-Type), при необходимости сжатое (Content-Encoding
+    gzip / zstd / br); записи — списком или в словарном кодировании (app.core.sync_wire).
+    """
+    try:
+        body = decompress_body(await request.body(), request.headers.get("content-encoding"))
+        raw = unpack_body(body, request.headers.get("content-type"))
+        if not isinstance(raw, dict):
+            raise WireFormatError("ожидался объект пакета")
+        raw = decode_envelope(raw)
+    except WireFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"sync/upload: {e}") from e
+    try:
+        return SyncBatch.model_validate(raw)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors()) from e
+
+
+def _sync_wire_response(request: Request, payload: Any, records_key: Optional[str] = None) -> Any:
+    """
+    Ответ sync в формате, который принимает клиент: MessagePack (Accept) и сжатие (Accept-Encoding);
+    без них — payload как есть (обычный JSON FastAPI).
+    """
+    accept = request.headers.get("accept")
+    accept_encoding = request.headers.get("accept-encoding")
+    if not negotiated(accept, accept_encoding):
+        return payload
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(mode="json")
+    body, media_type, encoding = encode_sync_response(payload, accept, accept_encoding, records_key)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
 @router.post("/upload", response_model=SyncResponse)
 async def upload_sync_batch(
-    batch: SyncBatch,
+    request: Request,
+    batch: SyncBatch = Depends(read_sync_batch),
+    mode: str = Query("sync", pattern="^(sync|async)$", description="async — обработка в фоне, ответ 202 с job_id"),
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Загрузка пакета данных для синхронизации. ЛЭП создаются первыми, затем опоры с подстановкой server line_id."""
-    
-    processed_count = 0
+    """
+    Загрузка пакета данных для синхронизации. ЛЭП создаются первыми, затем опоры с подстановкой server line_id.
+    Записи применяются пачками в savepoint (app.core.sync_upload); ошибочная запись локализуется
+    делением пачки, остальные обрабатываются, но при любой ошибке пакет целиком откатывается.
+    Повтор принятого пакета (тот же batch_id) возвращает сохранённый ответ, уже применённые
+    записи (тот же id) не применяются повторно (app.core.sync_idempotency).
+    mode=async — пакет сохраняется и обрабатывается воркером (app.core.sync_jobs); ответ 202 с
+    job_id, состояние и итоговый SyncResponse — GET /sync/jobs/{job_id}.
+    """
+    if mode == "async":
+        try:
+            job, enqueue = await create_upload_job(db, current_user.id, batch)
+            if enqueue:
+                await enqueue_upload_job(job.id)
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=f"sync/upload async: {type(e).__name__}: {e}")
+        payload = job_as_dict(job, await get_job_progress(job.id))
+        payload["status_url"] = str(request.url_for("get_sync_upload_job", job_id=job.id))
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=payload)
+    return _sync_wire_response(request, await _upload_sync_batch_impl(batch, current_user, db))
+
+
+@router.get("/jobs/{job_id}")
+async def get_sync_upload_job(
+    job_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Состояние фоновой загрузки пакета: status, done/total, progress, по завершении — response.
+    Потерянное задание (app.core.sync_jobs.job_stale) при опросе ставится в очередь заново.
+    """
+    job = await get_upload_job(db, job_id)
+    if job is None or (job.user_id != current_user.id and not is_admin(current_user)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Задание не найдено")
+    if job_stale(job) and await requeue_stale_jobs(db, job.id):
+        await db.refresh(job)
+    return _sync_wire_response(request, job_as_dict(job, await get_job_progress(job.id)))
+
+
+async def _upload_sync_batch_impl(
+    batch: SyncBatch,
+    current_user: User,
+    db: AsyncSession,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> SyncResponse:
+    """
+    Применить пакет (синхронный /upload и фоновое задание). Коммитит или откатывает транзакцию db.
+    progress(done, total) — после каждой пачки записей.
+    """
+    await lock_upload_batch(db, current_user.id, batch.batch_id)
+    stored = await get_stored_response(db, current_user.id, batch.batch_id)
+    if stored is not None:
+        await db.rollback()
+        logger.info("sync/upload: повтор пакета %s — отдаём сохранённый ответ", batch.batch_id)
+        return SyncResponse(**stored)
+
     failed_count = 0
-    errors = []
+    failures: List[Tuple[int, Dict[str, Any]]] = []
     # Маппинг локальных (отрицательных) id → серверные id после создания
     id_mapping: Dict[str, Dict[int, int]] = {"power_line": {}, "pole": {}, "equipment": {}}
+    touched_line_ids: Set[int] = set()
+    conflicts: List[Dict[str, Any]] = []
     ordered = _order_for_sync(batch.records)
     
-    logger.info("sync/upload: записей в пакете=%d, типы=%s", len(ordered), [f"{r.entity_type}:{r.action}" for r in ordered])
+    logger.info(
+        "sync/upload: записей в пакете=%d, типы=%s",
+        len(ordered),
+        dict(Counter(f"{r.entity_type}:{r.action}" for r in ordered)),
+    )
+
+    position = {id(r): i for i, r in enumerate(ordered)}
+
+    def _fail(record: SyncRecord, e: Exception) -> None:
+        nonlocal failed_count
+        failed_count += 1
+        record.status = SyncStatus.FAILED
+        record.error_message = str(e)
+        failures.append((position[id(record)], {
+            "record_id": record.id,
+            "error": str(e)
+        }))
+        logger.warning("sync/upload: ошибка записи %s %s: %s", record.entity_type, record.id, e)
+
+    # Записи, уже применённые в прошлых пакетах: не применяем, но отдаём их маппинг id. Сначала
+    # занимаем их: пакет с теми же записями, который ещё применяется, закоммитит журнал раньше
+    await lock_upload_records(db, current_user.id, (r.id for r in ordered))
+    already_applied = await get_applied_records(db, current_user.id, (r.id for r in ordered))
+    replayed: List[SyncRecord] = []
+
+    # Проверка схем до обращений к БД: подстановка id меняет только значения ссылок, не их тип
+    items: List[Tuple[SyncRecord, Dict[str, Any]]] = []
     for record in ordered:
-        data_preview = f"id={record.data.get('id')}"
-        if record.entity_type == "power_line":
-            data_preview += f" name={record.data.get('name', '')!r}"
-        elif record.entity_type == "pole":
-            data_preview += f" line_id={record.data.get('line_id')} pole_number={record.data.get('pole_number', '')!r} lat={record.data.get('latitude')} lon={record.data.get('longitude')}"
-        logger.info("sync/upload: обработка %s %s %s", record.entity_type, record.action, data_preview)
+        previous = already_applied.get(record.id)
+        if previous is not None:
+            if previous.client_id is not None and previous.server_id is not None and previous.entity_type in id_mapping:
+                id_mapping[previous.entity_type][previous.client_id] = previous.server_id
+            replayed.append(record)
+            continue
+        data = _normalize_legacy_line_id_keys(
+            record.data,
+            entity_type=record.entity_type,
+            record_id=record.id,
+        )
         try:
-            data = _normalize_legacy_line_id_keys(
-                record.data,
-                entity_type=record.entity_type,
-                record_id=record.id,
-            )
-            # Подстановка серверных id для опор и оборудования (локальные id отрицательные)
-            if record.entity_type == "pole" and record.action == SyncAction.CREATE:
-                pl_id = _to_int(data.get("line_id"))
-                if pl_id is not None and pl_id < 0 and pl_id in id_mapping["power_line"]:
-                    data = {**data, "line_id": id_mapping["power_line"][pl_id]}
-            elif record.entity_type == "equipment" and record.action == SyncAction.CREATE:
-                pole_id = _to_int(data.get("pole_id"))
-                pole_server_id = _to_int(data.get("pole_server_id"))
-                if pole_server_id is not None and pole_server_id > 0:
-                    # Клиент передал уже известный серверный id опоры — используем его
-                    data = {**data, "pole_id": pole_server_id}
-                elif pole_id is not None and pole_id < 0:
-                    if pole_id in id_mapping["pole"]:
-                        data = {**data, "pole_id": id_mapping["pole"][pole_id]}
-                    else:
-                        # Опора не в текущем пакете — ищем в сохранённом маппинге (предыдущие синхронизации)
-                        mapping_row = (
-                            await db.execute(
-                                select(SyncClientMapping)
-                                .where(
-                                    SyncClientMapping.user_id == current_user.id,
-                                    SyncClientMapping.entity_type == "pole",
-                                    SyncClientMapping.client_id == pole_id,
-                                )
-                            )
-                        ).scalar_one_or_none()
-                        if mapping_row:
-                            data = {**data, "pole_id": mapping_row.server_id}
-                        else:
-                            raise ValueError(
-                                f"pole_id={pole_id} (локальный) не найден в маппинге: опора должна быть в том же пакете синхронизации или уже синхронизирована ранее"
-                            )
-            record.data = data
-            
             # Валидируем только create/update — для delete в data только id
-            if record.entity_type in ENTITY_SCHEMAS and record.action != SyncAction.DELETE:
-                schema = ENTITY_SCHEMAS[record.entity_type]
-                jsonschema.validate(record.data, schema)
-            
-            # Savepoint: при ошибке откатываем только эту запись, не трогая сессию
-            async with db.begin_nested():
-                await process_sync_record(record, current_user, db, id_mapping)
-            
-            processed_count += 1
-            record.status = SyncStatus.SYNCED
-            
+            if record.action != SyncAction.DELETE:
+                validate_entity_data(
+                    record.entity_type,
+                    data,
+                    partial=record.action == SyncAction.UPDATE and record.base_revision is not None,
+                )
         except Exception as e:
-            failed_count += 1
-            record.status = SyncStatus.FAILED
-            record.error_message = str(e)
-            errors.append({
-                "record_id": record.id,
-                "error": str(e)
-            })
-            logger.warning("sync/upload: ошибка записи %s %s: %s", record.entity_type, record.id, e)
-            # Не делаем db.rollback() — savepoint уже откатился, сессия остаётся в консистентном состоянии
+            _fail(record, e)
+            continue
+        items.append((record, data))
+
+    prefetch = await prefetch_upload(db, current_user.id, ((r.entity_type, d) for r, d in items))
+
+    async def _apply_chunk(chunk: Sequence[Tuple[SyncRecord, Dict[str, Any]]]) -> None:
+        mapping_before = {k: dict(v) for k, v in id_mapping.items()}
+        touched_before = set(touched_line_ids)
+        conflicts_before = len(conflicts)
+        # Клеммы оборудования пересобираются один раз на ЛЭП в конце пачки
+        terminal_line_ids: Set[int] = set()
+        try:
+            async with db.begin_nested():
+                for record, data in chunk:
+                    logger.debug("sync/upload: обработка %s %s id=%s", record.entity_type, record.action, data.get("id"))
+                    # Всегда от исходных данных: при повторе пачки прежняя подстановка могла откатиться
+                    record.data = _resolve_upload_refs(record, data, id_mapping, prefetch.pole_mapping)
+                    try:
+                        await process_sync_record(
+                            record, current_user, db, id_mapping, touched_line_ids,
+                            prefetch=prefetch,
+                            terminal_line_ids=terminal_line_ids,
+                            conflicts=conflicts,
+                        )
+                    finally:
+                        prefetch.touch(record.entity_type, record.data.get("id"), record.data.get("mrid"))
+                for line_id in sorted(terminal_line_ids):
+                    await sync_equipment_terminals_for_line(db, line_id)
+        except Exception:
+            # Savepoint откатился — убираем и сделанные в нём подстановки id
+            for key, values in id_mapping.items():
+                values.clear()
+                values.update(mapping_before.get(key, {}))
+            touched_line_ids.clear()
+            touched_line_ids.update(touched_before)
+            del conflicts[conflicts_before:]
+            raise
+
+    async def _on_progress(handled: int) -> None:
+        # Отклонённые проверкой схем и уже применённые ранее записи считаем обработанными сразу
+        if progress is not None:
+            await progress(len(ordered) - len(items) + handled, len(ordered))
+
+    applied = await run_chunked_with_bisect(
+        items, _apply_chunk, lambda item, e: _fail(item[0], e), on_progress=_on_progress,
+    )
+    for record in [*replayed, *(r for r, _ in applied)]:
+        record.status = SyncStatus.SYNCED
+    processed_count = len(applied) + len(replayed)
+    # Ошибки — в порядке записей пакета (проверка схем идёт раньше применения)
+    errors = [error for _, error in sorted(failures, key=lambda f: f[0])]
     
-    logger.info("sync/upload: итог processed=%d failed=%d errors=%s", processed_count, failed_count, errors)
+    logger.info("sync/upload: итог processed=%d failed=%d", processed_count, failed_count)
     if failed_count == 0:
-        await db.commit()
-        if processed_count > 0:
-            await invalidate_map_geojson_cache()
         # Отдаём клиенту маппинг локальных id → серверные (ключи — строки для JSON)
         id_mapping_response = {
             "pole": {str(k): v for k, v in id_mapping["pole"].items()},
             "power_line": {str(k): v for k, v in id_mapping["power_line"].items()},
             "equipment": {str(k): v for k, v in id_mapping.get("equipment", {}).items()},
         }
+        revisions = await _applied_revisions(db, applied, id_mapping)
     else:
-        await db.rollback()
         id_mapping_response = None
-    return SyncResponse(
+        revisions = None
+    if conflicts:
+        logger.info("sync/upload: конфликтов правок=%d (оставлены серверные значения)", len(conflicts))
+    response = SyncResponse(
         success=failed_count == 0,
         processed_count=processed_count,
         failed_count=failed_count,
@@ -358,17 +689,80 @@ async def upload_sync_batch(
         batch_id=batch.batch_id,
         timestamp=datetime.utcnow(),
         id_mapping=id_mapping_response,
+        # При ошибке пакет откатывается целиком — слитых полей нет
+        conflicts=conflicts if failed_count == 0 else [],
+        revisions=revisions,
     )
+    if failed_count == 0:
+        # Журнал — в той же транзакции, что и изменения пакета
+        await store_upload_result(
+            db,
+            current_user.id,
+            batch.batch_id,
+            response.model_dump(mode="json"),
+            [_applied_record(record, data, id_mapping) for record, data in applied],
+        )
+        await db.commit()
+        if len(applied) > 0:
+            # Сбрасываем фрагменты кэша карты только затронутых ЛЭП
+            await invalidate_map_geojson_cache(line_ids=touched_line_ids)
+        try:
+            await compact_upload_ledger(db)
+        except Exception as e:
+            await db.rollback()
+            logger.warning("sync/upload: очистка журнала идемпотентности: %s", e)
+    else:
+        await db.rollback()
+    return response
 
 @router.get("/download")
 async def download_sync_data(
+    request: Request,
     last_sync: Optional[str] = Query(None, description="ISO 8601 timestamp последней синхронизации"),
+    cursor: Optional[int] = Query(
+        None,
+        ge=0,
+        description="Ревизия из прошлого ответа (0 — всё); если задан, last_sync не используется",
+    ),
+    limit: int = Query(SYNC_DOWNLOAD_PAGE_SIZE, ge=1, le=SYNC_DOWNLOAD_MAX_PAGE_SIZE),
+    format: Optional[str] = Query(
+        None,
+        pattern="^(json|ndjson)$",
+        description="ndjson — потоком все изменения после cursor (по умолчанию 0), запись на строку",
+    ),
+    accept: Optional[str] = Header(None),
+    line_ids: Optional[List[str]] = Query(None, description="Подписка: id ЛЭП (повтор параметра или через запятую)"),
+    branch_ids: Optional[List[str]] = Query(None, description="Подписка: id филиалов"),
+    region_ids: Optional[List[str]] = Query(None, description="Подписка: id регионов (с вложенными)"),
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """Скачивание изменений с сервера с момента last_sync"""
+    """
+    Скачивание изменений с сервера: по курсору ревизий (cursor, страницами по limit, has_more —
+    запросить следующую с новым cursor), потоком NDJSON (format=ndjson или Accept:
+    application/x-ndjson; limit — размер пачки чтения) или, для старых клиентов, с момента last_sync.
+    line_ids / branch_ids / region_ids — область подписки устройства: только ЛЭП области, их опоры
+    и оборудование (справочник — целиком); без них — вся сеть.
+    """
+    try:
+        scope = SyncScope.from_query(line_ids, branch_ids, region_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"sync/download: {e}") from e
+    if format == "ndjson" or (format is None and accept and NDJSON_MEDIA_TYPE in accept):
+        return StreamingResponse(
+            _stream_sync_changes_ndjson(cursor or 0, limit, scope),
+            media_type=NDJSON_MEDIA_TYPE,
+            headers={"Cache-Control": "no-store"},
+        )
     try:
-        return await _download_sync_data_impl(last_sync, current_user, db)
+        resolved = await resolve_scope(db, scope)
+        if cursor is not None:
+            payload = await _download_sync_changes_impl(cursor, limit, db, resolved)
+        else:
+            payload = await _download_sync_data_impl(
+                last_sync, current_user, db, list(resolved.line_ids) if resolved is not None else None
+            )
+        return _sync_wire_response(request, payload, records_key="records")
     except Exception as e:
         logger.exception("sync/download: %s", e)
         raise HTTPException(
@@ -377,10 +771,300 @@ async def download_sync_data(
         ) from e
 
 
+# Данные сущностей в ответе sync/download (общие для выгрузки по времени и по курсору)
+
+def _power_line_sync_data(pl: PowerLine) -> Dict[str, Any]:
+    pl_data = {
+        "id": pl.id,
+        "name": pl.name,
+        "voltage_level": pl.voltage_level,
+        "length": pl.length,
+        "branch_id": getattr(pl, "branch_id", None),
+        "status": pl.status,
+        "description": pl.description,
+        "created_by": pl.created_by,
+        "created_at": pl.created_at.isoformat() if pl.created_at else None,
+        "updated_at": pl.updated_at.isoformat() if pl.updated_at else None,
+    }
+    if getattr(pl, "mrid", None) is not None:
+        pl_data["mrid"] = pl.mrid
+    if getattr(pl, "region_id", None) is not None:
+        pl_data["region_id"] = pl.region_id
+    return pl_data
+
+
+def _pole_sync_data(pole: Pole) -> Dict[str, Any]:
+    # Координаты берём из PositionPoint/Location через get_longitude/get_latitude
+    lon = getattr(pole, "get_longitude", None) and pole.get_longitude()
+    lat = getattr(pole, "get_latitude", None) and pole.get_latitude()
+    pole_data = {
+        "id": pole.id,
+        "line_id": pole.line_id,
+        "pole_number": pole.pole_number,
+        "x_position": float(lon) if lon is not None else None,
+        "y_position": float(lat) if lat is not None else None,
+        "pole_type": pole.pole_type,
+        "height": pole.height,
+        "foundation_type": pole.foundation_type,
+        "material": pole.material,
+        "year_installed": pole.year_installed,
+        "condition": pole.condition,
+        "notes": pole.notes,
+        "created_by": pole.created_by,
+        "created_at": pole.created_at.isoformat() if pole.created_at else None,
+        "updated_at": pole.updated_at.isoformat() if pole.updated_at else None,
+    }
+    cc = getattr(pole, "card_comment", None)
+    if cc is not None:
+        pole_data["card_comment"] = cc
+    ca = getattr(pole, "card_comment_attachment", None)
+    if ca is not None:
+        pole_data["card_comment_attachment"] = ca
+    if getattr(pole, "mrid", None) is not None:
+        pole_data["mrid"] = pole.mrid
+    return pole_data
+
+
+def _equipment_sync_data(eq: Equipment) -> Dict[str, Any]:
+    eq_data = {
+        "id": eq.id,
+        "pole_id": eq.pole_id,
+        "equipment_type": eq.equipment_type,
+        "name": eq.name,
+        "manufacturer": eq.manufacturer,
+        "model": eq.model,
+        "serial_number": eq.serial_number,
+        "year_manufactured": eq.year_manufactured,
+        "installation_date": eq.installation_date.isoformat() if eq.installation_date else None,
+        "condition": eq.condition,
+        "notes": eq.notes,
+        "defect": eq.defect,
+        "criticality": eq.criticality,
+        "defect_attachment": getattr(eq, "defect_attachment", None),
+        "card_comment": getattr(eq, "card_comment", None),
+        "card_comment_attachment": getattr(eq, "card_comment_attachment", None),
+        "catalog_item_id": eq.catalog_item_id,
+        "rated_current": eq.rated_current,
+        "i_th": eq.i_th,
+        "ip_max": eq.ip_max,
+        "t_th": eq.t_th,
+        "normal_open": eq.normal_open,
+        "retained": eq.retained,
+        "identified_object_description": eq.identified_object_description,
+        "nameplate": eq.nameplate,
+        "psr_subtype": eq.psr_subtype,
+        "installation_display_name": eq.installation_display_name,
+        "tm_code": eq.tm_code,
+        "object_subtype": eq.object_subtype,
+        "pole_count": eq.pole_count,
+        "parent_object_ref": eq.parent_object_ref,
+        "parent_main_equipment_pole_ref": eq.parent_main_equipment_pole_ref,
+        "nominal_voltage_kv": eq.nominal_voltage_kv,
+        "nominal_breaking_current_ka": eq.nominal_breaking_current_ka,
+        "own_trip_time_sec": eq.own_trip_time_sec,
+        "emergency_current_a": eq.emergency_current_a,
+        "continuous_current_a": eq.continuous_current_a,
+        "arrester_type": eq.arrester_type,
+        "x_position": eq.x_position,
+        "y_position": eq.y_position,
+        "direction_angle": eq.direction_angle,
+        "created_by": eq.created_by,
+        "created_at": eq.created_at.isoformat() if eq.created_at else None,
+        "updated_at": eq.updated_at.isoformat() if eq.updated_at else None,
+    }
+    if getattr(eq, "mrid", None) is not None:
+        eq_data["mrid"] = eq.mrid
+    return eq_data
+
+
+def _catalog_sync_data(item: EquipmentCatalogItem) -> Dict[str, Any]:
+    item_data = {
+        "id": item.id,
+        "type_code": item.type_code,
+        "brand": item.brand,
+        "model": item.model,
+        "full_name": item.full_name,
+        "voltage_kv": item.voltage_kv,
+        "current_a": item.current_a,
+        "manufacturer": item.manufacturer,
+        "country": item.country,
+        "description": item.description,
+        "attrs_json": item.attrs_json,
+        "is_active": item.is_active,
+        "created_at": item.created_at.isoformat() if item.created_at else None,
+        "updated_at": item.updated_at.isoformat() if item.updated_at else None,
+    }
+    return item_data
+
+
+def _sync_timestamp(row: Any) -> str:
+    ts = getattr(row, "updated_at", None) or getattr(row, "created_at", None)
+    return ts.isoformat() if ts else datetime.now(timezone.utc).isoformat()
+
+
+def _upsert_action(cursor: int) -> str:
+    # Первая выгрузка (cursor=0) — снимок: всё как create; дальше — upsert как update
+    return "create" if cursor == 0 else "update"
+
+
+async def _sync_changes_page(
+    db: AsyncSession,
+    cursor: int,
+    limit: int,
+    high_water: int,
+    upsert_action: str,
+    scope: Optional[ResolvedScope] = None,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Строки с ревизией в (cursor, high_water] по возрастанию ревизии, не больше limit, и есть ли ещё.
+    Каждая таблица читается диапазоном по индексу sync_revision (limit + 1 строк), затем слияние.
+    scope — область подписки (app.core.sync_scope); None — вся сеть.
+    """
+    line_ids = scope.line_ids if scope is not None else None
+
+    def _window(col, in_scope=None):
+        condition = and_(col > cursor, col <= high_water)
+        if line_ids is not None and in_scope is not None:
+            condition = and_(condition, in_scope())
+        return condition
+
+    pages: List[List[Tuple[int, Dict[str, Any]]]] = []
+
+    def _page(entity_type: str, rows: Sequence[Any], to_data) -> None:
+        pages.append([
+            (
+                int(row.sync_revision),
+                {
+                    "entity_type": entity_type,
+                    "action": upsert_action,
+                    "data": to_data(row),
+                    "timestamp": _sync_timestamp(row),
+                    "revision": int(row.sync_revision),
+                },
+            )
+            for row in rows
+        ])
+
+    lines = (await db.execute(
+        select(PowerLine)
+        .where(_window(PowerLine.sync_revision, lambda: PowerLine.id.in_(line_ids)))
+        .order_by(PowerLine.sync_revision)
+        .limit(limit + 1)
+    )).scalars().all()
+    _page("power_line", lines, _power_line_sync_data)
+
+    poles = (await db.execute(
+        select(Pole)
+        .options(
+            selectinload(Pole.position_points),
+            selectinload(Pole.location).selectinload(Location.position_points),
+        )
+        .where(_window(Pole.sync_revision, lambda: Pole.line_id.in_(line_ids)))
+        .order_by(Pole.sync_revision)
+        .limit(limit + 1)
+    )).scalars().all()
+    _page("pole", poles, _pole_sync_data)
+
+    equipment = (await db.execute(
+        select(Equipment)
+        .where(_window(
+            Equipment.sync_revision,
+            lambda: Equipment.pole_id.in_(select(Pole.id).where(Pole.line_id.in_(line_ids))),
+        ))
+        .order_by(Equipment.sync_revision)
+        .limit(limit + 1)
+    )).scalars().all()
+    _page("equipment", equipment, _equipment_sync_data)
+
+    catalog = (await db.execute(
+        select(EquipmentCatalogItem)
+        .where(_window(EquipmentCatalogItem.sync_revision))
+        .order_by(EquipmentCatalogItem.sync_revision)
+        .limit(limit + 1)
+    )).scalars().all()
+    _page("equipment_catalog", catalog, _catalog_sync_data)
+
+    tombstones = (await db.execute(
+        select(SyncTombstone)
+        .where(_window(SyncTombstone.sync_revision), tombstone_in_scope(scope))
+        .order_by(SyncTombstone.sync_revision)
+        .limit(limit + 1)
+    )).scalars().all()
+    pages.append([
+        (
+            int(t.sync_revision),
+            {
+                "entity_type": t.entity_type,
+                "action": "delete",
+                "data": {"id": t.entity_id},
+                "timestamp": (_ensure_utc(t.deleted_at) or datetime.now(timezone.utc)).isoformat(),
+                "revision": int(t.sync_revision),
+            },
+        )
+        for t in tombstones
+    ])
+
+    page, has_more = merge_revision_pages(pages, limit)
+    return [{"id": str(uuid.uuid4()), **item} for item in page], has_more
+
+
+async def _download_sync_changes_impl(
+    cursor: int,
+    limit: int,
+    db: AsyncSession,
+    scope: Optional[ResolvedScope] = None,
+) -> Dict[str, Any]:
+    """Одна страница курсорной выгрузки (JSON)."""
+    high_water = await sync_high_water(db)
+    records, has_more = await _sync_changes_page(
+        db, cursor, limit, high_water, _upsert_action(cursor), scope
+    )
+    # Всё до high_water уже закоммичено: без продолжения курсор сразу на границу
+    next_cursor = records[-1]["revision"] if has_more else max(cursor, high_water)
+    return {
+        "records": records,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "count": len(records),
+        "cursor": next_cursor,
+        "has_more": has_more,
+    }
+
+
+async def _stream_sync_changes_ndjson(
+    cursor: int,
+    batch_size: int,
+    scope: Optional[SyncScope] = None,
+) -> AsyncIterator[bytes]:
+    """
+    NDJSON: запись на строку по возрастанию ревизии до high_water на момент начала, последняя
+    строка — {"end": true, "cursor": …, "count": …}. Читается страницами по batch_size
+    (keyset по sync_revision), после страницы сессия очищается — память сервера не растёт с объёмом.
+    Оборвавшийся поток клиент продолжает с revision последней применённой записи.
+    """
+    action = _upsert_action(cursor)
+    count = 0
+    async with AsyncSessionLocal() as db:
+        resolved = await resolve_scope(db, scope) if scope is not None else None
+        high_water = await sync_high_water(db)
+        while True:
+            records, has_more = await _sync_changes_page(db, cursor, batch_size, high_water, action, resolved)
+            if records:
+                yield b"".join(dumps_json_bytes(r) + b"\n" for r in records)
+                count += len(records)
+                cursor = records[-1]["revision"]
+            # Не держим снимок транзакции и объекты ORM между страницами
+            db.expunge_all()
+            await db.rollback()
+            if not has_more:
+                break
+    yield dumps_json_bytes({"end": True, "cursor": max(cursor, high_water), "count": count}) + b"\n"
+
+
 async def _download_sync_data_impl(
     last_sync: Optional[str],
     current_user: User,
     db: AsyncSession,
+    line_ids: Optional[List[int]] = None,
 ):
     # Парсим last_sync или используем время 24 часа назад. Сдвиг на 60 сек назад,
     # чтобы не терять записи из-за разницы часов поясов или задержки коммита.
@@ -405,28 +1089,14 @@ async def _download_sync_data_impl(
             or_(
                 PowerLine.created_at >= last_sync_dt,
                 PowerLine.updated_at >= last_sync_dt
-            )
+            ),
+            PowerLine.id.in_(line_ids) if line_ids is not None else true(),
         )
     )
     power_lines = power_lines_result.scalars().all()
     for pl in power_lines:
         pl_created = _ensure_utc(pl.created_at)
-        pl_data = {
-            "id": pl.id,
-            "name": pl.name,
-            "voltage_level": pl.voltage_level,
-            "length": pl.length,
-            "branch_id": getattr(pl, "branch_id", None),
-            "status": pl.status,
-            "description": pl.description,
-            "created_by": pl.created_by,
-            "created_at": pl.created_at.isoformat() if pl.created_at else None,
-            "updated_at": pl.updated_at.isoformat() if pl.updated_at else None,
-        }
-        if getattr(pl, "mrid", None) is not None:
-            pl_data["mrid"] = pl.mrid
-        if getattr(pl, "region_id", None) is not None:
-            pl_data["region_id"] = pl.region_id
+        pl_data = _power_line_sync_data(pl)
         records.append({
             "id": str(uuid.uuid4()),
             "entity_type": "power_line",
@@ -446,40 +1116,14 @@ async def _download_sync_data_impl(
             or_(
                 Pole.created_at >= last_sync_dt,
                 Pole.updated_at >= last_sync_dt
-            )
+            ),
+            Pole.line_id.in_(line_ids) if line_ids is not None else true(),
         )
     )
     poles = poles_result.scalars().all()
     for pole in poles:
         pole_created = _ensure_utc(pole.created_at)
-        # Координаты берём из PositionPoint/Location через get_longitude/get_latitude
-        lon = getattr(pole, "get_longitude", None) and pole.get_longitude()
-        lat = getattr(pole, "get_latitude", None) and pole.get_latitude()
-        pole_data = {
-            "id": pole.id,
-            "line_id": pole.line_id,
-            "pole_number": pole.pole_number,
-            "x_position": float(lon) if lon is not None else None,
-            "y_position": float(lat) if lat is not None else None,
-            "pole_type": pole.pole_type,
-            "height": pole.height,
-            "foundation_type": pole.foundation_type,
-            "material": pole.material,
-            "year_installed": pole.year_installed,
-            "condition": pole.condition,
-            "notes": pole.notes,
-            "created_by": pole.created_by,
-            "created_at": pole.created_at.isoformat() if pole.created_at else None,
-            "updated_at": pole.updated_at.isoformat() if pole.updated_at else None,
-        }
-        cc = getattr(pole, "card_comment", None)
-        if cc is not None:
-            pole_data["card_comment"] = cc
-        ca = getattr(pole, "card_comment_attachment", None)
-        if ca is not None:
-            pole_data["card_comment_attachment"] = ca
-        if getattr(pole, "mrid", None) is not None:
-            pole_data["mrid"] = pole.mrid
+        pole_data = _pole_sync_data(pole)
         records.append({
             "id": str(uuid.uuid4()),
             "entity_type": "pole",
@@ -495,60 +1139,15 @@ async def _download_sync_data_impl(
             or_(
                 Equipment.created_at >= last_sync_dt,
                 Equipment.updated_at >= last_sync_dt
-            )
+            ),
+            Equipment.pole_id.in_(select(Pole.id).where(Pole.line_id.in_(line_ids)))
+            if line_ids is not None else true(),
         )
     )
     equipment_list = equipment_result.scalars().all()
     for eq in equipment_list:
         eq_created = _ensure_utc(eq.created_at)
-        eq_data = {
-            "id": eq.id,
-            "pole_id": eq.pole_id,
-            "equipment_type": eq.equipment_type,
-            "name": eq.name,
-            "manufacturer": eq.manufacturer,
-            "model": eq.model,
-            "serial_number": eq.serial_number,
-            "year_manufactured": eq.year_manufactured,
-            "installation_date": eq.installation_date.isoformat() if eq.installation_date else None,
-            "condition": eq.condition,
-            "notes": eq.notes,
-            "defect": eq.defect,
-            "criticality": eq.criticality,
-            "defect_attachment": getattr(eq, "defect_attachment", None),
-            "card_comment": getattr(eq, "card_comment", None),
-            "card_comment_attachment": getattr(eq, "card_comment_attachment", None),
-            "catalog_item_id": eq.catalog_item_id,
-            "rated_current": eq.rated_current,
-            "i_th": eq.i_th,
-            "ip_max": eq.ip_max,
-            "t_th": eq.t_th,
-            "normal_open": eq.normal_open,
-            "retained": eq.retained,
-            "identified_object_description": eq.identified_object_description,
-            "nameplate": eq.nameplate,
-            "psr_subtype": eq.psr_subtype,
-            "installation_display_name": eq.installation_display_name,
-            "tm_code": eq.tm_code,
-            "object_subtype": eq.object_subtype,
-            "pole_count": eq.pole_count,
-            "parent_object_ref": eq.parent_object_ref,
-            "parent_main_equipment_pole_ref": eq.parent_main_equipment_pole_ref,
-            "nominal_voltage_kv": eq.nominal_voltage_kv,
-            "nominal_breaking_current_ka": eq.nominal_breaking_current_ka,
-            "own_trip_time_sec": eq.own_trip_time_sec,
-            "emergency_current_a": eq.emergency_current_a,
-            "continuous_current_a": eq.continuous_current_a,
-            "arrester_type": eq.arrester_type,
-            "x_position": eq.x_position,
-            "y_position": eq.y_position,
-            "direction_angle": eq.direction_angle,
-            "created_by": eq.created_by,
-            "created_at": eq.created_at.isoformat() if eq.created_at else None,
-            "updated_at": eq.updated_at.isoformat() if eq.updated_at else None,
-        }
-        if getattr(eq, "mrid", None) is not None:
-            eq_data["mrid"] = eq.mrid
+        eq_data = _equipment_sync_data(eq)
         records.append({
             "id": str(uuid.uuid4()),
             "entity_type": "equipment",
@@ -569,22 +1168,7 @@ async def _download_sync_data_impl(
     catalog_items = catalog_result.scalars().all()
     for item in catalog_items:
         item_created = _ensure_utc(item.created_at)
-        item_data = {
-            "id": item.id,
-            "type_code": item.type_code,
-            "brand": item.brand,
-            "model": item.model,
-            "full_name": item.full_name,
-            "voltage_kv": item.voltage_kv,
-            "current_a": item.current_a,
-            "manufacturer": item.manufacturer,
-            "country": item.country,
-            "description": item.description,
-            "attrs_json": item.attrs_json,
-            "is_active": item.is_active,
-            "created_at": item.created_at.isoformat() if item.created_at else None,
-            "updated_at": item.updated_at.isoformat() if item.updated_at else None,
-        }
+        item_data = _catalog_sync_data(item)
         records.append({
             "id": str(uuid.uuid4()),
             "entity_type": "equipment_catalog",
@@ -718,11 +1302,30 @@ async def _sync_update_connectivity_node_coords(
 
 async def process_sync_record(
     record: SyncRecord, user: User, db: AsyncSession,
-    id_mapping: Optional[Dict[str, Dict[int, int]]] = None
+    id_mapping: Optional[Dict[str, Dict[int, int]]] = None,
+    touched_line_ids: Optional[Set[int]] = None,
+    prefetch: Optional[UploadPrefetch] = None,
+    terminal_line_ids: Optional[Set[int]] = None,
+    conflicts: Optional[List[Dict[str, Any]]] = None,
 ):
-    """Обработка одной записи синхронизации. id_mapping заполняется при создании ЛЭП/опор с локальным (отрицательным) id."""
+    """Обработка одной записи синхронизации. id_mapping заполняется при создании ЛЭП/опор с локальным (отрицательным) id.
+    touched_line_ids пополняется id ЛЭП, чьи объекты изменились (для точечного сброса кэша карты).
+    prefetch — снимок пакета: поиск строки, которой заведомо нет, пропускается; terminal_line_ids —
+    пересборка клемм оборудования откладывается вызывающим кодом (раз на ЛЭП), иначе сразу.
+    conflicts пополняется полями устаревших патчей (update с base_revision), оставшимися серверными."""
     id_mapping = id_mapping or {"power_line": {}, "pole": {}, "equipment": {}}
+    touched_line_ids = touched_line_ids if touched_line_ids is not None else set()
+    conflicts = conflicts if conflicts is not None else []
     data = record.data
+
+    def _may_exist() -> bool:
+        return prefetch is None or prefetch.may_exist(record.entity_type, data.get('id'), data.get('mrid'))
+
+    async def _refresh_terminals(line_id: int) -> None:
+        if terminal_line_ids is not None:
+            terminal_line_ids.add(line_id)
+        else:
+            await sync_equipment_terminals_for_line(db, line_id)
     
     if record.entity_type == "power_line":
         if record.action == SyncAction.CREATE:
@@ -733,7 +1336,7 @@ async def process_sync_record(
                 conds.append(PowerLine.id == client_id_int)
             if data.get('mrid'):
                 conds.append(PowerLine.mrid == data.get('mrid'))
-            if not conds:
+            if not conds or not _may_exist():
                 existing_pl = None
             else:
                 existing = await db.execute(select(PowerLine).where(or_(*conds)))
@@ -748,6 +1351,7 @@ async def process_sync_record(
                 client_id_int = _to_int(client_id)
                 if client_id_int is not None and client_id_int < 0:
                     id_mapping["power_line"][client_id_int] = existing_pl.id
+                touched_line_ids.add(existing_pl.id)
             else:
                 mrid = data.get('mrid') or generate_mrid()
                 voltage = data.get('voltage_level')
@@ -774,24 +1378,29 @@ async def process_sync_record(
                 client_id_int = _to_int(client_id)
                 if client_id_int is not None and client_id_int < 0:
                     id_mapping["power_line"][client_id_int] = db_pl.id
+                touched_line_ids.add(db_pl.id)
         
         elif record.action == SyncAction.UPDATE:
             # Обновление ЛЭП (если не найдена — уже удалена на сервере, пропускаем)
-            result = await db.execute(
-                select(PowerLine).where(
-                    or_(
-                        PowerLine.id == data.get('id'),
-                        PowerLine.mrid == data.get('mrid')
+            pl = None
+            if _may_exist():
+                result = await db.execute(
+                    select(PowerLine).where(
+                        or_(
+                            PowerLine.id == data.get('id'),
+                            PowerLine.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            pl = result.scalar_one_or_none()
+                pl = result.scalar_one_or_none()
             if pl:
+                data = await _merge_stale_update(db, record, pl, data, conflicts)
                 for key, value in data.items():
                     if key in ('id', 'mrid', 'created_at', 'created_by', 'code'):
                         continue
                     if hasattr(pl, key):
                         setattr(pl, key, value)
+                touched_line_ids.add(pl.id)
             # иначе уже удалена — не ошибка
         
         elif record.action == SyncAction.DELETE:
@@ -802,10 +1411,11 @@ async def process_sync_record(
                     pl_id = int(pl_id)
                 except (TypeError, ValueError):
                     pl_id = None
-            if pl_id is not None:
+            if pl_id is not None and _may_exist():
                 result = await db.execute(select(PowerLine).where(PowerLine.id == pl_id))
                 pl = result.scalar_one_or_none()
                 if pl:
+                    touched_line_ids.add(pl.id)
                     await _delete_power_line_cascade(db, pl.id)
                     db.add(
                         ChangeLog(
@@ -821,19 +1431,22 @@ async def process_sync_record(
     elif record.entity_type == "pole":
         if record.action == SyncAction.CREATE:
             # Проверяем существование
-            existing = await db.execute(
-                select(Pole).where(
-                    or_(
-                        Pole.id == data.get('id'),
-                        Pole.mrid == data.get('mrid')
+            existing_pole = None
+            if _may_exist():
+                existing = await db.execute(
+                    select(Pole).where(
+                        or_(
+                            Pole.id == data.get('id'),
+                            Pole.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            existing_pole = existing.scalar_one_or_none()
+                existing_pole = existing.scalar_one_or_none()
             client_id = data.get('id')
             if existing_pole:
                 _old_cc = existing_pole.card_comment
                 _old_ca = existing_pole.card_comment_attachment
+                touched_line_ids.add(existing_pole.line_id)
                 pl_id_val = _to_int(data.get('line_id'))
                 if pl_id_val is not None:
                     existing_pole.line_id = pl_id_val
@@ -856,7 +1469,8 @@ async def process_sync_record(
                 client_id_int = _to_int(client_id)
                 if client_id_int is not None and client_id_int < 0:
                     id_mapping["pole"][client_id_int] = existing_pole.id
-                    await _upsert_pole_mapping(user.id, client_id_int, existing_pole.id, db)
+                    await _upsert_pole_mapping(user.id, client_id_int, existing_pole.id, db, prefetch)
+                touched_line_ids.add(existing_pole.line_id)
                 if existing_pole.sequence_number is None:
                     await _finalize_sync_pole_after_create(db, existing_pole, data, user.id)
             else:
@@ -886,6 +1500,7 @@ async def process_sync_record(
                 )
                 db.add(db_pole)
                 await db.flush()
+                touched_line_ids.add(pl_id)
                 if x_pos is not None and y_pos is not None:
                     pp = PositionPoint(
                         mrid=generate_mrid(),
@@ -910,20 +1525,23 @@ async def process_sync_record(
                 client_id_int = _to_int(client_id)
                 if client_id_int is not None and client_id_int < 0:
                     id_mapping["pole"][client_id_int] = db_pole.id
-                    await _upsert_pole_mapping(user.id, client_id_int, db_pole.id, db)
+                    await _upsert_pole_mapping(user.id, client_id_int, db_pole.id, db, prefetch)
         
         elif record.action == SyncAction.UPDATE:
-            result = await db.execute(
-                select(Pole).where(
-                    or_(
-                        Pole.id == data.get('id'),
-                        Pole.mrid == data.get('mrid')
+            pole = None
+            if _may_exist():
+                result = await db.execute(
+                    select(Pole).where(
+                        or_(
+                            Pole.id == data.get('id'),
+                            Pole.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            pole = result.scalar_one_or_none()
+                pole = result.scalar_one_or_none()
             if pole:
                 from app.api.v1.power_lines import normalize_pole_number
+                data = await _merge_stale_update(db, record, pole, data, conflicts)
                 old_snapshot = {
                     "pole_number": pole.pole_number,
                     "pole_type": pole.pole_type,
@@ -933,9 +1551,11 @@ async def process_sync_record(
                 }
                 _old_cc = pole.card_comment
                 _old_ca = pole.card_comment_attachment
+                touched_line_ids.add(pole.line_id)
                 pl_id_val = _to_int(data.get('line_id'))
                 if pl_id_val is not None:
                     pole.line_id = pl_id_val
+                    touched_line_ids.add(pl_id_val)
                 upd = dict(data)
                 if 'latitude' in upd and 'y_position' not in upd:
                     upd['y_position'] = upd['latitude']
@@ -1005,17 +1625,20 @@ async def process_sync_record(
                     )
         
         elif record.action == SyncAction.DELETE:
-            result = await db.execute(
-                select(Pole).where(
-                    or_(
-                        Pole.id == data.get('id'),
-                        Pole.mrid == data.get('mrid')
+            pole = None
+            if _may_exist():
+                result = await db.execute(
+                    select(Pole).where(
+                        or_(
+                            Pole.id == data.get('id'),
+                            Pole.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            pole = result.scalar_one_or_none()
+                pole = result.scalar_one_or_none()
             if pole:
                 pole_id = pole.id
+                touched_line_ids.add(pole.line_id)
                 await _delete_pole_cascade_sync(db, pole_id)
                 db.add(
                     ChangeLog(
@@ -1030,15 +1653,17 @@ async def process_sync_record(
     
     elif record.entity_type == "equipment":
         if record.action == SyncAction.CREATE:
-            existing = await db.execute(
-                select(Equipment).where(
-                    or_(
-                        Equipment.id == data.get('id'),
-                        Equipment.mrid == data.get('mrid')
+            existing_eq = None
+            if _may_exist():
+                existing = await db.execute(
+                    select(Equipment).where(
+                        or_(
+                            Equipment.id == data.get('id'),
+                            Equipment.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            existing_eq = existing.scalar_one_or_none()
+                existing_eq = existing.scalar_one_or_none()
             
             if existing_eq:
                 for key, value in data.items():
@@ -1103,19 +1728,23 @@ async def process_sync_record(
                         getattr(eq_for_validate, "equipment_type", None),
                         nominal_voltage_kv,
                     )
-                    await sync_equipment_terminals_for_line(db, pole_for_eq.line_id)
+                    touched_line_ids.add(pole_for_eq.line_id)
+                    await _refresh_terminals(pole_for_eq.line_id)
         
         elif record.action == SyncAction.UPDATE:
-            result = await db.execute(
-                select(Equipment).where(
-                    or_(
-                        Equipment.id == data.get('id'),
-                        Equipment.mrid == data.get('mrid')
+            eq = None
+            if _may_exist():
+                result = await db.execute(
+                    select(Equipment).where(
+                        or_(
+                            Equipment.id == data.get('id'),
+                            Equipment.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            eq = result.scalar_one_or_none()
+                eq = result.scalar_one_or_none()
             if eq:
+                data = await _merge_stale_update(db, record, eq, data, conflicts)
                 for key, value in data.items():
                     if key in ('id', 'mrid', 'created_at', 'created_by'):
                         continue
@@ -1152,25 +1781,29 @@ async def process_sync_record(
                         getattr(eq, "equipment_type", None),
                         nominal_voltage_kv,
                     )
-                    await sync_equipment_terminals_for_line(db, pole_for_eq.line_id)
+                    touched_line_ids.add(pole_for_eq.line_id)
+                    await _refresh_terminals(pole_for_eq.line_id)
         
         elif record.action == SyncAction.DELETE:
-            result = await db.execute(
-                select(Equipment).where(
-                    or_(
-                        Equipment.id == data.get('id'),
-                        Equipment.mrid == data.get('mrid')
+            eq = None
+            if _may_exist():
+                result = await db.execute(
+                    select(Equipment).where(
+                        or_(
+                            Equipment.id == data.get('id'),
+                            Equipment.mrid == data.get('mrid')
+                        )
                     )
                 )
-            )
-            eq = result.scalar_one_or_none()
+                eq = result.scalar_one_or_none()
             if eq:
                 pole_id = eq.pole_id
                 await db.execute(delete(Equipment).where(Equipment.id == eq.id))
                 if pole_id is not None:
                     pole_for_eq = await db.get(Pole, pole_id)
                     if pole_for_eq is not None:
-                        await sync_equipment_terminals_for_line(db, pole_for_eq.line_id)
+                        touched_line_ids.add(pole_for_eq.line_id)
+                        await _refresh_terminals(pole_for_eq.line_id)
                 db.add(
                     ChangeLog(
                         user_id=user.id,
@@ -0,0 +1,33 @@
+"""
+Celery для тяжёлых фоновых задач (сейчас — пакеты sync/upload?mode=async, app.core.sync_jobs).
+Брокер — Redis (CELERY_BROKER_URL или REDIS_URL); результаты задач не хранятся, состояние
+заданий — в таблице sync_upload_job. Запуск воркера (см. docker-compose, сервис sync_worker):
+
+    celery -A app.core.celery_app:celery_app worker -Q sync --concurrency 2
+"""
+from app.core.config import settings
+
+try:
+    from celery import Celery
+except ImportError:  # pragma: no cover
+    Celery = None  # type: ignore[assignment]
+
+celery_app = None
+if Celery is not None:
+    celery_app = Celery(
+        "lepm",
+        broker=settings.CELERY_BROKER_URL or settings.REDIS_URL,
+        include=["app.core.sync_jobs"],
+    )
+    celery_app.conf.update(
+        task_default_queue=settings.SYNC_JOB_QUEUE,
+        task_ignore_result=True,
+        # Задание подтверждается после обработки: упавший воркер — пакет получит другой
+        task_acks_late=True,
+        task_reject_on_worker_lost=True,
+        # Пакеты тяжёлые — не забирать впрок, пока текущий не обработан
+        worker_prefetch_multiplier=1,
+        broker_connection_retry_on_startup=True,
+        task_serializer="json",
+        accept_content=["json"],
+    )
@@ -16,14 +16,15 @@ import re
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Set, Tuple
 
-from sqlalchemy import delete, select
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from app.models.acline_segment import AClineSegment
 from app.models.cim_line_structure import ConnectivityNode, Terminal
+from app.models.base import generate_mrid
+from app.models.location import Location
 from app.models.power_line import Equipment, Pole
-from app.core.line_auto_assembly import get_or_create_connectivity_node_for_pole
 from app.core.wire_parameters import ensure_acline_segment_terminals
 from app.core.cim_topology import normalize_line_cim_topology
 
@@ -85,22 +86,18 @@ def _resolve_pole_by_ref(
 
 
 async def _pole_adjacency(
-    db: AsyncSession, power_line_id: int, poles_by_id: Dict[int, Pole]
+    db: AsyncSession, power_line_id: int, poles_by_id: Dict[int, Pole], cn_to_pole: Dict[int, int]
 ) -> Dict[int, Set[int]]:
     """Соседние опоры по концам ACLineSegment (От/К на CN опор)."""
     adj: Dict[int, Set[int]] = {pid: set() for pid in poles_by_id}
-    cn_to_pole: Dict[int, int] = {}
-    for pole in poles_by_id.values():
-        cn = pole.get_connectivity_node_for_line(power_line_id)
-        if cn is not None:
-            cn_to_pole[int(cn.id)] = int(pole.id)
-
     seg_result = await db.execute(
-        select(AClineSegment).where(AClineSegment.line_id == power_line_id)
+        select(AClineSegment.from_connectivity_node_id, AClineSegment.to_connectivity_node_id).where(
+            AClineSegment.line_id == power_line_id
+        )
     )
-    for seg in seg_result.scalars().all():
+    for from_cn_id, to_cn_id in seg_result.all():
         ends: List[int] = []
-        for cn_id in (seg.from_connectivity_node_id, seg.to_connectivity_node_id):
+        for cn_id in (from_cn_id, to_cn_id):
             if cn_id is None:
                 continue
             pid = cn_to_pole.get(int(cn_id))
@@ -175,24 +172,123 @@ def _placements_for_equipment(
     return placements
 
 
-async def _ensure_cn_for_pole(
-    db: AsyncSession, pole: Pole, power_line_id: int
-) -> ConnectivityNode:
-    cn = pole.get_connectivity_node_for_line(power_line_id)
-    if cn is not None:
-        return cn
-    return await get_or_create_connectivity_node_for_pole(db, pole, power_line_id)
+# (equipment_id, connectivity_node_id, sequence_number, connection_direction)
+TerminalKey = Tuple[int, int, int, str]
+
+
+@dataclass(frozen=True)
+class ExistingTerminal:
+    id: int
+    key: Optional[TerminalKey]  # None — терминал без оборудования (удаляется)
+    name: Optional[str]
+    description: Optional[str]
+    equipment_id: Optional[int]
+
+
+@dataclass
+class TerminalDiff:
+    insert: List[TerminalKey]
+    update: List[Tuple[int, TerminalKey]]  # (id, ключ) — поправить name / description / equipment_id
+    delete: List[int]
+
+
+def _terminal_values(key: TerminalKey) -> Dict[str, object]:
+    equipment_id, cn_id, sequence_number, direction = key
+    return {
+        "name": f"T{sequence_number}",
+        "connectivity_node_id": cn_id,
+        "acline_segment_id": None,
+        "sequence_number": sequence_number,
+        "connection_direction": direction,
+        "description": f"equipment_id={equipment_id}",
+        "equipment_id": equipment_id,
+    }
+
+
+def diff_equipment_terminals(desired: List[TerminalKey], existing: List[ExistingTerminal]) -> TerminalDiff:
+    """
+    Сравнить нужные терминалы с имеющимися: совпавшие по ключу остаются (и сохраняют mRID),
+    лишние и дубликаты удаляются, недостающие создаются.
+    """
+    by_key: Dict[TerminalKey, List[ExistingTerminal]] = {}
+    for term in sorted(existing, key=lambda t: t.id):
+        if term.key is not None:
+            by_key.setdefault(term.key, []).append(term)
+    keep: Set[int] = set()
+    diff = TerminalDiff(insert=[], update=[], delete=[])
+    for key in dict.fromkeys(desired):
+        matches = by_key.get(key)
+        if not matches:
+            diff.insert.append(key)
+            continue
+        term = matches[0]
+        keep.add(term.id)
+        values = _terminal_values(key)
+        if (term.name, term.description, term.equipment_id) != (
+            values["name"], values["description"], values["equipment_id"]
+        ):
+            diff.update.append((term.id, key))
+    diff.delete = [t.id for t in existing if t.id not in keep]
+    return diff
+
+
+async def _connectivity_nodes_for_poles(
+    db: AsyncSession, power_line_id: int, poles: List[Pole]
+) -> Dict[int, int]:
+    """pole_id → id CN опоры на линии (минимальный id); недостающие узлы создаются одним flush."""
+    result = await db.execute(
+        select(ConnectivityNode.pole_id, ConnectivityNode.id)
+        .where(ConnectivityNode.line_id == power_line_id, ConnectivityNode.pole_id.isnot(None))
+        .order_by(ConnectivityNode.id.asc())
+    )
+    cn_by_pole: Dict[int, int] = {}
+    for pole_id, cn_id in result.all():
+        cn_by_pole.setdefault(int(pole_id), int(cn_id))
+    missing = [int(p.id) for p in poles if int(p.id) not in cn_by_pole]
+    if missing:
+        # Координаты нового узла — из Location/PositionPoint опоры
+        missing_result = await db.execute(
+            select(Pole)
+            .where(Pole.id.in_(missing))
+            .options(
+                selectinload(Pole.location).selectinload(Location.position_points),
+                selectinload(Pole.position_points),
+            )
+        )
+        nodes = []
+        for pole in missing_result.scalars().all():
+            lat = pole.get_latitude()
+            lon = pole.get_longitude()
+            nodes.append(
+                ConnectivityNode(
+                    mrid=generate_mrid(),
+                    name=f"Узел {pole.pole_number}",
+                    pole_id=pole.id,
+                    line_id=power_line_id,
+                    y_position=float(lat) if lat is not None else 0.0,
+                    x_position=float(lon) if lon is not None else 0.0,
+                    is_virtual=True,
+                )
+            )
+        db.add_all(nodes)
+        await db.flush()
+        for node in nodes:
+            cn_by_pole[int(node.pole_id)] = int(node.id)
+    return cn_by_pole
 
 
 async def sync_equipment_terminals_for_line(db: AsyncSession, power_line_id: int) -> None:
     """
     Терминалы оборудования: не более одного на CN (T1 или T2).
     Двухполюсное — T1 и T2 на разных CN (опора установки и соседняя).
+    Нужный набор считается в памяти и сравнивается с имеющимся: неизменные терминалы
+    сохраняют id и mRID (меньше изменений в разностной выгрузке 552), остальное —
+    одним INSERT, UPDATE и DELETE.
     """
     poles_result = await db.execute(
         select(Pole)
         .where(Pole.line_id == power_line_id)
-        .options(selectinload(Pole.equipment), selectinload(Pole.connectivity_nodes))
+        .options(selectinload(Pole.equipment))
     )
     poles = list(poles_result.scalars().all())
     if not poles:
@@ -204,44 +300,72 @@ async def sync_equipment_terminals_for_line(db: AsyncSession, power_line_id: int
         for p in poles
         if (p.pole_number or "").strip()
     }
-    adjacency = await _pole_adjacency(db, power_line_id, poles_by_id)
-
-    cn_ids: List[int] = []
-    for pole in poles:
-        cn = await _ensure_cn_for_pole(db, pole, power_line_id)
-        cn_ids.append(int(cn.id))
-
-    await db.execute(
-        delete(Terminal).where(
-            Terminal.connectivity_node_id.in_(cn_ids),
-            Terminal.acline_segment_id.is_(None),
-        )
-    )
+    cn_by_pole = await _connectivity_nodes_for_poles(db, power_line_id, poles)
+    cn_to_pole = {cn_id: pole_id for pole_id, cn_id in cn_by_pole.items()}
+    adjacency = await _pole_adjacency(db, power_line_id, poles_by_id, cn_to_pole)
 
+    desired: List[TerminalKey] = []
     for pole in poles:
         for equipment in pole.equipment or []:
             for placement in _placements_for_equipment(
                 equipment, pole, poles_by_id, poles_by_number, adjacency
             ):
-                target_pole = poles_by_id.get(placement.pole_id)
-                if target_pole is None:
+                cn_id = cn_by_pole.get(placement.pole_id)
+                if cn_id is None:
                     continue
-                cn = await _ensure_cn_for_pole(db, target_pole, power_line_id)
-                from app.models.base import generate_mrid
-
-                term = Terminal(
-                    mrid=generate_mrid(),
-                    name=f"T{placement.sequence_number}",
-                    connectivity_node_id=cn.id,
-                    acline_segment_id=None,
-                    sequence_number=placement.sequence_number,
-                    connection_direction=placement.connection_direction,
-                    description=f"equipment_id={equipment.id}",
+                desired.append(
+                    (int(equipment.id), cn_id, placement.sequence_number, placement.connection_direction)
                 )
-                if hasattr(term, "equipment_id"):
-                    term.equipment_id = int(equipment.id)
-                db.add(term)
 
+    existing_result = await db.execute(
+        select(
+            Terminal.id,
+            Terminal.name,
+            Terminal.description,
+            Terminal.equipment_id,
+            Terminal.connectivity_node_id,
+            Terminal.sequence_number,
+            Terminal.connection_direction,
+        ).where(
+            Terminal.connectivity_node_id.in_(list(cn_by_pole.values())),
+            Terminal.acline_segment_id.is_(None),
+        )
+    )
+    existing: List[ExistingTerminal] = []
+    for row in existing_result.all():
+        equipment_id = _terminal_equipment_id(row)
+        key = (
+            (equipment_id, int(row.connectivity_node_id), int(row.sequence_number or 1), row.connection_direction)
+            if equipment_id is not None
+            else None
+        )
+        existing.append(ExistingTerminal(row.id, key, row.name, row.description, row.equipment_id))
+
+    diff = diff_equipment_terminals(desired, existing)
+    if diff.delete:
+        await db.execute(
+            delete(Terminal)
+            .where(Terminal.id.in_(diff.delete))
+            .execution_options(synchronize_session=False)
+        )
+    if diff.update:
+        await db.execute(
+            update(Terminal),
+            [
+                {
+                    "id": term_id,
+                    "name": values["name"],
+                    "description": values["description"],
+                    "equipment_id": values["equipment_id"],
+                }
+                for term_id, values in ((t, _terminal_values(k)) for t, k in diff.update)
+            ],
+        )
+    if diff.insert:
+        await db.execute(
+            insert(Terminal),
+            [{"mrid": generate_mrid(), **_terminal_values(key)} for key in diff.insert],
+        )
     await db.flush()
 
 
@@ -12,9 +12,9 @@ ConnectivityNode — стык: терминалы От/К ACLineSegment (2 на
 from __future__ import annotations
 
 from collections import defaultdict
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import Integer, column, delete, func, select, update, values
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
@@ -23,74 +23,78 @@ from app.models.cim_line_structure import ConnectivityNode, Terminal
 from app.models.power_line import Pole, Span
 
 
-async def _rewire_connectivity_node_fk(
-    db: AsyncSession, old_id: int, new_id: int
-) -> None:
-    """Перенаправить все ссылки с дублирующего CN на канонический."""
-    if old_id == new_id:
-        return
-    await db.execute(
-        update(AClineSegment)
-        .where(AClineSegment.from_connectivity_node_id == old_id)
-        .values(from_connectivity_node_id=new_id)
-    )
-    await db.execute(
-        update(AClineSegment)
-        .where(AClineSegment.to_connectivity_node_id == old_id)
-        .values(to_connectivity_node_id=new_id)
-    )
-    await db.execute(
-        update(Span)
-        .where(Span.from_connectivity_node_id == old_id)
-        .values(from_connectivity_node_id=new_id)
-    )
-    await db.execute(
-        update(Span)
-        .where(Span.to_connectivity_node_id == old_id)
-        .values(to_connectivity_node_id=new_id)
-    )
-    await db.execute(
-        update(Terminal)
-        .where(Terminal.connectivity_node_id == old_id)
-        .values(connectivity_node_id=new_id)
-    )
-    await db.execute(
-        update(Pole)
-        .where(Pole.connectivity_node_id == old_id)
-        .values(connectivity_node_id=new_id)
-    )
+# Пар (дубликат → канонический) в одном UPDATE … FROM (VALUES …): по 2 параметра на пару (предел asyncpg — 32767)
+REWIRE_BATCH_SIZE = 5000
+
+# Ссылки на ConnectivityNode, которые переводятся на канонический узел. UPDATE/DELETE —
+# с synchronize_session="fetch": загруженные в сессию опоры, пролёты и участки получают новые
+# id узлов (атрибуты истекают), удалённые дубликаты переходят в состояние deleted
+_CONNECTIVITY_NODE_FK_COLUMNS = (
+    AClineSegment.from_connectivity_node_id,
+    AClineSegment.to_connectivity_node_id,
+    Span.from_connectivity_node_id,
+    Span.to_connectivity_node_id,
+    Terminal.connectivity_node_id,
+    Pole.connectivity_node_id,
+)
+
+
+def canonical_connectivity_node_map(nodes: Iterable[Tuple[int, Optional[int]]]) -> Dict[int, int]:
+    """
+    (id, pole_id) узлов линии → {id дубликата: id канонического}. На опоре канонический —
+    минимальный id; узлы без опоры (ПС) не сливаются.
+    """
+    canonical: Dict[int, int] = {}
+    mapping: Dict[int, int] = {}
+    for cn_id, pole_id in sorted((int(i), p) for i, p in nodes):
+        if pole_id is None:
+            continue
+        keep = canonical.setdefault(int(pole_id), cn_id)
+        if keep != cn_id:
+            mapping[cn_id] = keep
+    return mapping
+
+
+async def _rewire_connectivity_nodes(db: AsyncSession, mapping: Dict[int, int]) -> None:
+    """Перенаправить ссылки с дубликатов на канонические узлы: по UPDATE … FROM (VALUES …) на колонку."""
+    pairs = sorted(mapping.items())
+    for start in range(0, len(pairs), REWIRE_BATCH_SIZE):
+        cn_map = values(
+            column("old_id", Integer), column("new_id", Integer), name="cn_map"
+        ).data(pairs[start:start + REWIRE_BATCH_SIZE])
+        for fk in _CONNECTIVITY_NODE_FK_COLUMNS:
+            await db.execute(
+                update(fk.class_)
+                .where(fk == cn_map.c.old_id)
+                .values({fk.key: cn_map.c.new_id})
+                .execution_options(synchronize_session="fetch")
+            )
 
 
 async def merge_duplicate_connectivity_nodes(
     db: AsyncSession, power_line_id: int
 ) -> int:
     """
-    На одной опоре и линии оставляет один CN (минимальный id), остальные сливает.
-    Возвращает число удалённых дубликатов.
+    На одной опоре и линии оставляет один CN (минимальный id), остальные сливает: соответствие
+    считается для всей линии сразу, ссылки переводятся UPDATE … FROM (VALUES …) на колонку,
+    дубликаты удаляются одним DELETE. Возвращает число удалённых дубликатов.
     """
     result = await db.execute(
-        select(ConnectivityNode)
-        .where(ConnectivityNode.line_id == power_line_id)
-        .order_by(ConnectivityNode.id.asc())
+        select(ConnectivityNode.id, ConnectivityNode.pole_id).where(ConnectivityNode.line_id == power_line_id)
     )
-    nodes = list(result.scalars().all())
-    by_pole: Dict[int, List[ConnectivityNode]] = defaultdict(list)
-    for cn in nodes:
-        if cn.pole_id is not None:
-            by_pole[int(cn.pole_id)].append(cn)
-
-    removed = 0
-    for _pole_id, group in by_pole.items():
-        if len(group) <= 1:
-            continue
-        canonical = group[0]
-        for dup in group[1:]:
-            await _rewire_connectivity_node_fk(db, int(dup.id), int(canonical.id))
-            await db.execute(delete(ConnectivityNode).where(ConnectivityNode.id == dup.id))
-            removed += 1
-    if removed:
-        await db.flush()
-    return removed
+    mapping = canonical_connectivity_node_map(result.all())
+    if not mapping:
+        return 0
+    await _rewire_connectivity_nodes(db, mapping)
+    dup_ids = sorted(mapping)
+    for start in range(0, len(dup_ids), REWIRE_BATCH_SIZE):
+        await db.execute(
+            delete(ConnectivityNode)
+            .where(ConnectivityNode.id.in_(dup_ids[start:start + REWIRE_BATCH_SIZE]))
+            .execution_options(synchronize_session="fetch")
+        )
+    await db.flush()
+    return len(mapping)
 
 
 def _segment_endpoint_ids(segments: List[AClineSegment]) -> Dict[int, int]:
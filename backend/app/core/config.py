@@ -27,9 +27,49 @@ class Settings(BaseSettings):
     # Прокси OSM + кэш PNG в Redis (отдельное соединение decode_responses=False)
     TILE_CACHE_ENABLED: bool = True
     TILE_CACHE_REDIS_TTL_SECONDS: int = 604800  # 7 суток
+    # Второй уровень кэша тайлов — файл MBTiles в TILE_CACHE_DIR (переживает вытеснение из Redis)
+    TILE_CACHE_DISK_ENABLED: bool = True
+    # Старше — перезапрашиваем у апстрима; при его сбое отдаём устаревший тайл с диска
+    TILE_CACHE_DISK_MAX_AGE_SECONDS: int = 2592000  # 30 суток
+    # Офлайн-подложка MBTiles (scripts/build_belarus_basemap_mbtiles.py) — отдаётся раньше Redis и апстрима;
+    # диапазон zoom — пересечение настроек и minzoom/maxzoom из metadata файла
+    TILE_BASEMAP_MBTILES_PATH: Optional[str] = None
+    TILE_BASEMAP_MIN_ZOOM: Optional[int] = None
+    TILE_BASEMAP_MAX_ZOOM: Optional[int] = 11
+    TILE_BASEMAP_POOL_SIZE: int = 4
+    # Прогрев кэша тайлов (админ): предел числа тайлов в задании и параллельных загрузок
+    TILE_PREFETCH_MAX_TILES: int = 200000
+    TILE_PREFETCH_MAX_CONCURRENCY: int = 8
+    # Журнал идемпотентности sync/upload: сколько помнить принятые пакеты/записи и как часто чистить
+    SYNC_IDEMPOTENCY_TTL_HOURS: int = 168  # 7 суток
+    SYNC_IDEMPOTENCY_COMPACT_INTERVAL_SECONDS: int = 3600
+    # Фоновая обработка sync/upload?mode=async: "celery" — воркер (docker-compose sync_worker),
+    # "inline" — задача asyncio в процессе API (разработка без воркера)
+    SYNC_JOBS_BACKEND: str = "celery"
+    CELERY_BROKER_URL: Optional[str] = None  # по умолчанию REDIS_URL
+    SYNC_JOB_QUEUE: str = "sync"
+    # Сколько пакетов обрабатывается одновременно в режиме inline (у celery — --concurrency воркера)
+    SYNC_JOB_MAX_CONCURRENCY: int = 2
+    # Задание в queued/running без движения дольше этого (от последнего прогресса) считается потерянным
+    # (перезапуск процесса с inline-задачей, потеря сообщения брокером) и ставится в очередь заново
+    SYNC_JOB_STALE_MINUTES: int = 30
     # GeoJSON слоёв карты (опоры, ЛЭП, оборудование…) — JSON в Redis
     MAP_GEOJSON_CACHE_ENABLED: bool = True
     MAP_GEOJSON_CACHE_TTL_SECONDS: int = 300
+    # Фрагменты слоёв по ЛЭП (сбрасываются точечно при правке линии)
+    MAP_GEOJSON_FRAGMENT_TTL_SECONDS: int = 300
+    # Прошлая версия слоя отдаётся, пока другой запрос/воркер пересчитывает слой (stale-while-revalidate)
+    MAP_GEOJSON_STALE_TTL_SECONDS: int = 86400
+    # Блокировка пересчёта слоя в Redis (один пересчёт на слой на все воркеры)
+    MAP_GEOJSON_REBUILD_LOCK_SECONDS: int = 120
+    # Сколько ждать чужой пересчёт, если прошлой версии нет; потом считаем сами
+    MAP_GEOJSON_REBUILD_WAIT_SECONDS: float = 15.0
+    # Запас вокруг окна карты (м) для поиска ЛЭП и пролётов по индексу точек опор: пролёт длиннее
+    # запаса, пересекающий окно без концов рядом с ним, в выборку по bbox не попадёт
+    MAP_BBOX_SPAN_MARGIN_M: int = 2000
+    # Векторные тайлы слоёв карты (MVT) — байты в бинарном Redis, ключ включает поколение
+    MAP_VECTOR_TILE_CACHE_ENABLED: bool = True
+    MAP_VECTOR_TILE_CACHE_TTL_SECONDS: int = 3600
     OSM_TILE_UPSTREAM_TEMPLATE: str = "https://tile.openstreetmap.de/{z}/{x}/{y}.png"
     # Через запятую; если пусто — в map_tile_cache используются встроенные запасные CDN
     OSM_TILE_UPSTREAM_FALLBACKS: str = ""
@@ -0,0 +1,115 @@
+"""
+Расстояния по координатам опор (WGS84, градусы) — сфера радиуса EARTH_RADIUS_M, формула гаверсинуса.
+
+Одна пара точек — haversine_m (math, без накладных расходов NumPy). Для массивов — функции *_array /
+chain_* / nearest_*: пролёты по парам опор, длины вдоль цепочки, накопленная длина и поиск
+ближайшей опоры считаются одной операцией над массивами, а не циклом Python. Координата None
+в массиве — NaN: такое расстояние тоже NaN, ближайшей такая точка не бывает.
+"""
+from __future__ import annotations
+
+import math
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+Coordinate = Tuple[Optional[float], Optional[float]]  # (широта, долгота)
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние между двумя точками (м)."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return EARTH_RADIUS_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def as_coordinate_array(values: Iterable[Optional[float]]) -> np.ndarray:
+    """Координаты в массив float64; None — NaN."""
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def haversine_array_m(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Расстояния (м) поэлементно; массивы и скаляры приводятся по правилам broadcasting."""
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    a = np.clip(a, 0.0, 1.0)
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def pair_lengths_m(pairs: Sequence[Tuple[Coordinate, Coordinate]]) -> List[Optional[float]]:
+    """Длины пролётов по парам ((lat, lon) начала, (lat, lon) конца); без координат — None."""
+    if not pairs:
+        return []
+    lat1 = as_coordinate_array(a[0] for a, _b in pairs)
+    lon1 = as_coordinate_array(a[1] for a, _b in pairs)
+    lat2 = as_coordinate_array(b[0] for _a, b in pairs)
+    lon2 = as_coordinate_array(b[1] for _a, b in pairs)
+    lengths = haversine_array_m(lat1, lon1, lat2, lon2)
+    return [None if math.isnan(d) else float(d) for d in lengths.tolist()]
+
+
+def chain_segment_lengths_m(lats, lons) -> np.ndarray:
+    """Длины отрезков цепочки точек (n - 1 значений)."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0, dtype=np.float64)
+    return haversine_array_m(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_lengths_m(lats, lons) -> np.ndarray:
+    """Расстояние от начала цепочки до каждой точки (n значений, первое 0)."""
+    segments = chain_segment_lengths_m(lats, lons)
+    return np.concatenate(([0.0], np.cumsum(segments))) if segments.size else np.zeros(len(lats), dtype=np.float64)
+
+
+def chain_length_m(points: Iterable[Coordinate]) -> float:
+    """Длина ломаной по точкам в порядке обхода; точки без координат пропускаются."""
+    located = [(lat, lon) for lat, lon in points if lat is not None and lon is not None]
+    if len(located) < 2:
+        return 0.0
+    lats = as_coordinate_array(lat for lat, _lon in located)
+    lons = as_coordinate_array(lon for _lat, lon in located)
+    return float(chain_segment_lengths_m(lats, lons).sum())
+
+
+def nearest_index(lat: float, lon: float, lats, lons, exclude=None) -> Optional[int]:
+    """
+    Индекс ближайшей к (lat, lon) точки массива; exclude — булева маска пропускаемых точек.
+    None — подходящих точек (с координатами, не исключённых) нет.
+    """
+    distances = haversine_array_m(lat, lon, lats, lons)
+    if exclude is not None:
+        distances = np.where(exclude, np.nan, distances)
+    if distances.size == 0 or np.isnan(distances).all():
+        return None
+    return int(np.nanargmin(distances))
+
+
+def nearest_neighbour_order(lats, lons, start: int = 0) -> List[int]:
+    """
+    Порядок обхода «каждый раз к ближайшей непосещённой точке» от start (индексы массива).
+    Точки без координат в обход не попадают.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    visited = np.isnan(lats) | np.isnan(lons)
+    visited[start] = True
+    order = [start]
+    current = start
+    while not visited.all():
+        nxt = nearest_index(lats[current], lons[current], lats, lons, exclude=visited)
+        if nxt is None:
+            break
+        order.append(nxt)
+        visited[nxt] = True
+        current = nxt
+    return order
@@ -0,0 +1,143 @@
+"""
+Готовые к отдаче JSON-ответы: байты (orjson, если установлен, иначе json), сжатые варианты
+gzip / brotli и ETag по содержимому.
+
+Кэш слоёв карты (map_geojson_cache.py) считает всё это один раз при пересчёте слоя и хранит
+в бинарном Redis; запрос отдаёт подходящий вариант как есть, без повторной сериализации,
+а на If-None-Match с тем же ETag отвечает 304.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Mapping, Optional, Sequence
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # type: ignore[assignment]
+
+JSON_MEDIA_TYPE = "application/json"
+IDENTITY = "identity"
+# Порядок предпочтения при равном q в Accept-Encoding
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# Короткие ответы не сжимаем: выигрыш меньше накладных расходов
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps_json_bytes(value: Any) -> bytes:
+    """Сериализация в UTF-8 JSON; нестандартные типы (Decimal, date…) — через str, как json.dumps(default=str)."""
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json_bytes(body: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def content_etag(body: bytes) -> str:
+    """Слабый ETag по содержимому: одинаков для всех вариантов сжатия одного ответа."""
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _compress(body: bytes, encoding: str) -> Optional[bytes]:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return None
+
+
+@dataclass(frozen=True)
+class JSONPayload:
+    """Сериализованный ответ: ETag и тела по Content-Encoding («identity», «gzip», «br»)."""
+
+    etag: str
+    bodies: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def identity(self) -> bytes:
+        return self.bodies[IDENTITY]
+
+    def to_redis_mapping(self) -> Dict[str, bytes]:
+        return {"etag": self.etag.encode("ascii"), **self.bodies}
+
+    @classmethod
+    def from_redis_mapping(cls, raw: Optional[Mapping[Any, bytes]]) -> Optional["JSONPayload"]:
+        """Обратное к to_redis_mapping; неполная запись (нет etag или тела) — None."""
+        if not raw:
+            return None
+        items = {(k.decode("ascii") if isinstance(k, bytes) else str(k)): v for k, v in raw.items()}
+        etag = items.pop("etag", None)
+        if etag is None or IDENTITY not in items:
+            return None
+        if isinstance(etag, bytes):
+            etag = etag.decode("ascii")
+        return cls(etag=etag, bodies=items)
+
+
+def build_json_payload(body: bytes, encodings: Iterable[str] = SUPPORTED_ENCODINGS) -> JSONPayload:
+    """Собрать ответ из готовых байт JSON; encodings — какие сжатые варианты посчитать."""
+    bodies: Dict[str, bytes] = {IDENTITY: body}
+    if len(body) >= MIN_COMPRESS_BYTES:
+        for encoding in encodings:
+            compressed = _compress(body, encoding)
+            if compressed is not None and len(compressed) < len(body):
+                bodies[encoding] = compressed
+    return JSONPayload(etag=content_etag(body), bodies=bodies)
+
+
+def choose_content_encoding(
+    accept_encoding: Optional[str],
+    available: Sequence[str] = SUPPORTED_ENCODINGS,
+) -> str:
+    """Лучший из available по заголовку Accept-Encoding (q-значения, «*»); иначе identity."""
+    if not accept_encoding:
+        return IDENTITY
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    best, best_q = IDENTITY, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадает ли If-None-Match с ETag (слабое сравнение, как требует RFC 9110 для 304)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def _opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    target = _opaque(etag)
+    return any(_opaque(candidate) == target for candidate in if_none_match.split(","))
@@ -16,9 +16,8 @@
 - Секции: 1-3(AC-50), 3-5(AC-70)
 """
 
-import math
 import re
-from typing import Optional, List, Tuple
+from typing import Dict, Iterable, Optional, List, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, update, or_, delete
 from sqlalchemy.orm import selectinload
@@ -29,6 +28,7 @@ from app.models.acline_segment import AClineSegment
 from app.models.substation import Substation
 from app.models.location import Location
 from app.models.base import generate_mrid
+from app.core.geodesy import as_coordinate_array, haversine_m, nearest_index
 
 
 async def get_or_create_connectivity_node_for_pole(
@@ -112,25 +112,86 @@ async def _connectivity_node_display_name(
         if sub:
             return (sub.name or sub.dispatcher_name or "ПС")[:50]
     if node.pole:
-        # Если на опоре есть секционирующее оборудование, граница участка — по имени
-        # оборудования из БД (например «РЛНД-10»), иначе родовое имя типа.
         sw_parts = await _main_switching_display_parts_on_pole(db, node.pole.id)
-        if sw_parts:
-            return " → ".join(sw_parts)
-
-        raw = (node.pole.pole_number or "").strip() or f"{node.pole.id}"
-        # Единообразие с API: «3», «3/2», «3/2 а» -> «Опора 3», …
-        if re.match(r"^\d+$", raw):
-            return f"Опора {raw}"
-        if re.match(r"^\d+/\s*\d+", raw) or re.match(r"^\d+\s*/\s*\d+", raw):
-            return f"Опора {raw}"
-        # Текстовые подписи («старт», «вход») — без «Опора»: иначе в UI получается «оп. старт» у подписи ПС/границы
-        if raw and not raw.lower().startswith(("опора", "оп.")):
-            return raw
-        return raw or f"Опора {node.pole.id}"
+        return _pole_display_name(node.pole.id, node.pole.pole_number, sw_parts)
     return f"Узел {connectivity_node_id}"
 
 
+def _pole_display_name(pole_id: int, pole_number: Optional[str], switching_parts: List[str]) -> str:
+    """Подпись узла опоры: секционирующее оборудование на ней или «Опора N»."""
+    # Если на опоре есть секционирующее оборудование, граница участка — по имени
+    # оборудования из БД (например «РЛНД-10»), иначе родовое имя типа.
+    if switching_parts:
+        return " → ".join(switching_parts)
+
+    raw = (pole_number or "").strip() or f"{pole_id}"
+    # Единообразие с API: «3», «3/2», «3/2 а» -> «Опора 3», …
+    if re.match(r"^\d+$", raw):
+        return f"Опора {raw}"
+    if re.match(r"^\d+/\s*\d+", raw) or re.match(r"^\d+\s*/\s*\d+", raw):
+        return f"Опора {raw}"
+    # Текстовые подписи («старт», «вход») — без «Опора»: иначе в UI получается «оп. старт» у подписи ПС/границы
+    if raw and not raw.lower().startswith(("опора", "оп.")):
+        return raw
+    return raw or f"Опора {pole_id}"
+
+
+async def _main_switching_display_parts_by_pole(
+    db: AsyncSession,
+    pole_ids: Iterable[int],
+) -> Dict[int, List[str]]:
+    """_main_switching_display_parts_on_pole для набора опор одним запросом (опоры без оборудования — нет ключа)."""
+    ids = sorted({int(pid) for pid in pole_ids if pid is not None})
+    if not ids:
+        return {}
+    result = await db.execute(
+        select(Equipment.pole_id, Equipment.equipment_type, Equipment.name)
+        .where(Equipment.pole_id.in_(ids))
+        .order_by(Equipment.id.asc())
+    )
+    by_pole: Dict[int, List[Tuple[Optional[str], Optional[str]]]] = {}
+    for pole_id, equipment_type, name in result.all():
+        by_pole.setdefault(int(pole_id), []).append((equipment_type, name))
+    parts = {pid: _switching_display_parts(rows) for pid, rows in by_pole.items()}
+    return {pid: p for pid, p in parts.items() if p}
+
+
+async def _connectivity_node_display_names(
+    db: AsyncSession,
+    connectivity_node_ids: Iterable[int],
+) -> Dict[int, str]:
+    """_connectivity_node_display_name для набора узлов: по запросу на узлы, опоры, ПС и оборудование."""
+    ids = sorted({int(cid) for cid in connectivity_node_ids if cid is not None})
+    if not ids:
+        return {}
+    nodes = (
+        await db.execute(
+            select(ConnectivityNode.id, ConnectivityNode.pole_id, ConnectivityNode.substation_id)
+            .where(ConnectivityNode.id.in_(ids))
+        )
+    ).all()
+    substation_ids = {n.substation_id for n in nodes if n.substation_id}
+    substation_names: Dict[int, str] = {}
+    if substation_ids:
+        rows = await db.execute(
+            select(Substation.id, Substation.name, Substation.dispatcher_name).where(Substation.id.in_(substation_ids))
+        )
+        substation_names = {sid: (name or dispatcher or "ПС")[:50] for sid, name, dispatcher in rows.all()}
+    pole_ids = {n.pole_id for n in nodes if n.pole_id}
+    pole_numbers: Dict[int, Optional[str]] = {}
+    if pole_ids:
+        rows = await db.execute(select(Pole.id, Pole.pole_number).where(Pole.id.in_(pole_ids)))
+        pole_numbers = {pid: number for pid, number in rows.all()}
+    switching = await _main_switching_display_parts_by_pole(db, pole_numbers)
+    names: Dict[int, str] = {cid: f"Узел {cid}" for cid in ids}
+    for node in nodes:
+        if node.substation_id and node.substation_id in substation_names:
+            names[node.id] = substation_names[node.substation_id]
+        elif node.pole_id in pole_numbers:
+            names[node.id] = _pole_display_name(node.pole_id, pole_numbers[node.pole_id], switching.get(node.pole_id, []))
+    return names
+
+
 def _short_label_for_span(display_name: str) -> str:
     """Подпись конца пролёта: «Опора 1» / «1» -> «оп.1», «Опора 3/2» -> «оп.3/2», подстанция — без изменения."""
     s = (display_name or "").strip()
@@ -147,28 +208,6 @@ def _short_label_for_span(display_name: str) -> str:
     return s
 
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """
-    Вычисление расстояния между двумя GPS координатами по формуле гаверсинуса (Haversine)
-    Возвращает расстояние в метрах
-    """
-    # Радиус Земли в метрах
-    R = 6371000
-    
-    # Преобразование в радианы
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    # Формула гаверсинуса
-    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    
-    distance = R * c
-    return distance
-
-
 async def find_previous_pole(
     db: AsyncSession,
     power_line_id: int,
@@ -239,7 +278,6 @@ async def find_previous_pole(
     # Находим ближайшую опору (для обратной совместимости)
     # В будущем это можно убрать, когда все опоры будут иметь sequence_number
     nearest_pole = None
-    min_distance = float('inf')
     
     # Получаем координаты текущей опоры для поиска ближайшей
     if exclude_pole_id:
@@ -247,15 +285,14 @@ async def find_previous_pole(
             select(Pole).where(Pole.id == exclude_pole_id)
         )
         current_pole = current_pole_result.scalar_one_or_none()
-        if current_pole:
-            for pole in poles:
-                distance = calculate_distance(
-                    current_pole.get_latitude(), current_pole.get_longitude(),
-                    pole.get_latitude(), pole.get_longitude(),
-                )
-                if distance < min_distance:
-                    min_distance = distance
-                    nearest_pole = pole
+        if current_pole and current_pole.get_latitude() is not None and current_pole.get_longitude() is not None:
+            index = nearest_index(
+                current_pole.get_latitude(), current_pole.get_longitude(),
+                as_coordinate_array(p.get_latitude() for p in poles),
+                as_coordinate_array(p.get_longitude() for p in poles),
+            )
+            if index is not None:
+                nearest_pole = poles[index]
     
     return nearest_pole
 
@@ -402,18 +439,22 @@ async def _main_switching_display_parts_on_pole(
     if pole_id is None:
         return []
     result = await db.execute(
-        select(Equipment).where(Equipment.pole_id == pole_id).order_by(Equipment.id.asc())
+        select(Equipment.equipment_type, Equipment.name).where(Equipment.pole_id == pole_id).order_by(Equipment.id.asc())
     )
-    eq_list = result.scalars().all()
+    return _switching_display_parts(result.all())
+
+
+def _switching_display_parts(equipment: Iterable[Tuple[Optional[str], Optional[str]]]) -> List[str]:
+    """Подписи по (equipment_type, name) оборудования опоры в порядке id."""
     parts: List[str] = []
     last_kind: Optional[str] = None
-    for eq in eq_list:
-        kind = _normalize_main_switching_equipment_type(getattr(eq, "equipment_type", None))
+    for equipment_type, name in equipment:
+        kind = _normalize_main_switching_equipment_type(equipment_type)
         if kind is None:
             continue
         if last_kind == kind:
             continue
-        raw_name = (getattr(eq, "name", None) or "").strip()
+        raw_name = (name or "").strip()
         parts.append((raw_name if raw_name else _generic_label_for_switching_kind(kind))[:100])
         last_kind = kind
     return parts
@@ -825,7 +866,7 @@ async def auto_create_span(
         conductor_section = getattr(previous_pole, 'conductor_section', None)
     
     # Вычисляем расстояние между опорами (в метрах)
-    distance = calculate_distance(
+    distance = haversine_m(
         previous_pole.get_latitude(), previous_pole.get_longitude(),
         new_pole.get_latitude(), new_pole.get_longitude(),
     )
@@ -1051,7 +1092,7 @@ async def link_line_to_substation(
     line_section.name = f"{from_name} - {to_name} ({conductor_type})"
     await db.flush()
 
-    distance = calculate_distance(
+    distance = haversine_m(
         float(sub_lat), float(sub_lon),
         first_pole.get_latitude() or 0, first_pole.get_longitude() or 0,
     )
@@ -1196,7 +1237,7 @@ async def add_substation_span_from_last_pole(
     line_section.name = f"{from_name} - {to_name} ({conductor_type})"
     await db.flush()
 
-    distance = calculate_distance(
+    distance = haversine_m(
         last_pole.get_latitude() or 0, last_pole.get_longitude() or 0,
         float(sub_lat), float(sub_lon),
     )
@@ -1346,13 +1387,27 @@ async def refresh_acline_and_line_section_names(db: AsyncSession, power_line_id:
         .order_by(AClineSegment.sequence_number.asc())
     )
     segments = result.scalars().all()
+    # Все подписи узлов — одним набором запросов, а не по запросу на конец каждого участка / секции
+    node_ids = set()
+    for seg in segments:
+        node_ids.add(seg.from_connectivity_node_id)
+        node_ids.add(seg.to_connectivity_node_id or _effective_to_connectivity_node_id_from_spans(seg))
+        for ls in seg.line_sections or []:
+            for sp in ls.spans or []:
+                node_ids.add(sp.from_connectivity_node_id)
+                node_ids.add(sp.to_connectivity_node_id)
+    names = await _connectivity_node_display_names(db, node_ids)
+
+    def _name(cn_id: Optional[int]) -> str:
+        return names.get(int(cn_id), f"Узел {cn_id}") if cn_id is not None else f"Узел {cn_id}"
+
     for seg in segments:
         if not seg.from_connectivity_node_id:
             continue
-        fn = await _connectivity_node_display_name(db, seg.from_connectivity_node_id)
+        fn = _name(seg.from_connectivity_node_id)
         to_cn_id = seg.to_connectivity_node_id or _effective_to_connectivity_node_id_from_spans(seg)
         if to_cn_id:
-            tn = await _connectivity_node_display_name(db, to_cn_id)
+            tn = _name(to_cn_id)
             seg.name = f"{fn} - {tn}"
         else:
             seg.name = f"{fn} - ..."
@@ -1364,16 +1419,11 @@ async def refresh_acline_and_line_section_names(db: AsyncSession, power_line_id:
             ct = (ls.conductor_type or "—").strip() or "—"
             spans = sorted(ls.spans or [], key=lambda s: (s.sequence_number or 0))
             if spans:
-                fna = await _connectivity_node_display_name(
-                    db, spans[0].from_connectivity_node_id
-                )
-                tna = await _connectivity_node_display_name(
-                    db, spans[-1].to_connectivity_node_id
-                )
+                fna = _name(spans[0].from_connectivity_node_id)
+                tna = _name(spans[-1].to_connectivity_node_id)
                 ls.name = f"{fna} - {tna} ({ct})"
             elif to_cn_id:
-                tn_ls = await _connectivity_node_display_name(db, to_cn_id)
-                ls.name = f"{fn} - {tn_ls} ({ct})"
+                ls.name = f"{fn} - {_name(to_cn_id)} ({ct})"
             else:
                 ls.name = f"{fn} - ... ({ct})"
     await db.flush()
@@ -1461,7 +1511,7 @@ async def extend_tap_segment_to_substation(
     from_name_span = await _connectivity_node_display_name(db, last_cn.id)
     to_name = await _connectivity_node_display_name(db, substation_cn.id)
 
-    distance = calculate_distance(
+    distance = haversine_m(
         last_pole.get_latitude() or 0, last_pole.get_longitude() or 0,
         float(sub_lat), float(sub_lon),
     )
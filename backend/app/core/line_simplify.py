@@ -0,0 +1,128 @@
+"""
+Упрощение геометрии ЛЭП для обзорных масштабов карты (Douglas–Peucker).
+
+Для каждой вершины линии один проход считает «ранг» — наибольший допуск, при котором
+Douglas–Peucker её ещё оставляет (ранг потомка не больше ранга родителя). Упрощение под любой
+zoom после этого — фильтр вершин по рангу, поэтому все уровни считаются за один проход
+и кэшируются вместе с фрагментом линии (map_geojson_cache).
+
+Расстояния — в единицах мира Web Mercator (0..1 на весь мир), допуск уровня — доля пикселя
+тайла 256 px на этом zoom: на экране упрощённая линия отличается от исходной меньше чем на пиксель.
+"""
+from __future__ import annotations
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Уровни упрощения; запрос с zoom получает ближайший уровень не грубее своего (zoom ≤ уровня)
+SIMPLIFY_ZOOM_LEVELS: Tuple[int, ...] = (5, 7, 9, 11, 13)
+# Допуск в пикселях тайла 256 px
+SIMPLIFY_TOLERANCE_PX = 0.75
+_TILE_SIZE = 256
+_MAX_MERCATOR_LAT = 85.0511287798066
+
+Point = Tuple[float, float]
+
+
+def simplification_level(zoom: Optional[int]) -> Optional[int]:
+    """Уровень упрощения для zoom карты; None — полная геометрия (zoom не задан или крупный масштаб)."""
+    if zoom is None:
+        return None
+    for level in SIMPLIFY_ZOOM_LEVELS:
+        if zoom <= level:
+            return level
+    return None
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """Допуск упрощения на zoom в единицах мира Web Mercator."""
+    return SIMPLIFY_TOLERANCE_PX / (_TILE_SIZE * (1 << zoom))
+
+
+def _mercator(lon: float, lat: float) -> Point:
+    lat = max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT)
+    s = math.sin(math.radians(lat))
+    return (lon + 180.0) / 360.0, 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+
+
+def _segment_distance(p: Point, a: Point, b: Point) -> float:
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0.0 and dy == 0.0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return math.hypot(p[0] - (a[0] + t * dx), p[1] - (a[1] + t * dy))
+
+
+def douglas_peucker_ranks(points: Sequence[Point]) -> List[float]:
+    """
+    Ранги вершин: вершина i остаётся при допуске tol тогда и только тогда, когда ranks[i] > tol
+    (результат совпадает с Douglas–Peucker с этим допуском). Концы линии — бесконечность.
+    """
+    n = len(points)
+    ranks = [0.0] * n
+    if n == 0:
+        return ranks
+    ranks[0] = ranks[-1] = math.inf
+    # Итеративно (без рекурсии): длинные магистрали — тысячи опор
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        first, last, parent_rank = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = points[first], points[last]
+        best_i, best_d = first + 1, -1.0
+        for i in range(first + 1, last):
+            d = _segment_distance(points[i], a, b)
+            if d > best_d:
+                best_i, best_d = i, d
+        rank = min(best_d, parent_rank)
+        ranks[best_i] = rank
+        stack.append((first, best_i, rank))
+        stack.append((best_i, last, rank))
+    return ranks
+
+
+def simplify_coords(coords: Sequence[Sequence[float]], zoom: int) -> List[List[float]]:
+    """Упростить координаты [lon, lat] линии под zoom."""
+    if len(coords) <= 2:
+        return [list(c) for c in coords]
+    ranks = douglas_peucker_ranks([_mercator(float(c[0]), float(c[1])) for c in coords])
+    tol = zoom_tolerance(zoom)
+    return [list(c) for c, r in zip(coords, ranks) if r > tol]
+
+
+def _with_coords(feature: Dict[str, Any], coords: List[List[float]]) -> Dict[str, Any]:
+    return {**feature, "geometry": {**feature["geometry"], "coordinates": coords}}
+
+
+def _is_linestring(feature: Dict[str, Any]) -> bool:
+    geometry = feature.get("geometry") or {}
+    return geometry.get("type") == "LineString" and len(geometry.get("coordinates") or []) > 2
+
+
+def simplify_features(features: Sequence[Dict[str, Any]], zoom: int) -> List[Dict[str, Any]]:
+    """Фичи с упрощёнными LineString (остальные — как есть)."""
+    return [
+        _with_coords(f, simplify_coords(f["geometry"]["coordinates"], zoom)) if _is_linestring(f) else f
+        for f in features
+    ]
+
+
+def simplify_features_by_level(
+    features: Sequence[Dict[str, Any]],
+    levels: Sequence[int] = SIMPLIFY_ZOOM_LEVELS,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """Все уровни упрощения сразу: ранги вершин каждой линии считаются один раз."""
+    out: Dict[int, List[Dict[str, Any]]] = {level: [] for level in levels}
+    for f in features:
+        if not _is_linestring(f):
+            for level in levels:
+                out[level].append(f)
+            continue
+        coords = f["geometry"]["coordinates"]
+        ranks = douglas_peucker_ranks([_mercator(float(c[0]), float(c[1])) for c in coords])
+        for level in levels:
+            tol = zoom_tolerance(level)
+            out[level].append(_with_coords(f, [list(c) for c, r in zip(coords, ranks) if r > tol]))
+    return out
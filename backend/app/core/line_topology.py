@@ -0,0 +1,1029 @@
+"""
+Автосборка топологии линии в памяти (POST .../spans/auto-create).
+
+Пошаговая сборка (auto_create_span) на каждую пару опор делает десятки запросов: предыдущая опора,
+узлы, подписи узлов, оборудование опоры, счётчики участков / секций / пролётов, суммы длин.
+На линии в сотни опор пересборка занимала минуты. Здесь то же самое в три шага:
+
+- load_line_topology — опоры, узлы (ConnectivityNode), оборудование, участки (ACLineSegment),
+  секции (LineSection) и пролёты линии несколькими запросами;
+- LineTopology.plan_span_pairs — целевая топология считается в Python по тем же правилам, что
+  auto_create_span / find_or_create_acline_segment / find_or_create_line_section (порядок пар,
+  номера, имена и длины совпадают);
+- apply_line_topology — разница с БД (новые узлы, участки, секции и пролёты, изменённые участки
+  и секции, удаляемые пролёты) одной пачкой на уровень: удаления и узлы, участки, секции, пролёты.
+
+Правка отдельных опор (добавление в середину, перемещение, смена номера) не требует пересборки:
+update_line_topology_for_poles (mode=incremental) меняет только соседние пролёты, их секции,
+участки и терминалы.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.core.cim_connectivity import sync_equipment_terminals_for_line
+from app.core.line_auto_assembly import (
+    _pole_display_name,
+    _short_label_for_span,
+    _switching_display_parts,
+)
+from app.core.geodesy import as_coordinate_array, haversine_m, nearest_index, pair_lengths_m
+from app.core.wire_parameters import ensure_acline_segment_terminals
+from app.models.acline_segment import AClineSegment
+from app.models.base import generate_mrid
+from app.models.cim_line_structure import ConnectivityNode, LineSection
+from app.models.location import Location
+from app.models.power_line import Equipment, Pole, PowerLine, Span
+from app.models.substation import Substation
+
+DEFAULT_CONDUCTOR_TYPE = "AC-70"
+DEFAULT_CONDUCTOR_SECTION = "70"
+DEFAULT_CONDUCTOR_MATERIAL = "алюминий"
+
+# Поля опоры, правка которых меняет соседние пролёты (длину, цепочку или секцию провода)
+TOPOLOGY_POLE_FIELDS = frozenset({
+    "x_position",
+    "y_position",
+    "sequence_number",
+    "tap_pole_id",
+    "tap_branch_index",
+    "conductor_type",
+    "conductor_material",
+    "conductor_section",
+})
+
+
+@dataclass
+class TopoPole:
+    id: int
+    pole_number: Optional[str]
+    line_id: int
+    sequence_number: Optional[int] = None
+    tap_pole_id: Optional[int] = None
+    tap_branch_index: Optional[int] = None
+    branch_type: Optional[str] = None
+    is_tap_pole: bool = False
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    conductor_type: Optional[str] = None
+    conductor_material: Optional[str] = None
+    conductor_section: Optional[str] = None
+    # Подписи секционирующего оборудования (разъединитель / выключатель / реклозер), см. _switching_display_parts
+    switching: List[str] = field(default_factory=list)
+
+
+@dataclass(eq=False)
+class TopoNode:
+    id: Optional[int]  # None — узел ещё не записан в БД
+    line_id: int
+    pole_id: Optional[int] = None
+    substation_id: Optional[int] = None
+    is_virtual: bool = False
+    display_name: str = ""
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    pole_number: Optional[str] = None
+    entity: Any = None
+
+
+@dataclass(eq=False)
+class TopoSpan:
+    id: Optional[int]
+    line_id: Optional[int]
+    from_pole_id: Optional[int]
+    to_pole_id: Optional[int]
+    length: Optional[float] = None
+    section: Optional["TopoSection"] = None
+    from_node: Optional[TopoNode] = None
+    to_node: Optional[TopoNode] = None
+    span_number: str = ""
+    sequence_number: Optional[int] = None
+    conductor_type: Optional[str] = None
+    conductor_material: Optional[str] = None
+    deleted: bool = False
+    dirty: bool = False  # у записанного пролёта изменились длина, номер в секции или секция
+    entity: Any = None
+
+
+@dataclass(eq=False)
+class TopoSection:
+    id: Optional[int]
+    segment: "TopoSegment"
+    conductor_type: Optional[str]
+    conductor_material: Optional[str]
+    conductor_section: Optional[str] = None
+    sequence_number: Optional[int] = None
+    name: str = ""
+    total_length: Optional[float] = None
+    spans: List[TopoSpan] = field(default_factory=list)
+    order: int = 0
+    dirty: bool = False
+    entity: Any = None
+
+
+@dataclass(eq=False)
+class TopoSegment:
+    id: Optional[int]
+    from_node: Optional[TopoNode]
+    to_node: Optional[TopoNode]
+    is_tap: bool = False
+    tap_number: Optional[str] = None
+    tap_pole_id: Optional[int] = None
+    branch_type: Optional[str] = None
+    sequence_number: Optional[int] = None
+    name: str = ""
+    length: Optional[float] = None
+    sections: List[TopoSection] = field(default_factory=list)
+    order: int = 0
+    dirty: bool = False
+    entity: Any = None
+
+
+def _rank(item: Any) -> Tuple[int, int]:
+    """ORDER BY sequence_number DESC LIMIT 1 — при равных номерах берётся более поздняя запись."""
+    return (item.sequence_number or 0, item.order)
+
+
+def _latest(items: Iterable[Any]) -> Any:
+    return max(items, key=_rank, default=None)
+
+
+def line_span_pairs(poles: Iterable[Any]) -> Tuple[List[Any], List[Tuple[Any, Any]]]:
+    """
+    Опоры магистрали (по sequence_number) и пары соседних опор (от, до): магистраль и каждая
+    ветка отпайки (tap_pole_id, tap_branch_index) от своей отпаечной опоры. Опоры без
+    sequence_number не участвуют. Подходят и ORM Pole, и TopoPole.
+    """
+    poles = [p for p in poles if p.sequence_number is not None]
+    main_poles = sorted((p for p in poles if p.tap_pole_id is None), key=lambda p: p.sequence_number or 0)
+    pairs: List[Tuple[Any, Any]] = list(zip(main_poles, main_poles[1:]))
+    # Каждая ветка от отпаечной опоры (3/1, 3/2, …) — своя цепочка
+    branches: Dict[Tuple[int, int], List[Any]] = {}
+    for p in poles:
+        if p.tap_pole_id is None:
+            continue
+        branches.setdefault((int(p.tap_pole_id), int(p.tap_branch_index or 1)), []).append(p)
+    poles_by_id = {p.id: p for p in poles}
+    for (tap_pole_id, _branch), branch_poles in branches.items():
+        tap_pole = poles_by_id.get(tap_pole_id)
+        if tap_pole is None:
+            continue
+        chain = [tap_pole] + sorted(branch_poles, key=lambda p: p.sequence_number or 0)
+        pairs.extend(zip(chain, chain[1:]))
+    return main_poles, pairs
+
+
+class LineTopology:
+    """Опоры, узлы, участки, секции и пролёты одной линии; plan_* меняют только эту модель."""
+
+    def __init__(
+        self,
+        line_id: int,
+        line_name: Optional[str],
+        voltage_level: Optional[float],
+        user_id: int,
+        poles: Iterable[TopoPole] = (),
+        nodes: Iterable[TopoNode] = (),
+        segments: Iterable[TopoSegment] = (),
+        spans: Iterable[TopoSpan] = (),
+    ):
+        self.line_id = line_id
+        self.line_name = line_name
+        self.voltage_level = voltage_level
+        self.user_id = user_id
+        self.poles: Dict[int, TopoPole] = {p.id: p for p in poles}
+        self._line_poles = sorted((p for p in self.poles.values() if p.line_id == line_id), key=lambda p: p.id)
+        self.nodes: List[TopoNode] = list(nodes)
+        self.segments: List[TopoSegment] = list(segments)
+        # Пролёты вне секций участков линии: только для поиска пролётов пары опор
+        self.spans: List[TopoSpan] = list(spans)
+        self._order = 0
+        for seg in self.segments:
+            seg.order = self._next_order()
+            for ls in seg.sections:
+                ls.order = self._next_order()
+        self.created_spans: List[TopoSpan] = []
+        self.deleted_spans: List[TopoSpan] = []
+
+    def _next_order(self) -> int:
+        self._order += 1
+        return self._order
+
+    # --- опоры и узлы ---
+
+    def previous_pole(self, pole: TopoPole) -> Optional[TopoPole]:
+        """find_previous_pole для auto_create_span (опоры магистрали — без признаков отпайки)."""
+        tap_pole_id = pole.tap_pole_id
+        tap_branch_index = pole.tap_branch_index
+        pn = (pole.pole_number or "").strip()
+        if pn and "/" not in pn:
+            tap_pole_id = None
+            tap_branch_index = None
+        seq = pole.sequence_number
+        line_poles = self._line_poles
+        if tap_pole_id is not None:
+            if seq == 1:
+                tap_pole = self.poles.get(tap_pole_id)
+                return tap_pole if tap_pole is not None and tap_pole.line_id == self.line_id else None
+            if seq is not None and seq > 1:
+                for p in line_poles:
+                    if p.tap_pole_id == tap_pole_id and p.sequence_number == seq - 1 and (
+                        tap_branch_index is None or p.tap_branch_index == tap_branch_index
+                    ):
+                        return p
+            return None
+        if seq is not None:
+            candidates = [
+                p for p in line_poles
+                if p.id != pole.id and p.tap_pole_id is None
+                and p.sequence_number is not None and p.sequence_number < seq
+            ]
+            if candidates:
+                # Первая с максимальным номером (max возвращает первый из равных)
+                return max(candidates, key=lambda p: p.sequence_number)
+        # Нет номера в последовательности: ближайшая опора линии (обратная совместимость)
+        if pole.lat is None or pole.lon is None:
+            return None
+        index = nearest_index(
+            pole.lat, pole.lon,
+            as_coordinate_array(p.lat for p in line_poles),
+            as_coordinate_array(p.lon for p in line_poles),
+            exclude=[p.id == pole.id for p in line_poles],
+        )
+        return line_poles[index] if index is not None else None
+
+    def node_for_pole(self, pole: TopoPole) -> TopoNode:
+        """Узел опоры на этой линии (первый по id); нет — новый виртуальный (get_or_create_connectivity_node_for_pole)."""
+        existing = [n for n in self.nodes if n.pole_id == pole.id and n.line_id == self.line_id]
+        if existing:
+            return min(existing, key=lambda n: (n.id is None, n.id or 0))
+        node = TopoNode(
+            id=None,
+            line_id=self.line_id,
+            pole_id=pole.id,
+            is_virtual=True,
+            display_name=_pole_display_name(pole.id, pole.pole_number, pole.switching),
+            lat=pole.lat,
+            lon=pole.lon,
+            pole_number=pole.pole_number,
+        )
+        self.nodes.append(node)
+        return node
+
+    def _pole_of_node(self, node: Optional[TopoNode]) -> Optional[TopoPole]:
+        if node is None or node.pole_id is None:
+            return None
+        pole = self.poles.get(node.pole_id)
+        return pole if pole is not None and pole.line_id == self.line_id else None
+
+    @staticmethod
+    def _display(node: Optional[TopoNode]) -> str:
+        if node is None:
+            return "Узел None"
+        return node.display_name or f"Узел {node.id}"
+
+    # --- участки и секции ---
+
+    def _new_segment(self, from_node: TopoNode, to_node: Optional[TopoNode], **values: Any) -> TopoSegment:
+        seg = TopoSegment(
+            id=None,
+            from_node=from_node,
+            to_node=to_node,
+            sequence_number=len(self.segments) + 1,
+            length=0.0,
+            order=self._next_order(),
+            dirty=True,
+            **values,
+        )
+        self.segments.append(seg)
+        return seg
+
+    def _rename_segment(self, seg: TopoSegment) -> None:
+        seg.name = f"{self._display(seg.from_node)} - {self._display(seg.to_node)}"
+        seg.dirty = True
+
+    def find_or_create_segment(
+        self,
+        from_node: TopoNode,
+        tap_to_node: Optional[TopoNode] = None,
+        branch_type: Optional[str] = None,
+        tap_pole_id: Optional[int] = None,
+        tap_branch_index: Optional[int] = None,
+    ) -> TopoSegment:
+        """find_or_create_acline_segment: tap_to_node — первая опора отпайки (to_connectivity_node_id_if_tap)."""
+        if tap_to_node is not None:
+            open_tap = _latest(
+                s for s in self.segments
+                if s.from_node is from_node and s.to_node is None and s.is_tap
+            )
+            if open_tap is not None:
+                open_tap.to_node = tap_to_node
+                self._rename_segment(open_tap)
+                return open_tap
+            tap_number = None
+            tap_pole = self.poles.get(tap_pole_id) if tap_pole_id is not None else None
+            if tap_pole is not None:
+                existing_taps = sum(1 for s in self.segments if s.tap_pole_id == tap_pole_id)
+                base = (tap_pole.pole_number or str(tap_pole.sequence_number or 0)).strip()
+                tap_number = f"{base}/{existing_taps + 1}"
+            seg = self._new_segment(
+                from_node,
+                tap_to_node,
+                is_tap=True,
+                tap_number=tap_number,
+                branch_type=branch_type or "tap",
+                tap_pole_id=tap_pole_id,
+            )
+            self._rename_segment(seg)
+            return seg
+
+        # Продолжение отпайки от узла самой отпаечной опоры — её участок ветки
+        if tap_pole_id is not None and from_node.pole_id is not None and from_node.pole_id == tap_pole_id:
+            right = str(tap_branch_index).strip() if tap_branch_index is not None else ""
+            existing_tap = _latest(
+                s for s in self.segments
+                if s.is_tap and s.tap_pole_id == tap_pole_id
+                and (not right or (s.tap_number or "").endswith(f"/{right}"))
+            )
+            if existing_tap is not None:
+                return existing_tap
+
+        pole = self._pole_of_node(from_node)
+        is_branching = pole is not None and (pole.is_tap_pole or bool(pole.switching))
+        sequences = [p.sequence_number for p in self._line_poles if p.sequence_number is not None]
+        min_sequence = min(sequences) if sequences else None
+        is_substation_start = pole is not None and pole.sequence_number == min_sequence and not self.segments
+
+        if not (is_substation_start or is_branching):
+            ending_here = _latest(s for s in self.segments if s.to_node is from_node)
+            if ending_here is not None:
+                return ending_here
+            open_main = _latest(s for s in self.segments if s.to_node is None and not s.is_tap)
+            if open_main is not None:
+                return open_main
+        seg = self._new_segment(from_node, None, is_tap=False, branch_type=branch_type, tap_pole_id=tap_pole_id)
+        seg.name = f"Сегмент {seg.sequence_number} линии {self.line_name}"
+        return seg
+
+    def find_or_create_section(
+        self,
+        segment: TopoSegment,
+        conductor_type: Optional[str],
+        conductor_material: Optional[str],
+        conductor_section: Optional[str],
+    ) -> TopoSection:
+        """find_or_create_line_section(check_last_section=True)."""
+        conductor_type = conductor_type or DEFAULT_CONDUCTOR_TYPE
+        conductor_section = conductor_section or DEFAULT_CONDUCTOR_SECTION
+        conductor_material = conductor_material or DEFAULT_CONDUCTOR_MATERIAL
+        last = _latest(segment.sections)
+        if last is not None and last.conductor_type == conductor_type and (last.conductor_material or "") == conductor_material:
+            return last
+        same = _latest(
+            ls for ls in segment.sections
+            if ls.conductor_type == conductor_type and ls.conductor_material == conductor_material
+        )
+        if same is not None:
+            return same
+        section = TopoSection(
+            id=None,
+            segment=segment,
+            conductor_type=conductor_type,
+            conductor_material=conductor_material,
+            conductor_section=conductor_section,
+            sequence_number=len(segment.sections) + 1,
+            name=f"Секция {len(segment.sections) + 1} (провод {conductor_type})",
+            total_length=0.0,
+            order=self._next_order(),
+            dirty=True,
+        )
+        segment.sections.append(section)
+        return section
+
+    # --- пролёты ---
+
+    def pair_spans(self, from_pole_id: int, to_pole_id: int) -> List[TopoSpan]:
+        return [
+            sp for sp in self.all_spans()
+            if not sp.deleted and sp.line_id == self.line_id
+            and sp.from_pole_id == from_pole_id and sp.to_pole_id == to_pole_id
+        ]
+
+    def all_spans(self) -> Iterable[TopoSpan]:
+        yield from self.spans
+        for seg in self.segments:
+            for ls in seg.sections:
+                yield from ls.spans
+
+    def delete_span(self, span: TopoSpan) -> None:
+        span.deleted = True
+        if span.section is not None and span in span.section.spans:
+            span.section.spans.remove(span)
+        if span in self.spans:
+            self.spans.remove(span)
+        if span.id is not None:
+            self.deleted_spans.append(span)
+        elif span in self.created_spans:
+            self.created_spans.remove(span)
+
+    def plan_span(
+        self,
+        new_pole: TopoPole,
+        conductor_type: Optional[str] = None,
+        conductor_material: Optional[str] = None,
+        conductor_section: Optional[str] = None,
+        is_tap: bool = False,
+        lengths: Optional[Dict[Tuple[int, int], float]] = None,
+    ) -> Optional[TopoSpan]:
+        """
+        auto_create_span: пролёт от предыдущей опоры к new_pole со своим участком и секцией.
+        lengths — длины пар (от, до), посчитанные заранее для всей линии (pair_lengths_m).
+        """
+        new_node = self.node_for_pole(new_pole)
+        previous = self.previous_pole(new_pole)
+        if previous is None:
+            return None
+        previous_node = self.node_for_pole(previous)
+        conductor_type = conductor_type or previous.conductor_type
+        conductor_material = conductor_material or previous.conductor_material
+        conductor_section = conductor_section or previous.conductor_section
+        distance = (lengths or {}).get((previous.id, new_pole.id))
+        if distance is None:
+            distance = self._pole_distance(previous, new_pole)
+
+        segment = self.find_or_create_segment(
+            previous_node,
+            tap_to_node=new_node if is_tap else None,
+            branch_type=new_pole.branch_type,
+            tap_pole_id=new_pole.tap_pole_id,
+            tap_branch_index=new_pole.tap_branch_index,
+        )
+        # Конец участка — на новой опоре (см. auto_create_span)
+        if not new_node.is_virtual or segment.is_tap or new_pole.tap_pole_id is None:
+            segment.to_node = new_node
+            self._rename_segment(segment)
+
+        section = self.find_or_create_section(segment, conductor_type, conductor_material, conductor_section)
+        return self._add_span(
+            section, previous, previous_node, new_pole, new_node, distance, conductor_type, conductor_material
+        )
+
+    def _add_span(
+        self,
+        section: TopoSection,
+        from_pole: TopoPole,
+        from_node: TopoNode,
+        to_pole: TopoPole,
+        to_node: TopoNode,
+        length: float,
+        conductor_type: Optional[str],
+        conductor_material: Optional[str],
+    ) -> TopoSpan:
+        span = TopoSpan(
+            id=None,
+            line_id=self.line_id,
+            from_pole_id=from_pole.id,
+            to_pole_id=to_pole.id,
+            length=length,
+            section=section,
+            from_node=from_node,
+            to_node=to_node,
+            span_number=(
+                f"Пролёт {_short_label_for_span(self._display(from_node))}"
+                f"-{_short_label_for_span(self._display(to_node))}"
+            ),
+            sequence_number=len(section.spans) + 1,
+            conductor_type=conductor_type or DEFAULT_CONDUCTOR_TYPE,
+            conductor_material=conductor_material or DEFAULT_CONDUCTOR_MATERIAL,
+        )
+        section.spans.append(span)
+        self.created_spans.append(span)
+        self._recompute_lengths(section)
+        return span
+
+    @staticmethod
+    def _pole_distance(from_pole: TopoPole, to_pole: TopoPole) -> float:
+        if None in (from_pole.lat, from_pole.lon, to_pole.lat, to_pole.lon):
+            return 0.0
+        return haversine_m(from_pole.lat, from_pole.lon, to_pole.lat, to_pole.lon)
+
+    def _pair_lengths(self, pairs: Sequence[Tuple[int, int]]) -> Dict[Tuple[int, int], float]:
+        """Длины пар опор одним расчётом по массивам; пары без координат не попадают."""
+        pairs = list(dict.fromkeys((int(f), int(t)) for f, t in pairs))
+        lengths = pair_lengths_m([
+            ((self.poles[f].lat, self.poles[f].lon), (self.poles[t].lat, self.poles[t].lon)) for f, t in pairs
+        ])
+        return {pair: length for pair, length in zip(pairs, lengths) if length is not None}
+
+    @staticmethod
+    def _recompute_lengths(section: TopoSection) -> None:
+        """Длина секции — сумма пролётов (км), участка — сумма секций."""
+        section.total_length = sum(sp.length or 0.0 for sp in section.spans) / 1000.0
+        section.dirty = True
+        segment = section.segment
+        segment.length = sum(ls.total_length or 0.0 for ls in segment.sections)
+        segment.dirty = True
+
+    def plan_span_pairs(self, pairs: Sequence[Tuple[int, int]]) -> List[TopoSpan]:
+        """
+        Пролёты для пар (from_pole_id, to_pole_id) в порядке пар. Пара, у которой пролёт уже есть,
+        пропускается; одиночный пролёт от опоры с секционирующим оборудованием пересоздаётся.
+        """
+        planned: List[TopoSpan] = []
+        lengths = self._pair_lengths(pairs)
+        for from_pole_id, to_pole_id in pairs:
+            from_pole = self.poles[from_pole_id]
+            to_pole = self.poles[to_pole_id]
+            existing = self.pair_spans(from_pole_id, to_pole_id)
+            if existing:
+                if not from_pole.switching or len(existing) >= 2:
+                    continue
+                for sp in existing:
+                    self.delete_span(sp)
+            # Первый пролёт отпайки: от отпаечной опоры к первой опоре ветки
+            is_tap = to_pole.tap_pole_id is not None and (to_pole.sequence_number or 0) == 1
+            span = self.plan_span(
+                to_pole,
+                conductor_type=from_pole.conductor_type,
+                conductor_material=from_pole.conductor_material,
+                conductor_section=from_pole.conductor_section,
+                is_tap=is_tap,
+                lengths=lengths,
+            )
+            if span is not None:
+                planned.append(span)
+        return [sp for sp in planned if not sp.deleted]
+
+    # --- правка отдельных опор ---
+
+    def _end_coordinates(self, pole_id: Optional[int], node: Optional[TopoNode]) -> Tuple[Optional[float], Optional[float]]:
+        pole = self.poles.get(pole_id) if pole_id is not None else None
+        if pole is not None:
+            return pole.lat, pole.lon
+        return (node.lat, node.lon) if node is not None else (None, None)
+
+    def _span_lengths(self, spans: Sequence[TopoSpan]) -> List[Optional[float]]:
+        """Длины пролётов по концам (опора или узел ПС); без координат — None."""
+        return pair_lengths_m([
+            (self._end_coordinates(sp.from_pole_id, sp.from_node), self._end_coordinates(sp.to_pole_id, sp.to_node))
+            for sp in spans
+        ])
+
+    def plan_incremental(self, pole_ids: Iterable[int]) -> List[TopoSpan]:
+        """
+        Топология после добавления / перемещения / смены номера отдельных опор — без пересборки линии.
+
+        Затронутые опоры — изменённые и их соседи по цепочке (line_span_pairs). Пролёты между
+        затронутыми опорами, которых в цепочке больше нет (вставка опоры между 2 и 3 заменяет
+        пролёт 2–3 на 2–N и N–3), удаляются; новые пары встают в секцию заменённого пролёта,
+        а без неё строятся как при пошаговом добавлении (plan_span). У сохранённых пролётов
+        изменённых опор пересчитывается длина, пролёт от опоры со сменённым проводом переходит
+        в секцию этого провода; номера пролётов и длины секций / участков — только у затронутых
+        секций. Концы снятых пролётов тоже затронуты: при смене номера опоры её прежние соседи
+        соединяются напрямую.
+        """
+        changed = {int(pid) for pid in pole_ids if int(pid) in self.poles}
+        _main, pole_pairs = line_span_pairs(self._line_poles)
+        pairs = [(a.id, b.id) for a, b in pole_pairs]
+        expected = set(pairs)
+        affected = set(changed)
+        for f, t in pairs:
+            if f in changed or t in changed:
+                affected.update((f, t))
+
+        stale = [
+            sp for sp in self.all_spans()
+            if sp.line_id == self.line_id and sp.from_pole_id is not None and sp.to_pole_id is not None
+            and (sp.from_pole_id in affected or sp.to_pole_id in affected)
+            and (sp.from_pole_id, sp.to_pole_id) not in expected
+        ]
+        touched: List[TopoSection] = []
+        for sp in stale:
+            if sp.section is not None and sp.section not in touched:
+                touched.append(sp.section)
+            affected.update((sp.from_pole_id, sp.to_pole_id))
+            self.delete_span(sp)
+
+        moved = [sp for sp in self.all_spans() if sp.from_pole_id in changed or sp.to_pole_id in changed]
+        for sp, length in zip(moved, self._span_lengths(moved)):
+            if length is not None and length != sp.length:
+                sp.length = length
+                sp.dirty = True
+                if sp.section is not None and sp.section not in touched:
+                    touched.append(sp.section)
+
+        for sp in list(self.all_spans()):
+            pole = self.poles.get(sp.from_pole_id) if sp.from_pole_id in changed else None
+            if pole is None or pole.conductor_type is None or sp.section is None:
+                continue
+            current = sp.section
+            if current.conductor_type == pole.conductor_type and (
+                (current.conductor_material or "") == (pole.conductor_material or DEFAULT_CONDUCTOR_MATERIAL)
+            ):
+                continue
+            target = self.find_or_create_section(
+                current.segment, pole.conductor_type, pole.conductor_material, pole.conductor_section
+            )
+            current.spans.remove(sp)
+            target.spans.append(sp)
+            sp.section = target
+            sp.conductor_type = target.conductor_type
+            sp.conductor_material = target.conductor_material
+            sp.dirty = True
+            touched.extend(ls for ls in (current, target) if ls not in touched)
+
+        replaced_from = {sp.from_pole_id: sp for sp in stale}
+        replaced_to = {sp.to_pole_id: sp for sp in stale}
+        planned: List[TopoSpan] = []
+        lengths = self._pair_lengths([(f, t) for f, t in pairs if f in affected or t in affected])
+        for f, t in pairs:
+            if (f not in affected and t not in affected) or self.pair_spans(f, t):
+                continue
+            from_pole, to_pole = self.poles[f], self.poles[t]
+            replaced = replaced_from.get(f) or replaced_to.get(t)
+            if replaced is not None and replaced.section is not None:
+                section = replaced.section
+                if not (
+                    section.conductor_type == (from_pole.conductor_type or DEFAULT_CONDUCTOR_TYPE)
+                    and (section.conductor_material or "") == (from_pole.conductor_material or DEFAULT_CONDUCTOR_MATERIAL)
+                ):
+                    section = self.find_or_create_section(
+                        section.segment, from_pole.conductor_type, from_pole.conductor_material, from_pole.conductor_section
+                    )
+                from_node, to_node = self.node_for_pole(from_pole), self.node_for_pole(to_pole)
+                span = self._add_span(
+                    section, from_pole, from_node, to_pole, to_node, lengths.get((f, t), 0.0),
+                    from_pole.conductor_type, from_pole.conductor_material,
+                )
+            else:
+                span = self.plan_span(
+                    to_pole,
+                    conductor_type=from_pole.conductor_type,
+                    conductor_material=from_pole.conductor_material,
+                    conductor_section=from_pole.conductor_section,
+                    is_tap=to_pole.tap_pole_id is not None and (to_pole.sequence_number or 0) == 1,
+                    lengths=lengths,
+                )
+                if span is None:
+                    continue
+            planned.append(span)
+            if span.section not in touched:
+                touched.append(span.section)
+
+        # Порядок пролётов в секции — по цепочке опор (пролёт к ПС — рядом со своей опорой)
+        chain_index = {pair: i for i, pair in enumerate(pairs)}
+        ends_at: Dict[int, int] = {}
+        starts_at: Dict[int, int] = {}
+        for i, (f, t) in enumerate(pairs):
+            ends_at.setdefault(t, i)
+            starts_at.setdefault(f, i)
+
+        def _chain_position(sp: TopoSpan) -> float:
+            pair = (sp.from_pole_id, sp.to_pole_id)
+            if pair in chain_index:
+                return chain_index[pair]
+            if sp.from_pole_id in ends_at:
+                return ends_at[sp.from_pole_id] + 0.5
+            if sp.to_pole_id in starts_at:
+                return starts_at[sp.to_pole_id] - 0.5
+            return sp.sequence_number or 0
+
+        for section in touched:
+            ordered = sorted(section.spans, key=_chain_position)
+            for number, sp in enumerate(ordered, start=1):
+                if sp.sequence_number != number:
+                    sp.sequence_number = number
+                    sp.dirty = True
+            section.spans = ordered
+            self._recompute_lengths(section)
+            if ordered:
+                # Как refresh_acline_and_line_section_names: от начала первого до конца последнего пролёта
+                section.name = (
+                    f"{self._display(ordered[0].from_node)} - {self._display(ordered[-1].to_node)}"
+                    f" ({(section.conductor_type or '—').strip() or '—'})"
+                )
+        return planned
+
+
+def _topo_pole(pole: Pole, switching: List[str]) -> TopoPole:
+    lat = pole.get_latitude()
+    lon = pole.get_longitude()
+    return TopoPole(
+        id=pole.id,
+        pole_number=pole.pole_number,
+        line_id=pole.line_id,
+        sequence_number=pole.sequence_number,
+        tap_pole_id=pole.tap_pole_id,
+        tap_branch_index=pole.tap_branch_index,
+        branch_type=pole.branch_type,
+        is_tap_pole=bool(pole.is_tap_pole),
+        lat=float(lat) if lat is not None else None,
+        lon=float(lon) if lon is not None else None,
+        conductor_type=pole.conductor_type,
+        conductor_material=pole.conductor_material,
+        conductor_section=pole.conductor_section,
+        switching=switching,
+    )
+
+
+async def load_line_topology(db: AsyncSession, power_line: PowerLine, user_id: int) -> LineTopology:
+    """Топология линии из БД: опоры, узлы, оборудование, ПС, участки с секциями, пролёты."""
+    line_id = power_line.id
+    pole_options = (
+        selectinload(Pole.location).selectinload(Location.position_points),
+        selectinload(Pole.position_points),
+    )
+    poles = list(
+        (await db.execute(select(Pole).where(Pole.line_id == line_id).options(*pole_options))).scalars().all()
+    )
+    nodes = list(
+        (
+            await db.execute(
+                select(ConnectivityNode).where(ConnectivityNode.line_id == line_id).order_by(ConnectivityNode.id.asc())
+            )
+        ).scalars().all()
+    )
+    # Опоры других линий, на которые ссылаются узлы линии и отпайки (подписи, номер отпайки)
+    known = {p.id for p in poles}
+    extra_ids = {n.pole_id for n in nodes if n.pole_id} | {p.tap_pole_id for p in poles if p.tap_pole_id}
+    extra_ids -= known
+    if extra_ids:
+        poles += list(
+            (await db.execute(select(Pole).where(Pole.id.in_(extra_ids)).options(*pole_options))).scalars().all()
+        )
+
+    equipment: Dict[int, List[Tuple[Optional[str], Optional[str]]]] = {}
+    if poles:
+        rows = await db.execute(
+            select(Equipment.pole_id, Equipment.equipment_type, Equipment.name)
+            .where(Equipment.pole_id.in_([p.id for p in poles]))
+            .order_by(Equipment.id.asc())
+        )
+        for pole_id, equipment_type, name in rows.all():
+            equipment.setdefault(int(pole_id), []).append((equipment_type, name))
+    topo_poles = {p.id: _topo_pole(p, _switching_display_parts(equipment.get(p.id, []))) for p in poles}
+
+    substation_ids = {n.substation_id for n in nodes if n.substation_id}
+    substation_names: Dict[int, str] = {}
+    if substation_ids:
+        rows = await db.execute(
+            select(Substation.id, Substation.name, Substation.dispatcher_name).where(Substation.id.in_(substation_ids))
+        )
+        substation_names = {sid: (name or dispatcher or "ПС")[:50] for sid, name, dispatcher in rows.all()}
+
+    topo_nodes: Dict[int, TopoNode] = {}
+    for n in nodes:
+        pole = topo_poles.get(n.pole_id) if n.pole_id else None
+        if n.substation_id and n.substation_id in substation_names:
+            display = substation_names[n.substation_id]
+        elif pole is not None:
+            display = _pole_display_name(pole.id, pole.pole_number, pole.switching)
+        else:
+            display = f"Узел {n.id}"
+        topo_nodes[n.id] = TopoNode(
+            id=n.id,
+            line_id=n.line_id,
+            pole_id=n.pole_id,
+            substation_id=n.substation_id,
+            is_virtual=bool(n.is_virtual),
+            display_name=display,
+            lat=n.y_position,
+            lon=n.x_position,
+            entity=n,
+        )
+
+    segments = list(
+        (
+            await db.execute(
+                select(AClineSegment).where(AClineSegment.line_id == line_id).order_by(AClineSegment.id.asc())
+            )
+        ).scalars().all()
+    )
+    segment_ids = [s.id for s in segments]
+    sections: List[LineSection] = []
+    if segment_ids:
+        sections = list(
+            (
+                await db.execute(
+                    select(LineSection).where(LineSection.acline_segment_id.in_(segment_ids)).order_by(LineSection.id.asc())
+                )
+            ).scalars().all()
+        )
+    section_ids = [ls.id for ls in sections]
+    span_filter = Span.line_id == line_id
+    if section_ids:
+        span_filter = or_(span_filter, Span.line_section_id.in_(section_ids))
+    spans = list((await db.execute(select(Span).where(span_filter).order_by(Span.id.asc()))).scalars().all())
+
+    def _node(node_id: Optional[int]) -> Optional[TopoNode]:
+        if node_id is None:
+            return None
+        node = topo_nodes.get(node_id)
+        if node is None:
+            # Узел другой линии — только для сравнения концов и подписи
+            node = topo_nodes[node_id] = TopoNode(id=node_id, line_id=-1, display_name=f"Узел {node_id}")
+        return node
+
+    topo_segments: Dict[int, TopoSegment] = {}
+    for s in segments:
+        topo_segments[s.id] = TopoSegment(
+            id=s.id,
+            from_node=_node(s.from_connectivity_node_id),
+            to_node=_node(s.to_connectivity_node_id),
+            is_tap=bool(s.is_tap),
+            tap_number=s.tap_number,
+            tap_pole_id=s.tap_pole_id,
+            branch_type=s.branch_type,
+            sequence_number=s.sequence_number,
+            name=s.name,
+            length=s.length,
+            entity=s,
+        )
+    topo_sections: Dict[int, TopoSection] = {}
+    for ls in sections:
+        seg = topo_segments[ls.acline_segment_id]
+        topo_sections[ls.id] = section = TopoSection(
+            id=ls.id,
+            segment=seg,
+            conductor_type=ls.conductor_type,
+            conductor_material=ls.conductor_material,
+            conductor_section=ls.conductor_section,
+            sequence_number=ls.sequence_number,
+            name=ls.name,
+            total_length=ls.total_length,
+            entity=ls,
+        )
+        seg.sections.append(section)
+    loose_spans: List[TopoSpan] = []
+    for sp in spans:
+        section = topo_sections.get(sp.line_section_id) if sp.line_section_id else None
+        topo_span = TopoSpan(
+            id=sp.id,
+            line_id=sp.line_id,
+            from_pole_id=sp.from_pole_id,
+            to_pole_id=sp.to_pole_id,
+            length=sp.length,
+            section=section,
+            from_node=_node(sp.from_connectivity_node_id),
+            to_node=_node(sp.to_connectivity_node_id),
+            span_number=sp.span_number,
+            sequence_number=sp.sequence_number,
+            conductor_type=sp.conductor_type,
+            conductor_material=sp.conductor_material,
+            entity=sp,
+        )
+        if section is not None:
+            section.spans.append(topo_span)
+        else:
+            loose_spans.append(topo_span)
+
+    return LineTopology(
+        line_id=line_id,
+        line_name=power_line.name,
+        voltage_level=power_line.voltage_level,
+        user_id=user_id,
+        poles=topo_poles.values(),
+        nodes=[n for n in topo_nodes.values() if n.line_id == line_id],
+        segments=topo_segments.values(),
+        spans=loose_spans,
+    )
+
+
+async def apply_line_topology(db: AsyncSession, topology: LineTopology) -> List[Span]:
+    """
+    Записать изменения модели: удалить снятые пролёты, добавить узлы, участки, секции и пролёты,
+    обновить изменённые участки и секции. Один flush на уровень (дочерним нужны id родителей).
+    Возвращает созданные пролёты (ORM) в порядке планирования.
+    """
+    line_id = topology.line_id
+    user_id = topology.user_id
+    deleted_ids = [sp.id for sp in topology.deleted_spans if sp.id is not None]
+    if deleted_ids:
+        await db.execute(delete(Span).where(Span.id.in_(deleted_ids)))
+        for sp in topology.deleted_spans:
+            if sp.entity is not None:
+                db.expunge(sp.entity)
+
+    new_nodes = [n for n in topology.nodes if n.id is None and n.entity is None]
+    for n in new_nodes:
+        n.entity = ConnectivityNode(
+            mrid=generate_mrid(),
+            name=f"Узел {n.pole_number}",
+            pole_id=n.pole_id,
+            line_id=line_id,
+            y_position=float(n.lat) if n.lat is not None else 0.0,
+            x_position=float(n.lon) if n.lon is not None else 0.0,
+            is_virtual=n.is_virtual,
+        )
+    db.add_all([n.entity for n in new_nodes])
+    await db.flush()
+    for n in new_nodes:
+        n.id = n.entity.id
+
+    def _node_id(node: Optional[TopoNode]) -> Optional[int]:
+        return node.id if node is not None else None
+
+    new_segments: List[AClineSegment] = []
+    for seg in topology.segments:
+        if not seg.dirty:
+            continue
+        if seg.entity is None:
+            mrid = generate_mrid()
+            seg.entity = AClineSegment(
+                mrid=mrid,
+                code=mrid,
+                line_id=line_id,
+                is_tap=seg.is_tap,
+                tap_number=seg.tap_number,
+                voltage_level=topology.voltage_level,
+                created_by=user_id,
+                branch_type=seg.branch_type,
+                tap_pole_id=seg.tap_pole_id,
+            )
+            new_segments.append(seg.entity)
+        seg.entity.name = seg.name
+        seg.entity.from_connectivity_node_id = _node_id(seg.from_node)
+        seg.entity.to_connectivity_node_id = _node_id(seg.to_node)
+        seg.entity.sequence_number = seg.sequence_number
+        seg.entity.length = seg.length
+    db.add_all(new_segments)
+    await db.flush()
+
+    new_sections: List[LineSection] = []
+    for seg in topology.segments:
+        seg.id = seg.entity.id if seg.entity is not None else seg.id
+        for ls in seg.sections:
+            if not ls.dirty:
+                continue
+            if ls.entity is None:
+                ls.entity = LineSection(
+                    mrid=generate_mrid(),
+                    name=ls.name,
+                    acline_segment_id=seg.id,
+                    conductor_type=ls.conductor_type,
+                    conductor_material=ls.conductor_material,
+                    conductor_section=ls.conductor_section,
+                    sequence_number=ls.sequence_number,
+                    created_by=user_id,
+                )
+                new_sections.append(ls.entity)
+            ls.entity.name = ls.name
+            ls.entity.total_length = ls.total_length
+    db.add_all(new_sections)
+    await db.flush()
+
+    for sp in topology.all_spans():
+        if sp.dirty and sp.entity is not None:
+            sp.entity.length = sp.length
+            sp.entity.sequence_number = sp.sequence_number
+            if sp.section is not None:
+                sp.entity.line_section_id = sp.section.entity.id
+            sp.entity.conductor_type = sp.conductor_type
+            sp.entity.conductor_material = sp.conductor_material
+
+    created: List[Span] = []
+    for sp in topology.created_spans:
+        sp.entity = Span(
+            mrid=generate_mrid(),
+            span_number=sp.span_number,
+            line_id=line_id,
+            from_pole_id=sp.from_pole_id,
+            to_pole_id=sp.to_pole_id,
+            from_connectivity_node_id=_node_id(sp.from_node),
+            to_connectivity_node_id=_node_id(sp.to_node),
+            line_section_id=sp.section.entity.id,
+            length=sp.length,
+            conductor_type=sp.conductor_type,
+            conductor_material=sp.conductor_material,
+            sequence_number=sp.sequence_number,
+            created_by=user_id,
+        )
+        created.append(sp.entity)
+    db.add_all(created)
+    await db.flush()
+    for sp in topology.created_spans:
+        sp.id = sp.entity.id
+    return created
+
+
+async def update_line_topology_for_poles(
+    db: AsyncSession, power_line: PowerLine, pole_ids: Iterable[int], user_id: int
+) -> List[Span]:
+    """
+    Поддержать топологию после правки отдельных опор (LineTopology.plan_incremental): соседние
+    пролёты, их секции и участки, терминалы изменённых участков и оборудования. Остальная
+    линия не перестраивается. Возвращает созданные пролёты.
+    """
+    topology = await load_line_topology(db, power_line, user_id)
+    topology.plan_incremental(pole_ids)
+    touched = [seg for seg in topology.segments if seg.dirty]
+    created = await apply_line_topology(db, topology)
+    for seg in touched:
+        await ensure_acline_segment_terminals(db, seg.entity)
+    await sync_equipment_terminals_for_line(db, power_line.id)
+    return created
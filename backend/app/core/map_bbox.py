@@ -0,0 +1,90 @@
+"""
+Окно просмотра карты (bbox + zoom) для слоёв GeoJSON.
+
+bbox передаётся строкой «minLon,minLat,maxLon,maxLat» (как Leaflet toBBoxString / OGC BBOX),
+координаты в десятичных градусах WGS84 — те же, что в PositionPoint (x = долгота, y = широта).
+SQL-фильтр по окну строится в map_tiles.py (GiST-индекс на point(x_position, y_position)),
+здесь — разбор параметров и точная проверка попадания координат.
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+_METERS_PER_DEGREE_LAT = 111320.0
+
+# Ниже этого zoom слой не отдаётся (пустая коллекция): при обзоре страны/области
+# тысячи точек опор не читаются из БД и не сериализуются. Слои без записи — на любом zoom.
+MAP_LAYER_MIN_ZOOM: Dict[str, int] = {
+    "poles": 11,
+    "taps": 11,
+    "spans": 12,
+    "equipment": 13,
+}
+
+
+@dataclass(frozen=True)
+class MapBBox:
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+    def contains(self, lon: Optional[float], lat: Optional[float]) -> bool:
+        if lon is None or lat is None:
+            return False
+        return self.min_lon <= lon <= self.max_lon and self.min_lat <= lat <= self.max_lat
+
+    def overlaps_segment(self, lon1: float, lat1: float, lon2: float, lat2: float) -> bool:
+        """Охват отрезка пересекает окно (как box && box в SQL): концы могут лежать вне окна."""
+        return (
+            min(lon1, lon2) <= self.max_lon and max(lon1, lon2) >= self.min_lon
+            and min(lat1, lat2) <= self.max_lat and max(lat1, lat2) >= self.min_lat
+        )
+
+
+    def expanded(self, margin_m: float) -> "MapBBox":
+        """Окно, расширенное на margin_m метров во все стороны (долгота — по широте дальнего края)."""
+        d_lat = margin_m / _METERS_PER_DEGREE_LAT
+        cos_lat = math.cos(math.radians(min(max(abs(self.min_lat), abs(self.max_lat)) + d_lat, 89.0)))
+        d_lon = margin_m / (_METERS_PER_DEGREE_LAT * cos_lat)
+        return replace(
+            self,
+            min_lon=max(self.min_lon - d_lon, -180.0),
+            min_lat=max(self.min_lat - d_lat, -90.0),
+            max_lon=min(self.max_lon + d_lon, 180.0),
+            max_lat=min(self.max_lat + d_lat, 90.0),
+        )
+
+
+def parse_bbox(raw: Optional[str]) -> Optional[MapBBox]:
+    """«minLon,minLat,maxLon,maxLat» → MapBBox; пустое значение → None. Ошибка формата — ValueError."""
+    if raw is None or not str(raw).strip():
+        return None
+    parts = [p.strip() for p in str(raw).split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox: ожидается 4 числа minLon,minLat,maxLon,maxLat")
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(p) for p in parts)
+    except ValueError:
+        raise ValueError("bbox: координаты должны быть числами") from None
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise ValueError("bbox: координаты должны быть конечными числами")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox: min больше max")
+    # Leaflet на малом zoom отдаёт долготы за пределами ±180 — обрезаем до допустимого диапазона
+    return MapBBox(
+        min_lon=max(min_lon, -180.0),
+        min_lat=max(min_lat, -90.0),
+        max_lon=min(max_lon, 180.0),
+        max_lat=min(max_lat, 90.0),
+    )
+
+
+def layer_visible_at_zoom(layer: str, zoom: Optional[int]) -> bool:
+    """Отдавать ли слой на данном zoom (zoom не передан — всегда да, прежнее поведение)."""
+    if zoom is None:
+        return True
+    min_zoom = MAP_LAYER_MIN_ZOOM.get(layer)
+    return min_zoom is None or zoom >= min_zoom
@@ -0,0 +1,153 @@
+"""
+Кластеризация точечных слоёв карты (опоры, оборудование) на сервере для малых zoom.
+
+Иерархическая сетка в пикселях Web Mercator: на самом крупном уровне кластеризации точки
+собираются в ячейки CLUSTER_RADIUS_PX, каждый следующий (более мелкий) zoom кластеризует
+уже кластеры предыдущего уровня с весом по числу точек — все уровни строятся одним проходом
+по слою (как supercluster), индекс считается один раз на версию слоя (map_geojson_cache).
+
+Кластер — точка в центре масс с properties: cluster, cluster_id, point_count, defect_count
+и criticality — худшая критичность дефекта среди точек. Одиночная точка отдаётся исходной фичей.
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Кластеры отдаются на zoom 0..CLUSTER_MAX_ZOOM; крупнее — обычный слой точек
+CLUSTER_MAX_ZOOM = 13
+CLUSTER_ZOOM_LEVELS: Tuple[int, ...] = tuple(range(CLUSTER_MAX_ZOOM + 1))
+CLUSTER_RADIUS_PX = 60
+_TILE_SIZE = 256
+_MAX_MERCATOR_LAT = 85.0511287798066
+
+_CRITICALITY_RANKS: Dict[str, int] = {"low": 1, "medium": 2, "high": 3}
+_RANK_CRITICALITY: Dict[int, str] = {rank: name for name, rank in _CRITICALITY_RANKS.items()}
+
+
+@dataclass(frozen=True)
+class ClusterRollup:
+    """Какие свойства точек слоя сворачиваются в кластер."""
+
+    criticality_key: str
+    defect_keys: Tuple[str, ...]
+
+
+# Свойства слоёв map_tiles.py: у опоры — итоговая критичность (оборудование ∪ дефект опоры)
+MAP_CLUSTER_LAYERS: Dict[str, ClusterRollup] = {
+    "poles": ClusterRollup("criticality", ("has_equipment_defect", "structural_defect")),
+    "equipment": ClusterRollup("defect_criticality", ("has_defect",)),
+}
+
+
+def cluster_zoom(zoom: Optional[int]) -> Optional[int]:
+    """Уровень кластеров для zoom карты; None — кластеры не нужны (zoom не задан или крупный масштаб)."""
+    if zoom is None or zoom > CLUSTER_MAX_ZOOM:
+        return None
+    return max(zoom, 0)
+
+
+def _mercator(lon: float, lat: float) -> Tuple[float, float]:
+    lat = max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT)
+    s = math.sin(math.radians(lat))
+    return (lon + 180.0) / 360.0, 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+
+
+def _lonlat(x: float, y: float) -> Tuple[float, float]:
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return round(lon, 7), round(lat, 7)
+
+
+@dataclass
+class _Item:
+    x: float
+    y: float
+    count: int
+    rank: int
+    defects: int
+    feature: Optional[Dict[str, Any]]  # исходная фича, пока точка одна
+
+
+def _point_items(features: Iterable[Dict[str, Any]], rollup: ClusterRollup) -> List[_Item]:
+    items: List[_Item] = []
+    for f in features:
+        geometry = f.get("geometry") or {}
+        coords = geometry.get("coordinates")
+        if geometry.get("type") != "Point" or not coords:
+            continue
+        try:
+            lon, lat = float(coords[0]), float(coords[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if not (math.isfinite(lon) and math.isfinite(lat)):
+            continue
+        props = f.get("properties") or {}
+        x, y = _mercator(lon, lat)
+        has_defect = any(props.get(k) for k in rollup.defect_keys)
+        items.append(_Item(
+            x=x,
+            y=y,
+            count=1,
+            rank=_CRITICALITY_RANKS.get(str(props.get(rollup.criticality_key) or ""), 0),
+            defects=1 if has_defect else 0,
+            feature=f,
+        ))
+    return items
+
+
+def _merge_level(items: Sequence[_Item], zoom: int) -> Dict[Tuple[int, int], _Item]:
+    cell = CLUSTER_RADIUS_PX / (_TILE_SIZE * (1 << zoom))
+    cells: Dict[Tuple[int, int], List[_Item]] = {}
+    for item in items:
+        cells.setdefault((int(item.x // cell), int(item.y // cell)), []).append(item)
+    merged: Dict[Tuple[int, int], _Item] = {}
+    for key, group in cells.items():
+        if len(group) == 1:
+            merged[key] = group[0]
+            continue
+        count = sum(i.count for i in group)
+        merged[key] = _Item(
+            x=sum(i.x * i.count for i in group) / count,
+            y=sum(i.y * i.count for i in group) / count,
+            count=count,
+            rank=max(i.rank for i in group),
+            defects=sum(i.defects for i in group),
+            feature=None,
+        )
+    return merged
+
+
+def _cluster_feature(zoom: int, key: Tuple[int, int], item: _Item) -> Dict[str, Any]:
+    props: Dict[str, Any] = {
+        "cluster": True,
+        "cluster_id": f"{zoom}/{key[0]}/{key[1]}",
+        "point_count": item.count,
+        "defect_count": item.defects,
+    }
+    if item.rank:
+        props["criticality"] = _RANK_CRITICALITY[item.rank]
+    return {
+        "type": "Feature",
+        "properties": props,
+        "geometry": {"type": "Point", "coordinates": list(_lonlat(item.x, item.y))},
+    }
+
+
+def build_cluster_levels(
+    features: Iterable[Dict[str, Any]],
+    rollup: ClusterRollup,
+    zooms: Sequence[int] = CLUSTER_ZOOM_LEVELS,
+) -> Dict[int, List[Dict[str, Any]]]:
+    """Фичи кластеров для каждого zoom из zooms (от крупного к мелкому, каждый уровень — из предыдущего)."""
+    items = _point_items(features, rollup)
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for zoom in sorted(zooms, reverse=True):
+        merged = _merge_level(items, zoom)
+        out[zoom] = [
+            item.feature if item.feature is not None else _cluster_feature(zoom, key, item)
+            for key, item in sorted(merged.items())
+        ]
+        items = list(merged.values())
+    return out
@@ -1,16 +1,43 @@
 """
-Кэш ответов GeoJSON карты в Redis (JSON + TTL).
-Инвалидация при изменении опор, ЛЭП, оборудования, подстанций, пролётов.
+Кэш ответов GeoJSON карты в Redis.
+Слой хранится уже сериализованным (json_payload.JSONPayload: байты JSON, варианты gzip/brotli
+и ETag) в бинарном Redis — запрос отдаёт байты как есть, без повторной сериализации.
+Инвалидация при изменении опор, ЛЭП, оборудования, подстанций, пролётов;
+она же сдвигает поколение векторных тайлов (старые тайлы доживают TTL и не читаются).
+
+Слои, привязанные к ЛЭП, дополнительно хранятся фрагментами: ключ на линию «JSON-массив фич линии»
+и манифест (множество id ЛЭП). Правка одной опоры сбрасывает только фрагмент её линии,
+ответ слоя склеивается из байт остальных фрагментов без обращения к БД. У каждого фрагмента свой
+TTL (MAP_GEOJSON_FRAGMENT_TTL_SECONDS): пересчёт одной линии не продлевает жизнь остальным, и
+фрагмент, изменённый в обход invalidate_map_geojson_cache, устаревает не дольше TTL.
+Варианты слоя (упрощённая по zoom геометрия ЛЭП, line_simplify.py) считаются вместе с фрагментом
+линии и лежат в ключах «id@вариант».
+
+Пересчёт слоя — single-flight: в процессе один asyncio.Future на слой (остальные запросы
+ждут его), между воркерами — блокировка SET NX в Redis. Пока слой пересчитывается,
+проигравшие гонку запросы получают прошлую версию (ключ «:stale» с длинным TTL,
+инвалидация его не удаляет), так что одновременное открытие карты всеми бригадами
+даёт один тяжёлый запрос к БД на слой, а не по одному на клиента.
+
+Кластеры точечных слоёв (map_clusters.py) строятся из закэшированного полного слоя сразу
+для всех zoom и хранятся под ключом с ETag слоя: новая версия слоя — новые ключи,
+старые кластеры не читаются и доживают TTL (отдельная инвалидация не нужна).
 """
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import Any, Awaitable, Callable, Dict, List, Optional
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
 
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.redis_client import cache_get_json, cache_set_json, get_redis_client
+from app.core.json_payload import JSONPayload, build_json_payload, dumps_json_bytes, loads_json_bytes
+from app.core.map_clusters import CLUSTER_ZOOM_LEVELS, MAP_CLUSTER_LAYERS, build_cluster_levels
+from app.core.line_simplify import SIMPLIFY_ZOOM_LEVELS, simplification_level, simplify_features_by_level
+from app.core.redis_client import CACHE_PREFIX, get_redis_binary_client, get_redis_client
 
 logger = logging.getLogger(__name__)
 
@@ -23,42 +50,490 @@ MAP_GEOJSON_LAYERS: List[str] = [
     "spans",
 ]
 
+# Слои, которые собираются из фрагментов по ЛЭП (у подстанций своей ЛЭП нет — кэшируются целиком)
+MAP_GEOJSON_LINE_LAYERS: List[str] = [
+    "power-lines",
+    "poles",
+    "taps",
+    "equipment",
+    "spans",
+]
+# Фрагмент для объектов без ЛЭП (пролёты старых БД с line_id NULL)
+NO_LINE_FRAGMENT_ID = 0
+
+# Слои, попадающие в векторные тайлы /map/vt/{z}/{x}/{y}.mvt (см. map_tile_cache.py)
+MAP_VECTOR_TILE_LAYERS: List[str] = [
+    "power-lines",
+    "spans",
+    "poles",
+    "taps",
+    "substations",
+]
+# Поколение векторных тайлов: входит в ключ тайла, инвалидация — INCR вместо удаления по маске
+_VECTOR_TILE_GENERATION_KEY = "map:vt:generation"
+
+_LINE_MANIFEST_KEY = f"{CACHE_PREFIX}map:geojson:manifest:lines"
+
+# Варианты слоя: имя варианта → фичи линии; считаются из полной геометрии одним проходом
+FeatureList = List[Dict[str, Any]]
+
+
+def _power_line_zoom_variants(features: FeatureList) -> Dict[str, FeatureList]:
+    return {f"z{level}": feats for level, feats in simplify_features_by_level(features).items()}
+
+
+_LAYER_VARIANTS: Dict[str, Callable[[FeatureList], Dict[str, FeatureList]]] = {
+    "power-lines": _power_line_zoom_variants,
+}
+_LAYER_VARIANT_NAMES: Dict[str, List[str]] = {
+    "power-lines": [f"z{level}" for level in SIMPLIFY_ZOOM_LEVELS],
+}
+
+_FEATURE_COLLECTION_HEAD = b'{"type":"FeatureCollection","features":['
+_FEATURE_COLLECTION_TAIL = b"]}"
+
+# Пересчёты слоёв, идущие в этом процессе: слой → Future с готовым ответом
+_inflight_rebuilds: Dict[str, "asyncio.Future[JSONPayload]"] = {}
+# Построение кластеров: «слой:ETag» → Future с ответами по zoom
+_inflight_clusters: Dict[str, "asyncio.Future[Dict[int, JSONPayload]]"] = {}
+_REBUILD_POLL_SECONDS = 0.2
+# Снять блокировку, только если она всё ещё наша (могла истечь и достаться другому воркеру)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _layer_name(layer: str, variant: Optional[str]) -> str:
+    return layer if variant is None else f"{layer}@{variant}"
+
+
+def _payload_key(layer: str, variant: Optional[str] = None) -> str:
+    return f"{CACHE_PREFIX}map:geojson:{_layer_name(layer, variant)}:payload"
+
+
+def _stale_key(layer: str, variant: Optional[str] = None) -> str:
+    return f"{CACHE_PREFIX}map:geojson:{_layer_name(layer, variant)}:payload:stale"
+
+
+def _lock_key(layer: str, variant: Optional[str] = None) -> str:
+    return f"{CACHE_PREFIX}map:geojson:{_layer_name(layer, variant)}:lock"
+
+
+def _clusters_key(layer: str, etag: str, zoom: int) -> str:
+    version = etag[2:] if etag.startswith("W/") else etag
+    return f"{CACHE_PREFIX}map:geojson:{layer}@clusters:{version.strip(chr(34))}:z{zoom}:payload"
+
+
+def _fragment_field(line_id: int, variant: Optional[str]) -> str:
+    return str(line_id) if variant is None else f"{line_id}@{variant}"
+
+
+def map_geojson_variant(layer: str, zoom: Optional[int]) -> Optional[str]:
+    """Вариант слоя для zoom карты (упрощённая геометрия ЛЭП); None — полный слой."""
+    if layer not in _LAYER_VARIANTS:
+        return None
+    level = simplification_level(zoom)
+    return None if level is None else f"z{level}"
+
+
+def apply_map_geojson_variant(layer: str, variant: Optional[str], data: Dict[str, Any]) -> Dict[str, Any]:
+    """Вариант слоя из полного FeatureCollection (для выборок по bbox, которые не кэшируются)."""
+    if variant is None:
+        return data
+    features = _LAYER_VARIANTS[layer](data.get("features") or [])[variant]
+    return {**data, "features": features}
+
+
+def _fragment_key(layer: str, line_id: int, variant: Optional[str]) -> str:
+    return f"{CACHE_PREFIX}map:geojson:{layer}:by-line:{_fragment_field(line_id, variant)}"
+
+
+def _fragment_pattern(layer: str) -> str:
+    return f"{CACHE_PREFIX}map:geojson:{layer}:by-line:*"
+
+
+def feature_line_id(layer: str, feature: Dict[str, Any]) -> int:
+    """id ЛЭП фичи слоя (для «power-lines» — собственный id), без ЛЭП — NO_LINE_FRAGMENT_ID."""
+    props = feature.get("properties") or {}
+    raw = props.get("id") if layer == "power-lines" else props.get("line_id")
+    try:
+        return int(raw) if raw is not None else NO_LINE_FRAGMENT_ID
+    except (TypeError, ValueError):
+        return NO_LINE_FRAGMENT_ID
+
+
+def feature_collection_bytes(feature_arrays: Iterable[bytes]) -> bytes:
+    """Склеить FeatureCollection из JSON-массивов фич («[...]») без их разбора."""
+    parts = [arr.strip()[1:-1].strip() for arr in feature_arrays]
+    return _FEATURE_COLLECTION_HEAD + b",".join(p for p in parts if p) + _FEATURE_COLLECTION_TAIL
+
+
+async def get_map_vector_tile_generation() -> int:
+    """Текущее поколение векторных тайлов (0, если Redis недоступен или счётчика ещё нет)."""
+    client = get_redis_client()
+    if not client:
+        return 0
+    try:
+        raw = await client.get(_VECTOR_TILE_GENERATION_KEY)
+        return int(raw) if raw is not None else 0
+    except Exception:
+        return 0
+
+
+async def _payload_get(key: str) -> Optional[JSONPayload]:
+    client = get_redis_binary_client()
+    if not client:
+        return None
+    try:
+        return JSONPayload.from_redis_mapping(await client.hgetall(key))
+    except Exception:
+        return None
+
+
+async def _payload_set(key: str, payload: JSONPayload, ttl_seconds: int) -> bool:
+    client = get_redis_binary_client()
+    if not client:
+        return False
+    try:
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=payload.to_redis_mapping())
+            pipe.expire(key, ttl_seconds)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning("map geojson payload set failed: %s", e)
+        return False
+
+
+async def _line_manifest(client, db: AsyncSession) -> List[int]:
+    """Список id ЛЭП слоя: из Redis, при отсутствии — одним запросом к БД."""
+    try:
+        members = await client.smembers(_LINE_MANIFEST_KEY)
+    except Exception:
+        members = None
+    if members:
+        return sorted(int(m) for m in members)
+
+    from app.models.power_line import PowerLine
+
+    ids = (await db.execute(select(PowerLine.id))).scalars().all()
+    line_ids = sorted({int(i) for i in ids} | {NO_LINE_FRAGMENT_ID})
+    try:
+        await client.sadd(_LINE_MANIFEST_KEY, *line_ids)
+        await client.expire(_LINE_MANIFEST_KEY, settings.MAP_GEOJSON_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("map geojson manifest set failed: %s", e)
+    return line_ids
+
+
+async def _assemble_from_line_fragments(
+    client,
+    binary_client,
+    layer: str,
+    variant: Optional[str],
+    loader: Callable[..., Awaitable[Dict[str, Any]]],
+    db: AsyncSession,
+) -> bytes:
+    """
+    Собрать слой из фрагментов по ЛЭП; недостающие линии — одним запросом loader(db, None, ids).
+    Для пересчитанной линии сразу пишутся и полный фрагмент, и все варианты слоя.
+    """
+    line_ids = await _line_manifest(client, db)
+    try:
+        stored = await binary_client.mget([_fragment_key(layer, lid, variant) for lid in line_ids])
+    except Exception:
+        stored = [None] * len(line_ids)
+
+    by_line: Dict[int, bytes] = {lid: raw for lid, raw in zip(line_ids, stored) if raw is not None}
+
+    missing = [lid for lid in line_ids if lid not in by_line]
+    if missing:
+        fresh = await loader(db, None, missing)
+        grouped: Dict[int, FeatureList] = {lid: [] for lid in missing}
+        for feature in fresh.get("features") or []:
+            grouped.setdefault(feature_line_id(layer, feature), []).append(feature)
+        build_variants = _LAYER_VARIANTS.get(layer)
+        fragments: Dict[str, bytes] = {}
+        for lid, feats in grouped.items():
+            fragments[_fragment_key(layer, lid, None)] = dumps_json_bytes(feats)
+            if build_variants is not None:
+                for name, variant_feats in build_variants(feats).items():
+                    fragments[_fragment_key(layer, lid, name)] = dumps_json_bytes(variant_feats)
+            by_line[lid] = fragments[_fragment_key(layer, lid, variant)]
+        try:
+            async with binary_client.pipeline(transaction=False) as pipe:
+                for key, value in fragments.items():
+                    pipe.set(key, value, ex=settings.MAP_GEOJSON_FRAGMENT_TTL_SECONDS)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("map geojson fragments set failed: %s", e)
+        logger.debug("map geojson %s: пересчитано ЛЭП %d из %d", layer, len(missing), len(line_ids))
+
+    return feature_collection_bytes(by_line[lid] for lid in line_ids if lid in by_line)
 
-def _cache_key(layer: str) -> str:
-    return f"map:geojson:{layer}"
 
+async def _build_layer(
+    layer: str,
+    variant: Optional[str],
+    loader: Callable[..., Awaitable[Dict[str, Any]]],
+    db: AsyncSession,
+) -> JSONPayload:
+    """Пересчитать слой и положить в кэш (свежая копия + прошлая версия для stale-while-revalidate)."""
+    client = get_redis_client()
+    binary_client = get_redis_binary_client()
+    if client and binary_client and layer in MAP_GEOJSON_LINE_LAYERS:
+        body = await _assemble_from_line_fragments(client, binary_client, layer, variant, loader, db)
+    else:
+        body = dumps_json_bytes(apply_map_geojson_variant(layer, variant, await loader(db)))
+    payload = build_json_payload(body)
+    ttl = settings.MAP_GEOJSON_CACHE_TTL_SECONDS
+    if await _payload_set(_payload_key(layer, variant), payload, ttl):
+        await _payload_set(_stale_key(layer, variant), payload, settings.MAP_GEOJSON_STALE_TTL_SECONDS)
+        logger.debug("map geojson cache set: %s ttl=%ss bytes=%d", _layer_name(layer, variant), ttl, len(body))
+    return payload
+
+
+async def _acquire_rebuild_lock(client, layer: str, variant: Optional[str]) -> Optional[str]:
+    """Токен блокировки пересчёта слоя или None, если слой уже пересчитывает другой воркер."""
+    token = uuid.uuid4().hex
+    try:
+        acquired = await client.set(
+            _lock_key(layer, variant), token, nx=True, ex=settings.MAP_GEOJSON_REBUILD_LOCK_SECONDS
+        )
+    except Exception as e:
+        # Без блокировки работаем как раньше — пересчёт в каждом воркере
+        logger.warning("map geojson rebuild lock failed: %s", e)
+        return token
+    return token if acquired else None
 
-async def get_map_geojson_cached(
+
+async def _release_rebuild_lock(client, layer: str, variant: Optional[str], token: str) -> None:
+    try:
+        await client.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(layer, variant), token)
+    except Exception as e:
+        logger.warning("map geojson rebuild unlock failed: %s", e)
+
+
+async def _wait_for_foreign_rebuild(layer: str, variant: Optional[str]) -> Optional[JSONPayload]:
+    """Дождаться, пока другой воркер положит слой в кэш (не дольше MAP_GEOJSON_REBUILD_WAIT_SECONDS)."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.MAP_GEOJSON_REBUILD_WAIT_SECONDS
+    while loop.time() < deadline:
+        await asyncio.sleep(_REBUILD_POLL_SECONDS)
+        cached = await _payload_get(_payload_key(layer, variant))
+        if cached is not None:
+            return cached
+    return None
+
+
+async def _rebuild_single_flight(
     layer: str,
-    loader: Callable[[AsyncSession], Awaitable[Dict[str, Any]]],
+    variant: Optional[str],
+    loader: Callable[..., Awaitable[Dict[str, Any]]],
     db: AsyncSession,
-) -> Dict[str, Any]:
-    """Вернуть GeoJSON слоя из Redis или пересчитать и положить в кэш."""
+) -> JSONPayload:
+    client = get_redis_client()
+    if not client:
+        return await _build_layer(layer, variant, loader, db)
+
+    name = _layer_name(layer, variant)
+    token = await _acquire_rebuild_lock(client, layer, variant)
+    if token is None:
+        # Слой пересчитывает другой воркер: отдаём прошлую версию, а если её нет — ждём его результат
+        stale = await _payload_get(_stale_key(layer, variant))
+        if stale is not None:
+            logger.debug("map geojson %s: пересчёт в другом воркере, отдана прошлая версия", name)
+            return stale
+        payload = await _wait_for_foreign_rebuild(layer, variant)
+        if payload is not None:
+            return payload
+        logger.warning("map geojson %s: не дождались пересчёта в другом воркере, считаем сами", name)
+        return await _build_layer(layer, variant, loader, db)
+
+    try:
+        # Пока брали блокировку, слой мог положить завершившийся пересчёт
+        cached = await _payload_get(_payload_key(layer, variant))
+        if cached is not None:
+            return cached
+        return await _build_layer(layer, variant, loader, db)
+    finally:
+        await _release_rebuild_lock(client, layer, variant, token)
+
+
+async def get_map_geojson_payload(
+    layer: str,
+    loader: Callable[..., Awaitable[Dict[str, Any]]],
+    db: AsyncSession,
+    variant: Optional[str] = None,
+) -> JSONPayload:
+    """
+    Готовый ответ слоя из Redis или пересчитать (один пересчёт на слой) и положить в кэш.
+    variant — см. map_geojson_variant (упрощённая по zoom геометрия).
+    """
     if not settings.MAP_GEOJSON_CACHE_ENABLED:
-        return await loader(db)
+        return build_json_payload(dumps_json_bytes(apply_map_geojson_variant(layer, variant, await loader(db))))
 
-    key = _cache_key(layer)
-    cached = await cache_get_json(key)
+    cached = await _payload_get(_payload_key(layer, variant))
     if cached is not None:
         return cached
 
-    data = await loader(db)
-    ttl = settings.MAP_GEOJSON_CACHE_TTL_SECONDS
-    ok = await cache_set_json(key, data, ttl_seconds=ttl)
-    if ok:
-        logger.debug("map geojson cache set: %s ttl=%ss", layer, ttl)
-    return data
+    name = _layer_name(layer, variant)
+    inflight = _inflight_rebuilds.get(name)
+    if inflight is not None:
+        try:
+            return await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise
+        except Exception:
+            pass
+        # Ведущий запрос оборвался или упал — пересчитываем сами
+
+    future: "asyncio.Future[JSONPayload]" = asyncio.get_running_loop().create_future()
+    _inflight_rebuilds[name] = future
+    try:
+        payload = await _rebuild_single_flight(layer, variant, loader, db)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # помечаем как полученное: ждущих может не быть
+        raise
+    else:
+        future.set_result(payload)
+        return payload
+    finally:
+        if _inflight_rebuilds.get(name) is future:
+            del _inflight_rebuilds[name]
+
+
+def _cluster_payloads(layer: str, base: JSONPayload, zoom: Optional[int] = None) -> Dict[int, JSONPayload]:
+    """
+    Кластеры слоя для всех CLUSTER_ZOOM_LEVELS или только для zoom (уровни крупнее него нужны:
+    каждый строится из предыдущего). Разбор, кластеры и сжатие — CPU: вызывать через asyncio.to_thread.
+    """
+    data = loads_json_bytes(base.identity)
+    zooms = CLUSTER_ZOOM_LEVELS if zoom is None else [z for z in CLUSTER_ZOOM_LEVELS if z >= zoom]
+    levels = build_cluster_levels(data.get("features") or [], MAP_CLUSTER_LAYERS[layer], zooms)
+    return {
+        level: build_json_payload(dumps_json_bytes({"type": "FeatureCollection", "features": feats}))
+        for level, feats in levels.items()
+        if zoom is None or level == zoom
+    }
+
+
+async def _payload_etag(layer: str) -> Optional[str]:
+    """ETag закэшированного слоя без чтения его тела."""
+    client = get_redis_binary_client()
+    if not client:
+        return None
+    try:
+        raw = await client.hget(_payload_key(layer), "etag")
+    except Exception:
+        return None
+    return raw.decode("ascii") if raw is not None else None
+
+
+async def get_map_geojson_cluster_payload(
+    layer: str,
+    loader: Callable[..., Awaitable[Dict[str, Any]]],
+    db: AsyncSession,
+    zoom: int,
+) -> JSONPayload:
+    """
+    Кластеры точечного слоя (MAP_CLUSTER_LAYERS) на zoom из CLUSTER_ZOOM_LEVELS.
+    Индекс строится из полного слоя один раз на его версию и сразу для всех zoom; к БД не ходит,
+    если полный слой уже в кэше. Построение идёт в потоке, не блокируя цикл событий; без кэша —
+    только уровни до запрошенного zoom, сериализуется лишь он.
+    """
+    if not settings.MAP_GEOJSON_CACHE_ENABLED:
+        base = await get_map_geojson_payload(layer, loader, db)
+        return (await asyncio.to_thread(_cluster_payloads, layer, base, zoom))[zoom]
+
+    etag = await _payload_etag(layer)
+    if etag is not None:
+        cached = await _payload_get(_clusters_key(layer, etag, zoom))
+        if cached is not None:
+            return cached
+
+    base = await get_map_geojson_payload(layer, loader, db)
+    name = f"{layer}:{base.etag}"
+    inflight = _inflight_clusters.get(name)
+    if inflight is not None:
+        try:
+            return (await asyncio.shield(inflight))[zoom]
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise
+        except Exception:
+            pass
+
+    cached = await _payload_get(_clusters_key(layer, base.etag, zoom))
+    if cached is not None:
+        return cached
+
+    future: "asyncio.Future[Dict[int, JSONPayload]]" = asyncio.get_running_loop().create_future()
+    _inflight_clusters[name] = future
+    try:
+        payloads = await asyncio.to_thread(_cluster_payloads, layer, base)
+        ttl = settings.MAP_GEOJSON_CACHE_TTL_SECONDS
+        for level, payload in payloads.items():
+            await _payload_set(_clusters_key(layer, base.etag, level), payload, ttl)
+        logger.debug("map geojson %s: кластеры построены для zoom %s", layer, list(CLUSTER_ZOOM_LEVELS))
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # помечаем как полученное: ждущих может не быть
+        raise
+    else:
+        future.set_result(payloads)
+        return payloads[zoom]
+    finally:
+        if _inflight_clusters.get(name) is future:
+            del _inflight_clusters[name]
 
 
-async def invalidate_map_geojson_cache(layers: Optional[List[str]] = None) -> None:
-    """Сбросить кэш GeoJSON (все слои или перечисленные)."""
+async def invalidate_map_geojson_cache(
+    layers: Optional[List[str]] = None,
+    line_ids: Optional[Iterable[Optional[int]]] = None,
+) -> None:
+    """
+    Сбросить кэш GeoJSON (все слои или перечисленные). Прошлая версия слоя («:stale») остаётся:
+    её получают только запросы, пришедшие во время пересчёта.
+    line_ids — изменились только эти ЛЭП: сбрасываются их фрагменты, остальные линии остаются в кэше;
+    слои, не привязанные к ЛЭП (подстанции), при этом не трогаются. None среди id — объект без ЛЭП
+    (фрагмент NO_LINE_FRAGMENT_ID). Поколение векторных тайлов сдвигается в любом случае.
+    """
     client = get_redis_client()
     if not client:
         return
     targets = layers if layers is not None else MAP_GEOJSON_LAYERS
-    prefix = "cache:"
+    scoped_ids: Optional[List[int]] = None
+    if line_ids is not None:
+        scoped_ids = sorted({NO_LINE_FRAGMENT_ID if i is None else int(i) for i in line_ids})
+        targets = [layer for layer in targets if layer in MAP_GEOJSON_LINE_LAYERS]
     try:
         for layer in targets:
-            await client.delete(f"{prefix}{_cache_key(layer)}")
+            variants: List[Optional[str]] = [None, *_LAYER_VARIANT_NAMES.get(layer, [])]
+            await client.delete(*[_payload_key(layer, v) for v in variants])
+            if layer not in MAP_GEOJSON_LINE_LAYERS:
+                continue
+            if scoped_ids is None:
+                keys = [key async for key in client.scan_iter(match=_fragment_pattern(layer), count=500)]
+            else:
+                keys = [_fragment_key(layer, lid, v) for lid in scoped_ids for v in variants]
+            for start in range(0, len(keys), 500):
+                await client.delete(*keys[start:start + 500])
+        # Набор ЛЭП мог измениться (создание/удаление линии) — манифест перечитается одним запросом
+        await client.delete(_LINE_MANIFEST_KEY)
+        if any(layer in MAP_VECTOR_TILE_LAYERS for layer in targets):
+            await client.incr(_VECTOR_TILE_GENERATION_KEY)
     except Exception as e:
         logger.warning("map geojson cache invalidate failed: %s", e)
@@ -0,0 +1,102 @@
+"""
+Конфликты sync/upload: правка устройства поверх строки, которую уже изменил кто-то другой.
+
+Версия строки — её ревизия синхронизации (sync_revision, app.core.sync_revision): клиент получает
+её в sync/download ("revision") и возвращает в обновлении как base_revision. Такое обновление —
+патч: в data только изменённые поля (и id / mrid для поиска строки).
+
+- Ревизия строки не больше base_revision — строка не менялась, патч применяется целиком.
+- Строка новее (stale) — поле за полем (трёхстороннее слияние, base — значения полей до правки
+  на устройстве):
+    значение клиента совпадает с серверным — сошлись, ничего не делаем;
+    серверное значение равно base — на сервере поле не трогали, применяем значение клиента;
+    иначе конфликт: остаётся серверное значение, поле возвращается клиенту в conflicts.
+  Без base изменение поля на сервере не отличить от правки клиента — все расходящиеся поля
+  считаются конфликтами (устаревший патч отклоняется, клиент перечитывает строку).
+
+Обновление без base_revision применяется как раньше (последняя запись выигрывает).
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Dict, List, Mapping, Optional
+
+# Поля для поиска строки и служебные — не сливаются и в конфликты не попадают
+MERGE_KEY_FIELDS = frozenset({"id", "mrid"})
+MERGE_IGNORED_FIELDS = frozenset({"created_at", "updated_at", "created_by", "code"})
+
+CONFLICT_RESOLUTION_SERVER_WINS = "server_wins"
+
+
+def _comparable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def values_equal(a: Any, b: Any) -> bool:
+    """Равенство значений поля с клиента и из БД (число 1 и 1.0, дата и её ISO-строка — равны)."""
+    a, b = _comparable(a), _comparable(b)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b or a == b and type(a) is type(b)
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+@dataclass(frozen=True)
+class FieldConflict:
+    field: str
+    client_value: Any
+    server_value: Any
+    base_value: Any = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "field": self.field,
+            "client_value": _comparable(self.client_value),
+            "server_value": _comparable(self.server_value),
+            "base_value": _comparable(self.base_value),
+        }
+
+
+@dataclass
+class MergeResult:
+    data: Dict[str, Any]  # что применять: ключи строки и принятые поля
+    stale: bool = False
+    conflicts: List[FieldConflict] = field(default_factory=list)
+
+
+def is_stale(base_revision: Optional[int], server_revision: Optional[int]) -> bool:
+    return base_revision is not None and server_revision is not None and int(server_revision) > int(base_revision)
+
+
+def merge_update(
+    data: Mapping[str, Any],
+    current: Mapping[str, Any],
+    base_revision: Optional[int],
+    server_revision: Optional[int],
+    base: Optional[Mapping[str, Any]] = None,
+) -> MergeResult:
+    """
+    Слить патч data со строкой сервера. current — серверные значения полей патча (поля, которых
+    в current нет, сравнить не с чем — они применяются); base — значения до правки на устройстве.
+    """
+    if not is_stale(base_revision, server_revision):
+        return MergeResult(data=dict(data))
+    merged: Dict[str, Any] = {}
+    conflicts: List[FieldConflict] = []
+    for key, value in data.items():
+        if key in MERGE_KEY_FIELDS or key in MERGE_IGNORED_FIELDS or key not in current:
+            merged[key] = value
+            continue
+        server_value = current[key]
+        if values_equal(value, server_value):
+            continue
+        if base is not None and key in base and values_equal(base[key], server_value):
+            merged[key] = value
+            continue
+        conflicts.append(FieldConflict(key, value, server_value, base.get(key) if base else None))
+    return MergeResult(data=merged, stale=True, conflicts=conflicts)
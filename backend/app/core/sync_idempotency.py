@@ -0,0 +1,183 @@
+"""
+Идемпотентность sync/upload. Клиент на нестабильной связи повторяет запрос после таймаута, хотя
+сервер пакет уже применил; без журнала повтор создаёт вторые опоры и пролёты.
+
+- Пакет (user_id, batch_id), принятый без ошибок, сохраняется вместе с ответом: повтор получает
+  тот же SyncResponse / id_mapping, таблицы данных не трогаются.
+- Применённые записи (user_id, record_id) сохраняются с результатом (локальный id → серверный):
+  та же запись в другом пакете не применяется повторно, её маппинг подставляется в ответ.
+- Одновременные повторы одного пакета сериализуются транзакционной advisory-блокировкой, записи —
+  своими блокировками (lock_upload_records) до проверки журнала: та же запись в другом пакете,
+  который ещё применяется, ждёт его коммита и видит её применённой.
+
+Журнал пишется в транзакции пакета — либо есть и изменения, и запись журнала, либо ничего.
+Записи старше SYNC_IDEMPOTENCY_TTL_HOURS не учитываются и удаляются не чаще раза в
+SYNC_IDEMPOTENCY_COMPACT_INTERVAL_SECONDS на процесс — вместе с завершёнными фоновыми
+заданиями sync_upload_job (app.core.sync_jobs).
+"""
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.sync_upload_job import SyncUploadJob
+from app.models.sync_upload_ledger import SyncUploadBatch, SyncUploadRecord
+
+logger = logging.getLogger(__name__)
+
+# Длина ключей в журнале (String(64)); более длинные id не журналируются
+LEDGER_KEY_MAX_LENGTH = 64
+
+_last_compaction = 0.0
+
+
+@dataclass(frozen=True)
+class AppliedRecord:
+    record_id: str
+    entity_type: str
+    action: str
+    client_id: Optional[int] = None
+    server_id: Optional[int] = None
+
+
+def ledger_key_ok(key: Any) -> bool:
+    return isinstance(key, str) and 0 < len(key) <= LEDGER_KEY_MAX_LENGTH
+
+
+def ledger_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Граница срока жизни: более ранние записи журнала не действуют."""
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(hours=settings.SYNC_IDEMPOTENCY_TTL_HOURS)
+
+
+async def lock_upload_batch(db: AsyncSession, user_id: int, batch_id: str) -> None:
+    """Дождаться, пока закончится обработка того же пакета в другой транзакции (до конца текущей)."""
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(:user_id, hashtext(:batch_id))"),
+        {"user_id": int(user_id), "batch_id": batch_id},
+    )
+
+
+async def lock_upload_records(db: AsyncSession, user_id: int, record_ids: Iterable[str]) -> None:
+    """
+    Занять записи пакета до конца транзакции (одним запросом). Блокировки по 64-битному хешу
+    «user_id:record_id» берутся по возрастанию id — два пакета с общими записями не ждут друг друга
+    по кругу. Не журналируемые id (ledger_key_ok) не блокируются: их повтор не распознаётся и так.
+    """
+    ids = sorted({r for r in record_ids if ledger_key_ok(r)})
+    if not ids:
+        return
+    await db.execute(
+        text(
+            "SELECT count(pg_advisory_xact_lock(hashtextextended(:prefix || r.id, 0))) "
+            "FROM (SELECT id FROM unnest(CAST(:ids AS text[])) AS id ORDER BY id COLLATE \"C\") AS r"
+        ),
+        {"prefix": f"{int(user_id)}:", "ids": ids},
+    )
+
+
+async def get_stored_response(db: AsyncSession, user_id: int, batch_id: str) -> Optional[Dict[str, Any]]:
+    """Сохранённый ответ на пакет или None."""
+    if not ledger_key_ok(batch_id):
+        return None
+    row = await db.execute(
+        select(SyncUploadBatch.response).where(
+            SyncUploadBatch.user_id == user_id,
+            SyncUploadBatch.batch_id == batch_id,
+            SyncUploadBatch.created_at >= ledger_cutoff(),
+        )
+    )
+    return row.scalar_one_or_none()
+
+
+async def get_applied_records(
+    db: AsyncSession,
+    user_id: int,
+    record_ids: Iterable[str],
+) -> Dict[str, AppliedRecord]:
+    """Уже применённые записи пакета (одним запросом)."""
+    ids = sorted({r for r in record_ids if ledger_key_ok(r)})
+    if not ids:
+        return {}
+    rows = await db.execute(
+        select(
+            SyncUploadRecord.record_id,
+            SyncUploadRecord.entity_type,
+            SyncUploadRecord.action,
+            SyncUploadRecord.client_id,
+            SyncUploadRecord.server_id,
+        ).where(
+            SyncUploadRecord.user_id == user_id,
+            SyncUploadRecord.record_id.in_(ids),
+            SyncUploadRecord.created_at >= ledger_cutoff(),
+        )
+    )
+    return {
+        row.record_id: AppliedRecord(row.record_id, row.entity_type, row.action, row.client_id, row.server_id)
+        for row in rows.all()
+    }
+
+
+async def store_upload_result(
+    db: AsyncSession,
+    user_id: int,
+    batch_id: str,
+    response: Dict[str, Any],
+    records: Sequence[AppliedRecord],
+) -> None:
+    """Записать пакет и применённые записи в журнал (в текущей транзакции, до commit)."""
+    if ledger_key_ok(batch_id):
+        await db.execute(
+            insert(SyncUploadBatch)
+            .values(user_id=user_id, batch_id=batch_id, response=response)
+            .on_conflict_do_nothing(constraint="uq_sync_upload_batch_user_batch")
+        )
+    rows = [
+        {
+            "user_id": user_id,
+            "record_id": r.record_id,
+            "batch_id": batch_id[:LEDGER_KEY_MAX_LENGTH],
+            "entity_type": r.entity_type,
+            "action": r.action,
+            "client_id": r.client_id,
+            "server_id": r.server_id,
+        }
+        for r in records
+        if ledger_key_ok(r.record_id)
+    ]
+    if rows:
+        await db.execute(
+            insert(SyncUploadRecord)
+            .values(rows)
+            .on_conflict_do_nothing(constraint="uq_sync_upload_record_user_record")
+        )
+
+
+async def compact_upload_ledger(db: AsyncSession, force: bool = False) -> bool:
+    """Удалить просроченные записи журнала (не чаще интервала на процесс). True — удаление выполнялось."""
+    global _last_compaction
+    now = time.monotonic()
+    if not force and now - _last_compaction < settings.SYNC_IDEMPOTENCY_COMPACT_INTERVAL_SECONDS:
+        return False
+    _last_compaction = now
+    cutoff = ledger_cutoff()
+    batches = await db.execute(delete(SyncUploadBatch).where(SyncUploadBatch.created_at < cutoff))
+    records = await db.execute(delete(SyncUploadRecord).where(SyncUploadRecord.created_at < cutoff))
+    jobs = await db.execute(
+        delete(SyncUploadJob).where(SyncUploadJob.finished_at.is_not(None), SyncUploadJob.finished_at < cutoff)
+    )
+    await db.commit()
+    if batches.rowcount or records.rowcount or jobs.rowcount:
+        logger.info(
+            "sync/upload: журнал идемпотентности — удалено пакетов=%s записей=%s заданий=%s",
+            batches.rowcount, records.rowcount, jobs.rowcount,
+        )
+    return True
@@ -0,0 +1,363 @@
+"""
+Фоновая обработка sync/upload (?mode=async). Пакет после недели офлайна обрабатывается минутами —
+дольше таймаутов мобильной сети и прокси; запрос только принимает пакет:
+
+- пакет сохраняется в sync_upload_job (status=queued), клиент сразу получает 202 и job_id;
+- воркер celery (очередь SYNC_JOB_QUEUE, сервис sync_worker) применяет его той же логикой, что и
+  синхронный /sync/upload, — с журналом идемпотентности, поэтому повторная доставка задания безопасна;
+- прогресс (обработано записей из total) публикуется в Redis, итоговый SyncResponse или ошибка —
+  в строку задания; клиент опрашивает GET /sync/jobs/{job_id}.
+
+Одновременно обрабатывается не больше --concurrency воркера пакетов (в режиме inline —
+SYNC_JOB_MAX_CONCURRENCY на процесс), API-процессы тяжёлой работой не заняты.
+Повторная отправка того же batch_id возвращает существующее задание; задание, завершившееся
+ошибкой или неуспешным ответом, ставится в очередь заново.
+
+Inline-задача живёт только в памяти процесса: после перезапуска её задание навсегда осталось бы
+queued/running. Задание без движения дольше SYNC_JOB_STALE_MINUTES считается потерянным: отсчёт от
+пульса updated_at (старт, перестановка в очередь, каждая пачка прогресса — publish_job_progress),
+поэтому долгая, но идущая загрузка потерянной не становится. При старте API и при опросе
+GET /sync/jobs/{job_id} потерянное задание снова ставится в очередь (requeue_stale_jobs), повторная
+отправка пакета тоже его перезапускает.
+Двойная обработка безопасна — журнал идемпотентности отдаст второму запуску сохранённый ответ.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis_client import get_redis_client
+from app.core.sync_idempotency import ledger_key_ok
+from app.models.sync_upload_job import SyncUploadJob
+from app.schemas.sync import SyncBatch
+
+logger = logging.getLogger(__name__)
+
+PROCESS_UPLOAD_TASK = "sync.process_upload_job"
+JOB_PROGRESS_KEY_PREFIX = "sync:job:"
+JOB_PROGRESS_TTL_SECONDS = 86400
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Задачи inline-режима этого процесса (ссылки держим, чтобы задачи не собрал GC)
+_inline_tasks: Dict[str, "asyncio.Task[None]"] = {}
+_inline_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _progress_key(job_id: str) -> str:
+    return f"{JOB_PROGRESS_KEY_PREFIX}{job_id}:progress"
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def job_stale_cutoff(now: Optional[datetime] = None) -> datetime:
+    """Задания queued/running без движения с этой границы считаются потерянными."""
+    now = now or datetime.now(timezone.utc)
+    return now - timedelta(minutes=settings.SYNC_JOB_STALE_MINUTES)
+
+
+def job_stale(job: SyncUploadJob, now: Optional[datetime] = None) -> bool:
+    if job.status not in (JOB_QUEUED, JOB_RUNNING):
+        return False
+    # Задания до колонки updated_at — от старта или создания
+    since = job.updated_at or job.started_at or job.created_at
+    return since is not None and since < job_stale_cutoff(now)
+
+
+def job_retryable(job: SyncUploadJob) -> bool:
+    """
+    Повторная отправка пакета перезапускает задание: упало, ответ с ошибками записей или
+    задание потеряно (job_stale).
+    """
+    if job.status == JOB_FAILED or job_stale(job):
+        return True
+    return job.status == JOB_DONE and not (job.response or {}).get("success", False)
+
+
+def job_as_dict(job: SyncUploadJob, progress: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Состояние задания для клиента; progress — свежий счётчик из Redis (пока задание идёт)."""
+    total = int(job.total or 0)
+    done = int(job.done or 0)
+    if progress and job.status in (JOB_QUEUED, JOB_RUNNING):
+        total = int(progress.get("total", total))
+        done = int(progress.get("done", done))
+    return {
+        "job_id": job.id,
+        "batch_id": job.batch_id,
+        "status": job.status,
+        "total": total,
+        "done": done,
+        "progress": round(done / total, 4) if total else (1.0 if job.status == JOB_DONE else 0.0),
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+        "error": job.error,
+        "response": job.response,
+    }
+
+
+async def touch_upload_job(job_id: str) -> None:
+    """
+    Пульс идущего задания (updated_at). Отдельной сессией: транзакция пакета ещё не закоммичена,
+    а пульс должен быть виден другим процессам сразу.
+    """
+    from app.database import AsyncSessionLocal
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(SyncUploadJob)
+                .where(SyncUploadJob.id == job_id, SyncUploadJob.status == JOB_RUNNING)
+                .values(updated_at=datetime.now(timezone.utc))
+            )
+            await db.commit()
+    except Exception as e:
+        logger.warning("sync/upload: пульс задания %s не записан (%s)", job_id, e)
+
+
+async def publish_job_progress(job_id: str, done: int, total: int) -> None:
+    await touch_upload_job(job_id)
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        await client.set(
+            _progress_key(job_id),
+            json.dumps({"done": int(done), "total": int(total)}),
+            ex=JOB_PROGRESS_TTL_SECONDS,
+        )
+    except Exception:
+        pass
+
+
+async def get_job_progress(job_id: str) -> Optional[Dict[str, int]]:
+    client = get_redis_client()
+    if not client:
+        return None
+    try:
+        raw = await client.get(_progress_key(job_id))
+    except Exception:
+        return None
+    return json.loads(raw) if raw else None
+
+
+async def create_upload_job(db: AsyncSession, user_id: int, batch: SyncBatch) -> Tuple[SyncUploadJob, bool]:
+    """
+    Сохранить пакет как задание (и закоммитить). Возвращает (задание, нужно ли ставить в очередь):
+    для уже принятого batch_id — существующее задание, в очередь — только если его стоит повторить.
+    """
+    job_id = uuid.uuid4().hex
+    # Длинный batch_id не дедуплицируется (как и в журнале идемпотентности)
+    batch_key = batch.batch_id if ledger_key_ok(batch.batch_id) else job_id
+    values = {
+        "id": job_id,
+        "user_id": user_id,
+        "batch_id": batch_key,
+        "status": JOB_QUEUED,
+        "total": len(batch.records),
+        "done": 0,
+        "payload": batch.model_dump(mode="json"),
+    }
+    inserted = await db.execute(
+        insert(SyncUploadJob)
+        .values(**values)
+        .on_conflict_do_nothing(constraint="uq_sync_upload_job_user_batch")
+        .returning(SyncUploadJob.id)
+    )
+    enqueue = inserted.scalar_one_or_none() is not None
+    job = (
+        await db.execute(
+            select(SyncUploadJob).where(SyncUploadJob.user_id == user_id, SyncUploadJob.batch_id == batch_key)
+        )
+    ).scalar_one()
+    if not enqueue and job_retryable(job):
+        job.status = JOB_QUEUED
+        job.payload = values["payload"]
+        job.total = values["total"]
+        job.done = 0
+        job.response = None
+        job.error = None
+        job.started_at = None
+        job.finished_at = None
+        job.updated_at = datetime.now(timezone.utc)
+        enqueue = True
+    await db.commit()
+    await db.refresh(job)
+    return job, enqueue
+
+
+async def get_upload_job(db: AsyncSession, job_id: str) -> Optional[SyncUploadJob]:
+    return (await db.execute(select(SyncUploadJob).where(SyncUploadJob.id == job_id))).scalar_one_or_none()
+
+
+async def requeue_stale_jobs(db: AsyncSession, job_id: Optional[str] = None) -> List[str]:
+    """
+    Заново поставить в очередь потерянные задания (все или одно job_id). Возвращает их id.
+    Условный UPDATE: из нескольких процессов, заметивших задание одновременно, его ставит один;
+    пульс — время перестановки, чтобы задание снова считалось потерянным не раньше срока.
+    """
+    conditions = [
+        SyncUploadJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+        func.coalesce(SyncUploadJob.updated_at, SyncUploadJob.started_at, SyncUploadJob.created_at)
+        < job_stale_cutoff(),
+    ]
+    if job_id is not None:
+        conditions.append(SyncUploadJob.id == job_id)
+    now = datetime.now(timezone.utc)
+    rows = await db.execute(
+        update(SyncUploadJob)
+        .where(*conditions)
+        .values(status=JOB_QUEUED, done=0, started_at=now, updated_at=now)
+        .returning(SyncUploadJob.id)
+        .execution_options(synchronize_session=False)
+    )
+    job_ids = [row[0] for row in rows.all()]
+    await db.commit()
+    for stale_id in job_ids:
+        logger.warning("sync/upload: задание %s потеряно — ставим в очередь заново", stale_id)
+        await enqueue_upload_job(stale_id)
+    return job_ids
+
+
+async def _finish_job(db: AsyncSession, job_id: str, **values: Any) -> None:
+    await db.execute(
+        update(SyncUploadJob)
+        .where(SyncUploadJob.id == job_id)
+        .values(payload=None, finished_at=datetime.now(timezone.utc), **values)
+    )
+    await db.commit()
+
+
+async def run_upload_job(job_id: str) -> None:
+    """Обработать пакет задания (воркер или inline-задача); состояние — в sync_upload_job."""
+    # Обработчик пакета живёт в API-модуле sync; импорт здесь — иначе цикл импортов
+    from app.api.v1.sync import _upload_sync_batch_impl
+    from app.database import AsyncSessionLocal
+    from app.models.user import User
+
+    async with AsyncSessionLocal() as db:
+        job = await get_upload_job(db, job_id)
+        if job is None or job.status not in (JOB_QUEUED, JOB_RUNNING):
+            # Удалено или уже завершено (повторная доставка задачи брокером)
+            return
+        user = (await db.execute(select(User).where(User.id == job.user_id))).scalar_one_or_none()
+        if user is None or not user.is_active or job.payload is None:
+            await _finish_job(db, job_id, status=JOB_FAILED, error="пользователь неактивен или пакет утерян")
+            return
+        batch = SyncBatch.model_validate(job.payload)
+        total = len(batch.records)
+        now = datetime.now(timezone.utc)
+        await db.execute(
+            update(SyncUploadJob)
+            .where(SyncUploadJob.id == job_id)
+            .values(status=JOB_RUNNING, started_at=now, updated_at=now, total=total, done=0)
+        )
+        await db.commit()
+        await publish_job_progress(job_id, 0, total)
+
+        async def _progress(done: int, total: int) -> None:
+            await publish_job_progress(job_id, done, total)
+
+        try:
+            response = await _upload_sync_batch_impl(batch, user, db, progress=_progress)
+        except Exception as e:
+            await db.rollback()
+            logger.exception("sync/upload: задание %s (пакет %s) упало", job_id, batch.batch_id)
+            await _finish_job(db, job_id, status=JOB_FAILED, error=f"{type(e).__name__}: {e}")
+            return
+        await _finish_job(
+            db,
+            job_id,
+            status=JOB_DONE,
+            done=total,
+            response=response.model_dump(mode="json"),
+        )
+        await publish_job_progress(job_id, total, total)
+        logger.info(
+            "sync/upload: задание %s готово processed=%d failed=%d",
+            job_id, response.processed_count, response.failed_count,
+        )
+
+
+async def _run_inline(job_id: str) -> None:
+    global _inline_semaphore
+    if _inline_semaphore is None:
+        _inline_semaphore = asyncio.Semaphore(max(settings.SYNC_JOB_MAX_CONCURRENCY, 1))
+    try:
+        async with _inline_semaphore:
+            await run_upload_job(job_id)
+    except Exception:
+        logger.exception("sync/upload: inline-задание %s", job_id)
+    finally:
+        _inline_tasks.pop(job_id, None)
+
+
+async def enqueue_upload_job(job_id: str) -> str:
+    """Поставить задание в очередь celery (или запустить в процессе). Возвращает использованный режим."""
+    if settings.SYNC_JOBS_BACKEND == "celery" and celery_app is not None:
+        try:
+            # send_task блокирует на время обращения к брокеру
+            await asyncio.to_thread(
+                celery_app.send_task,
+                PROCESS_UPLOAD_TASK,
+                args=[job_id],
+                queue=settings.SYNC_JOB_QUEUE,
+            )
+            return "celery"
+        except Exception as e:
+            logger.warning("sync/upload: брокер celery недоступен (%s) — задание %s в процессе API", e, job_id)
+    _inline_tasks[job_id] = asyncio.create_task(_run_inline(job_id))
+    return "inline"
+
+
+async def _run_in_worker(job_id: str) -> None:
+    """Задание в воркере celery: свой цикл событий, свои соединения Redis и пул БД на задачу."""
+    import redis.asyncio as redis
+
+    from app.core.redis_client import set_redis_binary_client, set_redis_client
+    from app.database import engine
+
+    clients = []
+    for decode_responses, setter in ((True, set_redis_client), (False, set_redis_binary_client)):
+        try:
+            client = redis.from_url(settings.REDIS_URL, decode_responses=decode_responses, socket_connect_timeout=5)
+            await client.ping()
+        except Exception as e:
+            logger.warning("sync worker: Redis недоступен (%s) — без прогресса и сброса кэша карты", e)
+            client = None
+        setter(client)
+        if client is not None:
+            clients.append(client)
+    try:
+        await run_upload_job(job_id)
+    finally:
+        set_redis_client(None)
+        set_redis_binary_client(None)
+        for client in clients:
+            await client.aclose()
+        # Соединения asyncpg привязаны к циклу событий, который asyncio.run закроет
+        await engine.dispose()
+
+
+if celery_app is not None:
+
+    @celery_app.task(name=PROCESS_UPLOAD_TASK)
+    def process_upload_job(job_id: str) -> None:
+        from app import models  # noqa: F401 — все модели до первого запроса (связи mapper'ов)
+
+        asyncio.run(_run_in_worker(job_id))
@@ -0,0 +1,308 @@
+"""
+Ревизии синхронизации: глобальный монотонный номер изменения строки для курсорного sync/download.
+
+Каждая вставка и изменение строк line / pole / equipment / equipment_catalog получает в триггере
+BEFORE INSERT OR UPDATE следующий номер последовательности sync_revision_seq (колонка sync_revision),
+удаление — надгробие (tombstone) в sync_tombstone с номером из той же последовательности. Клиент
+передаёт последний полученный номер (cursor) и получает ровно строки после него по возрастанию
+ревизии — выборка по индексу на sync_revision, без окна «last_sync − 60 с».
+
+Перенос опоры на другую ЛЭП (или оборудования на опору другой ЛЭП) — тоже надгробие, с moved и
+moved_to_line_id: его получают только устройства, чья область содержит старую ЛЭП и не содержит
+новую (app.core.sync_scope.tombstone_in_scope), иначе у них осталась бы «призрачная» строка.
+Оборудование перенесённой опоры получает такие же надгробия и новую ревизию (новая область).
+
+Порядок коммитов: номер выдаётся при записи, а видна строка после коммита, поэтому транзакция с
+меньшим номером может закоммититься позже большего. Перед первым номером транзакция объявляет
+нижнюю границу своих номеров (sync_revision_claim): разделяемая транзакционная advisory-блокировка
+с ключом из двух int (SYNC_REVISION_LOCK_KEY, граница), видимая в pg_locks до коммита. Верхняя
+граница выгрузки (sync_high_water) — последнее значение последовательности, но не выше наименьшей
+объявленной границы минус один; читатель ничего не блокирует и никого не ждёт. Курсор никогда
+не перепрыгивает через незакоммиченную ревизию.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SYNC_REVISION_SEQUENCE = "sync_revision_seq"
+# Ключ advisory-блокировки (ASCII «SYNC»): первый int ключа границы ревизий транзакции
+SYNC_REVISION_LOCK_KEY = 0x53594E43
+# Граница — второй int ключа. pg_locks.objid (oid) читает его без знака, поэтому граница выше
+# 2^31 - 1 передаётся со сдвигом на 2^32 и доступны номера до 2^32 - 1; дальше claim — ошибка.
+SYNC_REVISION_FLOOR_MAX = 2 ** 32 - 1
+
+# Объявить нижнюю границу номеров транзакции (один раз на транзакцию). Граница читается до
+# nextval, поэтому каждый номер транзакции не меньше объявленной границы; блокировка разделяемая —
+# пишущие транзакции друг друга не ждут.
+SYNC_REVISION_CLAIM_FUNCTION = f"""
+        CREATE OR REPLACE FUNCTION sync_revision_claim() RETURNS void AS $$
+        DECLARE
+            v_floor BIGINT;
+        BEGIN
+            IF coalesce(current_setting('sync_revision.floor', true), '') <> '' THEN
+                RETURN;
+            END IF;
+            SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END INTO v_floor
+            FROM {SYNC_REVISION_SEQUENCE};
+            IF v_floor > {SYNC_REVISION_FLOOR_MAX} THEN
+                RAISE EXCEPTION 'sync_revision_claim: граница % вне ключа advisory-блокировки (до %)',
+                    v_floor, {SYNC_REVISION_FLOOR_MAX};
+            END IF;
+            PERFORM pg_advisory_xact_lock_shared(
+                {SYNC_REVISION_LOCK_KEY},
+                (v_floor - CASE WHEN v_floor > 2147483647 THEN 4294967296 ELSE 0 END)::int
+            );
+            PERFORM set_config('sync_revision.floor', v_floor::text, true);
+        END
+        $$ LANGUAGE plpgsql
+"""
+
+# Тип сущности синхронизации → таблица
+SYNC_REVISION_TABLES: Dict[str, str] = {
+    "power_line": "line",
+    "pole": "pole",
+    "equipment": "equipment",
+    "equipment_catalog": "equipment_catalog",
+}
+
+# Тело триггерной функции надгробия. line_id — ЛЭП удалённой строки для фильтра подписки
+# (app.core.sync_scope); у справочника и оборудования, чья опора уже удалена, — NULL, такие
+# надгробия получают все устройства.
+SYNC_TOMBSTONE_FUNCTION_BODY = f"""
+        DECLARE
+            v_line_id INTEGER;
+        BEGIN
+            PERFORM sync_revision_claim();
+            IF TG_ARGV[0] = 'power_line' THEN
+                v_line_id := OLD.id;
+            ELSIF TG_ARGV[0] = 'pole' THEN
+                v_line_id := OLD.line_id;
+            ELSIF TG_ARGV[0] = 'equipment' THEN
+                SELECT line_id INTO v_line_id FROM pole WHERE id = OLD.pole_id;
+            END IF;
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id)
+            VALUES (nextval('{SYNC_REVISION_SEQUENCE}'), TG_ARGV[0], OLD.id, v_line_id);
+            RETURN OLD;
+        END
+"""
+
+
+# Перенос между ЛЭП (BEFORE UPDATE OF line_id / pole_id): надгробие для области старой ЛЭП.
+# Номер надгробия выдаётся раньше новой ревизии строки (триггер *_sync_move срабатывает раньше
+# *_sync_revision — порядок по имени), поэтому устройство сначала удаляет, потом получает строку.
+SYNC_MOVE_FUNCTION = f"""
+        CREATE OR REPLACE FUNCTION sync_revision_move() RETURNS trigger AS $$
+        DECLARE
+            v_old_line_id INTEGER;
+            v_new_line_id INTEGER;
+        BEGIN
+            IF TG_ARGV[0] = 'pole' THEN
+                v_old_line_id := OLD.line_id;
+                v_new_line_id := NEW.line_id;
+            ELSE
+                SELECT line_id INTO v_old_line_id FROM pole WHERE id = OLD.pole_id;
+                SELECT line_id INTO v_new_line_id FROM pole WHERE id = NEW.pole_id;
+            END IF;
+            IF v_old_line_id IS NULL OR v_old_line_id IS NOT DISTINCT FROM v_new_line_id THEN
+                RETURN NEW;
+            END IF;
+            PERFORM sync_revision_claim();
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved, moved_to_line_id)
+            VALUES (nextval('{SYNC_REVISION_SEQUENCE}'), TG_ARGV[0], OLD.id, v_old_line_id, true, v_new_line_id);
+            IF TG_ARGV[0] = 'pole' THEN
+                INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved, moved_to_line_id)
+                SELECT nextval('{SYNC_REVISION_SEQUENCE}'), 'equipment', e.id, v_old_line_id, true, v_new_line_id
+                FROM equipment e WHERE e.pole_id = OLD.id ORDER BY e.id;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+"""
+
+# После переноса опоры — новая ревизия её оборудования (триггер sync_revision_bump), уже после
+# ревизии самой опоры: устройство новой области получает опору раньше оборудования на ней.
+SYNC_MOVE_CHILDREN_FUNCTION = """
+        CREATE OR REPLACE FUNCTION sync_revision_move_children() RETURNS trigger AS $$
+        BEGIN
+            UPDATE equipment SET sync_revision = NULL WHERE pole_id = NEW.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+"""
+
+# Смена филиала/региона ЛЭП (BEFORE UPDATE OF branch_id, region_id ON line): ЛЭП со всеми опорами
+# и оборудованием уходит из областей, выбиравших её по прежнему филиалу/региону. Надгробия
+# (moved_to_line_id = line_id) помнят прежние значения — выгрузка отдаёт их только таким областям.
+SYNC_LINE_SCOPE_FUNCTION = f"""
+        CREATE OR REPLACE FUNCTION sync_revision_line_scope() RETURNS trigger AS $$
+        BEGIN
+            IF OLD.branch_id IS NULL AND OLD.region_id IS NULL THEN
+                RETURN NEW;
+            END IF;
+            PERFORM sync_revision_claim();
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            VALUES (nextval('{SYNC_REVISION_SEQUENCE}'), 'power_line', OLD.id, OLD.id, true,
+                    OLD.id, OLD.branch_id, OLD.region_id);
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            SELECT nextval('{SYNC_REVISION_SEQUENCE}'), 'pole', p.id, OLD.id, true,
+                   OLD.id, OLD.branch_id, OLD.region_id
+            FROM pole p WHERE p.line_id = OLD.id ORDER BY p.id;
+            INSERT INTO sync_tombstone (sync_revision, entity_type, entity_id, line_id, moved,
+                                        moved_to_line_id, moved_from_branch_id, moved_from_region_id)
+            SELECT nextval('{SYNC_REVISION_SEQUENCE}'), 'equipment', e.id, OLD.id, true,
+                   OLD.id, OLD.branch_id, OLD.region_id
+            FROM equipment e JOIN pole p ON p.id = e.pole_id WHERE p.line_id = OLD.id ORDER BY e.id;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+"""
+
+# После смены филиала/региона — новые ревизии опор, затем их оборудования: устройство новой
+# области получает ЛЭП целиком.
+SYNC_LINE_SCOPE_CHILDREN_FUNCTION = """
+        CREATE OR REPLACE FUNCTION sync_revision_line_scope_children() RETURNS trigger AS $$
+        BEGIN
+            UPDATE pole SET sync_revision = NULL WHERE line_id = NEW.id;
+            UPDATE equipment SET sync_revision = NULL
+            WHERE pole_id IN (SELECT id FROM pole WHERE line_id = NEW.id);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+"""
+
+# Условие триггеров смены филиала/региона ЛЭП
+SYNC_LINE_SCOPE_CHANGED = (
+    "OLD.branch_id IS DISTINCT FROM NEW.branch_id OR OLD.region_id IS DISTINCT FROM NEW.region_id"
+)
+
+# (таблица, колонка переноса, тип сущности)
+SYNC_MOVE_COLUMNS: Tuple[Tuple[str, str, str], ...] = (
+    ("pole", "line_id", "pole"),
+    ("equipment", "pole_id", "equipment"),
+)
+
+
+def sync_move_trigger_ddl() -> List[str]:
+    """Триггеры надгробий переноса (после колонок sync_tombstone и триггеров ревизий)."""
+    statements = [
+        SYNC_MOVE_FUNCTION,
+        SYNC_MOVE_CHILDREN_FUNCTION,
+        SYNC_LINE_SCOPE_FUNCTION,
+        SYNC_LINE_SCOPE_CHILDREN_FUNCTION,
+    ]
+    for table, column, entity_type in SYNC_MOVE_COLUMNS:
+        statements += [
+            f'DROP TRIGGER IF EXISTS trg_{table}_sync_move ON "{table}"',
+            f'CREATE TRIGGER trg_{table}_sync_move BEFORE UPDATE OF {column} ON "{table}" '
+            f"FOR EACH ROW WHEN (OLD.{column} IS DISTINCT FROM NEW.{column}) "
+            f"EXECUTE FUNCTION sync_revision_move('{entity_type}')",
+        ]
+    statements += [
+        'DROP TRIGGER IF EXISTS trg_pole_sync_move_children ON "pole"',
+        'CREATE TRIGGER trg_pole_sync_move_children AFTER UPDATE OF line_id ON "pole" '
+        "FOR EACH ROW WHEN (OLD.line_id IS DISTINCT FROM NEW.line_id) "
+        "EXECUTE FUNCTION sync_revision_move_children()",
+        'DROP TRIGGER IF EXISTS trg_line_sync_move ON "line"',
+        'CREATE TRIGGER trg_line_sync_move BEFORE UPDATE OF branch_id, region_id ON "line" '
+        f"FOR EACH ROW WHEN ({SYNC_LINE_SCOPE_CHANGED}) EXECUTE FUNCTION sync_revision_line_scope()",
+        'DROP TRIGGER IF EXISTS trg_line_sync_move_children ON "line"',
+        'CREATE TRIGGER trg_line_sync_move_children AFTER UPDATE OF branch_id, region_id ON "line" '
+        f"FOR EACH ROW WHEN ({SYNC_LINE_SCOPE_CHANGED}) EXECUTE FUNCTION sync_revision_line_scope_children()",
+    ]
+    return statements
+
+
+def sync_revision_ddl() -> List[str]:
+    """Идемпотентный DDL (последовательность, колонки, индексы, триггеры) — для init_db."""
+    statements = [
+        f"CREATE SEQUENCE IF NOT EXISTS {SYNC_REVISION_SEQUENCE}",
+        """
+        CREATE TABLE IF NOT EXISTS sync_tombstone (
+            sync_revision BIGINT PRIMARY KEY,
+            entity_type VARCHAR(32) NOT NULL,
+            entity_id INTEGER NOT NULL,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            line_id INTEGER
+        )
+        """,
+        "ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS line_id INTEGER",
+        "ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved BOOLEAN NOT NULL DEFAULT false",
+        "ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_to_line_id INTEGER",
+        "ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_from_branch_id INTEGER",
+        "ALTER TABLE sync_tombstone ADD COLUMN IF NOT EXISTS moved_from_region_id INTEGER",
+        SYNC_REVISION_CLAIM_FUNCTION,
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_bump() RETURNS trigger AS $$
+        BEGIN
+            PERFORM sync_revision_claim();
+            NEW.sync_revision := nextval('{SYNC_REVISION_SEQUENCE}');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION sync_revision_tombstone() RETURNS trigger AS $$
+        {SYNC_TOMBSTONE_FUNCTION_BODY}
+        $$ LANGUAGE plpgsql
+        """,
+    ]
+    for entity_type, table in SYNC_REVISION_TABLES.items():
+        statements += [
+            f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS sync_revision BIGINT',
+            f"UPDATE \"{table}\" SET sync_revision = nextval('{SYNC_REVISION_SEQUENCE}') WHERE sync_revision IS NULL",
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_sync_revision ON "{table}" (sync_revision)',
+            f'DROP TRIGGER IF EXISTS trg_{table}_sync_revision ON "{table}"',
+            f'CREATE TRIGGER trg_{table}_sync_revision BEFORE INSERT OR UPDATE ON "{table}" '
+            f"FOR EACH ROW EXECUTE FUNCTION sync_revision_bump()",
+            f'DROP TRIGGER IF EXISTS trg_{table}_sync_tombstone ON "{table}"',
+            f'CREATE TRIGGER trg_{table}_sync_tombstone AFTER DELETE ON "{table}" '
+            f"FOR EACH ROW EXECUTE FUNCTION sync_revision_tombstone('{entity_type}')",
+        ]
+    return statements + sync_move_trigger_ddl()
+
+
+def high_water_from(last_value: Optional[int], claimed_floor: Optional[int]) -> int:
+    """Граница выгрузки: последний выданный номер, но ниже границы самой старой пишущей транзакции."""
+    high_water = int(last_value or 0)
+    if claimed_floor is not None:
+        high_water = min(high_water, int(claimed_floor) - 1)
+    return max(high_water, 0)
+
+
+async def sync_high_water(db: AsyncSession) -> int:
+    """
+    Наибольшая ревизия, все записи до которой уже закоммичены (или откачены). Не блокирует:
+    последовательность читается раньше pg_locks — транзакция, получившая номер не больше
+    прочитанного, к этому моменту уже объявила границу (или завершилась).
+    """
+    row = (await db.execute(text(f"SELECT last_value, is_called FROM {SYNC_REVISION_SEQUENCE}"))).first()
+    if row is None or not row.is_called:
+        return 0
+    # Ключ из двух int: objsubid = 2, classid — первый, objid — граница (без знака)
+    claimed_floor = (await db.execute(
+        text(
+            "SELECT min(objid::bigint) FROM pg_locks "
+            "WHERE locktype = 'advisory' AND objsubid = 2 AND classid = CAST(:k AS oid) "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+        ),
+        {"k": SYNC_REVISION_LOCK_KEY},
+    )).scalar()
+    return high_water_from(row.last_value, claimed_floor)
+
+
+def merge_revision_pages(
+    pages: Iterable[Sequence[Tuple[int, Any]]],
+    limit: int,
+) -> Tuple[List[Any], bool]:
+    """
+    Слить отсортированные по ревизии выборки таблиц (каждая — не больше limit + 1 строк) в одну
+    страницу: первые limit элементов по возрастанию ревизии и признак, что есть ещё.
+    """
+    merged = list(heapq.merge(*pages, key=lambda item: item[0]))
+    return [item for _, item in merged[:limit]], len(merged) > limit
@@ -0,0 +1,131 @@
+"""
+Подписка устройства на часть сети для sync/download: набор ЛЭП, филиалов (PowerLine.branch_id)
+и географических регионов (PowerLine.region_id, вместе с вложенными — ФЭС → РЭС → …).
+
+Область сводится к списку id ЛЭП один раз на запрос; дальше выгрузка фильтрует опоры по
+pole.line_id, оборудование — через опору, надгробия — по sync_tombstone.line_id (индексы
+ix_pole_line_id, ix_equipment_pole_id, ix_line_branch_id, ix_line_region_id). Справочник
+оборудования общий и в область не входит. Перенос строки на ЛЭП вне области — тоже надгробие
+(sync_tombstone.moved, tombstone_in_scope), как и смена филиала/региона самой ЛЭП: надгробия
+помнят прежние branch_id/region_id, поэтому область хранит и их (ResolvedScope).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import and_, false, or_, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.geographic_region import GeographicRegion
+from app.models.power_line import PowerLine
+from app.models.sync_tombstone import SyncTombstone
+
+
+def parse_id_list(values: Optional[Iterable[str]]) -> Tuple[int, ...]:
+    """
+    Id из параметров запроса: повторяющийся параметр и/или значения через запятую
+    (?line_ids=1&line_ids=2 или ?line_ids=1,2). Без повторов, по возрастанию; ValueError — не число.
+    """
+    ids = set()
+    for value in values or ():
+        for part in str(value).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                ids.add(int(part))
+            except ValueError:
+                raise ValueError(f"ожидался целочисленный id, получено {part!r}") from None
+    return tuple(sorted(ids))
+
+
+@dataclass(frozen=True)
+class SyncScope:
+    line_ids: Tuple[int, ...] = ()
+    branch_ids: Tuple[int, ...] = ()
+    region_ids: Tuple[int, ...] = ()
+
+    @classmethod
+    def from_query(
+        cls,
+        line_ids: Optional[Iterable[str]] = None,
+        branch_ids: Optional[Iterable[str]] = None,
+        region_ids: Optional[Iterable[str]] = None,
+    ) -> "SyncScope":
+        return cls(parse_id_list(line_ids), parse_id_list(branch_ids), parse_id_list(region_ids))
+
+    @property
+    def is_empty(self) -> bool:
+        """Пустая область — без фильтра (вся сеть, как раньше)."""
+        return not (self.line_ids or self.branch_ids or self.region_ids)
+
+
+@dataclass(frozen=True)
+class ResolvedScope:
+    """Область, сведённая к id: ЛЭП, входящие в неё сейчас, и её филиалы/регионы (с вложенными)."""
+    line_ids: Tuple[int, ...]
+    branch_ids: Tuple[int, ...] = ()
+    region_ids: Tuple[int, ...] = ()
+
+
+def tombstone_in_scope(scope: Optional[ResolvedScope]):
+    """
+    Условие на sync_tombstone для области: удаление — по ЛЭП строки (NULL — для всех); перенос —
+    только если старая ЛЭП в области, а новая нет (иначе строка придёт обычным обновлением).
+    Смена филиала/региона ЛЭП (moved_to_line_id = line_id) — если прежний филиал или регион был
+    в области, а сама ЛЭП в неё больше не входит.
+    Без области переносы не выгружаются: вся сеть и так получит строку с новой ревизией.
+    """
+    if scope is None:
+        return SyncTombstone.moved.is_(false())
+    line_ids = scope.line_ids
+    return or_(
+        and_(
+            or_(SyncTombstone.line_id.is_(None), SyncTombstone.line_id.in_(line_ids)),
+            or_(
+                SyncTombstone.moved.is_(false()),
+                SyncTombstone.moved_to_line_id.is_(None),
+                SyncTombstone.moved_to_line_id.not_in(line_ids),
+            ),
+        ),
+        and_(
+            SyncTombstone.moved.is_(true()),
+            SyncTombstone.line_id.not_in(line_ids),
+            or_(
+                SyncTombstone.moved_from_branch_id.in_(scope.branch_ids),
+                SyncTombstone.moved_from_region_id.in_(scope.region_ids),
+            ),
+        ),
+    )
+
+
+async def resolve_scope(db: AsyncSession, scope: SyncScope) -> Optional[ResolvedScope]:
+    """Id ЛЭП, филиалов и регионов области (None — область пуста, фильтровать не нужно)."""
+    if scope.is_empty:
+        return None
+    region_ids: Tuple[int, ...] = ()
+    if scope.region_ids:
+        # Регион вместе с дочерними; UNION (не ALL) — защита от циклов в parent_id
+        regions = (
+            select(GeographicRegion.id)
+            .where(GeographicRegion.id.in_(scope.region_ids))
+            .cte("scope_regions", recursive=True)
+        )
+        regions = regions.union(
+            select(GeographicRegion.id).where(GeographicRegion.parent_id == regions.c.id)
+        )
+        rows = await db.execute(select(regions.c.id).order_by(regions.c.id))
+        region_ids = tuple(int(region_id) for region_id in rows.scalars().all())
+    conditions = []
+    if scope.line_ids:
+        conditions.append(PowerLine.id.in_(scope.line_ids))
+    if scope.branch_ids:
+        conditions.append(PowerLine.branch_id.in_(scope.branch_ids))
+    if region_ids:
+        conditions.append(PowerLine.region_id.in_(region_ids))
+    line_ids: Tuple[int, ...] = ()
+    if conditions:
+        rows = await db.execute(select(PowerLine.id).where(or_(*conditions)).order_by(PowerLine.id))
+        line_ids = tuple(int(line_id) for line_id in rows.scalars().all())
+    return ResolvedScope(line_ids, scope.branch_ids, region_ids)
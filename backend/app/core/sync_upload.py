@@ -0,0 +1,205 @@
+"""
+Пакетная обработка sync/upload: планшет после недели без связи присылает тысячи записей.
+
+- Схемы сущностей компилируются в валидаторы один раз на процесс (entity_validator).
+- UploadPrefetch — снимок до обработки пакета: какие id / mrid ЛЭП, опор и оборудования из пакета
+  уже есть в БД (по одному запросу на тип) и сохранённые маппинги локальных id опор. Поиск
+  существующей строки пропускается, если ключа заведомо нет: его не было в БД и его ещё не
+  касалась ни одна запись пакета.
+- run_chunked_with_bisect — записи применяются пачками в одном savepoint; упавшая пачка
+  делится пополам и повторяется, пока ошибка не локализуется до одной записи.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, TypeVar
+
+import jsonschema
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.power_line import Equipment, Pole, PowerLine
+from app.models.sync_client_mapping import SyncClientMapping
+from app.schemas.sync import ENTITY_SCHEMAS
+
+T = TypeVar("T")
+
+# Записей в одном savepoint пакетной загрузки
+SYNC_UPLOAD_CHUNK_SIZE = 128
+
+_PREFETCH_MODELS = {
+    "power_line": PowerLine,
+    "pole": Pole,
+    "equipment": Equipment,
+}
+
+
+@lru_cache(maxsize=None)
+def entity_validator(entity_type: str, partial: bool = False) -> Optional[Any]:
+    """
+    Скомпилированный валидатор JSON-схемы сущности (None — схемы нет).
+    partial — для патча (update с base_revision): типы полей проверяются, обязательные — нет.
+    """
+    schema = ENTITY_SCHEMAS.get(entity_type)
+    if schema is None:
+        return None
+    if partial:
+        schema = {k: v for k, v in schema.items() if k != "required"}
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+def validate_entity_data(entity_type: str, data: Dict[str, Any], partial: bool = False) -> None:
+    """Как jsonschema.validate, но без разбора схемы на каждый вызов; ValidationError при ошибке."""
+    validator = entity_validator(entity_type, partial)
+    if validator is None:
+        return
+    error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+    if error is not None:
+        raise error
+
+
+def _int_or_none(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class UploadPrefetch:
+    """Что было в БД до обработки пакета (для пропуска заведомо пустых поисков)."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, Set[int]] = {}
+        self.mrids: Dict[str, Set[str]] = {}
+        # Наибольший id на момент снимка: строки с большим id могли появиться в этом же пакете
+        self.max_ids: Dict[str, int] = {}
+        # Локальный id опоры → серверный из прошлых синхронизаций
+        self.pole_mapping: Dict[int, int] = {}
+        self._touched_ids: Dict[str, Set[int]] = {}
+        self._touched_mrids: Dict[str, Set[str]] = {}
+        self._touched_pole_mappings: Set[int] = set()
+
+    def may_exist(self, entity_type: str, row_id: Any, mrid: Any) -> bool:
+        """False — строки с таким id / mrid точно нет: запрос к БД не нужен."""
+        if entity_type not in self.ids:
+            return True
+        row_id = _int_or_none(row_id)
+        if row_id is not None and row_id > 0:
+            if (
+                row_id in self.ids[entity_type]
+                or row_id in self._touched_ids.get(entity_type, ())
+                or row_id > self.max_ids.get(entity_type, 0)
+            ):
+                return True
+        if mrid:
+            mrid = str(mrid)
+            if mrid in self.mrids[entity_type] or mrid in self._touched_mrids.get(entity_type, ()):
+                return True
+        return False
+
+    def touch(self, entity_type: str, row_id: Any, mrid: Any) -> None:
+        """Запись пакета обработана (даже если откатилась): её ключи дальше ищутся в БД."""
+        row_id = _int_or_none(row_id)
+        if row_id is not None and row_id > 0:
+            self._touched_ids.setdefault(entity_type, set()).add(row_id)
+        if mrid:
+            self._touched_mrids.setdefault(entity_type, set()).add(str(mrid))
+
+    def pole_mapping_absent(self, client_id: int) -> bool:
+        """Маппинга опоры нет в БД и он не записывался в этом пакете — можно вставлять без поиска."""
+        return client_id not in self.pole_mapping and client_id not in self._touched_pole_mappings
+
+    def touch_pole_mapping(self, client_id: int) -> None:
+        self._touched_pole_mappings.add(client_id)
+
+
+async def prefetch_upload(
+    db: AsyncSession,
+    user_id: int,
+    records: Iterable[Tuple[str, Dict[str, Any]]],
+) -> UploadPrefetch:
+    """Снимок по записям пакета (entity_type, data): один запрос на тип сущности и один — маппинги."""
+    prefetch = UploadPrefetch()
+    wanted_ids: Dict[str, Set[int]] = {t: set() for t in _PREFETCH_MODELS}
+    wanted_mrids: Dict[str, Set[str]] = {t: set() for t in _PREFETCH_MODELS}
+    client_pole_ids: Set[int] = set()
+    for entity_type, data in records:
+        if entity_type in _PREFETCH_MODELS:
+            row_id = _int_or_none(data.get("id"))
+            if row_id is not None and row_id > 0:
+                wanted_ids[entity_type].add(row_id)
+            if data.get("mrid"):
+                wanted_mrids[entity_type].add(str(data["mrid"]))
+        if entity_type == "pole":
+            row_id = _int_or_none(data.get("id"))
+            if row_id is not None and row_id < 0:
+                client_pole_ids.add(row_id)
+        elif entity_type == "equipment":
+            pole_id = _int_or_none(data.get("pole_id"))
+            if pole_id is not None and pole_id < 0:
+                client_pole_ids.add(pole_id)
+
+    for entity_type, model in _PREFETCH_MODELS.items():
+        prefetch.ids[entity_type] = set()
+        prefetch.mrids[entity_type] = set()
+        prefetch.max_ids[entity_type] = int((await db.execute(select(func.max(model.id)))).scalar() or 0)
+        conditions = []
+        if wanted_ids[entity_type]:
+            conditions.append(model.id.in_(wanted_ids[entity_type]))
+        if wanted_mrids[entity_type]:
+            conditions.append(model.mrid.in_(wanted_mrids[entity_type]))
+        if not conditions:
+            continue
+        for row_id, mrid in (await db.execute(select(model.id, model.mrid).where(or_(*conditions)))).all():
+            prefetch.ids[entity_type].add(int(row_id))
+            if mrid:
+                prefetch.mrids[entity_type].add(str(mrid))
+
+    if client_pole_ids:
+        rows = await db.execute(
+            select(SyncClientMapping.client_id, SyncClientMapping.server_id).where(
+                SyncClientMapping.user_id == user_id,
+                SyncClientMapping.entity_type == "pole",
+                SyncClientMapping.client_id.in_(client_pole_ids),
+            )
+        )
+        prefetch.pole_mapping = {int(client_id): int(server_id) for client_id, server_id in rows.all()}
+    return prefetch
+
+
+async def run_chunked_with_bisect(
+    items: Sequence[T],
+    attempt: Callable[[Sequence[T]], Awaitable[None]],
+    on_item_failed: Callable[[T, Exception], None],
+    chunk_size: int = SYNC_UPLOAD_CHUNK_SIZE,
+    on_progress: Optional[Callable[[int], Awaitable[None]]] = None,
+) -> List[T]:
+    """
+    attempt(chunk) применяет пачку атомарно (savepoint) или бросает исключение. Упавшая пачка
+    делится пополам до одиночных записей; для них вызывается on_item_failed. Порядок применения
+    сохраняется. on_progress(n) — после каждой пачки, n — сколько элементов уже обработано.
+    Возвращает успешно применённые элементы.
+    """
+    applied: List[T] = []
+
+    async def run(chunk: Sequence[T]) -> None:
+        try:
+            await attempt(chunk)
+        except Exception as e:
+            if len(chunk) == 1:
+                on_item_failed(chunk[0], e)
+                return
+            mid = len(chunk) // 2
+            await run(chunk[:mid])
+            await run(chunk[mid:])
+            return
+        applied.extend(chunk)
+
+    size = max(int(chunk_size), 1)
+    for start in range(0, len(items), size):
+        await run(items[start:start + size])
+        if on_progress is not None:
+            await on_progress(min(start + size, len(items)))
+    return applied
@@ -0,0 +1,276 @@
+"""
+Компактный формат обмена sync/upload и sync/download для полевых SIM-карт с лимитом трафика.
+
+Записи опор и оборудования повторяют одни и те же 40+ ключей. В словарном кодировании
+(DICT_RECORDS_FORMAT) каждый набор ключей передаётся один раз, а запись — только значениями:
+
+    {"format": "dict/1", "keys": [["id", "entity_type", …], ["id", "line_id", …]],
+     "rows": [[0, [<значения записи>], 1, [<значения data>]], …], …остальные поля конверта}
+
+Порядок записей сохраняется (курсорная выгрузка идёт по возрастанию ревизии), отсутствующий
+ключ отличается от null (у update это разные вещи).
+
+Тело — MessagePack (application/x-msgpack, пакет msgpack) или JSON; Content-Encoding —
+zstd (пакет zstandard), br или gzip по Accept-Encoding. Без msgpack / zstandard эти варианты
+просто не предлагаются: клиент получает JSON и gzip/br.
+"""
+from __future__ import annotations
+
+import gzip
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.json_payload import (
+    IDENTITY,
+    JSON_MEDIA_TYPE,
+    MIN_COMPRESS_BYTES,
+    choose_content_encoding,
+    dumps_json_bytes,
+    loads_json_bytes,
+)
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore[assignment]
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore[assignment]
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None  # type: ignore[assignment]
+
+MSGPACK_MEDIA_TYPES = ("application/x-msgpack", "application/msgpack", "application/vnd.msgpack")
+MSGPACK_MEDIA_TYPE = MSGPACK_MEDIA_TYPES[0]
+DICT_RECORDS_FORMAT = "dict/1"
+
+# Порядок предпочтения при равном q в Accept-Encoding
+SYNC_ENCODINGS: Tuple[str, ...] = tuple(
+    e for e, available in (("zstd", zstandard is not None), ("br", brotli is not None), ("gzip", True)) if available
+)
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Предел тела после распаковки (защита от «zip-бомбы» в upload)
+MAX_DECODED_BYTES = 64 * 1024 * 1024
+
+
+class WireFormatError(ValueError):
+    """Тело запроса не разбирается: неизвестная кодировка, формат или превышен размер."""
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def _media_type(content_type: Optional[str]) -> str:
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return _media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """Клиент просит MessagePack (и сервер его умеет)."""
+    if msgpack is None or not accept:
+        return False
+    for part in accept.split(","):
+        media, *params = (p.strip() for p in part.split(";"))
+        if media.lower() not in MSGPACK_MEDIA_TYPES:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            return True
+    return False
+
+
+# --- словарное кодирование записей ---
+
+
+def encode_records(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Список записей {…, "data": {…}} → {"format", "keys", "rows"} (порядок записей сохраняется)."""
+    keysets: List[List[str]] = []
+    index: Dict[Tuple[str, ...], int] = {}
+
+    def _keyset(keys: Tuple[str, ...]) -> int:
+        idx = index.get(keys)
+        if idx is None:
+            idx = index[keys] = len(keysets)
+            keysets.append(list(keys))
+        return idx
+
+    rows: List[List[Any]] = []
+    for record in records:
+        meta = {k: v for k, v in record.items() if k != "data"}
+        data = record.get("data")
+        row: List[Any] = [_keyset(tuple(meta)), list(meta.values())]
+        if isinstance(data, dict):
+            row += [_keyset(tuple(data)), list(data.values())]
+        rows.append(row)
+    return {"format": DICT_RECORDS_FORMAT, "keys": keysets, "rows": rows}
+
+
+def decode_records(encoded: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Обратное к encode_records; WireFormatError при несогласованных данных."""
+    if encoded.get("format") != DICT_RECORDS_FORMAT:
+        raise WireFormatError(f"неизвестный формат записей: {encoded.get('format')!r}")
+    keysets = encoded.get("keys") or []
+    records: List[Dict[str, Any]] = []
+    try:
+        for row in encoded.get("rows") or []:
+            meta_keys = keysets[row[0]]
+            if len(meta_keys) != len(row[1]):
+                raise WireFormatError("число значений записи не совпадает с набором ключей")
+            record = dict(zip(meta_keys, row[1]))
+            if len(row) >= 4:
+                data_keys = keysets[row[2]]
+                if len(data_keys) != len(row[3]):
+                    raise WireFormatError("число значений data не совпадает с набором ключей")
+                record["data"] = dict(zip(data_keys, row[3]))
+            records.append(record)
+    except (IndexError, TypeError, KeyError) as e:
+        raise WireFormatError(f"повреждённые записи: {e}") from e
+    return records
+
+
+def encode_envelope(envelope: Dict[str, Any], records_key: str = "records") -> Dict[str, Any]:
+    """Конверт (пакет / ответ выгрузки) с записями в словарном кодировании."""
+    out = {k: v for k, v in envelope.items() if k != records_key}
+    out[records_key] = encode_records(envelope.get(records_key) or [])
+    return out
+
+
+def decode_envelope(envelope: Dict[str, Any], records_key: str = "records") -> Dict[str, Any]:
+    """Развернуть записи, если они в словарном кодировании; обычный конверт возвращается как есть."""
+    records = envelope.get(records_key)
+    if isinstance(records, dict):
+        return {**envelope, records_key: decode_records(records)}
+    return envelope
+
+
+# --- сериализация и сжатие ---
+
+
+def pack_body(value: Any, media_type: str) -> bytes:
+    if media_type == MSGPACK_MEDIA_TYPE:
+        if msgpack is None:
+            raise WireFormatError("MessagePack недоступен на сервере")
+        return msgpack.packb(value, default=str, use_bin_type=True)
+    return dumps_json_bytes(value)
+
+
+def unpack_body(body: bytes, content_type: Optional[str]) -> Any:
+    """Разбор тела по Content-Type (MessagePack или JSON)."""
+    try:
+        if is_msgpack(content_type):
+            if msgpack is None:
+                raise WireFormatError("MessagePack недоступен на сервере")
+            return msgpack.unpackb(body, raw=False, strict_map_key=False)
+        return loads_json_bytes(body)
+    except WireFormatError:
+        raise
+    except Exception as e:
+        raise WireFormatError(f"тело не разбирается: {type(e).__name__}: {e}") from e
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def _brotli_decompress(body: bytes, limit: int) -> bytes:
+    """Потоковая распаковка br: выход наращивается порциями и обрывается после limit + 1 байт."""
+    d = brotli.Decompressor()
+    out = bytearray(d.process(body, output_buffer_limit=limit + 1))
+    # Упёрлись в размер буфера — остаток входа дочитывается пустыми вызовами
+    while len(out) <= limit and not d.is_finished() and not d.can_accept_more_data():
+        out += d.process(b"", output_buffer_limit=limit + 1 - len(out))
+    if len(out) <= limit and not d.is_finished():
+        raise WireFormatError("повреждённое тело br: поток оборван")
+    return bytes(out)
+
+
+def decompress_body(body: bytes, content_encoding: Optional[str], limit: int = MAX_DECODED_BYTES) -> bytes:
+    """Распаковать тело запроса по Content-Encoding, не больше limit байт."""
+    encoding = (content_encoding or IDENTITY).strip().lower()
+    if encoding in ("", IDENTITY):
+        out = body
+    elif encoding in ("gzip", "x-gzip", "deflate"):
+        wbits = 16 + zlib.MAX_WBITS if encoding != "deflate" else zlib.MAX_WBITS
+        try:
+            d = zlib.decompressobj(wbits)
+            out = d.decompress(body, limit + 1)
+        except zlib.error as e:
+            raise WireFormatError(f"повреждённое тело {encoding}: {e}") from e
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise WireFormatError("Content-Encoding zstd не поддерживается сервером")
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(body)
+            out = reader.read(limit + 1)
+        except zstandard.ZstdError as e:
+            raise WireFormatError(f"повреждённое тело zstd: {e}") from e
+    elif encoding == "br":
+        if brotli is None:
+            raise WireFormatError("Content-Encoding br не поддерживается сервером")
+        try:
+            out = _brotli_decompress(body, limit)
+        except WireFormatError:
+            raise
+        except Exception as e:
+            raise WireFormatError(f"повреждённое тело br: {e}") from e
+    else:
+        raise WireFormatError(f"неизвестный Content-Encoding: {encoding}")
+    if len(out) > limit:
+        raise WireFormatError(f"тело больше {limit} байт после распаковки")
+    return out
+
+
+def choose_sync_encoding(accept_encoding: Optional[str]) -> str:
+    return choose_content_encoding(accept_encoding, SYNC_ENCODINGS)
+
+
+def encode_sync_response(
+    payload: Dict[str, Any],
+    accept: Optional[str],
+    accept_encoding: Optional[str],
+    records_key: Optional[str] = None,
+) -> Tuple[bytes, str, str]:
+    """
+    (тело, Content-Type, Content-Encoding) ответа sync: MessagePack со словарными записями, если
+    клиент его принимает, иначе JSON; сжатие — по Accept-Encoding (короткие тела не сжимаются).
+    """
+    if wants_msgpack(accept):
+        media_type = MSGPACK_MEDIA_TYPE
+        if records_key is not None:
+            payload = encode_envelope(payload, records_key)
+    else:
+        media_type = JSON_MEDIA_TYPE
+    body = pack_body(payload, media_type)
+    encoding = choose_sync_encoding(accept_encoding)
+    if encoding != IDENTITY and len(body) >= MIN_COMPRESS_BYTES:
+        compressed = compress_body(body, encoding)
+        if len(compressed) < len(body):
+            return compressed, media_type, encoding
+    return body, media_type, IDENTITY
+
+
+def negotiated(accept: Optional[str], accept_encoding: Optional[str]) -> bool:
+    """Нужен ли особый ответ (MessagePack или сжатие), или подходит обычный JSON."""
+    return wants_msgpack(accept) or choose_sync_encoding(accept_encoding) != IDENTITY
@@ -0,0 +1,308 @@
+"""
+Прогрев кэша растровых тайлов (прокси map_tile_cache) перед выездом: тайлы области заранее
+загружаются в Redis и дисковый MBTiles, чтобы бригада на линии не обращалась к апстриму.
+
+Область — bbox (или границы данных, как /map/bounds) либо коридор заданной ширины вдоль
+геометрии ЛЭП. Задание выполняется в фоне процесса (asyncio.Task) с ограничением
+параллельности; прогресс дублируется в Redis, поэтому его видно из любого воркера,
+там же флаг отмены.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.core.map_bbox import MapBBox
+from app.core.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+Tile = Tuple[int, int, int]
+
+PREFETCH_KEY_PREFIX = "tileprefetch:job:"
+PREFETCH_STATE_TTL_SECONDS = 86400
+# Прогресс пишется в Redis не чаще, чем раз в столько тайлов
+_PROGRESS_EVERY = 50
+
+_EARTH_CIRCUMFERENCE_M = 40075016.686
+_METERS_PER_DEG_LAT = 111320.0
+_MAX_MERCATOR_LAT = 85.0511287798066
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """Тайл XYZ, содержащий точку (с обрезкой по краям мира)."""
+    n = 1 << z
+    lat = max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT)
+    x = int(math.floor((lon + 180.0) / 360.0 * n))
+    y = int(math.floor((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n))
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _bbox_tile_range(bbox: MapBBox, z: int) -> Tuple[int, int, int, int]:
+    x0, y0 = lonlat_to_tile(bbox.min_lon, bbox.max_lat, z)
+    x1, y1 = lonlat_to_tile(bbox.max_lon, bbox.min_lat, z)
+    return x0, y0, x1, y1
+
+
+def bbox_tile_count(bbox: MapBBox, min_zoom: int, max_zoom: int) -> int:
+    total = 0
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = _bbox_tile_range(bbox, z)
+        total += (x1 - x0 + 1) * (y1 - y0 + 1)
+    return total
+
+
+def bbox_tiles(bbox: MapBBox, min_zoom: int, max_zoom: int) -> Iterator[Tile]:
+    """Тайлы bbox по уровням от мелкого zoom к крупному (обзорные тайлы готовы первыми)."""
+    for z in range(min_zoom, max_zoom + 1):
+        x0, y0, x1, y1 = _bbox_tile_range(bbox, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield z, x, y
+
+
+class TileLimitExceeded(ValueError):
+    """Тайлов области больше лимита — перебор прерван, не дожидаясь полного множества."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Слишком много тайлов: > {limit}")
+        self.limit = limit
+
+
+def _tiles_around(
+    lon: float,
+    lat: float,
+    half_m: float,
+    z: int,
+    out: Set[Tile],
+    clip: Optional[Tuple[int, int, int, int]] = None,
+    limit: Optional[int] = None,
+) -> None:
+    dlat = half_m / _METERS_PER_DEG_LAT
+    dlon = half_m / (_METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    x0, y0 = lonlat_to_tile(lon - dlon, lat + dlat, z)
+    x1, y1 = lonlat_to_tile(lon + dlon, lat - dlat, z)
+    if clip is not None:
+        x0, y0, x1, y1 = max(x0, clip[0]), max(y0, clip[1]), min(x1, clip[2]), min(y1, clip[3])
+    if limit is not None and (x1 - x0 + 1) * (y1 - y0 + 1) > limit:
+        raise TileLimitExceeded(limit)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            out.add((z, x, y))
+    if limit is not None and len(out) > limit:
+        raise TileLimitExceeded(limit)
+
+
+def corridor_tiles(
+    lines: Iterable[Sequence[Sequence[float]]],
+    radius_m: float,
+    min_zoom: int,
+    max_zoom: int,
+    bbox: Optional[MapBBox] = None,
+    limit: Optional[int] = None,
+) -> List[Tile]:
+    """
+    Тайлы в пределах radius_m от ломаных [[lon, lat], …]. Отрезки проходятся с шагом не больше
+    radius_m и половины тайла; вокруг каждой точки берётся квадрат radius_m + полшага.
+    bbox — только тайлы внутри окна; limit — TileLimitExceeded, как только тайлов стало больше
+    (широкий коридор на крупном zoom — миллиарды тайлов, полное множество не строится).
+    CPU-работа: из async-кода — через asyncio.to_thread.
+    """
+    lines = [[(float(c[0]), float(c[1])) for c in line if len(c) >= 2] for line in lines]
+    out: Set[Tile] = set()
+    for z in range(min_zoom, max_zoom + 1):
+        clip = _bbox_tile_range(bbox, z) if bbox is not None else None
+        for coords in lines:
+            if not coords:
+                continue
+            if len(coords) == 1:
+                _tiles_around(coords[0][0], coords[0][1], radius_m, z, out, clip, limit)
+                continue
+            for (lon_a, lat_a), (lon_b, lat_b) in zip(coords, coords[1:]):
+                mid_lat = math.radians((lat_a + lat_b) / 2.0)
+                dx = (lon_b - lon_a) * _METERS_PER_DEG_LAT * math.cos(mid_lat)
+                dy = (lat_b - lat_a) * _METERS_PER_DEG_LAT
+                length = math.hypot(dx, dy)
+                tile_m = _EARTH_CIRCUMFERENCE_M * math.cos(mid_lat) / (1 << z)
+                step = max(min(radius_m, tile_m / 2.0), 1.0)
+                steps = max(int(math.ceil(length / step)), 1)
+                for i in range(steps + 1):
+                    t = i / steps
+                    _tiles_around(
+                        lon_a + (lon_b - lon_a) * t, lat_a + (lat_b - lat_a) * t, radius_m + step / 2.0, z, out,
+                        clip, limit,
+                    )
+    # Порядок как у bbox_tiles: по zoom, затем x, y
+    return sorted(out)
+
+
+@dataclass
+class TilePrefetchJob:
+    id: str
+    mode: str  # bbox | bounds | corridor
+    min_zoom: int
+    max_zoom: int
+    total: int
+    concurrency: int
+    status: str = "running"  # running | done | cancelled | failed
+    done: int = 0
+    cached: int = 0  # уже были в Redis или офлайн-подложке
+    loaded: int = 0  # положены в кэш (с диска или апстрима)
+    failed: int = 0
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, object]:
+        data = asdict(self)
+        data["progress"] = round(self.done / self.total, 4) if self.total else 1.0
+        return data
+
+
+# Задания этого процесса; состояние для всех воркеров — в Redis
+_jobs: Dict[str, TilePrefetchJob] = {}
+_tasks: Dict[str, "asyncio.Task[None]"] = {}
+
+
+def _state_key(job_id: str) -> str:
+    return f"{PREFETCH_KEY_PREFIX}{job_id}"
+
+
+def _cancel_key(job_id: str) -> str:
+    return f"{PREFETCH_KEY_PREFIX}{job_id}:cancel"
+
+
+async def _publish(job: TilePrefetchJob) -> None:
+    client = get_redis_client()
+    if not client:
+        return
+    try:
+        await client.set(_state_key(job.id), json.dumps(job.as_dict()), ex=PREFETCH_STATE_TTL_SECONDS)
+    except Exception:
+        pass
+
+
+async def _cancel_requested(job_id: str) -> bool:
+    client = get_redis_client()
+    if not client:
+        return False
+    try:
+        return bool(await client.exists(_cancel_key(job_id)))
+    except Exception:
+        return False
+
+
+async def _run(
+    job: TilePrefetchJob,
+    tiles: Iterable[Tile],
+    is_cached: Callable[[int, int, int], Awaitable[bool]],
+    load: Callable[[int, int, int], Awaitable[bool]],
+) -> None:
+    it = iter(tiles)
+    stop = asyncio.Event()
+
+    async def worker() -> None:
+        for z, x, y in it:
+            if stop.is_set():
+                return
+            try:
+                if await is_cached(z, x, y):
+                    job.cached += 1
+                elif await load(z, x, y):
+                    job.loaded += 1
+                else:
+                    job.failed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.failed += 1
+                logger.warning("Tile prefetch %s: z=%s x=%s y=%s: %s", job.id, z, x, y, e)
+            job.done += 1
+            if job.done % _PROGRESS_EVERY == 0:
+                if await _cancel_requested(job.id):
+                    stop.set()
+                    job.status = "cancelled"
+                    return
+                await _publish(job)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(job.concurrency, 1))))
+        if job.status == "running":
+            job.status = "done"
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+    except Exception as e:
+        job.status = "failed"
+        job.error = f"{type(e).__name__}: {e}"
+        logger.exception("Tile prefetch %s failed", job.id)
+    finally:
+        job.finished_at = time.time()
+        await _publish(job)
+        _tasks.pop(job.id, None)
+
+
+async def start_prefetch_job(
+    mode: str,
+    tiles: Iterable[Tile],
+    total: int,
+    min_zoom: int,
+    max_zoom: int,
+    concurrency: int,
+    is_cached: Callable[[int, int, int], Awaitable[bool]],
+    load: Callable[[int, int, int], Awaitable[bool]],
+) -> TilePrefetchJob:
+    """Запустить прогрев в фоне; is_cached / load — проверка кэша и загрузка тайла прокси."""
+    now = time.time()
+    for old_id in [k for k, j in _jobs.items() if j.finished_at and now - j.finished_at > PREFETCH_STATE_TTL_SECONDS]:
+        del _jobs[old_id]
+    job = TilePrefetchJob(
+        id=uuid.uuid4().hex,
+        mode=mode,
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        total=total,
+        concurrency=concurrency,
+    )
+    _jobs[job.id] = job
+    await _publish(job)
+    _tasks[job.id] = asyncio.create_task(_run(job, tiles, is_cached, load))
+    return job
+
+
+async def get_prefetch_job(job_id: str) -> Optional[Dict[str, object]]:
+    """Состояние задания: из этого процесса, иначе из Redis (задание другого воркера)."""
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job.as_dict()
+    client = get_redis_client()
+    if not client:
+        return None
+    try:
+        raw = await client.get(_state_key(job_id))
+    except Exception:
+        return None
+    return json.loads(raw) if raw else None
+
+
+async def cancel_prefetch_job(job_id: str) -> bool:
+    """Остановить задание (в этом процессе — сразу, в другом — по флагу в Redis). False — не найдено."""
+    task = _tasks.get(job_id)
+    if task is not None:
+        task.cancel()
+        return True
+    state = await get_prefetch_job(job_id)
+    if state is None:
+        return False
+    client = get_redis_client()
+    if client:
+        try:
+            await client.set(_cancel_key(job_id), "1", ex=PREFETCH_STATE_TTL_SECONDS)
+        except Exception:
+            pass
+    return True
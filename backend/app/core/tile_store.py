@@ -0,0 +1,265 @@
+"""
+Дисковый кэш растровых тайлов в файле MBTiles (SQLite) — второй уровень после Redis у прокси
+map_tile_cache: вытеснение ключа из Redis или его перезапуск не означает повторную загрузку
+тайла с апстрима.
+
+Схема совместима с MBTiles (tiles / metadata, tile_row в TMS — ось Y перевёрнута), как у
+scripts/build_belarus_basemap_mbtiles.py; в tiles добавлена колонка fetched_at (unix-время
+загрузки) для срока свежести. Файл открывается один раз на процесс, WAL — несколько воркеров
+uvicorn пишут в один файл. Вызовы синхронные: из async-кода — через asyncio.to_thread.
+
+Офлайн-подложка (MBTilesReader) — готовый файл той же схемы только на чтение: пул соединений
+mode=ro с memory-mapped чтением, прокси отдаёт из неё тайлы в пределах её zoom и границ раньше
+Redis и апстрима.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+OSM_TILE_STORE_FILENAME = "osm.mbtiles"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+  zoom_level INTEGER NOT NULL,
+  tile_column INTEGER NOT NULL,
+  tile_row INTEGER NOT NULL,
+  tile_data BLOB NOT NULL,
+  fetched_at INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+"""
+
+
+def tms_row(z: int, y: int) -> int:
+    """Строка MBTiles (TMS) для y в схеме XYZ; преобразование симметрично."""
+    return (1 << z) - 1 - y
+
+
+class MBTilesStore:
+    """Тайлы z/x/y (XYZ, как в URL прокси) в файле MBTiles."""
+
+    def __init__(self, path: Path, name: str = "OSM tile cache"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)",
+            (("name", name), ("type", "baselayer"), ("format", "png")),
+        )
+        self._conn.commit()
+
+    def get(self, z: int, x: int, y: int) -> Optional[Tuple[bytes, int]]:
+        """(байты тайла, fetched_at) или None, если тайла нет."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tile_data, fetched_at FROM tiles "
+                "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, tms_row(z, y)),
+            ).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), int(row[1] or 0)
+
+    def put(self, z: int, x: int, y: int, data: bytes, fetched_at: Optional[int] = None) -> None:
+        self.put_many([(z, x, y, data)], fetched_at=fetched_at)
+
+    def put_many(self, tiles: Iterable[Tuple[int, int, int, bytes]], fetched_at: Optional[int] = None) -> int:
+        """Записать пачку тайлов одной транзакцией; возвращает число записанных."""
+        ts = int(time.time()) if fetched_at is None else int(fetched_at)
+        rows = [(z, x, tms_row(z, y), sqlite3.Binary(data), ts) for z, x, y, data in tiles]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data, fetched_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+        return len(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _lon_to_tile_x(lon: float, z: int) -> int:
+    return int(math.floor((lon + 180.0) / 360.0 * (1 << z)))
+
+
+def _lat_to_tile_y(lat: float, z: int) -> int:
+    lat_rad = math.radians(max(min(lat, 85.0511287798066), -85.0511287798066))
+    return int(math.floor((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * (1 << z)))
+
+
+class MBTilesReader:
+    """
+    Готовый MBTiles только на чтение: pool_size соединений mode=ro (по одному на поток
+    asyncio.to_thread), mmap_size — чтение страниц файла через отображение в память.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        min_zoom: Optional[int] = None,
+        max_zoom: Optional[int] = None,
+        pool_size: int = 4,
+        mmap_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise FileNotFoundError(str(self.path))
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._connections = []
+        for _ in range(max(pool_size, 1)):
+            conn = sqlite3.connect(
+                f"{self.path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=30.0,
+                check_same_thread=False,
+            )
+            conn.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+            conn.execute("PRAGMA query_only=1")
+            self._connections.append(conn)
+            self._pool.put(conn)
+        self.metadata = self._read_metadata()
+        # Диапазон zoom: настройка, иначе из metadata файла; берётся пересечение
+        meta_min = self._meta_int("minzoom")
+        meta_max = self._meta_int("maxzoom")
+        lo = [v for v in (min_zoom, meta_min) if v is not None]
+        hi = [v for v in (max_zoom, meta_max) if v is not None]
+        self.min_zoom = max(lo) if lo else 0
+        self.max_zoom = min(hi) if hi else 22
+        self.bounds = self._meta_bounds()
+
+    def _read_metadata(self) -> Dict[str, str]:
+        conn = self._pool.get()
+        try:
+            return {str(k): str(v) for k, v in conn.execute("SELECT name, value FROM metadata")}
+        except sqlite3.Error:
+            return {}
+        finally:
+            self._pool.put(conn)
+
+    def _meta_int(self, name: str) -> Optional[int]:
+        try:
+            return int(self.metadata[name])
+        except (KeyError, ValueError):
+            return None
+
+    def _meta_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        try:
+            west, south, east, north = (float(v) for v in self.metadata["bounds"].split(","))
+        except (KeyError, ValueError):
+            return None
+        return west, south, east, north
+
+    def covers(self, z: int, x: int, y: int) -> bool:
+        """Может ли тайл быть в файле: zoom в диапазоне и тайл пересекает bounds из metadata."""
+        if z < self.min_zoom or z > self.max_zoom:
+            return False
+        if self.bounds is None:
+            return True
+        west, south, east, north = self.bounds
+        return (
+            _lon_to_tile_x(west, z) <= x <= _lon_to_tile_x(east, z)
+            and _lat_to_tile_y(north, z) <= y <= _lat_to_tile_y(south, z)
+        )
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        if not self.covers(z, x, y):
+            return None
+        conn = self._pool.get()
+        try:
+            row = conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, tms_row(z, y)),
+            ).fetchone()
+        finally:
+            self._pool.put(conn)
+        return bytes(row[0]) if row is not None and row[0] else None
+
+    def close(self) -> None:
+        for conn in self._connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._connections = []
+
+
+_osm_store: Optional[MBTilesStore] = None
+_osm_store_failed = False
+_basemap: Optional[MBTilesReader] = None
+_basemap_failed = False
+
+
+def get_osm_tile_store() -> Optional[MBTilesStore]:
+    """Дисковый кэш прокси OSM (TILE_CACHE_DIR) или None, если выключен или файл не открывается."""
+    global _osm_store, _osm_store_failed
+    if not settings.TILE_CACHE_ENABLED or not settings.TILE_CACHE_DISK_ENABLED:
+        return None
+    if _osm_store is None and not _osm_store_failed:
+        path = Path(settings.TILE_CACHE_DIR) / OSM_TILE_STORE_FILENAME
+        try:
+            _osm_store = MBTilesStore(path)
+        except Exception as e:
+            _osm_store_failed = True
+            logger.warning("Tile disk cache unavailable (%s): %s", path, e)
+    return _osm_store
+
+
+def get_basemap_tile_reader() -> Optional[MBTilesReader]:
+    """Офлайн-подложка (TILE_BASEMAP_MBTILES_PATH) или None, если не задана или не открывается."""
+    global _basemap, _basemap_failed
+    path = (settings.TILE_BASEMAP_MBTILES_PATH or "").strip()
+    if not path:
+        return None
+    if _basemap is None and not _basemap_failed:
+        try:
+            _basemap = MBTilesReader(
+                Path(path),
+                min_zoom=settings.TILE_BASEMAP_MIN_ZOOM,
+                max_zoom=settings.TILE_BASEMAP_MAX_ZOOM,
+                pool_size=settings.TILE_BASEMAP_POOL_SIZE,
+            )
+            logger.info(
+                "Offline basemap %s: z%s-z%s, bounds %s",
+                path, _basemap.min_zoom, _basemap.max_zoom, _basemap.bounds,
+            )
+        except Exception as e:
+            _basemap_failed = True
+            logger.warning("Offline basemap unavailable (%s): %s", path, e)
+    return _basemap
+
+
+def close_tile_stores() -> None:
+    """Закрыть открытые файлы тайлов (main.lifespan при остановке)."""
+    global _osm_store, _osm_store_failed, _basemap, _basemap_failed
+    for store in (_osm_store, _basemap):
+        if store is not None:
+            try:
+                store.close()
+            except Exception:
+                pass
+    _osm_store = None
+    _osm_store_failed = False
+    _basemap = None
+    _basemap_failed = False
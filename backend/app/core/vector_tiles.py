@@ -0,0 +1,306 @@
+"""
+Кодирование векторных тайлов Mapbox Vector Tile (MVT 2.1) без внешних зависимостей.
+
+На вход — фичи GeoJSON (Point / LineString в WGS84, как отдают слои map_tiles.py),
+на выход — protobuf-тайл z/x/y в проекции Web Mercator. Упрощение по zoom получается
+из квантования в сетку тайла (extent): вершины, попавшие в одну ячейку, схлопываются,
+а линии, выродившиеся в точку, отбрасываются. Линии обрезаются по тайлу с запасом (buffer):
+в тайл низкого zoom не попадает вся геометрия ЛЭП, а только её части над тайлом.
+Спецификация: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+from __future__ import annotations
+
+import math
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+DEFAULT_EXTENT = 4096
+# Запас вокруг тайла (доля ширины): значки и линии у края не обрезаются на стыке тайлов
+DEFAULT_BUFFER = 64 / 4096
+
+_MAX_MERCATOR_LAT = 85.0511287798066
+
+_GEOM_POINT = 1
+_GEOM_LINESTRING = 2
+
+_CMD_MOVE_TO = 1
+_CMD_LINE_TO = 2
+
+_WIRE_VARINT = 0
+_WIRE_64BIT = 1
+_WIRE_LEN = 2
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int, buffer: float = 0.0) -> Tuple[float, float, float, float]:
+    """Границы тайла (minLon, minLat, maxLon, maxLat); buffer — запас в долях ширины тайла."""
+    n = 1 << z
+
+    def lon(tx: float) -> float:
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (
+        max(lon(x - buffer), -180.0),
+        max(lat(y + 1 + buffer), -_MAX_MERCATOR_LAT),
+        min(lon(x + 1 + buffer), 180.0),
+        min(lat(y - buffer), _MAX_MERCATOR_LAT),
+    )
+
+
+class _TileProjector:
+    def __init__(self, z: int, x: int, y: int, extent: int):
+        self.scale = float(1 << z)
+        self.x = x
+        self.y = y
+        self.extent = extent
+
+    def __call__(self, lon: float, lat: float) -> Tuple[int, int]:
+        lat = max(min(lat, _MAX_MERCATOR_LAT), -_MAX_MERCATOR_LAT)
+        wx = (lon + 180.0) / 360.0 * self.scale
+        s = math.sin(math.radians(lat))
+        wy = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * self.scale
+        return (
+            int(round((wx - self.x) * self.extent)),
+            int(round((wy - self.y) * self.extent)),
+        )
+
+
+# --- protobuf ---
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 31)
+
+
+def _key(field: int, wire: int) -> bytes:
+    return _varint((field << 3) | wire)
+
+
+def _len_field(field: int, payload: bytes) -> bytes:
+    return _key(field, _WIRE_LEN) + _varint(len(payload)) + payload
+
+
+def _varint_field(field: int, value: int) -> bytes:
+    return _key(field, _WIRE_VARINT) + _varint(value)
+
+
+def _packed_field(field: int, values: Iterable[int]) -> bytes:
+    return _len_field(field, b"".join(_varint(v) for v in values))
+
+
+def _encode_value(value: Any) -> bytes:
+    """Value: 1 string, 3 double, 4 int64, 6 sint64, 7 bool."""
+    if isinstance(value, bool):
+        return _varint_field(7, 1 if value else 0)
+    if isinstance(value, int):
+        if value < 0:
+            return _varint_field(6, (value << 1) ^ (value >> 63))
+        return _varint_field(4, value)
+    if isinstance(value, float):
+        return _key(3, _WIRE_64BIT) + struct.pack("<d", value)
+    return _len_field(1, str(value).encode("utf-8"))
+
+
+def _mvt_value(value: Any) -> Optional[Any]:
+    """Свойство GeoJSON → скаляр MVT; None и вложенные структуры в тайл не попадают."""
+    if value is None or isinstance(value, (dict, list, tuple)):
+        return None
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+# --- геометрия ---
+
+def _line_command(cmd: int, count: int) -> int:
+    return (cmd & 0x7) | (count << 3)
+
+
+def _dedupe(points: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    out: List[Tuple[int, int]] = []
+    for p in points:
+        if not out or out[-1] != p:
+            out.append(p)
+    return out
+
+
+def _encode_point(p: Tuple[int, int]) -> List[int]:
+    return [_line_command(_CMD_MOVE_TO, 1), _zigzag(p[0]), _zigzag(p[1])]
+
+
+def _encode_linestrings(parts: Sequence[Sequence[Tuple[int, int]]]) -> List[int]:
+    """Одна или несколько частей линии; курсор MVT общий для всех частей геометрии."""
+    out: List[int] = []
+    cx = cy = 0
+    for points in parts:
+        px, py = points[0]
+        out += [_line_command(_CMD_MOVE_TO, 1), _zigzag(px - cx), _zigzag(py - cy)]
+        out.append(_line_command(_CMD_LINE_TO, len(points) - 1))
+        cx, cy = px, py
+        for px, py in points[1:]:
+            out.append(_zigzag(px - cx))
+            out.append(_zigzag(py - cy))
+            cx, cy = px, py
+    return out
+
+
+def _clip_segment(
+    p: Tuple[int, int], q: Tuple[int, int], lo: int, hi: int
+) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """Отрезок p–q, обрезанный квадратом [lo, hi]² (Лян — Барски); None — отрезок вне квадрата."""
+    x0, y0 = p
+    dx, dy = q[0] - x0, q[1] - y0
+    t0, t1 = 0.0, 1.0
+    for pk, qk in ((-dx, x0 - lo), (dx, hi - x0), (-dy, y0 - lo), (dy, hi - y0)):
+        if pk == 0:
+            if qk < 0:
+                return None
+            continue
+        r = qk / pk
+        if pk < 0:
+            if r > t1:
+                return None
+            t0 = max(t0, r)
+        else:
+            if r < t0:
+                return None
+            t1 = min(t1, r)
+    return (
+        (int(round(x0 + t0 * dx)), int(round(y0 + t0 * dy))),
+        (int(round(x0 + t1 * dx)), int(round(y0 + t1 * dy))),
+    )
+
+
+def _clip_linestring(points: Sequence[Tuple[int, int]], lo: int, hi: int) -> List[List[Tuple[int, int]]]:
+    """Части линии внутри квадрата [lo, hi]²: выход за тайл и возврат дают новую часть."""
+    parts: List[List[Tuple[int, int]]] = []
+    current: List[Tuple[int, int]] = []
+    for p, q in zip(points, points[1:]):
+        clipped = _clip_segment(p, q, lo, hi)
+        if clipped is None:
+            if current:
+                parts.append(current)
+            current = []
+            continue
+        a, b = clipped
+        if current and current[-1] == a:
+            current.append(b)
+        else:
+            if current:
+                parts.append(current)
+            current = [a, b]
+    if current:
+        parts.append(current)
+    return [part for part in (_dedupe(part) for part in parts) if len(part) >= 2]
+
+
+def _feature_geometry(
+    geometry: Optional[Dict[str, Any]],
+    project: _TileProjector,
+    lo: int,
+    hi: int,
+) -> Optional[Tuple[int, List[int]]]:
+    if not geometry:
+        return None
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates")
+    if gtype == "Point" and coords:
+        p = project(float(coords[0]), float(coords[1]))
+        if not (lo <= p[0] <= hi and lo <= p[1] <= hi):
+            return None
+        return _GEOM_POINT, _encode_point(p)
+    if gtype == "LineString" and coords:
+        pts = _dedupe([project(float(c[0]), float(c[1])) for c in coords])
+        if len(pts) < 2:
+            return None
+        parts = _clip_linestring(pts, lo, hi)
+        if not parts:
+            return None
+        return _GEOM_LINESTRING, _encode_linestrings(parts)
+    return None
+
+
+def _encode_layer(
+    name: str,
+    features: Iterable[Dict[str, Any]],
+    project: _TileProjector,
+    extent: int,
+    buffer_px: int,
+) -> Optional[bytes]:
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[type, Any], int] = {}
+    encoded_features: List[bytes] = []
+    lo, hi = -buffer_px, extent + buffer_px
+
+    for feature in features:
+        geom = _feature_geometry(feature.get("geometry"), project, lo, hi)
+        if geom is None:
+            continue
+        gtype, commands = geom
+        tags: List[int] = []
+        for k, raw in (feature.get("properties") or {}).items():
+            v = _mvt_value(raw)
+            if v is None:
+                continue
+            ki = keys.setdefault(str(k), len(keys))
+            vi = values.setdefault((type(v), v), len(values))
+            tags.append(ki)
+            tags.append(vi)
+        body = b""
+        fid = (feature.get("properties") or {}).get("id")
+        if isinstance(fid, int) and not isinstance(fid, bool) and fid >= 0:
+            body += _varint_field(1, fid)
+        if tags:
+            body += _packed_field(2, tags)
+        body += _varint_field(3, gtype)
+        body += _packed_field(4, commands)
+        encoded_features.append(_len_field(2, body))
+
+    if not encoded_features:
+        return None
+    out = bytearray()
+    out += _varint_field(15, 2)
+    out += _len_field(1, name.encode("utf-8"))
+    for f in encoded_features:
+        out += f
+    for k in keys:
+        out += _len_field(3, k.encode("utf-8"))
+    for (_, v) in values:
+        out += _len_field(4, _encode_value(v))
+    out += _varint_field(5, extent)
+    return bytes(out)
+
+
+def encode_vector_tile(
+    layers: Iterable[Tuple[str, Iterable[Dict[str, Any]]]],
+    z: int,
+    x: int,
+    y: int,
+    extent: int = DEFAULT_EXTENT,
+    buffer: float = DEFAULT_BUFFER,
+) -> bytes:
+    """Собрать тайл из пар (имя слоя, фичи GeoJSON). Пустые слои не пишутся; пустой тайл — b""."""
+    project = _TileProjector(z, x, y, extent)
+    buffer_px = int(round(buffer * extent))
+    out = bytearray()
+    for name, features in layers:
+        layer = _encode_layer(name, features, project, extent, buffer_px)
+        if layer is not None:
+            out += _len_field(3, layer)
+    return bytes(out)
@@ -591,6 +591,25 @@ async def init_db():
                 """))
                 await conn.execute(text('CREATE INDEX IF NOT EXISTS idx_line_substation_start_id ON "line"(substation_start_id)'))
                 await conn.execute(text('CREATE INDEX IF NOT EXISTS idx_line_substation_end_id ON "line"(substation_end_id)'))
+                # Выборка слоёв карты по bbox (alembic 20261016_100000)
+                await conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_position_point_xy_gist "
+                    "ON position_point USING gist (point(x_position, y_position))"
+                ))
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_position_point_location_id ON position_point (location_id)"))
+                # Свёртки слоя опор по опоре (alembic 20261016_110000)
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_equipment_pole_id ON equipment (pole_id)"))
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_connectivity_node_pole_id ON connectivity_node (pole_id)"))
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pole_tap_pole_id ON pole (tap_pole_id)"))
+                # Ревизии курсорной синхронизации: последовательность, колонки, триггеры (alembic 20261017_100000, 20261018_100000)
+                from app.core.sync_revision import sync_revision_ddl
+
+                for statement in sync_revision_ddl():
+                    await conn.execute(text(statement))
+                # Фильтр области подписки sync/download (alembic 20261017_110000)
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pole_line_id ON pole (line_id)"))
+                await conn.execute(text('CREATE INDEX IF NOT EXISTS ix_line_branch_id ON "line" (branch_id)'))
+                await conn.execute(text('CREATE INDEX IF NOT EXISTS ix_line_region_id ON "line" (region_id)'))
                 await conn.execute(text("""
                     DO $$
                     BEGIN
@@ -72,6 +72,15 @@ async def lifespan(app: FastAPI):
         print(f"Приложение не может быть запущено без подключения к БД.")
         raise
     log_media_storage_mode()
+    # Задания sync/upload, чьи inline-задачи пропали с прошлым процессом (app.core.sync_jobs)
+    try:
+        from app.core.sync_jobs import requeue_stale_jobs
+        from app.database import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as db:
+            await requeue_stale_jobs(db)
+    except Exception as e:
+        print(f"WARNING: не удалось перезапустить потерянные задания sync/upload: {e}")
     from app.core.export_deps import log_passport_export_dependencies
 
     log_passport_export_dependencies()
@@ -98,6 +107,9 @@ async def lifespan(app: FastAPI):
             await http_osm.aclose()
         except Exception:
             pass
+    from app.core.tile_store import close_tile_stores
+
+    close_tile_stores()
     set_redis_client(None)
     set_redis_binary_client(None)
     if redis_binary_client:
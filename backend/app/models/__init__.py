@@ -17,6 +17,9 @@ from .location import Location, PositionPoint, LocationType
 from .patrol_session import PatrolSession
 from .change_log import ChangeLog
 from .sync_client_mapping import SyncClientMapping
+from .sync_tombstone import SyncTombstone
+from .sync_upload_ledger import SyncUploadBatch, SyncUploadRecord
+from .sync_upload_job import SyncUploadJob
 from .equipment_catalog import EquipmentCatalogItem
 from .line_conductor_catalog import LineConductorCatalogItem
 from .tech_passport import TechPassport
@@ -51,6 +54,10 @@ __all__ = [
     "PatrolSession",
     "ChangeLog",
     "SyncClientMapping",
+    "SyncTombstone",
+    "SyncUploadBatch",
+    "SyncUploadRecord",
+    "SyncUploadJob",
     "EquipmentCatalogItem",
     "LineConductorCatalogItem",
     "TechPassport",
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, FetchedValue
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -23,6 +23,8 @@ class EquipmentCatalogItem(Base):
     created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), nullable=True)
+    # Ревизия синхронизации: выставляет триггер БД при каждой записи (app.core.sync_revision)
+    sync_revision = Column(BigInteger, nullable=True, index=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
     equipment = relationship("Equipment", back_populates="catalog_item")
 
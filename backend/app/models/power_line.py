@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, FetchedValue
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship, remote
 from app.database import Base
@@ -35,6 +35,8 @@ class PowerLine(Base, ConnectivityNodeContainer):
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     status = Column(String(20), default="active")  # active, inactive, maintenance
     # description, created_at, updated_at - наследуются от IdentifiedObject
+    # Ревизия синхронизации: выставляет триггер БД при каждой записи (app.core.sync_revision)
+    sync_revision = Column(BigInteger, nullable=True, index=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
     # Подстанции в начале и конце линии (для автосборки пролётов ПС↔опора при пересборке топологии)
     substation_start_id = Column(Integer, ForeignKey("substation.id"), nullable=True)
@@ -124,6 +126,8 @@ class Pole(Base):
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Ревизия синхронизации: выставляет триггер БД при каждой записи (app.core.sync_revision)
+    sync_revision = Column(BigInteger, nullable=True, index=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
     # Связи
     # lazy='selectin' предотвращает ленивую загрузку в async контексте
@@ -389,6 +393,8 @@ class Equipment(Base):
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Ревизия синхронизации: выставляет триггер БД при каждой записи (app.core.sync_revision)
+    sync_revision = Column(BigInteger, nullable=True, index=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
 
     # Направление от опоры для отрисовки на карте (градусы 0–360; если задано — участок до оборудования в этом направлении)
     direction_angle = Column(Float, nullable=True)
@@ -0,0 +1,23 @@
+"""Надгробия удалённых сущностей для курсорной синхронизации (пишет триггер БД, app.core.sync_revision)."""
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, String
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class SyncTombstone(Base):
+    __tablename__ = "sync_tombstone"
+
+    # Номер из sync_revision_seq — общий с колонкой sync_revision сущностей
+    sync_revision = Column(BigInteger, primary_key=True, autoincrement=False)
+    entity_type = Column(String(32), nullable=False)  # power_line | pole | equipment | equipment_catalog
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # ЛЭП удалённой строки (фильтр подписки sync/download); NULL — надгробие для всех
+    line_id = Column(Integer, nullable=True)
+    # Строка не удалена, а перенесена на ЛЭП moved_to_line_id: надгробие только для областей без неё
+    moved = Column(Boolean, nullable=False, default=False, server_default="false")
+    moved_to_line_id = Column(Integer, nullable=True)
+    # Смена филиала/региона ЛЭП (moved_to_line_id = line_id): прежние значения — для областей, где их нет
+    moved_from_branch_id = Column(Integer, nullable=True)
+    moved_from_region_id = Column(Integer, nullable=True)
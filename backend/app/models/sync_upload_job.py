@@ -0,0 +1,31 @@
+"""Фоновая обработка крупного пакета sync/upload (app.core.sync_jobs): пакет, прогресс и итоговый SyncResponse."""
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class SyncUploadJob(Base):
+    __tablename__ = "sync_upload_job"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, nullable=False)
+    batch_id = Column(String(64), nullable=False)
+    status = Column(String(16), nullable=False, default="queued")  # queued | running | done | failed
+    total = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)
+    # Пакет (SyncBatch в JSON) — до завершения задания, затем очищается
+    payload = Column(JSONB, nullable=True)
+    response = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # Пульс: старт, перестановка в очередь, прогресс — от него отсчитывается потерянное задание
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "batch_id", name="uq_sync_upload_job_user_batch"),
+        Index("ix_sync_upload_job_created_at", "created_at"),
+    )
@@ -0,0 +1,48 @@
+"""Журнал идемпотентности sync/upload: повтор пакета или записи не применяется к данным повторно.
+
+Пишется в той же транзакции, что и изменения пакета; записи старше SYNC_IDEMPOTENCY_TTL_HOURS
+удаляются (app.core.sync_idempotency).
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, String, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import func
+
+from app.database import Base
+
+
+class SyncUploadBatch(Base):
+    """Принятый пакет: сохранённый SyncResponse отдаётся повторно на тот же batch_id."""
+
+    __tablename__ = "sync_upload_batch"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    batch_id = Column(String(64), nullable=False)
+    response = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "batch_id", name="uq_sync_upload_batch_user_batch"),
+        Index("ix_sync_upload_batch_created_at", "created_at"),
+    )
+
+
+class SyncUploadRecord(Base):
+    """Применённая запись пакета и её результат (серверный id для локального) — для повтора в другом пакете."""
+
+    __tablename__ = "sync_upload_record"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    record_id = Column(String(64), nullable=False)
+    batch_id = Column(String(64), nullable=False)
+    entity_type = Column(String(32), nullable=False)
+    action = Column(String(16), nullable=False)
+    client_id = Column(Integer, nullable=True)  # локальный (отрицательный) id созданной сущности
+    server_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "record_id", name="uq_sync_upload_record_user_record"),
+        Index("ix_sync_upload_record_created_at", "created_at"),
+    )
@@ -24,6 +24,11 @@ class SyncRecord(BaseModel):
     device_id: Optional[str] = None
     status: SyncStatus = SyncStatus.PENDING
     error_message: Optional[str] = None
+    # Ревизия строки (revision из sync/download), на которую опирается правка. С ней update — патч:
+    # в data только изменённые поля; устаревший патч сливается по полям (app.core.sync_conflicts)
+    base_revision: Optional[int] = None
+    # Значения изменённых полей до правки на устройстве (для слияния с правками на сервере)
+    base: Optional[Dict[str, Any]] = None
 
 class SyncBatch(BaseModel):
     """Пакет записей для синхронизации"""
@@ -41,6 +46,10 @@ class SyncResponse(BaseModel):
     timestamp: datetime
     # Маппинг локальных id → серверные (для обновления клиента: pole_server_id и сброса needsSync)
     id_mapping: Optional[Dict[str, Dict[str, int]]] = None  # {"pole": {"-34": 101}, "power_line": {"-5": 10}}
+    # Поля устаревших патчей, оставшиеся серверными: [{"record_id", "entity_type", "entity_id", "fields": […]}]
+    conflicts: List[Dict[str, Any]] = []
+    # Ревизии созданных / изменённых строк после пакета — base_revision для следующих правок
+    revisions: Optional[Dict[str, Dict[str, int]]] = None  # {"pole": {"101": 5012}}
 
 # JSON Schema для валидации данных
 # branch_id и region_id не обязательны — мобильное приложение может создавать ЛЭП без филиала/региона
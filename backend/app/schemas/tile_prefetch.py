@@ -0,0 +1,39 @@
+"""Схемы прогрева кэша тайлов карты (map_tile_cache, app.core.tile_prefetch)."""
+from typing import List, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+
+class TilePrefetchRequest(BaseModel):
+    # Без bbox и corridor_m — границы всех данных (как GET /map/bounds)
+    bbox: Optional[str] = Field(None, description="minLon,minLat,maxLon,maxLat")
+    min_zoom: int = Field(8, ge=0, le=19)
+    max_zoom: int = Field(15, ge=0, le=19)
+    concurrency: int = Field(4, ge=1, le=32)
+    # Коридор вдоль ЛЭП: тайлы в пределах corridor_m метров от пролётов (bbox — дополнительный фильтр)
+    corridor_m: Optional[float] = Field(None, gt=0, le=10000)
+    line_ids: Optional[List[int]] = None  # только эти ЛЭП (режим коридора)
+
+    @model_validator(mode="after")
+    def _zoom_range(self):
+        if self.min_zoom > self.max_zoom:
+            raise ValueError("min_zoom больше max_zoom")
+        return self
+
+
+class TilePrefetchJobResponse(BaseModel):
+    id: str
+    mode: str  # bbox | bounds | corridor
+    min_zoom: int
+    max_zoom: int
+    total: int
+    concurrency: int
+    status: str  # running | done | cancelled | failed
+    done: int
+    cached: int  # уже были в Redis или офлайн-подложке
+    loaded: int  # загружены в кэш
+    failed: int
+    progress: float
+    started_at: float
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
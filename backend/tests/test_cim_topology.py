@@ -0,0 +1,42 @@
+import asyncio
+
+from sqlalchemy.sql import Delete, Select, Update
+
+from app.core.cim_topology import canonical_connectivity_node_map, merge_duplicate_connectivity_nodes
+
+
+def test_duplicates_map_to_lowest_id_per_pole():
+    nodes = [(9, 10), (3, 10), (1, 10), (7, 11), (2, None), (4, None)]
+    assert canonical_connectivity_node_map(nodes) == {3: 1, 9: 1}
+
+
+def test_no_duplicates_gives_empty_map():
+    assert canonical_connectivity_node_map([(1, 10), (2, 11), (3, None)]) == {}
+
+
+class _RecordingSession:
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        nodes = self.nodes
+
+        class _Result:
+            def all(self):
+                return nodes if isinstance(statement, Select) else []
+
+        return _Result()
+
+    async def flush(self):
+        pass
+
+
+def test_merge_keeps_session_objects_in_sync():
+    db = _RecordingSession([(1, 10), (3, 10), (7, 11)])
+    assert asyncio.run(merge_duplicate_connectivity_nodes(db, 5)) == 1
+    writes = [s for s in db.statements if isinstance(s, (Update, Delete))]
+    # Ссылки (6 колонок) и удаление дубликатов: загруженные объекты не остаются со старыми id
+    assert len(writes) == 7
+    assert all(s.get_execution_options().get("synchronize_session") == "fetch" for s in writes)
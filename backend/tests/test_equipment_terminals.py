@@ -0,0 +1,27 @@
+"""Сравнение нужных терминалов оборудования с имеющимися (sync_equipment_terminals_for_line)."""
+from app.core.cim_connectivity import ExistingTerminal, diff_equipment_terminals
+
+
+def test_unchanged_terminals_are_kept():
+    desired = [(5, 100, 1, "from"), (5, 101, 2, "to")]
+    existing = [
+        ExistingTerminal(1, (5, 100, 1, "from"), "T1", "equipment_id=5", 5),
+        ExistingTerminal(2, (5, 101, 2, "to"), "T2", "equipment_id=5", 5),
+    ]
+    diff = diff_equipment_terminals(desired, existing)
+    assert (diff.insert, diff.update, diff.delete) == ([], [], [])
+
+
+def test_moved_duplicate_and_legacy_terminals():
+    desired = [(5, 100, 1, "from"), (5, 102, 2, "to"), (6, 100, 1, "both")]
+    existing = [
+        ExistingTerminal(1, (5, 100, 1, "from"), "T1", "equipment_id=5", 5),
+        ExistingTerminal(2, (5, 101, 2, "to"), "T2", "equipment_id=5", 5),  # сосед сменился
+        ExistingTerminal(3, (5, 100, 1, "from"), "T1", "equipment_id=5", 5),  # дубликат
+        ExistingTerminal(4, (6, 100, 1, "both"), "T1", "equipment_id=6", None),  # id только в описании
+        ExistingTerminal(7, None, "T1", None, None),
+    ]
+    diff = diff_equipment_terminals(desired, existing)
+    assert diff.insert == [(5, 102, 2, "to")]
+    assert diff.update == [(4, (6, 100, 1, "both"))]
+    assert diff.delete == [2, 3, 7]
@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+
+from app.core.geodesy import (
+    chain_length_m,
+    cumulative_lengths_m,
+    haversine_array_m,
+    haversine_m,
+    nearest_index,
+    nearest_neighbour_order,
+    pair_lengths_m,
+)
+
+
+def test_array_matches_scalar_haversine():
+    lat1, lon1 = np.array([53.0, 53.9, -10.0]), np.array([27.0, 27.56, 100.0])
+    lat2, lon2 = np.array([53.001, 52.4, -10.0]), np.array([27.0, 31.0, 100.0])
+    expected = [haversine_m(*args) for args in zip(lat1, lon1, lat2, lon2)]
+    assert np.allclose(haversine_array_m(lat1, lon1, lat2, lon2), expected)
+    # 0.001° широты ≈ 111 м
+    assert round(expected[0]) == 111
+    assert expected[2] == 0.0
+
+
+def test_pair_lengths_without_coordinates_are_none():
+    lengths = pair_lengths_m([((53.0, 27.0), (53.001, 27.0)), ((None, 27.0), (53.0, 27.0))])
+    assert round(lengths[0]) == 111
+    assert lengths[1] is None
+    assert pair_lengths_m([]) == []
+
+
+def test_chain_and_cumulative_lengths():
+    lats, lons = [53.0, 53.001, 53.002, 53.002], [27.0, 27.0, 27.0, 27.002]
+    cumulative = cumulative_lengths_m(lats, lons)
+    assert cumulative[0] == 0.0 and len(cumulative) == 4
+    assert math.isclose(cumulative[-1], chain_length_m(zip(lats, lons)))
+    # Точка без координат пропускается — ломаная идёт от предыдущей
+    assert math.isclose(chain_length_m([(53.0, 27.0), (None, None), (53.002, 27.0)]), haversine_m(53.0, 27.0, 53.002, 27.0))
+    assert chain_length_m([(53.0, 27.0)]) == 0.0
+
+
+def test_nearest_index_and_order():
+    lats = np.array([53.0, 53.003, 53.001, np.nan, 53.002])
+    lons = np.array([27.0, 27.0, 27.0, 27.0, 27.0])
+    assert nearest_index(53.0, 27.0, lats, lons, exclude=[True, False, False, False, False]) == 2
+    assert nearest_index(53.0, 27.0, lats, lons, exclude=[True, True, True, True, True]) is None
+    # Точка без координат в обход не попадает
+    assert nearest_neighbour_order(lats, lons) == [0, 2, 4, 1]
+    assert nearest_neighbour_order(lats, lons, start=1) == [1, 4, 2, 0]
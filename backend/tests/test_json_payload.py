@@ -0,0 +1,58 @@
+"""Готовые JSON-ответы: сжатие, ETag, выбор Content-Encoding."""
+import gzip
+import json
+
+from app.core.json_payload import (
+    IDENTITY,
+    JSONPayload,
+    build_json_payload,
+    choose_content_encoding,
+    dumps_json_bytes,
+    etag_matches,
+)
+
+
+def test_dumps_json_bytes_roundtrip_unicode():
+    data = {"type": "FeatureCollection", "features": [{"properties": {"name": "ЛЭП-10 кВ", "id": 1}}]}
+    assert json.loads(dumps_json_bytes(data)) == data
+
+
+def test_small_body_is_not_compressed():
+    payload = build_json_payload(b'{"a":1}')
+    assert set(payload.bodies) == {IDENTITY}
+
+
+def test_gzip_variant_and_stable_etag():
+    body = dumps_json_bytes({"features": [{"id": i, "name": "опора"} for i in range(200)]})
+    p1 = build_json_payload(body, encodings=("gzip",))
+    p2 = build_json_payload(body, encodings=("gzip",))
+    assert gzip.decompress(p1.bodies["gzip"]) == body
+    assert p1.etag == p2.etag
+    assert p1.etag != build_json_payload(body + b" ").etag
+
+
+def test_redis_mapping_roundtrip():
+    payload = build_json_payload(b"[" + b"1," * 1000 + b"1]", encodings=("gzip",))
+    raw = {k.encode(): v for k, v in payload.to_redis_mapping().items()}
+    assert JSONPayload.from_redis_mapping(raw) == payload
+    assert JSONPayload.from_redis_mapping({}) is None
+    assert JSONPayload.from_redis_mapping({b"identity": b"[]"}) is None
+
+
+def test_choose_content_encoding():
+    assert choose_content_encoding(None, ["gzip"]) == IDENTITY
+    assert choose_content_encoding("gzip, deflate, br", ["br", "gzip"]) == "br"
+    assert choose_content_encoding("gzip;q=0.5, br;q=0.1", ["br", "gzip"]) == "gzip"
+    assert choose_content_encoding("br;q=0", ["br"]) == IDENTITY
+    assert choose_content_encoding("*", ["gzip"]) == "gzip"
+    assert choose_content_encoding("gzip", []) == IDENTITY
+
+
+def test_etag_matches_weak_and_lists():
+    etag = 'W/"abc"'
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"abd"', etag)
@@ -0,0 +1,75 @@
+"""Упрощение геометрии ЛЭП по zoom (Douglas–Peucker с рангами вершин)."""
+import math
+
+from app.core.line_simplify import (
+    SIMPLIFY_ZOOM_LEVELS,
+    douglas_peucker_ranks,
+    simplification_level,
+    simplify_coords,
+    simplify_features,
+    simplify_features_by_level,
+)
+
+
+def _classic_dp(points, tol):
+    """Эталонный рекурсивный Douglas–Peucker."""
+    from app.core.line_simplify import _segment_distance
+
+    if len(points) < 3:
+        return list(range(len(points)))
+    keep = {0, len(points) - 1}
+
+    def rec(first, last):
+        best_i, best_d = None, -1.0
+        for i in range(first + 1, last):
+            d = _segment_distance(points[i], points[first], points[last])
+            if d > best_d:
+                best_i, best_d = i, d
+        if best_i is not None and best_d > tol:
+            keep.add(best_i)
+            rec(first, best_i)
+            rec(best_i, last)
+
+    rec(0, len(points) - 1)
+    return sorted(keep)
+
+
+def test_ranks_match_classic_douglas_peucker():
+    points = [(i / 10.0, math.sin(i / 3.0) * (i % 7) / 10.0) for i in range(60)]
+    ranks = douglas_peucker_ranks(points)
+    for tol in (0.0, 0.01, 0.05, 0.1, 0.3, 1.0):
+        assert [i for i, r in enumerate(ranks) if r > tol] == _classic_dp(points, tol)
+
+
+def test_simplification_level():
+    assert simplification_level(None) is None
+    assert simplification_level(3) == SIMPLIFY_ZOOM_LEVELS[0]
+    assert simplification_level(SIMPLIFY_ZOOM_LEVELS[1]) == SIMPLIFY_ZOOM_LEVELS[1]
+    assert simplification_level(SIMPLIFY_ZOOM_LEVELS[-1] + 1) is None
+
+
+def test_straight_line_collapses_to_endpoints():
+    coords = [[27.0 + i * 0.001, 53.0 + i * 0.001] for i in range(100)]
+    out = simplify_coords(coords, 8)
+    assert out == [coords[0], coords[-1]]
+
+
+def test_overview_drops_vertices_but_detail_keeps_them():
+    # Зигзаг ~50 м: на обзоре исчезает, на zoom 13 остаётся
+    coords = [[27.0 + i * 0.002, 53.0 + (0.0005 if i % 2 else 0.0)] for i in range(50)]
+    assert len(simplify_coords(coords, 5)) == 2
+    assert len(simplify_coords(coords, 13)) == len(coords)
+
+
+def test_features_by_level_matches_single_level_and_keeps_points():
+    line = {
+        "type": "Feature",
+        "properties": {"id": 1},
+        "geometry": {"type": "LineString", "coordinates": [[27.0 + i * 0.01, 53.0 + (i % 3) * 0.001] for i in range(30)]},
+    }
+    point = {"type": "Feature", "properties": {"id": 2}, "geometry": None}
+    by_level = simplify_features_by_level([line, point])
+    for level in SIMPLIFY_ZOOM_LEVELS:
+        assert by_level[level] == simplify_features([line, point], level)
+        assert by_level[level][1] is point
+    assert line["geometry"]["coordinates"][1] == [27.01, 53.001]
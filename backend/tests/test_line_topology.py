@@ -0,0 +1,147 @@
+from app.core.line_topology import LineTopology, TopoNode, TopoPole, TopoSpan
+
+
+def _topology(poles, spans=(), segments=()):
+    nodes = [
+        TopoNode(id=100 + p.id, line_id=1, pole_id=p.id, is_virtual=True, display_name=f"Опора {p.pole_number}")
+        for p in poles
+    ]
+    return LineTopology(1, "Л-1", 10.0, user_id=7, poles=poles, nodes=nodes, segments=segments, spans=spans)
+
+
+def _main(n, extra=None):
+    extra = extra or {}
+    return [
+        TopoPole(**{"id": i, "pole_number": str(i), "line_id": 1, "sequence_number": i, "lat": 53.0 + i * 0.001, "lon": 27.0, **extra.get(i, {})})
+        for i in range(1, n + 1)
+    ]
+
+
+def _pairs(ids):
+    return list(zip(ids, ids[1:]))
+
+
+def test_main_chain_sections_split_by_conductor():
+    poles = _main(5, {i: {"conductor_type": "AC-50" if i < 3 else "AC-70"} for i in range(1, 6)})
+    topo = _topology(poles)
+    spans = topo.plan_span_pairs(_pairs([1, 2, 3, 4, 5]))
+
+    assert [s.span_number for s in spans] == ["Пролёт оп.1-оп.2", "Пролёт оп.2-оп.3", "Пролёт оп.3-оп.4", "Пролёт оп.4-оп.5"]
+    assert len(topo.segments) == 1
+    seg = topo.segments[0]
+    assert seg.name == "Опора 1 - Опора 5"
+    assert seg.to_node.pole_id == 5
+    assert [(ls.conductor_type, len(ls.spans), ls.sequence_number) for ls in seg.sections] == [("AC-50", 2, 1), ("AC-70", 2, 2)]
+    assert [s.sequence_number for s in spans] == [1, 2, 1, 2]
+    assert abs(seg.length - sum(s.length for s in spans) / 1000.0) < 1e-9
+    assert round(spans[0].length) == 111
+
+
+def test_switching_equipment_starts_new_segment():
+    poles = _main(4, {3: {"switching": ["РЛНД-10"]}})
+    topo = _topology(poles)
+    topo.plan_span_pairs(_pairs([1, 2, 3, 4]))
+
+    assert [(s.from_node.pole_id, s.to_node.pole_id) for s in topo.segments] == [(1, 3), (3, 4)]
+    assert [s.sequence_number for s in topo.segments] == [1, 2]
+
+
+def test_tap_branch_gets_own_numbered_segment():
+    poles = _main(4, {3: {"is_tap_pole": True}}) + [
+        TopoPole(id=11, pole_number="3/1", line_id=1, sequence_number=1, tap_pole_id=3, tap_branch_index=1, lat=53.0, lon=27.01),
+        TopoPole(id=12, pole_number="3/2", line_id=1, sequence_number=2, tap_pole_id=3, tap_branch_index=1, lat=53.0, lon=27.02),
+    ]
+    topo = _topology(poles)
+    topo.plan_span_pairs(_pairs([1, 2, 3, 4]) + [(3, 11), (11, 12)])
+
+    tap = [s for s in topo.segments if s.is_tap]
+    assert len(tap) == 1
+    assert tap[0].tap_number == "3/1"
+    assert tap[0].branch_type == "tap"
+    assert (tap[0].from_node.pole_id, tap[0].to_node.pole_id) == (3, 12)
+    main = [(s.from_node.pole_id, s.to_node.pole_id) for s in topo.segments if not s.is_tap]
+    assert main == [(1, 3), (3, 4)]
+
+
+def test_preserve_skips_existing_pairs_and_creates_missing_nodes():
+    poles = _main(3)
+    existing = TopoSpan(id=55, line_id=1, from_pole_id=1, to_pole_id=2, length=100.0)
+    topo = LineTopology(1, "Л-1", 10.0, user_id=7, poles=poles, spans=[existing])
+    spans = topo.plan_span_pairs(_pairs([1, 2, 3]))
+
+    assert [(s.from_pole_id, s.to_pole_id) for s in spans] == [(2, 3)]
+    assert not topo.deleted_spans
+    # Узлов не было — созданы виртуальные, подпись по номеру опоры
+    assert [(n.id, n.pole_id, n.display_name) for n in topo.nodes] == [(None, 3, "Опора 3"), (None, 2, "Опора 2")]
+
+
+def _persisted(spans):
+    for i, sp in enumerate(spans, start=1):
+        sp.id = 500 + i
+    return spans
+
+
+def test_incremental_insert_replaces_only_neighbouring_span():
+    poles = _main(3)
+    first, old = _persisted(_topology(poles).plan_span_pairs(_pairs([1, 2, 3])))
+    section = first.section
+    # Опора 4 вставлена между 2 и 3: номер 3, опора 3 сдвинулась на 4
+    poles[2].sequence_number = 4
+    inserted = TopoPole(id=4, pole_number="2а", line_id=1, sequence_number=3, lat=53.0025, lon=27.0)
+    topo = _topology(poles + [inserted], segments=[section.segment])
+
+    planned = topo.plan_incremental([4])
+
+    assert [(s.from_pole_id, s.to_pole_id) for s in planned] == [(2, 4), (4, 3)]
+    assert topo.deleted_spans == [old]
+    assert all(s.section is section for s in planned)
+    assert [(s.from_pole_id, s.to_pole_id, s.sequence_number) for s in section.spans] == [(1, 2, 1), (2, 4, 2), (4, 3, 3)]
+    assert not first.dirty
+    assert section.name == "Опора 1 - Опора 3 (AC-70)"
+    assert abs(section.total_length - sum(s.length for s in section.spans) / 1000.0) < 1e-9
+
+
+def test_incremental_move_recomputes_adjacent_lengths():
+    poles = _main(4)
+    topo = _topology(poles)
+    spans = _persisted(topo.plan_span_pairs(_pairs([1, 2, 3, 4])))
+    before = [s.length for s in spans]
+
+    topo.poles[2].lon = 27.001
+    assert topo.plan_incremental([2]) == []
+
+    assert [s.dirty for s in spans] == [True, True, False]
+    assert spans[0].length > before[0] and spans[2].length == before[2]
+    assert not topo.deleted_spans
+
+
+def test_incremental_renumber_reconnects_old_neighbours():
+    poles = _main(4)
+    topo = _topology(poles)
+    spans = _persisted(topo.plan_span_pairs(_pairs([1, 2, 3, 4])))
+    section = spans[0].section
+    # Опора 2 перенумерована в конец цепочки: 1–3–4–2
+    topo.poles[2].sequence_number = 5
+
+    planned = topo.plan_incremental([2])
+
+    assert sorted((s.from_pole_id, s.to_pole_id) for s in planned) == [(1, 3), (4, 2)]
+    assert sorted((s.from_pole_id, s.to_pole_id) for s in topo.deleted_spans) == [(1, 2), (2, 3)]
+    assert [(s.from_pole_id, s.to_pole_id) for s in section.spans] == [(1, 3), (3, 4), (4, 2)]
+    assert [s.sequence_number for s in section.spans] == [1, 2, 3]
+
+
+def test_incremental_conductor_change_moves_span_to_new_section():
+    poles = _main(3)
+    topo = _topology(poles)
+    spans = _persisted(topo.plan_span_pairs(_pairs([1, 2, 3])))
+    old_section = spans[1].section
+    topo.poles[2].conductor_type = "AC-95"
+
+    assert topo.plan_incremental([2]) == []
+
+    moved = spans[1]
+    assert moved.dirty and moved.section is not old_section
+    assert moved.section.conductor_type == "AC-95" and moved.conductor_type == "AC-95"
+    assert [s.id for s in old_section.spans] == [spans[0].id]
+    assert old_section.segment.sections == [old_section, moved.section]
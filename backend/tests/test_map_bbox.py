@@ -0,0 +1,53 @@
+"""Окно карты (bbox/zoom) для слоёв GeoJSON."""
+import pytest
+
+from app.core.map_bbox import MapBBox, layer_visible_at_zoom, parse_bbox
+
+
+def test_parse_bbox_empty_is_none():
+    assert parse_bbox(None) is None
+    assert parse_bbox("  ") is None
+
+
+def test_parse_bbox_clamps_world_wrap():
+    b = parse_bbox("-200,50.5,30.1,95")
+    assert b == MapBBox(min_lon=-180.0, min_lat=50.5, max_lon=30.1, max_lat=90.0)
+
+
+@pytest.mark.parametrize("raw", ["1,2,3", "a,b,c,d", "30,55,29,56", "nan,1,2,3"])
+def test_parse_bbox_rejects_invalid(raw):
+    with pytest.raises(ValueError):
+        parse_bbox(raw)
+
+
+def test_bbox_contains_edges():
+    b = MapBBox(27.0, 53.0, 28.0, 54.0)
+    assert b.contains(27.0, 53.0)
+    assert b.contains(27.5, 53.5)
+    assert not b.contains(28.1, 53.5)
+    assert not b.contains(None, 53.5)
+
+
+def test_bbox_overlaps_segment_crossing_view():
+    b = MapBBox(27.0, 53.0, 28.0, 54.0)
+    # Оба конца вне окна, отрезок проходит насквозь
+    assert b.overlaps_segment(26.5, 53.5, 28.5, 53.6)
+    assert b.overlaps_segment(27.5, 53.5, 29.0, 55.0)
+    assert not b.overlaps_segment(28.1, 53.0, 29.0, 54.0)
+
+
+def test_bbox_expanded_keeps_near_span_ends():
+    b = MapBBox(27.0, 53.0, 28.0, 54.0)
+    near = b.expanded(2000)
+    # Концы пролёта в 1.5 км от краёв окна — в окне с запасом 2 км, в 3 км — нет
+    assert near.contains(27.0 - 1500 / (111320 * 0.588), 53.5)
+    assert near.contains(27.5, 54.0 + 1500 / 111320)
+    assert not near.contains(27.5, 54.0 + 3000 / 111320)
+    assert MapBBox(-180.0, -90.0, 180.0, 90.0).expanded(2000) == MapBBox(-180.0, -90.0, 180.0, 90.0)
+
+
+def test_layer_min_zoom():
+    assert layer_visible_at_zoom("poles", None)
+    assert not layer_visible_at_zoom("poles", 8)
+    assert layer_visible_at_zoom("poles", 14)
+    assert layer_visible_at_zoom("power-lines", 3)
@@ -0,0 +1,51 @@
+"""Серверная кластеризация точечных слоёв карты."""
+from app.core.map_clusters import (
+    CLUSTER_MAX_ZOOM,
+    MAP_CLUSTER_LAYERS,
+    build_cluster_levels,
+    cluster_zoom,
+)
+
+
+def _pole(pid, lon, lat, criticality=None, defect=False):
+    props = {"id": pid, "has_equipment_defect": defect}
+    if criticality:
+        props["criticality"] = criticality
+    return {"type": "Feature", "properties": props, "geometry": {"type": "Point", "coordinates": [lon, lat]}}
+
+
+def test_cluster_zoom():
+    assert cluster_zoom(None) is None
+    assert cluster_zoom(5) == 5
+    assert cluster_zoom(CLUSTER_MAX_ZOOM + 1) is None
+
+
+def test_counts_and_worst_criticality_are_preserved_on_every_level():
+    # Две группы опор: у Минска и у Гродно
+    poles = [_pole(i, 27.5 + i * 0.0005, 53.9, "low" if i == 3 else None, defect=i == 3) for i in range(20)]
+    poles += [_pole(100 + i, 23.8 + i * 0.0005, 53.7, "high" if i == 5 else None, defect=i == 5) for i in range(10)]
+    poles.append({"type": "Feature", "properties": {"id": 999}, "geometry": None})
+    levels = build_cluster_levels(poles, MAP_CLUSTER_LAYERS["poles"])
+    for zoom, feats in levels.items():
+        total = sum(f["properties"].get("point_count", 1) for f in feats)
+        assert total == 30, zoom
+    low = levels[6]
+    assert len(low) == 2
+    by_count = {f["properties"]["point_count"]: f["properties"] for f in low}
+    assert by_count[20]["criticality"] == "low" and by_count[20]["defect_count"] == 1
+    assert by_count[10]["criticality"] == "high"
+    assert by_count[10]["cluster"] is True
+
+
+def test_isolated_point_keeps_original_feature():
+    lone = _pole(1, 30.0, 55.0)
+    levels = build_cluster_levels([lone, _pole(2, 24.0, 52.0)], MAP_CLUSTER_LAYERS["poles"], zooms=(8,))
+    assert lone in levels[8]
+
+
+def test_partial_levels_match_full_build():
+    poles = [_pole(i, 27.5 + i * 0.003, 53.9 + (i % 3) * 0.002) for i in range(40)]
+    full = build_cluster_levels(poles, MAP_CLUSTER_LAYERS["poles"])
+    zoom = 9
+    partial = build_cluster_levels(poles, MAP_CLUSTER_LAYERS["poles"], [z for z in full if z >= zoom])
+    assert partial[zoom] == full[zoom]
@@ -0,0 +1,121 @@
+"""Фрагменты слоёв карты по ЛЭП в Redis: свой TTL на фрагмент, точечная инвалидация."""
+import asyncio
+
+import pytest
+
+from app.core import map_geojson_cache as cache
+from app.core.config import settings
+from app.core.redis_client import set_redis_binary_client, set_redis_client
+
+
+class _FakeRedis:
+    """Словарь вместо Redis: значения и TTL ключей (только используемые кэшем команды)."""
+
+    def __init__(self):
+        self.values = {}
+        self.ttl = {}
+        self.manifest = set()
+
+    async def smembers(self, key):
+        return set(self.manifest)
+
+    async def sadd(self, key, *members):
+        self.manifest.update(members)
+
+    async def expire(self, key, seconds):
+        self.ttl[key] = seconds
+
+    async def mget(self, keys):
+        return [self.values.get(k) for k in keys]
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    async def set(self, key, value, ex=None, nx=False):
+        self.values[key] = value
+        self.ttl[key] = ex
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.ttl.pop(key, None)
+            if key == cache._LINE_MANIFEST_KEY:
+                self.manifest.clear()
+
+    async def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+    async def scan_iter(self, match, count=None):
+        prefix = match.rstrip("*")
+        for key in list(self.values):
+            if key.startswith(prefix):
+                yield key
+
+
+class _FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    async def execute(self):
+        for key, value, ex in self.commands:
+            await self.client.set(key, value, ex=ex)
+
+
+@pytest.fixture
+def redis():
+    client = _FakeRedis()
+    set_redis_client(client)
+    set_redis_binary_client(client)
+    yield client
+    set_redis_client(None)
+    set_redis_binary_client(None)
+
+
+def _loader(calls):
+    async def load(db, bbox=None, line_ids=None):
+        calls.append(sorted(line_ids))
+        return {"features": [{"properties": {"id": lid, "line_id": lid}} for lid in line_ids if lid]}
+
+    return load
+
+
+def test_rebuilt_line_does_not_extend_other_fragments(redis):
+    redis.manifest.update({cache.NO_LINE_FRAGMENT_ID, 1, 2})
+    calls = []
+    asyncio.run(cache._assemble_from_line_fragments(redis, redis, "spans", None, _loader(calls), None))
+    assert calls == [[0, 1, 2]]
+    ttl = settings.MAP_GEOJSON_FRAGMENT_TTL_SECONDS
+    assert all(redis.ttl[cache._fragment_key("spans", lid, None)] == ttl for lid in (0, 1, 2))
+
+    # Пересчёт линии 2 пишет только её ключ; TTL фрагмента линии 1 не трогается
+    redis.ttl[cache._fragment_key("spans", 1, None)] = 5
+    asyncio.run(cache.invalidate_map_geojson_cache(layers=["spans"], line_ids=[2]))
+    redis.manifest.update({0, 1, 2})
+    body = asyncio.run(cache._assemble_from_line_fragments(redis, redis, "spans", None, _loader(calls), None))
+    assert calls[-1] == [2]
+    assert redis.ttl[cache._fragment_key("spans", 1, None)] == 5
+    assert body.count(b'"id"') == 2
+
+
+def test_invalidate_without_line_clears_no_line_fragment_and_bumps_tiles(redis):
+    redis.values[cache._fragment_key("spans", cache.NO_LINE_FRAGMENT_ID, None)] = b"[]"
+    redis.values[cache._fragment_key("spans", 7, None)] = b"[]"
+    asyncio.run(cache.invalidate_map_geojson_cache(line_ids=[None]))
+    assert cache._fragment_key("spans", cache.NO_LINE_FRAGMENT_ID, None) not in redis.values
+    assert cache._fragment_key("spans", 7, None) in redis.values
+    assert redis.values[cache._VECTOR_TILE_GENERATION_KEY] == 1
+
+    # Полная инвалидация удаляет фрагменты всех линий
+    asyncio.run(cache.invalidate_map_geojson_cache())
+    assert cache._fragment_key("spans", 7, None) not in redis.values
+    assert redis.values[cache._VECTOR_TILE_GENERATION_KEY] == 2
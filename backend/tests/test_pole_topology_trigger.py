@@ -0,0 +1,46 @@
+"""Правка и добавление опоры через эндпоинты ЛЭП запускают инкрементальную пересборку пролётов."""
+import asyncio
+
+import pytest
+
+from app.api.v1 import power_lines
+from app.core import line_topology
+
+
+class _FakeSession:
+    def begin_nested(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def topology_calls(monkeypatch):
+    calls = []
+
+    async def fake_update(db, power_line, pole_ids, user_id):
+        calls.append(list(pole_ids))
+        return []
+
+    monkeypatch.setattr(line_topology, "update_line_topology_for_poles", fake_update)
+    return calls
+
+
+@pytest.mark.parametrize("field", ["sequence_number", "conductor_type", "conductor_section", "x_position"])
+def test_topology_fields_trigger_update_without_existing_spans(topology_calls, field):
+    assert asyncio.run(power_lines._update_pole_topology(_FakeSession(), object(), 5, 7, [field]))
+    assert topology_calls == [[5]]
+
+
+def test_other_fields_do_not_touch_topology(topology_calls):
+    assert not asyncio.run(power_lines._update_pole_topology(_FakeSession(), object(), 5, 7, ["notes", "height"]))
+    assert topology_calls == []
+
+
+def test_created_pole_always_updates_topology(topology_calls):
+    assert asyncio.run(power_lines._update_pole_topology(_FakeSession(), object(), 9, 7))
+    assert topology_calls == [[9]]
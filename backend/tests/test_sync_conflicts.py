@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.api.v1 import sync as sync_api
+from app.core.sync_conflicts import merge_update, values_equal
+from app.models.location import PositionPoint
+from app.models.power_line import Pole
+
+
+class _FakeDb:
+    """Точки по условию запроса: PositionPoint.pole_id или PositionPoint.location_id."""
+
+    def __init__(self, by_pole=None, by_location=None):
+        self.points = {"pole_id": by_pole, "location_id": by_location}
+        self.queried = []
+
+    async def execute(self, statement):
+        column = statement.whereclause.left.name
+        self.queried.append(column)
+        return SimpleNamespace(scalar_one_or_none=lambda: self.points[column])
+
+
+def _current(db, pole):
+    return asyncio.run(sync_api._current_sync_values(db, "pole", pole, ["latitude", "longitude", "pole_number"]))
+
+
+def test_fresh_patch_is_applied_as_is():
+    result = merge_update({"id": 5, "notes": "a"}, {"notes": "b"}, base_revision=10, server_revision=10)
+    assert not result.stale
+    assert result.data == {"id": 5, "notes": "a"}
+
+
+def test_stale_patch_merges_field_by_field():
+    data = {"id": 5, "notes": "client", "condition": "bad", "height": 10, "material": "wood"}
+    current = {"notes": "server", "condition": "good", "height": 10.0, "material": "concrete"}
+    base = {"notes": "old", "condition": "good", "height": 9, "material": "concrete"}
+    result = merge_update(data, current, base_revision=10, server_revision=12, base=base)
+    # condition/material на сервере не менялись — значение клиента; height уже совпадает
+    assert result.data == {"id": 5, "condition": "bad", "material": "wood"}
+    assert [(c.field, c.client_value, c.server_value, c.base_value) for c in result.conflicts] == [
+        ("notes", "client", "server", "old"),
+    ]
+
+
+def test_stale_patch_without_base_keeps_server_values():
+    result = merge_update({"mrid": "m", "notes": "client"}, {"notes": "server"}, base_revision=1, server_revision=2)
+    assert result.data == {"mrid": "m"}
+    assert [c.field for c in result.conflicts] == ["notes"]
+
+
+def test_values_equal_normalizes_numbers_and_dates():
+    assert values_equal(1, 1.0)
+    assert not values_equal(True, 1)
+    assert values_equal(datetime(2026, 1, 2, 3, 4), "2026-01-02T03:04:00")
+
+
+def test_stale_pole_patch_compares_location_coordinates():
+    pole = Pole(id=5, pole_number="5", location_id=7, x_position=30.0, y_position=60.0)
+    db = _FakeDb(by_location=PositionPoint(x_position=37.2, y_position=55.1))
+    assert _current(db, pole) == {"latitude": 55.1, "longitude": 37.2, "pole_number": "5"}
+    assert db.queried == ["pole_id", "location_id"]
+
+    # Своя точка опоры важнее Location, без точек — колонки
+    db = _FakeDb(by_pole=PositionPoint(x_position=1.0, y_position=2.0))
+    assert _current(db, pole)["latitude"] == 2.0
+    assert db.queried == ["pole_id"]
+    assert _current(_FakeDb(), pole)["longitude"] == 30.0
+    pole.location_id = None
+    db = _FakeDb()
+    assert _current(db, pole)["latitude"] == 60.0
+    assert db.queried == ["pole_id"]
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.v1 import sync as sync_api
+from app.core.config import settings
+from app.core.sync_idempotency import AppliedRecord, LEDGER_KEY_MAX_LENGTH, ledger_cutoff, ledger_key_ok
+from app.core.sync_upload import UploadPrefetch
+from app.schemas.sync import SyncAction, SyncBatch, SyncRecord, SyncResponse
+
+
+def test_ledger_key_ok_limits_length_and_type():
+    assert ledger_key_ok("0b0e2f7c-6a5e-4a37-9d7c-1f7f4f6a2b11")
+    assert not ledger_key_ok("")
+    assert not ledger_key_ok("x" * (LEDGER_KEY_MAX_LENGTH + 1))
+    assert not ledger_key_ok(None)
+
+
+def test_ledger_cutoff_uses_ttl():
+    now = datetime(2026, 10, 17, tzinfo=timezone.utc)
+    assert ledger_cutoff(now) == now - timedelta(hours=settings.SYNC_IDEMPOTENCY_TTL_HOURS)
+
+
+class _FakeSession:
+    def __init__(self):
+        self.committed = False
+        self.rolled_back = False
+
+    def begin_nested(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+def _record(record_id, client_id):
+    return SyncRecord(
+        id=record_id,
+        entity_type="pole",
+        action=SyncAction.CREATE,
+        data={"id": client_id, "pole_number": f"P{-client_id}", "pole_type": "intermediate", "line_id": 1},
+        timestamp=datetime(2026, 10, 17, tzinfo=timezone.utc),
+    )
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    """Журнал в памяти: сохранённые ответы, применённые записи и порядок вызовов."""
+    state = {"responses": {}, "applied": {}, "calls": [], "processed": [], "stored": None}
+
+    async def lock_batch(db, user_id, batch_id):
+        state["calls"].append(("lock_batch", batch_id))
+
+    async def stored_response(db, user_id, batch_id):
+        return state["responses"].get(batch_id)
+
+    async def lock_records(db, user_id, record_ids):
+        state["calls"].append(("lock_records", sorted(record_ids)))
+
+    async def applied_records(db, user_id, record_ids):
+        state["calls"].append(("applied_records",))
+        return {r: state["applied"][r] for r in record_ids if r in state["applied"]}
+
+    async def process(record, user, db, id_mapping, *args, **kwargs):
+        state["processed"].append(record.id)
+        id_mapping["pole"][record.data["id"]] = 200
+
+    async def store(db, user_id, batch_id, response, records):
+        state["stored"] = (response, list(records))
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(sync_api, "lock_upload_batch", lock_batch)
+    monkeypatch.setattr(sync_api, "get_stored_response", stored_response)
+    monkeypatch.setattr(sync_api, "lock_upload_records", lock_records)
+    monkeypatch.setattr(sync_api, "get_applied_records", applied_records)
+    monkeypatch.setattr(sync_api, "prefetch_upload", lambda *a, **k: _async(UploadPrefetch()))
+    monkeypatch.setattr(sync_api, "process_sync_record", process)
+    monkeypatch.setattr(sync_api, "_applied_revisions", noop)
+    monkeypatch.setattr(sync_api, "store_upload_result", store)
+    monkeypatch.setattr(sync_api, "invalidate_map_geojson_cache", noop)
+    monkeypatch.setattr(sync_api, "compact_upload_ledger", noop)
+    return state
+
+
+async def _async(value):
+    return value
+
+
+def _upload(records, batch_id="batch-2"):
+    db = _FakeSession()
+    batch = SyncBatch(records=records, batch_id=batch_id, timestamp=datetime(2026, 10, 17, tzinfo=timezone.utc))
+    user = SimpleNamespace(id=7)
+    return asyncio.run(sync_api._upload_sync_batch_impl(batch, user, db)), db
+
+
+def test_replayed_batch_returns_stored_response(ledger):
+    stored = SyncResponse(
+        success=True, processed_count=1, failed_count=0, batch_id="batch-1",
+        timestamp=datetime(2026, 10, 17), id_mapping={"pole": {"-5": 101}},
+    )
+    ledger["responses"]["batch-1"] = stored.model_dump(mode="json")
+    response, db = _upload([_record("rec-1", -5)], batch_id="batch-1")
+    assert response.id_mapping == {"pole": {"-5": 101}}
+    assert db.rolled_back and not db.committed
+    assert ledger["processed"] == [] and ledger["stored"] is None
+    # Пакет целиком из журнала — записи не занимаются и не читаются
+    assert ledger["calls"] == [("lock_batch", "batch-1")]
+
+
+def test_applied_record_is_skipped_and_its_mapping_merged(ledger):
+    ledger["applied"]["rec-1"] = AppliedRecord("rec-1", "pole", "create", client_id=-5, server_id=101)
+    response, db = _upload([_record("rec-1", -5), _record("rec-2", -6)])
+    assert response.success and response.processed_count == 2
+    assert ledger["processed"] == ["rec-2"]
+    assert response.id_mapping["pole"] == {"-5": 101, "-6": 200}
+    # Записи заняты до чтения журнала применённых
+    assert ledger["calls"][1:] == [("lock_records", ["rec-1", "rec-2"]), ("applied_records",)]
+    _, journaled = ledger["stored"]
+    assert [r.record_id for r in journaled] == ["rec-2"]
+    assert db.committed
@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import app.database
+from app.core import sync_jobs
+from app.core.config import settings
+from app.core.sync_jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, job_as_dict, job_retryable, job_stale
+from app.models.sync_upload_job import SyncUploadJob
+
+
+def _job(**kwargs):
+    defaults = dict(id="j1", user_id=1, batch_id="b1", status=JOB_RUNNING, total=200, done=0)
+    defaults.update(kwargs)
+    return SyncUploadJob(**defaults)
+
+
+def test_running_job_takes_progress_from_redis():
+    state = job_as_dict(_job(), {"done": 50, "total": 200})
+    assert (state["done"], state["total"], state["progress"]) == (50, 200, 0.25)
+    # Завершённое задание — счётчики из строки, не из устаревшего прогресса
+    state = job_as_dict(_job(status=JOB_DONE, done=200), {"done": 50, "total": 200})
+    assert state["progress"] == 1.0
+
+
+def test_only_failed_or_unsuccessful_jobs_are_retried():
+    assert job_retryable(_job(status=JOB_FAILED))
+    assert job_retryable(_job(status=JOB_DONE, response={"success": False}))
+    assert not job_retryable(_job(status=JOB_DONE, response={"success": True}))
+    assert not job_retryable(_job(status=JOB_RUNNING))
+
+
+def test_jobs_without_progress_past_the_limit_are_stale():
+    now = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    old = now - timedelta(minutes=settings.SYNC_JOB_STALE_MINUTES + 1)
+    recent = now - timedelta(minutes=1)
+    assert job_stale(_job(status=JOB_QUEUED, created_at=old), now)
+    assert job_stale(_job(status=JOB_RUNNING, created_at=old, started_at=old), now)
+    # Отсчёт — от старта (или перестановки в очередь), а не от создания
+    assert not job_stale(_job(status=JOB_RUNNING, created_at=old, started_at=recent), now)
+    assert not job_stale(_job(status=JOB_DONE, created_at=old, finished_at=old), now)
+    assert not job_stale(_job(status=JOB_QUEUED, created_at=None), now)
+    # Потерянное задание перезапускается и повторной отправкой пакета
+    assert job_retryable(_job(status=JOB_QUEUED, created_at=datetime(2020, 1, 1, tzinfo=timezone.utc)))
+
+
+def test_long_running_job_with_recent_progress_is_not_stale():
+    now = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    old = now - timedelta(minutes=settings.SYNC_JOB_STALE_MINUTES + 1)
+    recent = now - timedelta(minutes=1)
+    assert not job_stale(_job(status=JOB_RUNNING, created_at=old, started_at=old, updated_at=recent), now)
+    assert job_stale(_job(status=JOB_RUNNING, created_at=old, started_at=old, updated_at=old), now)
+
+
+class _FakeSession:
+    def __init__(self):
+        self.statements = []
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+
+    async def commit(self):
+        self.committed = True
+
+
+def test_progress_bumps_job_heartbeat(monkeypatch):
+    session = _FakeSession()
+    monkeypatch.setattr(app.database, "AsyncSessionLocal", lambda: session)
+    monkeypatch.setattr(sync_jobs, "get_redis_client", lambda: None)
+
+    asyncio.run(sync_jobs.publish_job_progress("j1", 50, 200))
+
+    (statement,) = session.statements
+    assert statement.table.name == "sync_upload_job"
+    assert "updated_at" in statement.compile().params
+    assert session.committed
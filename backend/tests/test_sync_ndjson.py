@@ -0,0 +1,89 @@
+"""Потоковая выгрузка sync/download в NDJSON: построчная разметка и продолжение курсора."""
+import asyncio
+import json
+
+import pytest
+
+from app.api.v1 import sync as sync_api
+from app.core.sync_revision import merge_revision_pages
+
+# Выборки «таблиц» по возрастанию ревизии
+TABLES = {
+    "power_line": [1, 6],
+    "pole": [2, 3, 7],
+    "equipment": [5],
+}
+HIGH_WATER = 9
+
+
+class _FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def expunge_all(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+@pytest.fixture
+def page_calls(monkeypatch):
+    calls = []
+
+    async def fake_page(db, cursor, limit, high_water, action, scope=None):
+        calls.append(cursor)
+        pages = [
+            [
+                (rev, {"entity_type": entity_type, "action": action, "data": {"id": rev}, "revision": rev})
+                for rev in revisions
+                if cursor < rev <= high_water
+            ][: limit + 1]
+            for entity_type, revisions in TABLES.items()
+        ]
+        return merge_revision_pages(pages, limit)
+
+    async def fake_high_water(db):
+        return HIGH_WATER
+
+    monkeypatch.setattr(sync_api, "AsyncSessionLocal", _FakeSession)
+    monkeypatch.setattr(sync_api, "sync_high_water", fake_high_water)
+    monkeypatch.setattr(sync_api, "_sync_changes_page", fake_page)
+    return calls
+
+
+def _stream(cursor, batch_size):
+    async def collect():
+        return [chunk async for chunk in sync_api._stream_sync_changes_ndjson(cursor, batch_size)]
+
+    body = b"".join(asyncio.run(collect()))
+    assert body.endswith(b"\n")
+    return [json.loads(line) for line in body.decode("utf-8").splitlines()]
+
+
+def test_stream_is_one_record_per_line_with_end_line(page_calls):
+    lines = _stream(0, 100)
+    records, end = lines[:-1], lines[-1]
+    assert [r["revision"] for r in records] == [1, 2, 3, 5, 6, 7]
+    assert all(r["action"] == "create" for r in records)
+    # Последняя строка — маркер конца: курсор на high_water, число записей
+    assert end == {"end": True, "cursor": HIGH_WATER, "count": 6}
+    assert not any("end" in r for r in records)
+
+
+def test_stream_continues_cursor_across_pages(page_calls):
+    lines = _stream(0, 2)
+    assert [r["revision"] for r in lines[:-1]] == [1, 2, 3, 5, 6, 7]
+    # Каждая страница читается от ревизии последней записи предыдущей
+    assert page_calls == [0, 2, 5]
+    assert lines[-1]["count"] == 6
+
+    # Оборвавшийся поток продолжается с revision последней применённой записи
+    page_calls.clear()
+    resumed = _stream(3, 2)
+    assert [r["revision"] for r in resumed[:-1]] == [5, 6, 7]
+    assert all(r["action"] == "update" for r in resumed[:-1])
+    assert resumed[-1] == {"end": True, "cursor": HIGH_WATER, "count": 3}
@@ -0,0 +1,182 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from app.core.sync_revision import (
+    SYNC_REVISION_FLOOR_MAX,
+    SYNC_REVISION_LOCK_KEY,
+    SYNC_REVISION_TABLES,
+    high_water_from,
+    merge_revision_pages,
+    sync_high_water,
+    sync_revision_ddl,
+    sync_move_trigger_ddl,
+)
+
+
+class _FakePostgres:
+    """sync_revision_seq и advisory-блокировки pg_locks; транзакции объявляют границу как sync_revision_claim."""
+
+    def __init__(self, last_value=1, is_called=False):
+        self.last_value = last_value
+        self.is_called = is_called
+        self.locks = {}
+
+    def begin(self):
+        return _FakeTransaction(self)
+
+
+class _FakeTransaction:
+    def __init__(self, pg):
+        self.pg = pg
+        self.floor = None
+        self.revisions = []
+
+    def write(self):
+        pg = self.pg
+        if self.floor is None:
+            floor = pg.last_value + (1 if pg.is_called else 0)
+            if floor > SYNC_REVISION_FLOOR_MAX:
+                raise OverflowError(floor)
+            key = floor - (2 ** 32 if floor > 2 ** 31 - 1 else 0)
+            assert -2 ** 31 <= key < 2 ** 31  # ::int
+            pg.locks[self] = key & 0xFFFFFFFF  # pg_locks.objid — oid, без знака
+            self.floor = floor
+        pg.last_value = pg.last_value + 1 if pg.is_called else pg.last_value
+        pg.is_called = True
+        self.revisions.append(pg.last_value)
+        return pg.last_value
+
+    def commit(self):
+        self.pg.locks.pop(self, None)
+
+
+class _FakeDb:
+    """Отвечает на два запроса sync_high_water; between_reads — чужие транзакции между ними."""
+
+    def __init__(self, pg, between_reads=None):
+        self.pg = pg
+        self.between_reads = between_reads
+
+    async def execute(self, statement, params=None):
+        if "pg_locks" in str(statement):
+            assert params == {"k": SYNC_REVISION_LOCK_KEY}
+            return SimpleNamespace(scalar=lambda: min(self.pg.locks.values(), default=None))
+        row = SimpleNamespace(last_value=self.pg.last_value, is_called=self.pg.is_called)
+        if self.between_reads is not None:
+            self.between_reads()
+        return SimpleNamespace(first=lambda: row)
+
+
+def _high_water(pg, between_reads=None):
+    return asyncio.run(sync_high_water(_FakeDb(pg, between_reads)))
+
+
+def test_merge_revision_pages_orders_across_tables_and_cuts_page():
+    lines = [(1, "l1"), (7, "l7")]
+    poles = [(2, "p2"), (3, "p3"), (9, "p9")]
+    tombstones = [(5, "t5")]
+    page, has_more = merge_revision_pages([lines, poles, tombstones], limit=4)
+    assert page == ["l1", "p2", "p3", "t5"]
+    assert has_more
+
+    page, has_more = merge_revision_pages([lines, poles, tombstones], limit=10)
+    assert page == ["l1", "p2", "p3", "t5", "l7", "p9"]
+    assert not has_more
+
+
+def test_sync_revision_ddl_covers_every_synced_table():
+    ddl = "\n".join(sync_revision_ddl())
+    for entity_type, table in SYNC_REVISION_TABLES.items():
+        assert f"trg_{table}_sync_revision" in ddl
+        assert f"sync_revision_tombstone('{entity_type}')" in ddl
+
+
+def test_high_water_stops_below_oldest_claimed_floor():
+    assert high_water_from(None, None) == 0
+    assert high_water_from(42, None) == 42
+    # Пишущая транзакция объявила номера от 30 — выгрузка не дальше 29, даже если выданы до 42
+    assert high_water_from(42, 30) == 29
+    assert high_water_from(42, 50) == 42
+    assert high_water_from(5, 1) == 0
+
+
+def test_move_tombstone_trigger_fires_before_revision_bump():
+    ddl = "\n".join(sync_move_trigger_ddl())
+    assert "BEFORE UPDATE OF line_id ON \"pole\"" in ddl
+    assert "BEFORE UPDATE OF pole_id ON \"equipment\"" in ddl
+    # Триггеры одного момента срабатывают по имени: надгробие получает номер раньше новой ревизии
+    for table in ("pole", "equipment"):
+        assert f"trg_{table}_sync_move" < f"trg_{table}_sync_revision"
+    assert "\n".join(sync_revision_ddl()).endswith(ddl)
+
+
+def test_line_scope_change_trigger_covers_branch_and_region():
+    ddl = "\n".join(sync_move_trigger_ddl())
+    assert 'BEFORE UPDATE OF branch_id, region_id ON "line"' in ddl
+    assert 'AFTER UPDATE OF branch_id, region_id ON "line"' in ddl
+    assert "trg_line_sync_move" < "trg_line_sync_revision"
+
+
+def test_high_water_waits_for_in_flight_writer():
+    pg = _FakePostgres(10, is_called=True)
+    slow, fast = pg.begin(), pg.begin()
+    assert slow.write() == 11
+    assert fast.write() == 12
+    fast.commit()
+    # 12 закоммичена, но 11 ещё нет — курсор не перепрыгивает через неё
+    assert _high_water(pg) == 10
+    assert slow.write() == 13
+    assert _high_water(pg) == 10
+    slow.commit()
+    assert _high_water(pg) == 13
+
+
+def test_writers_racing_the_reader_are_never_skipped():
+    pg = _FakePostgres(10, is_called=True)
+    # Объявил границу после чтения последовательности: его номер больше прочитанного
+    late = pg.begin()
+    assert _high_water(pg, between_reads=late.write) == 10
+    # Закоммитил между чтениями: номер уже виден
+    assert _high_water(pg, between_reads=late.commit) == 11
+
+
+def test_high_water_never_covers_uncommitted_revision():
+    rnd = random.Random(13)
+    pg = _FakePostgres()
+    in_flight = []
+
+    def step():
+        action = rnd.random()
+        if action < 0.3 or not in_flight:
+            in_flight.append(pg.begin())
+        elif action < 0.7:
+            rnd.choice(in_flight).write()
+        else:
+            in_flight.pop(rnd.randrange(len(in_flight))).commit()
+
+    previous = 0
+    for _ in range(500):
+        step()
+        high_water = _high_water(pg, between_reads=step)
+        uncommitted = [rev for txn in in_flight for rev in txn.revisions]
+        assert all(rev > high_water for rev in uncommitted)
+        assert high_water >= previous
+        previous = high_water
+
+
+def test_high_water_reads_floors_past_int4_range():
+    pg = _FakePostgres(2 ** 31 - 2, is_called=True)
+    below, above = pg.begin(), pg.begin()
+    assert below.write() == 2 ** 31 - 1
+    assert above.write() == 2 ** 31
+    assert _high_water(pg) == 2 ** 31 - 2
+    below.commit()
+    assert _high_water(pg) == 2 ** 31 - 1
+    above.commit()
+    assert _high_water(pg) == 2 ** 31
+
+    pg = _FakePostgres(2 ** 32 - 5, is_called=True)
+    tail = pg.begin()
+    tail.write()
+    assert _high_water(pg) == 2 ** 32 - 5
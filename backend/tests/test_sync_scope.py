@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.sync_scope import ResolvedScope, SyncScope, parse_id_list, tombstone_in_scope
+from app.models.sync_tombstone import SyncTombstone
+
+
+def test_parse_id_list_accepts_repeated_and_comma_separated():
+    assert parse_id_list(["3,1", "2", " 1 ", ""]) == (1, 2, 3)
+    assert parse_id_list(None) == ()
+
+
+def test_parse_id_list_rejects_non_integers():
+    with pytest.raises(ValueError):
+        parse_id_list(["1,abc"])
+
+
+def test_scope_is_empty_without_ids():
+    assert SyncScope.from_query().is_empty
+    assert not SyncScope.from_query(region_ids=["7"]).is_empty
+
+
+def test_move_tombstones_reach_only_scopes_losing_the_row():
+    engine = create_engine("sqlite://")
+    SyncTombstone.__table__.create(engine)
+    with Session(engine) as session:
+        session.execute(insert(SyncTombstone), [
+            {"sync_revision": 1, "entity_type": "pole", "entity_id": 10, "line_id": 1},
+            {"sync_revision": 2, "entity_type": "equipment_catalog", "entity_id": 5, "line_id": None},
+            # Опора 11 перенесена с ЛЭП 1 на ЛЭП 2, опора 12 — с ЛЭП 1 на ЛЭП 3
+            {"sync_revision": 3, "entity_type": "pole", "entity_id": 11, "line_id": 1,
+             "moved": True, "moved_to_line_id": 2},
+            {"sync_revision": 4, "entity_type": "pole", "entity_id": 12, "line_id": 1,
+             "moved": True, "moved_to_line_id": 3},
+        ])
+
+        assert _revisions(session, None) == [1, 2]
+        assert _revisions(session, ResolvedScope((1,))) == [1, 2, 3, 4]
+        assert _revisions(session, ResolvedScope((1, 2))) == [1, 2, 4]
+        assert _revisions(session, ResolvedScope((2,))) == [2]
+
+
+def test_line_scope_change_tombstones_reach_only_scopes_of_old_branch_or_region():
+    engine = create_engine("sqlite://")
+    SyncTombstone.__table__.create(engine)
+    moved = {"moved": True, "moved_to_line_id": 1, "moved_from_branch_id": 10, "moved_from_region_id": 20}
+    with Session(engine) as session:
+        # ЛЭП 1 переведена из филиала 10 / региона 20: надгробия ЛЭП, её опоры и оборудования
+        session.execute(insert(SyncTombstone), [
+            {"sync_revision": 1, "entity_type": "power_line", "entity_id": 1, "line_id": 1, **moved},
+            {"sync_revision": 2, "entity_type": "pole", "entity_id": 11, "line_id": 1, **moved},
+            {"sync_revision": 3, "entity_type": "equipment", "entity_id": 21, "line_id": 1, **moved},
+        ])
+
+        # Вся сеть и области без прежнего филиала/региона ЛЭП не теряют
+        assert _revisions(session, None) == []
+        assert _revisions(session, ResolvedScope((5,), branch_ids=(11,))) == []
+        # Область по прежнему филиалу или региону: ЛЭП в ней больше нет — удаление
+        assert _revisions(session, ResolvedScope((5,), branch_ids=(10,))) == [1, 2, 3]
+        assert _revisions(session, ResolvedScope((), region_ids=(20, 21))) == [1, 2, 3]
+        # ЛЭП осталась в области (новый филиал тоже в ней или она выбрана явно) — без удаления
+        assert _revisions(session, ResolvedScope((1,), branch_ids=(10, 12))) == []
+
+
+def _revisions(session, scope):
+    return session.execute(
+        select(SyncTombstone.sync_revision)
+        .where(tombstone_in_scope(scope))
+        .order_by(SyncTombstone.sync_revision)
+    ).scalars().all()
@@ -0,0 +1,62 @@
+import asyncio
+
+import jsonschema
+import pytest
+
+from app.core.sync_upload import UploadPrefetch, run_chunked_with_bisect, validate_entity_data
+
+
+def test_bisect_isolates_failing_records_and_keeps_order():
+    attempts = []
+
+    async def attempt(chunk):
+        attempts.append(list(chunk))
+        if any(item in (3, 6) for item in chunk):
+            raise ValueError("bad")
+
+    failed = []
+    applied = asyncio.run(
+        run_chunked_with_bisect(list(range(8)), attempt, lambda item, e: failed.append(item), chunk_size=8)
+    )
+    assert applied == [0, 1, 2, 4, 5, 7]
+    assert failed == [3, 6]
+    assert attempts[0] == list(range(8))
+
+
+def test_prefetch_skips_only_keys_known_to_be_absent():
+    prefetch = UploadPrefetch()
+    prefetch.ids["pole"] = {10}
+    prefetch.mrids["pole"] = {"m-10"}
+    prefetch.max_ids["pole"] = 50
+
+    assert prefetch.may_exist("pole", 10, None)
+    assert prefetch.may_exist("pole", -1, "m-10")
+    assert not prefetch.may_exist("pole", -1, "m-new")
+    # Больше максимального id на момент снимка — могла создаться в этом же пакете
+    assert prefetch.may_exist("pole", 51, None)
+    prefetch.touch("pole", -1, "m-new")
+    assert prefetch.may_exist("pole", -2, "m-new")
+    # Тип без снимка — всегда ищем в БД
+    assert prefetch.may_exist("equipment_catalog", 1, None)
+
+
+def test_validate_entity_data_uses_schema():
+    validate_entity_data("unknown_type", {"anything": 1})
+    with pytest.raises(jsonschema.ValidationError):
+        validate_entity_data("equipment", {"name": "x"})
+
+
+def test_bisect_reports_progress_per_top_level_chunk():
+    seen = []
+
+    async def attempt(chunk):
+        if 4 in chunk:
+            raise ValueError("bad")
+
+    async def on_progress(handled):
+        seen.append(handled)
+
+    asyncio.run(
+        run_chunked_with_bisect(list(range(10)), attempt, lambda item, e: None, chunk_size=4, on_progress=on_progress)
+    )
+    assert seen == [4, 8, 10]
@@ -0,0 +1,68 @@
+import gzip
+
+import pytest
+
+from app.core.sync_wire import (
+    WireFormatError,
+    decode_envelope,
+    decode_records,
+    decompress_body,
+    encode_envelope,
+    encode_records,
+    wants_msgpack,
+)
+
+
+def test_dict_encoding_round_trips_and_shares_keysets():
+    records = [
+        {"id": "a", "entity_type": "pole", "action": "create", "data": {"id": -1, "notes": None, "line_id": 3}},
+        {"id": "b", "entity_type": "pole", "action": "create", "data": {"id": -2, "notes": "x", "line_id": 3}},
+        # update без notes: отсутствующий ключ не должен превратиться в null
+        {"id": "c", "entity_type": "pole", "action": "update", "data": {"id": 7, "line_id": 4}},
+        {"id": "d", "entity_type": "power_line", "action": "delete", "data": {"id": 9}},
+    ]
+    encoded = encode_records(records)
+    assert len(encoded["keys"]) == 4  # общий набор ключей записи + три набора data
+    decoded = decode_records(encoded)
+    assert decoded == records
+    assert "notes" not in decoded[2]["data"]
+
+
+def test_envelope_passthrough_for_plain_records():
+    envelope = {"batch_id": "b", "records": [{"id": "a", "data": {"x": 1}}]}
+    assert decode_envelope(envelope) is envelope
+    assert decode_envelope(encode_envelope(envelope)) == envelope
+
+
+def test_decode_rejects_mismatched_rows():
+    with pytest.raises(WireFormatError):
+        decode_records({"format": "dict/1", "keys": [["id", "x"]], "rows": [[0, [1]]]})
+
+
+def test_decompress_body_gzip_and_limit():
+    body = b"{}" * 1000
+    assert decompress_body(gzip.compress(body), "gzip") == body
+    with pytest.raises(WireFormatError):
+        decompress_body(gzip.compress(body), "gzip", limit=100)
+    with pytest.raises(WireFormatError):
+        decompress_body(body, "lzma")
+
+
+def test_decompress_body_br_stops_at_limit():
+    brotli = pytest.importorskip("brotli")
+    body = b"{}" * 100000
+    packed = brotli.compress(body)
+    assert decompress_body(packed, "br") == body
+    assert decompress_body(packed, "br", limit=len(body)) == body
+    # Выход не распаковывается целиком: порции до limit + 1 байт
+    with pytest.raises(WireFormatError, match="после распаковки"):
+        decompress_body(packed, "br", limit=100)
+    with pytest.raises(WireFormatError, match="br"):
+        decompress_body(packed[: len(packed) // 2], "br")
+
+
+def test_wants_msgpack_respects_q_zero():
+    pytest.importorskip("msgpack")
+    assert wants_msgpack("application/x-msgpack, application/json;q=0.5")
+    assert not wants_msgpack("application/x-msgpack;q=0, application/json")
+    assert not wants_msgpack("application/json")
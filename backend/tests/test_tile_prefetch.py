@@ -0,0 +1,45 @@
+import pytest
+
+from app.core.map_bbox import MapBBox
+from app.core.tile_prefetch import TileLimitExceeded, bbox_tile_count, bbox_tiles, corridor_tiles, lonlat_to_tile
+
+
+def test_bbox_tiles_match_count_and_cover_corners():
+    bbox = MapBBox(min_lon=27.4, min_lat=53.8, max_lon=27.7, max_lat=54.0)
+    tiles = list(bbox_tiles(bbox, 10, 13))
+    assert len(tiles) == bbox_tile_count(bbox, 10, 13)
+    assert len(set(tiles)) == len(tiles)
+    for z in (10, 13):
+        assert (z, *lonlat_to_tile(27.4, 54.0, z)) in tiles
+        assert (z, *lonlat_to_tile(27.7, 53.8, z)) in tiles
+
+
+def test_corridor_tiles_follow_line_and_stay_narrow():
+    line = [[27.0, 53.9], [27.5, 53.9]]  # ~33 км вдоль параллели
+    tiles = corridor_tiles([line], 100.0, 14, 14)
+    xs = {x for _, x, _ in tiles}
+    ys = {y for _, _, y in tiles}
+    x0, y_line = lonlat_to_tile(27.0, 53.9, 14)
+    x1, _ = lonlat_to_tile(27.5, 53.9, 14)
+    assert set(range(x0, x1 + 1)) <= xs
+    assert y_line in ys
+    # Коридор 100 м не шире пары тайлов (~1.4 км на z14) по вертикали
+    assert len(ys) <= 2
+    full = bbox_tile_count(MapBBox(27.0, 53.0, 27.5, 54.8), 14, 14)
+    assert len(tiles) < full / 50
+
+
+def test_corridor_tiles_stop_at_limit():
+    line = [[27.0, 53.9], [27.5, 53.9]]
+    # Коридор 10 км до z19 — миллиарды тайлов: перебор прерывается сразу после лимита
+    with pytest.raises(TileLimitExceeded):
+        corridor_tiles([line], 10000.0, 10, 19, limit=1000)
+    assert len(corridor_tiles([line], 100.0, 14, 14, limit=1000)) <= 1000
+
+
+def test_corridor_tiles_clipped_to_bbox():
+    line = [[27.0, 53.9], [27.5, 53.9]]
+    bbox = MapBBox(27.0, 53.8, 27.1, 54.0)
+    tiles = corridor_tiles([line], 100.0, 14, 14, bbox=bbox)
+    x_max = lonlat_to_tile(27.1, 53.9, 14)[0]
+    assert tiles and all(x <= x_max for _, x, _ in tiles)
@@ -0,0 +1,50 @@
+from app.core.tile_store import MBTilesStore, tms_row
+
+
+def test_tms_row_flips_y_axis():
+    assert tms_row(0, 0) == 0
+    assert tms_row(3, 0) == 7
+    assert tms_row(3, tms_row(3, 2)) == 2
+
+
+def test_mbtiles_store_roundtrip(tmp_path):
+    path = tmp_path / "cache" / "osm.mbtiles"
+    store = MBTilesStore(path)
+    assert store.get(5, 18, 10) is None
+    store.put(5, 18, 10, b"png-1", fetched_at=100)
+    assert store.get(5, 18, 10) == (b"png-1", 100)
+    assert store.put_many([(5, 18, 10, b"png-2"), (6, 36, 20, b"png-3")], fetched_at=200) == 2
+    assert store.get(5, 18, 10) == (b"png-2", 200)
+    store.close()
+
+    # Файл читается как обычный MBTiles: строка в TMS
+    import sqlite3
+
+    with sqlite3.connect(path) as conn:
+        row = conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = 6 AND tile_column = 36 AND tile_row = ?",
+            ((1 << 6) - 1 - 20,),
+        ).fetchone()
+    assert bytes(row[0]) == b"png-3"
+
+
+def test_mbtiles_reader_serves_only_within_zoom_and_bounds(tmp_path):
+    from app.core.tile_store import MBTilesReader
+
+    path = tmp_path / "basemap.mbtiles"
+    store = MBTilesStore(path)
+    store.put_many([(6, 36, 20, b"in"), (12, 2330, 1330, b"too-deep")])
+    store._conn.executemany(
+        "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+        (("minzoom", "4"), ("maxzoom", "12"), ("bounds", "23.18,51.26,32.78,56.17")),
+    )
+    store._conn.commit()
+    store.close()
+
+    reader = MBTilesReader(path, max_zoom=11, pool_size=2)
+    assert (reader.min_zoom, reader.max_zoom) == (4, 11)
+    assert reader.get(6, 36, 20) == b"in"
+    assert reader.get(6, 0, 0) is None  # вне границ — без запроса к файлу
+    assert not reader.covers(12, 2330, 1330)
+    assert reader.get(12, 2330, 1330) is None
+    reader.close()
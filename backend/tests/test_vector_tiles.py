@@ -0,0 +1,121 @@
+"""Кодирование MVT-тайлов слоёв карты."""
+import pytest
+
+from app.core.vector_tiles import encode_vector_tile, tile_bounds_lonlat
+
+
+def _read_varint(buf, i):
+    shift = result = 0
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, i
+        shift += 7
+
+
+def _fields(buf):
+    """Минимальный разбор protobuf: список (номер поля, значение)."""
+    out, i = [], 0
+    while i < len(buf):
+        key, i = _read_varint(buf, i)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            val, i = _read_varint(buf, i)
+        elif wire == 1:
+            val, i = buf[i:i + 8], i + 8
+        else:
+            n, i = _read_varint(buf, i)
+            val, i = buf[i:i + n], i + n
+        out.append((field, val))
+    return out
+
+
+def _packed(buf):
+    vals, i = [], 0
+    while i < len(buf):
+        v, i = _read_varint(buf, i)
+        vals.append(v)
+    return vals
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def test_tile_bounds_world():
+    min_lon, min_lat, max_lon, max_lat = tile_bounds_lonlat(0, 0, 0)
+    assert (min_lon, max_lon) == (-180.0, 180.0)
+    assert max_lat == pytest.approx(85.0511, abs=1e-3)
+    assert min_lat == pytest.approx(-85.0511, abs=1e-3)
+
+
+def test_point_layer_roundtrip():
+    features = [
+        {"type": "Feature", "properties": {"id": 7, "pole_number": "12", "height": 10.5, "notes": None},
+         "geometry": {"type": "Point", "coordinates": [0.0, 0.0]}},
+    ]
+    tile = encode_vector_tile([("poles", features)], 0, 0, 0)
+    (field, layer), = _fields(tile)
+    assert field == 3
+    layer_fields = _fields(layer)
+    assert (1, b"poles") in layer_fields
+    assert (5, 4096) in layer_fields
+    keys = [v.decode() for f, v in layer_fields if f == 3]
+    assert keys == ["id", "pole_number", "height"]
+    feature = dict(_fields(next(v for f, v in layer_fields if f == 2)))
+    assert feature[1] == 7
+    assert feature[3] == 1
+    cmd, x, y = _packed(feature[4])
+    assert cmd == (1 | (1 << 3))
+    assert (_unzigzag(x), _unzigzag(y)) == (2048, 2048)
+
+
+def test_line_collapsed_at_low_zoom_is_dropped():
+    short = {"type": "Feature", "properties": {"id": 1},
+             "geometry": {"type": "LineString", "coordinates": [[27.5, 53.9], [27.50001, 53.90001]]}}
+    assert encode_vector_tile([("spans", [short])], 0, 0, 0) == b""
+
+
+def test_line_deltas():
+    line = {"type": "Feature", "properties": {"id": 2},
+            "geometry": {"type": "LineString", "coordinates": [[-90.0, 0.0], [0.0, 0.0], [90.0, 0.0]]}}
+    tile = encode_vector_tile([("power-lines", [line])], 0, 0, 0)
+    layer = _fields(tile)[0][1]
+    feature = dict(_fields(next(v for f, v in _fields(layer) if f == 2)))
+    assert feature[3] == 2
+    cmds = _packed(feature[4])
+    assert cmds[0] == (1 | (1 << 3))
+    assert (_unzigzag(cmds[1]), _unzigzag(cmds[2])) == (1024, 2048)
+    assert cmds[3] == (2 | (2 << 3))
+    assert [_unzigzag(v) for v in cmds[4:]] == [1024, 0, 1024, 0]
+
+
+def _line_commands(tile):
+    layer = _fields(tile)[0][1]
+    feature = dict(_fields(next(v for f, v in _fields(layer) if f == 2)))
+    return _packed(feature[4])
+
+
+def test_line_clipped_to_tile_with_buffer():
+    # z=1, тайл 0/0 — западная половина; линия уходит на восток за тайл
+    line = {"type": "Feature", "properties": {"id": 3},
+            "geometry": {"type": "LineString", "coordinates": [[-90.0, 45.0], [90.0, 45.0]]}}
+    cmds = _line_commands(encode_vector_tile([("power-lines", [line])], 1, 0, 0))
+    x0, y0 = _unzigzag(cmds[1]), _unzigzag(cmds[2])
+    assert x0 == 2048
+    assert cmds[3] == (2 | (1 << 3))
+    # Конец обрезан по краю тайла + буфер (64)
+    assert (x0 + _unzigzag(cmds[4]), y0 + _unzigzag(cmds[5])) == (4096 + 64, y0)
+
+
+def test_line_leaving_and_reentering_tile_is_split():
+    line = {"type": "Feature", "properties": {"id": 4},
+            "geometry": {"type": "LineString", "coordinates": [[-135.0, 45.0], [45.0, 45.0], [45.0, 60.0], [-135.0, 60.0]]}}
+    cmds = _line_commands(encode_vector_tile([("power-lines", [line])], 1, 0, 0))
+    # Две части: MoveTo/LineTo(1) дважды, курсор второй части — от конца первой
+    assert [cmds[0], cmds[3], cmds[6], cmds[9]] == [9, 10, 9, 10]
+    end_x = _unzigzag(cmds[1]) + _unzigzag(cmds[4])
+    assert end_x == 4160
+    assert end_x + _unzigzag(cmds[7]) == 4160
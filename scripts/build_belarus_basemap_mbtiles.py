@@ -1,20 +1,40 @@
 #!/usr/bin/env python3
 """Скачивает растровые тайлы OSM DE для Беларуси и собирает MBTiles (офлайн-подложка в APK).
 
+Загрузка параллельная (пул потоков) с ограничением на каждый хост: не больше --per-host
+одновременных запросов и не чаще одного запроса в --delay секунд. Повторный запуск докачивает:
+тайлы, уже записанные в файл, пропускаются (--fresh — собрать заново). Запись пачками по --batch
+тайлов в одной транзакции, поэтому обрыв сети теряет не больше одной пачки.
+
+С --dedupe файл в раскладке MBTiles map/images (tiles — view): одинаковые тайлы (вода, пустые
+поля) хранятся один раз. --optimize-png пережимает PNG через Pillow, если он установлен.
+
 Пример:
   python scripts/build_belarus_basemap_mbtiles.py --max-zoom 11
+  python scripts/build_belarus_basemap_mbtiles.py --max-zoom 12 --workers 8 --dedupe --optimize-png
   python scripts/build_belarus_basemap_mbtiles.py --max-zoom 10 --output frontend/assets/maps/belarus_basemap.mbtiles
 """
 from __future__ import annotations
 
 import argparse
+import hashlib
+import io
 import math
 import sqlite3
 import sys
+import threading
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Iterator
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
 
 # Границы РБ — как в frontend/lib/core/config/app_config.dart
 SOUTH, WEST, NORTH, EAST = 51.26, 23.18, 56.17, 32.78
@@ -46,67 +66,246 @@ def tile_range(zoom: int) -> list[tuple[int, int, int]]:
     return out
 
 
-def create_mbtiles(path: Path, min_zoom: int, max_zoom: int) -> sqlite3.Connection:
+def tms_row(z: int, y: int) -> int:
+    # MBTiles TMS: tile_row flipped
+    return (1 << z) - 1 - y
+
+
+PLAIN_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+  zoom_level INTEGER,
+  tile_column INTEGER,
+  tile_row INTEGER,
+  tile_data BLOB
+);
+CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+"""
+
+DEDUPE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS map (
+  zoom_level INTEGER,
+  tile_column INTEGER,
+  tile_row INTEGER,
+  tile_id TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row);
+CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+CREATE VIEW IF NOT EXISTS tiles AS
+  SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row,
+         images.tile_data AS tile_data
+  FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+
+def _tiles_object_type(conn: sqlite3.Connection) -> str | None:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'tiles'").fetchone()
+    return row[0] if row else None
+
+
+def open_mbtiles(path: Path, min_zoom: int, max_zoom: int, dedupe: bool, fresh: bool) -> tuple[sqlite3.Connection, bool]:
+    """Открыть (или создать) файл; возвращает соединение и раскладку (True — map/images)."""
     path.parent.mkdir(parents=True, exist_ok=True)
-    if path.exists():
+    if fresh and path.exists():
         path.unlink()
     conn = sqlite3.connect(path)
+    existing = _tiles_object_type(conn)
+    if existing is not None:
+        # Докачка: раскладка уже выбрана при первой сборке
+        dedupe = existing == "view"
+    conn.executescript(DEDUPE_SCHEMA if dedupe else PLAIN_SCHEMA)
     conn.executescript(
         """
-        CREATE TABLE tiles (
-          zoom_level INTEGER,
-          tile_column INTEGER,
-          tile_row INTEGER,
-          tile_data BLOB
-        );
-        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
-        CREATE TABLE metadata (name text, value text);
+        CREATE TABLE IF NOT EXISTS metadata (name text, value text);
+        CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
         """
     )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("name", "Belarus OSM DE basemap"),
-    )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("type", "baselayer"),
-    )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("format", "png"),
-    )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("minzoom", str(min_zoom)),
-    )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("maxzoom", str(max_zoom)),
-    )
-    conn.execute(
-        "INSERT INTO metadata VALUES (?, ?)",
-        ("bounds", f"{WEST},{SOUTH},{EAST},{NORTH}"),
+    prev_min = conn.execute("SELECT value FROM metadata WHERE name = 'minzoom'").fetchone()
+    prev_max = conn.execute("SELECT value FROM metadata WHERE name = 'maxzoom'").fetchone()
+    if prev_min:
+        min_zoom = min(min_zoom, int(prev_min[0]))
+    if prev_max:
+        max_zoom = max(max_zoom, int(prev_max[0]))
+    conn.executemany(
+        "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+        (
+            ("name", "Belarus OSM DE basemap"),
+            ("type", "baselayer"),
+            ("format", "png"),
+            ("minzoom", str(min_zoom)),
+            ("maxzoom", str(max_zoom)),
+            ("bounds", f"{WEST},{SOUTH},{EAST},{NORTH}"),
+        ),
     )
     conn.commit()
-    return conn
+    return conn, dedupe
+
+
+def existing_tiles(conn: sqlite3.Connection, zoom: int) -> set[tuple[int, int]]:
+    """(tile_column, tile_row) уже записанных тайлов уровня."""
+    return {
+        (col, row)
+        for col, row in conn.execute(
+            "SELECT tile_column, tile_row FROM tiles WHERE zoom_level = ?", (zoom,)
+        )
+    }
+
+
+def pending_tiles(conn: sqlite3.Connection, min_zoom: int, max_zoom: int) -> tuple[list[tuple[int, int, int]], int]:
+    """Тайлы, которых ещё нет в файле, и число пропущенных."""
+    todo: list[tuple[int, int, int]] = []
+    skipped = 0
+    for z in range(min_zoom, max_zoom + 1):
+        done = existing_tiles(conn, z)
+        for tile in tile_range(z):
+            if (tile[1], tms_row(z, tile[2])) in done:
+                skipped += 1
+            else:
+                todo.append(tile)
+    return todo, skipped
+
+
+class HostLimiter:
+    """Вежливость к тайловому серверу: не больше max_concurrent запросов и интервал min_interval на хост."""
+
+    def __init__(self, max_concurrent: int, min_interval: float):
+        self._max_concurrent = max(1, max_concurrent)
+        self._min_interval = max(0.0, min_interval)
+        self._lock = threading.Lock()
+        self._slots: dict[str, threading.Semaphore] = {}
+        self._next_at: dict[str, float] = {}
 
+    def _slot(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.Semaphore(self._max_concurrent)
+            return self._slots[host]
 
-def fetch_tile(z: int, x: int, y: int, retries: int = 3) -> bytes | None:
-    url = TILE_URL.format(z=z, x=x, y=y)
+    def _reserve(self, host: str) -> float:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at.get(host, now))
+            self._next_at[host] = start + self._min_interval
+            return start - now
+
+    def penalize(self, host: str, seconds: float) -> None:
+        """Сервер попросил подождать (429/503 с Retry-After) — сдвинуть следующие запросы к хосту."""
+        with self._lock:
+            self._next_at[host] = max(self._next_at.get(host, 0.0), time.monotonic() + seconds)
+
+    def __call__(self, host: str) -> "_HostSlot":
+        return _HostSlot(self, host)
+
+
+class _HostSlot:
+    def __init__(self, limiter: HostLimiter, host: str):
+        self._limiter = limiter
+        self._host = host
+
+    def __enter__(self) -> None:
+        self._limiter._slot(self._host).acquire()
+        wait_s = self._limiter._reserve(self._host)
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+    def __exit__(self, *exc) -> None:
+        self._limiter._slot(self._host).release()
+
+
+def fetch_tile(
+    z: int, x: int, y: int, limiter: HostLimiter, url_template: str = TILE_URL, retries: int = 3
+) -> bytes | None:
+    url = url_template.format(z=z, x=x, y=y)
+    host = urllib.parse.urlsplit(url).netloc
     req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
     for attempt in range(retries):
         try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                return resp.read()
+            with limiter(host):
+                with urllib.request.urlopen(req, timeout=30) as resp:
+                    return resp.read()
         except urllib.error.HTTPError as e:
             if e.code == 404:
                 return None
-            time.sleep(1.5 * (attempt + 1))
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            if e.code in (429, 503) and retry_after and retry_after.isdigit():
+                limiter.penalize(host, float(retry_after))
+            else:
+                time.sleep(1.5 * (attempt + 1))
         except Exception:
             time.sleep(1.5 * (attempt + 1))
     return None
 
 
+def optimize_png(data: bytes) -> bytes:
+    """Пережать PNG без потерь (Pillow, optimize); если не получилось меньше — исходные байты."""
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format != "PNG":
+                return data
+            out = io.BytesIO()
+            img.save(out, format="PNG", optimize=True)
+    except Exception:
+        return data
+    packed = out.getvalue()
+    return packed if len(packed) < len(data) else data
+
+
+def write_batch(conn: sqlite3.Connection, batch: list[tuple[int, int, int, bytes]], dedupe: bool) -> None:
+    """Записать пачку тайлов (z, x, y в XYZ) одной транзакцией."""
+    with conn:
+        if not dedupe:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                [(z, x, tms_row(z, y), sqlite3.Binary(data)) for z, x, y, data in batch],
+            )
+            return
+        images: dict[str, bytes] = {}
+        rows = []
+        for z, x, y, data in batch:
+            tile_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+            images.setdefault(tile_id, data)
+            rows.append((z, x, tms_row(z, y), tile_id))
+        conn.executemany(
+            "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+            [(sqlite3.Binary(data), tile_id) for tile_id, data in images.items()],
+        )
+        conn.executemany("INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)", rows)
+
+
+def download(
+    tiles: list[tuple[int, int, int]],
+    workers: int,
+    limiter: HostLimiter,
+    url_template: str,
+    optimize: bool,
+) -> Iterator[tuple[tuple[int, int, int], bytes | None]]:
+    """Результаты загрузки по мере готовности; в полёте не больше 4 × workers задач (память)."""
+
+    def job(tile: tuple[int, int, int]) -> bytes | None:
+        data = fetch_tile(*tile, limiter=limiter, url_template=url_template)
+        if data and optimize:
+            data = optimize_png(data)
+        return data
+
+    it = iter(tiles)
+    in_flight: dict[Future, tuple[int, int, int]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for tile in it:
+            in_flight[pool.submit(job, tile)] = tile
+            if len(in_flight) >= workers * 4:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                tile = in_flight.pop(fut)
+                yield tile, fut.result()
+                nxt = next(it, None)
+                if nxt is not None:
+                    in_flight[pool.submit(job, nxt)] = nxt
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--min-zoom", type=int, default=4)
@@ -116,36 +315,53 @@ def main() -> int:
         type=Path,
         default=Path("frontend/assets/maps/belarus_basemap.mbtiles"),
     )
-    parser.add_argument("--delay", type=float, default=0.05, help="Пауза между запросами, сек")
+    parser.add_argument("--url", default=TILE_URL, help="Шаблон URL тайлов с {z}/{x}/{y}")
+    parser.add_argument("--workers", type=int, default=4, help="Потоков загрузки")
+    parser.add_argument("--per-host", type=int, default=2, help="Одновременных запросов к одному хосту")
+    parser.add_argument("--delay", type=float, default=0.05, help="Минимальный интервал между запросами к хосту, сек")
+    parser.add_argument("--batch", type=int, default=200, help="Тайлов в одной транзакции")
+    parser.add_argument("--fresh", action="store_true", help="Удалить существующий файл и собрать заново")
+    parser.add_argument("--dedupe", action="store_true", help="Хранить одинаковые тайлы один раз (map/images)")
+    parser.add_argument("--optimize-png", action="store_true", help="Пережать PNG без потерь (нужен Pillow)")
     args = parser.parse_args()
 
-    tiles: list[tuple[int, int, int]] = []
-    for z in range(args.min_zoom, args.max_zoom + 1):
-        tiles.extend(tile_range(z))
-    print(f"Tiles to fetch: {len(tiles)} (z{args.min_zoom}–z{args.max_zoom})")
+    if args.optimize_png and Image is None:
+        print("Pillow не установлен — --optimize-png пропущен")
+
+    conn, dedupe = open_mbtiles(args.output, args.min_zoom, args.max_zoom, args.dedupe, args.fresh)
+    tiles, skipped = pending_tiles(conn, args.min_zoom, args.max_zoom)
+    print(
+        f"Tiles to fetch: {len(tiles)} (z{args.min_zoom}–z{args.max_zoom}), "
+        f"already in file: {skipped}, layout: {'map/images' if dedupe else 'tiles'}"
+    )
 
-    conn = create_mbtiles(args.output, args.min_zoom, args.max_zoom)
+    limiter = HostLimiter(args.per_host, args.delay)
+    batch: list[tuple[int, int, int, bytes]] = []
     ok = 0
-    for i, (z, x, y) in enumerate(tiles, start=1):
-        # MBTiles TMS: tile_row flipped
-        tms_y = (1 << z) - 1 - y
-        data = fetch_tile(z, x, y)
-        if data:
-            conn.execute(
-                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
-                (z, x, tms_y, sqlite3.Binary(data)),
-            )
-            ok += 1
-        if i % 25 == 0:
-            conn.commit()
-            print(f"  {i}/{len(tiles)} downloaded ({ok} ok)")
-        time.sleep(args.delay)
+    started = time.monotonic()
+    try:
+        for i, ((z, x, y), data) in enumerate(
+            download(tiles, max(1, args.workers), limiter, args.url, args.optimize_png and Image is not None),
+            start=1,
+        ):
+            if data:
+                batch.append((z, x, y, data))
+                ok += 1
+            if len(batch) >= args.batch:
+                write_batch(conn, batch, dedupe)
+                batch.clear()
+            if i % 100 == 0:
+                rate = i / max(time.monotonic() - started, 1e-6)
+                print(f"  {i}/{len(tiles)} downloaded ({ok} ok, {rate:.1f} tiles/s)")
+    finally:
+        # Ctrl+C / сбой — записанное не теряется, следующий запуск продолжит
+        if batch:
+            write_batch(conn, batch, dedupe)
+        conn.close()
 
-    conn.commit()
-    conn.close()
     size_mb = args.output.stat().st_size / (1024 * 1024)
-    print(f"Done: {args.output} ({size_mb:.1f} MB, {ok}/{len(tiles)} tiles)")
-    return 0 if ok > 0 else 1
+    print(f"Done: {args.output} ({size_mb:.1f} MB, {ok}/{len(tiles)} new tiles, {skipped} kept)")
+    return 0 if ok > 0 or skipped > 0 else 1
 
 
 if __name__ == "__main__":